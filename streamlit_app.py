@@ -4,8 +4,10 @@ The Unofficial EMIS XML Toolkit - Streamlit Cloud Optimized
 
 import streamlit as st
 from util_modules.ui import render_status_bar, render_results_tabs
-from util_modules.xml_parsers.xml_utils import parse_xml_for_emis_guids
+from util_modules.xml_parsers.xml_utils import parse_xml_for_emis_guids, extract_emis_guids_by_source
+from util_modules.xml_parsers.parsed_document import discard_parsed_document
 from util_modules.core import translate_emis_to_snomed
+from util_modules.utils.lookup import get_lookup_handle
 from util_modules.analysis.search_analyzer import SearchAnalyzer
 from util_modules.analysis.report_analyzer import ReportAnalyzer
 from util_modules.utils import get_debug_logger, render_debug_controls
@@ -14,7 +16,6 @@ from util_modules.utils import create_processing_stats
 import time
 import psutil
 import os
-import xml.etree.ElementTree as ET
 
 
 @st.cache_data(ttl=1800, max_entries=50)  # Cache XML processing for 30 minutes
@@ -22,139 +23,22 @@ def extract_codes_with_separate_parsers(xml_content):
     """
     Extract EMIS GUIDs using separate search and report parsers while maintaining architectural separation.
     Returns combined list of EMIS GUIDs with proper source attribution.
+    
+    Reuses the shared ParsedDocument (one parse per upload, also consumed by the structure
+    analysis) instead of re-serializing and re-parsing every search and report subtree.
     """
+    report_labels = {
+        'search': 'search',
+        'listReport': 'list report',
+        'auditReport': 'audit report',
+        'aggregateReport': 'aggregate report'
+    }
+    
+    def warn_report_error(kind, error):
+        st.warning(f"Error processing {report_labels.get(kind, kind)}: {str(error)}")
+    
     try:
-        root = ET.fromstring(xml_content)
-        all_emis_guids = []
-        
-        # Define namespaces
-        namespaces = {
-            'emis': 'http://www.e-mis.com/emisopen'
-        }
-        
-        # Step 1: Extract codes from searches using SearchAnalyzer approach
-        # Note: We don't actually need the analyzers for code extraction, just for structure
-        # Find all reports first, then filter for those with criteria
-        all_reports = root.findall('.//emis:report', namespaces) + root.findall('.//report')
-        searches = []
-        for report in all_reports:
-            # Check if this report has criteria (making it a search)
-            criteria = report.find('.//criteria')
-            if criteria is None:
-                criteria = report.find('.//emis:criteria', namespaces)
-            if criteria is not None:
-                searches.append(report)
-        
-        for search_elem in searches:
-            try:
-                # Get search ID for source attribution
-                search_id_elem = search_elem.find('id')
-                if search_id_elem is None:
-                    search_id_elem = search_elem.find('emis:id', namespaces)
-                if search_id_elem is None:
-                    search_id_elem = search_elem.find('id')
-                search_id = search_id_elem.text if search_id_elem is not None else f"search_{hash(ET.tostring(search_elem))}"
-                
-                # Extract the criteria content from this search and parse it as XML
-                criteria_content = ET.tostring(search_elem, encoding='unicode')
-                search_codes = parse_xml_for_emis_guids(f"<root>{criteria_content}</root>", source_guid=search_id)
-                all_emis_guids.extend(search_codes)
-                
-            except Exception as e:
-                st.warning(f"Error processing search: {str(e)}")
-                continue
-        
-        # Step 2: Extract codes from reports using ReportAnalyzer approach
-        
-        # Find list reports
-        list_reports = root.findall('.//emis:listReport', namespaces) + root.findall('.//listReport')
-        for report_elem in list_reports:
-            try:
-                # Find parent report by searching from root for reports containing this listReport
-                parent_report = None
-                for report in all_reports:
-                    if report_elem in list(report.iter()):
-                        parent_report = report
-                        break
-                
-                if parent_report is not None:
-                    report_id_elem = parent_report.find('id')
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('emis:id', namespaces)
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('id')
-                    report_id = report_id_elem.text if report_id_elem is not None else f"list_report_{hash(ET.tostring(report_elem))}"
-                else:
-                    report_id = f"list_report_{hash(ET.tostring(report_elem))}"
-                
-                # Extract codes from the report content
-                report_content = ET.tostring(report_elem, encoding='unicode')
-                report_codes = parse_xml_for_emis_guids(f"<root>{report_content}</root>", source_guid=report_id)
-                all_emis_guids.extend(report_codes)
-                
-            except Exception as e:
-                st.warning(f"Error processing list report: {str(e)}")
-                continue
-        
-        # Find audit reports
-        audit_reports = root.findall('.//emis:auditReport', namespaces) + root.findall('.//auditReport')
-        for report_elem in audit_reports:
-            try:
-                # Find parent report by searching from root for reports containing this auditReport
-                parent_report = None
-                for report in all_reports:
-                    if report_elem in list(report.iter()):
-                        parent_report = report
-                        break
-                
-                if parent_report is not None:
-                    report_id_elem = parent_report.find('id')
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('emis:id', namespaces)
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('id')
-                    report_id = report_id_elem.text if report_id_elem is not None else f"audit_report_{hash(ET.tostring(report_elem))}"
-                else:
-                    report_id = f"audit_report_{hash(ET.tostring(report_elem))}"
-                
-                report_content = ET.tostring(report_elem, encoding='unicode')
-                report_codes = parse_xml_for_emis_guids(f"<root>{report_content}</root>", source_guid=report_id)
-                all_emis_guids.extend(report_codes)
-                
-            except Exception as e:
-                st.warning(f"Error processing audit report: {str(e)}")
-                continue
-        
-        # Find aggregate reports
-        aggregate_reports = root.findall('.//emis:aggregateReport', namespaces) + root.findall('.//aggregateReport')
-        for report_elem in aggregate_reports:
-            try:
-                # Find parent report by searching from root for reports containing this aggregateReport
-                parent_report = None
-                for report in all_reports:
-                    if report_elem in list(report.iter()):
-                        parent_report = report
-                        break
-                
-                if parent_report is not None:
-                    report_id_elem = parent_report.find('id')
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('emis:id', namespaces)
-                    if report_id_elem is None:
-                        report_id_elem = parent_report.find('id')
-                    report_id = report_id_elem.text if report_id_elem is not None else f"aggregate_report_{hash(ET.tostring(report_elem))}"
-                else:
-                    report_id = f"aggregate_report_{hash(ET.tostring(report_elem))}"
-                
-                report_content = ET.tostring(report_elem, encoding='unicode')
-                report_codes = parse_xml_for_emis_guids(f"<root>{report_content}</root>", source_guid=report_id)
-                all_emis_guids.extend(report_codes)
-                
-            except Exception as e:
-                st.warning(f"Error processing aggregate report: {str(e)}")
-                continue
-        
-        return all_emis_guids
+        return extract_emis_guids_by_source(xml_content, on_error=warn_report_error)
         
     except Exception as e:
         st.error(f"Error in separate parser extraction: {str(e)}")
@@ -367,9 +251,12 @@ def main():
                         # Get deduplication mode from session state, default to unique_codes
                         deduplication_mode = st.session_state.get('current_deduplication_mode', 'unique_codes')
                         
+                        # Key the cached translation on the lookup table's version fingerprint, not its contents
+                        lookup_handle = get_lookup_handle(lookup_df, emis_guid_column, snomed_code_column, version_info)
+                        
                         translated_codes = translate_emis_to_snomed(
                             emis_guids, 
-                            lookup_df, 
+                            lookup_handle, 
                             emis_guid_column, 
                             snomed_code_column,
                             deduplication_mode
@@ -424,6 +311,7 @@ def main():
                             from util_modules.analysis.xml_structure_analyzer import analyze_search_rules
                             
                             # Run full XML structure analysis - this is ONLY for report tabs, not clinical codes
+                            # (reuses the document parsed during code extraction)
                             analysis = analyze_search_rules(xml_content)
                             
                             # Store analysis results in separate, isolated session keys
@@ -442,6 +330,9 @@ def main():
                             st.session_state.search_analysis = None
                             st.session_state.search_results = None
                             st.session_state.report_results = None
+                        finally:
+                            # Extraction and analysis are done with the shared parse - release the tree
+                            discard_parsed_document(xml_content)
                         
                         # Calculate success rate for logging
                         total_found = sum(1 for item in translated_codes.get('clinical', []) if item.get('Mapping Found') == 'Found')
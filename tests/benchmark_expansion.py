@@ -0,0 +1,125 @@
+"""
+SNOMED Expansion Benchmark
+Measures the expansion pipeline against the local terminology server stand-in.
+
+Runs plan_expansions + expand_with_plan + AsyncExpansionEngine (the path
+perform_expansion drives, minus the Streamlit session) for 10, 100 and 1000
+codes and reports codes/sec, terminology server requests and peak Python
+memory. The stand-in runs in its own process so its request handling doesn't
+share the GIL with the code being measured.
+
+Usage:
+    python -m tests.benchmark_expansion [--sizes 10 100 1000] [--latency 0.02] [--error-rate 0.0]
+"""
+
+import argparse
+import multiprocessing
+import time
+import tracemalloc
+from typing import Dict, List
+
+import requests
+
+from util_modules.terminology_server.nhs_terminology_client import NHSTerminologyClient
+from util_modules.terminology_server.async_expansion import AsyncExpansionEngine, run_async
+from util_modules.terminology_server.concurrency_controller import AdaptiveConcurrencyController
+from util_modules.terminology_server.expansion_planner import plan_expansions, expand_with_plan
+from tests.terminology_standin import StandInServer, SyntheticHierarchy
+
+
+DEFAULT_SIZES = (10, 100, 1000)
+HIERARCHY_SIZE = 30000
+
+
+def _serve(connection, hierarchy_size: int, server_options: Dict):
+    """Child process: run the stand-in until told to stop"""
+    with StandInServer(SyntheticHierarchy(hierarchy_size), **server_options) as server:
+        connection.send(server.port)
+        connection.recv()
+
+
+def _workload(hierarchy: SyntheticHierarchy, count: int) -> List[Dict]:
+    """Clinical code entries like those the XML translator produces, including nested includeChildren codes"""
+    codes = hierarchy.sample_codes(count, seed=count)
+    # Swap a tenth of the codes for a child of another requested code, as real searches often do
+    for index in range(0, len(codes), 10):
+        children = [child for child in hierarchy.children[codes[index]] if child not in codes]
+        if children and index + 1 < len(codes):
+            codes[index + 1] = children[0]
+    return [{'SNOMED Code': code, 'Include Children': True} for code in codes]
+
+
+def run_benchmark(base_url: str, auth_url: str, stats_url: str, code_entries: List[Dict]) -> Dict:
+    """Expand code_entries once, returning throughput, request and memory figures"""
+    client = NHSTerminologyClient('benchmark', 'benchmark', base_url=base_url, auth_url=auth_url)
+    engine = AsyncExpansionEngine(None, None, client=client, controller=AdaptiveConcurrencyController())
+    before = requests.get(stats_url).json()['total_requests']
+
+    async def consume(plan):
+        outcomes = []
+        async for outcome in expand_with_plan(engine, code_entries, plan):
+            outcomes.append(outcome)
+        return outcomes
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    plan = plan_expansions(client, [entry['SNOMED Code'] for entry in code_entries])
+    outcomes = run_async(consume(plan))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests_made = requests.get(stats_url).json()['total_requests'] - before
+    return {
+        'codes': len(code_entries),
+        'seconds': elapsed,
+        'codes_per_sec': len(code_entries) / elapsed if elapsed else float('inf'),
+        'requests': requests_made,
+        'derived': plan.saved_expansions,
+        'failed': sum(1 for outcome in outcomes if not outcome.success),
+        'concepts': sum(outcome.result.total_count for outcome in outcomes if outcome.success),
+        'peak_mb': peak / (1024 * 1024),
+        'final_limit': engine.controller.limit,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to each server request")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Extra random latency per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--max-concurrent', type=int, default=None, help="Server-side limit before 429s")
+    args = parser.parse_args()
+
+    server_options = {
+        'latency': args.latency,
+        'latency_jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'max_concurrent': args.max_concurrent,
+    }
+    parent_end, child_end = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target=_serve, args=(child_end, HIERARCHY_SIZE, server_options), daemon=True)
+    server_process.start()
+    port = parent_end.recv()
+    base_url = f"http://127.0.0.1:{port}/fhir"
+    auth_url = f"http://127.0.0.1:{port}/token"
+    stats_url = f"http://127.0.0.1:{port}/_stats"
+
+    # Same seed as the server process, so workloads use codes the server knows
+    hierarchy = SyntheticHierarchy(HIERARCHY_SIZE)
+    print(f"{'codes':>6} {'seconds':>8} {'codes/s':>8} {'requests':>9} {'derived':>8} "
+          f"{'failed':>7} {'concepts':>9} {'peak MB':>8} {'limit':>6}")
+    try:
+        for size in args.sizes:
+            row = run_benchmark(base_url, auth_url, stats_url, _workload(hierarchy, size))
+            print(f"{row['codes']:>6} {row['seconds']:>8.2f} {row['codes_per_sec']:>8.1f} {row['requests']:>9} "
+                  f"{row['derived']:>8} {row['failed']:>7} {row['concepts']:>9} {row['peak_mb']:>8.1f} "
+                  f"{row['final_limit']:>6}")
+    finally:
+        parent_end.send('stop')
+        server_process.join(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
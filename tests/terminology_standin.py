@@ -0,0 +1,447 @@
+"""
+Local NHS Terminology Server Stand-in
+
+A small FHIR R4 terminology server for benchmarking and regression-testing
+NHSTerminologyClient and the expansion pipeline without NHS credentials.
+
+Implements:
+- POST /token                      OAuth client-credentials token endpoint
+- GET  /fhir/metadata              CapabilityStatement
+- GET  /fhir/CodeSystem/$lookup    display and version of one concept
+- GET  /fhir/ValueSet/$expand      implicit ECL value sets (fhir_vs=ecl/...) with
+                                   count/offset paging, total, activeOnly and
+                                   property=parent
+- GET  /_stats                     request counters (not FHIR; for benchmarks)
+
+The ECL subset covers what the client sends: focus concepts, < << > >>
+operators, parentheses, OR and AND.
+
+Data comes from a synthetic SNOMED hierarchy (SyntheticHierarchy). Latency,
+error injection and rate limiting are configurable per server.
+
+Usage:
+    with StandInServer(SyntheticHierarchy(20000), latency=0.01) as server:
+        client = NHSTerminologyClient('id', 'secret', base_url=server.base_url, auth_url=server.auth_url)
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+ROOT_CODE = "138875005"
+EDITION = "http://snomed.info/sct/83821000000107/version/20250917"
+SNOMED_SYSTEM = "http://snomed.info/sct"
+STANDIN_TOKEN_PREFIX = "standin-token-"
+
+
+class SyntheticHierarchy:
+    """
+    Deterministic SNOMED-like polyhierarchy
+
+    Concepts are numbered breadth-first under the root with a branching factor
+    that tapers with depth; a fraction of concepts get a second parent and a
+    fraction are inactive (inactive concepts have no parents, as in SNOMED).
+    """
+
+    def __init__(self, size: int = 20000, branching: int = 6, multi_parent_rate: float = 0.05,
+                 inactive_rate: float = 0.02, seed: int = 7):
+        rng = random.Random(seed)
+        self.codes: List[str] = [ROOT_CODE]
+        self.display: Dict[str, str] = {ROOT_CODE: "SNOMED CT Concept"}
+        self.parents: Dict[str, List[str]] = {ROOT_CODE: []}
+        self.children: Dict[str, List[str]] = {ROOT_CODE: []}
+        self.depth: Dict[str, int] = {ROOT_CODE: 0}
+        self.inactive: Set[str] = set()
+
+        frontier = deque([ROOT_CODE])
+        next_id = 1000000
+        while len(self.codes) < size and frontier:
+            parent = frontier.popleft()
+            width = max(1, branching - self.depth[parent] + rng.randint(-1, 2))
+            for _ in range(width):
+                if len(self.codes) >= size:
+                    break
+                code = str(next_id)
+                next_id += 7
+                self.codes.append(code)
+                self.display[code] = f"Synthetic concept {code}"
+                self.parents[code] = [parent]
+                self.children[code] = []
+                self.children[parent].append(code)
+                self.depth[code] = self.depth[parent] + 1
+                frontier.append(code)
+
+        # Second parents from earlier, shallower concepts keep the graph acyclic
+        for index, code in enumerate(self.codes[2:], start=2):
+            if rng.random() < multi_parent_rate:
+                candidate = self.codes[rng.randrange(1, index)]
+                if candidate not in self.parents[code] and self.depth[candidate] < self.depth[code]:
+                    self.parents[code].append(candidate)
+                    self.children[candidate].append(code)
+
+        for code in self.codes[1:]:
+            if not self.children[code] and rng.random() < inactive_rate:
+                self.inactive.add(code)
+                for parent in self.parents[code]:
+                    self.children[parent].remove(code)
+                self.parents[code] = []
+
+        self._order = {code: index for index, code in enumerate(self.codes)}
+        self._descendants_cache: Dict[str, Set[str]] = {}
+        self._ancestors_cache: Dict[str, Set[str]] = {}
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.display
+
+    def descendants(self, code: str) -> Set[str]:
+        cached = self._descendants_cache.get(code)
+        if cached is None:
+            cached = set()
+            stack = list(self.children.get(code, ()))
+            while stack:
+                child = stack.pop()
+                if child not in cached:
+                    cached.add(child)
+                    stack.extend(self.children[child])
+            self._descendants_cache[code] = cached
+        return cached
+
+    def ancestors(self, code: str) -> Set[str]:
+        cached = self._ancestors_cache.get(code)
+        if cached is None:
+            cached = set()
+            stack = list(self.parents.get(code, ()))
+            while stack:
+                parent = stack.pop()
+                if parent not in cached:
+                    cached.add(parent)
+                    stack.extend(self.parents[parent])
+            self._ancestors_cache[code] = cached
+        return cached
+
+    def ordered(self, codes: Set[str]) -> List[str]:
+        """Codes in stable hierarchy order, like a real server's paging order"""
+        return sorted(codes, key=self._order.__getitem__)
+
+    def sample_codes(self, count: int, seed: int = 11, min_descendants: int = 1) -> List[str]:
+        """Active codes with at least min_descendants descendants, for expansion workloads"""
+        rng = random.Random(seed)
+        candidates = [code for code in self.codes[1:]
+                      if code not in self.inactive and len(self.descendants(code)) >= min_descendants]
+        rng.shuffle(candidates)
+        return candidates[:count]
+
+
+class ECLError(ValueError):
+    pass
+
+
+_ECL_TOKEN = re.compile(r"\s*(<<|>>|<|>|\(|\)|\bAND\b|\bOR\b|\d+)")
+
+
+def evaluate_ecl(expression: str, hierarchy: SyntheticHierarchy) -> Set[str]:
+    """Evaluate the ECL subset used by the client against the hierarchy"""
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _ECL_TOKEN.match(expression, position)
+        if not match:
+            raise ECLError(f"Unsupported ECL near: {expression[position:position + 20]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+        while position < len(expression) and expression[position].isspace():
+            position += 1
+
+    index = 0
+
+    def peek():
+        return tokens[index] if index < len(tokens) else None
+
+    def take():
+        nonlocal index
+        token = peek()
+        index += 1
+        return token
+
+    def parse_expression() -> Set[str]:
+        result = parse_term()
+        while peek() in ("AND", "OR"):
+            operator = take()
+            right = parse_term()
+            result = result & right if operator == "AND" else result | right
+        return result
+
+    def parse_term() -> Set[str]:
+        operator = take() if peek() in ("<", "<<", ">", ">>") else None
+        token = take()
+        if token == "(":
+            focus = parse_expression()
+            if take() != ")":
+                raise ECLError("Unbalanced parentheses")
+        elif token and token.isdigit():
+            if token not in hierarchy:
+                raise KeyError(token)
+            focus = {token}
+        else:
+            raise ECLError(f"Unexpected token {token!r}")
+
+        if operator is None:
+            return focus
+        result = set()
+        for code in focus:
+            if operator in ("<", "<<"):
+                result |= hierarchy.descendants(code)
+            else:
+                result |= hierarchy.ancestors(code)
+            if operator in ("<<", ">>"):
+                result.add(code)
+        return result
+
+    codes = parse_expression()
+    if index != len(tokens):
+        raise ECLError("Trailing tokens in ECL")
+    return codes
+
+
+class StandInServer:
+    """
+    Threaded local stand-in for the NHS Terminology Server
+
+    Args:
+        hierarchy: Concepts to serve
+        latency: Seconds added to every FHIR request
+        latency_jitter: Extra uniform random latency in [0, jitter]
+        page_cap: Largest page the server returns regardless of count
+        error_rate: Fraction of FHIR requests answered with 503
+        max_concurrent: Requests served at once; more are answered with 429 (None = unlimited)
+        token_lifetime: expires_in for issued tokens
+        seed: Seed for latency jitter and error injection
+    """
+
+    def __init__(self, hierarchy: SyntheticHierarchy, latency: float = 0.0, latency_jitter: float = 0.0,
+                 page_cap: int = 1000, error_rate: float = 0.0, max_concurrent: Optional[int] = None,
+                 token_lifetime: int = 1800, seed: int = 3):
+        self.hierarchy = hierarchy
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.page_cap = page_cap
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.token_lifetime = token_lifetime
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.max_in_flight = 0
+        self.requests = Counter()
+        self.concepts_served = 0
+        self._tokens_issued = 0
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    # Lifecycle
+
+    def start(self) -> "StandInServer":
+        handler = _make_handler(self)
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="terminology-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/fhir"
+
+    @property
+    def auth_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/token"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': sum(self.requests.values()),
+                'max_in_flight': self.max_in_flight,
+                'concepts_served': self.concepts_served,
+                'tokens_issued': self._tokens_issued,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.max_in_flight = 0
+            self.concepts_served = 0
+
+    # Request handling (called from handler threads)
+
+    def _enter(self, endpoint: str) -> Optional[int]:
+        """Count the request and decide whether to throttle or fail it; returns an error status or None"""
+        with self._lock:
+            self.requests[endpoint] += 1
+            if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+                return 429
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        return 503 if fail else None
+
+    def _leave(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def issue_token(self) -> Dict:
+        with self._lock:
+            self._tokens_issued += 1
+            self.requests['token'] += 1
+            token = f"{STANDIN_TOKEN_PREFIX}{self._tokens_issued}"
+        return {'access_token': token, 'expires_in': self.token_lifetime, 'token_type': 'bearer'}
+
+    def lookup(self, query: Dict[str, List[str]]):
+        code = query.get('code', [''])[0]
+        if code not in self.hierarchy:
+            return 404, _operation_outcome(f"Code {code} does not exist")
+        parameters = [
+            {'name': 'name', 'valueString': 'SNOMED CT'},
+            {'name': 'version', 'valueString': EDITION},
+            {'name': 'display', 'valueString': self.hierarchy.display[code]},
+            {'name': 'inactive', 'valueBoolean': code in self.hierarchy.inactive},
+        ]
+        return 200, {'resourceType': 'Parameters', 'parameter': parameters}
+
+    def expand(self, query: Dict[str, List[str]]):
+        url = query.get('url', [''])[0]
+        marker = 'fhir_vs=ecl/'
+        if marker not in url:
+            return 400, _operation_outcome("Only implicit ECL value sets are supported")
+        try:
+            codes = evaluate_ecl(unquote(url.split(marker, 1)[1]), self.hierarchy)
+        except KeyError as e:
+            return 422, _operation_outcome(f"Concept {e.args[0]} does not exist")
+        except ECLError as e:
+            return 400, _operation_outcome(str(e))
+
+        if query.get('activeOnly', ['false'])[0] == 'true':
+            codes = {code for code in codes if code not in self.hierarchy.inactive}
+        ordered = self.hierarchy.ordered(codes)
+
+        offset = int(query.get('offset', ['0'])[0])
+        count = min(int(query.get('count', [str(self.page_cap)])[0]), self.page_cap)
+        include_parents = 'parent' in query.get('property', [])
+        contains = []
+        for code in ordered[offset:offset + count]:
+            entry = {'system': SNOMED_SYSTEM, 'code': code, 'display': self.hierarchy.display[code]}
+            if code in self.hierarchy.inactive:
+                entry['inactive'] = True
+            if include_parents:
+                entry['property'] = [{'code': 'parent', 'valueCode': parent} for parent in self.hierarchy.parents[code]]
+            contains.append(entry)
+
+        with self._lock:
+            self.concepts_served += len(contains)
+        return 200, {
+            'resourceType': 'ValueSet',
+            'expansion': {
+                'total': len(ordered),
+                'offset': offset,
+                'parameter': [{'name': 'version', 'valueUri': f"{SNOMED_SYSTEM}|{EDITION}"}],
+                'contains': contains,
+            }
+        }
+
+
+def _operation_outcome(message: str) -> Dict:
+    return {
+        'resourceType': 'OperationOutcome',
+        'issue': [{'severity': 'error', 'code': 'invalid', 'diagnostics': message}]
+    }
+
+
+def _make_handler(server: StandInServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real server
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, body: Dict):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/fhir+json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            if urlparse(self.path).path != '/token':
+                self._send(404, _operation_outcome("Not found"))
+                return
+            self._send(200, server.issue_token())
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = parse_qs(parsed.query)
+            path = parsed.path
+
+            if path == '/_stats':
+                self._send(200, server.stats())
+                return
+
+            if not self.headers.get('Authorization', '').startswith(f"Bearer {STANDIN_TOKEN_PREFIX}"):
+                self._send(401, _operation_outcome("Missing or invalid token"))
+                return
+
+            endpoint = path[len('/fhir/'):] if path.startswith('/fhir/') else path
+            routes = {
+                'metadata': lambda q: (200, {'resourceType': 'CapabilityStatement', 'status': 'active', 'fhirVersion': '4.0.1'}),
+                'CodeSystem/$lookup': server.lookup,
+                'ValueSet/$expand': server.expand,
+            }
+            route = routes.get(endpoint)
+            if route is None:
+                self._send(404, _operation_outcome(f"Unknown endpoint {endpoint}"))
+                return
+
+            error_status = server._enter(endpoint)
+            try:
+                if error_status == 429:
+                    self._send(429, _operation_outcome("Too many requests"))
+                    return
+                if error_status:
+                    self._send(error_status, _operation_outcome("Injected server error"))
+                    return
+                status, body = route(query)
+                self._send(status, body)
+            finally:
+                if error_status != 429:
+                    server._leave()
+
+    return Handler
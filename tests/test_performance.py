@@ -3,15 +3,59 @@ Performance Testing Script
 Tests the performance controls and metrics functionality.
 """
 
+import os
+import pickle
+import tempfile
+import threading
 import time
 import unittest
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 import pandas as pd
 import xml.etree.ElementTree as ET
 from io import StringIO
+from datetime import datetime
 
 from util_modules.analysis.performance_optimizer import render_performance_controls, display_performance_metrics
-from util_modules.xml_parsers.xml_utils import parse_xml_for_emis_guids
+from util_modules.xml_parsers.xml_utils import parse_xml_for_emis_guids, extract_emis_guids_by_source
+from util_modules.xml_parsers.parsed_document import get_parsed_document, clear_parsed_document_cache
+from util_modules.xml_parsers.report_cache import ReportResultCache, scan_report_spans, get_report_cache, clear_report_cache
+from util_modules.analysis.xml_structure_analyzer import analyze_search_rules, _build_complete_dependency_tree
+from util_modules.analysis.dependency_graph import DependencyGraph
+from util_modules.analysis.search_analyzer import SearchAnalyzer
+from util_modules.analysis.search_rule_analyzer import _build_dependency_tree
+from util_modules.analysis.analysis_orchestrator import AnalysisOrchestrator
+from util_modules.analysis import parallel_parsing
+from util_modules.core.translator import translate_emis_guids_batch
+from util_modules.utils.lookup import LookupTableHandle, LookupIndex, get_lookup_statistics, create_lookup_dictionaries
+from util_modules.utils.lookup_index import LookupColumns
+from util_modules.utils.shared_buffers import (
+    SharedLookupTable, SharedLookupIndex, attach_shared_lookup, share_text, read_shared_text, _open_block
+)
+from util_modules.core.background_processor import BackgroundProcessor, TaskStatus, translate_with_shared_lookup
+from util_modules.core.task_control import (
+    TaskChannels, TaskCancelled, install_channels, task_scope, progress_range, report_progress
+)
+from util_modules.utils.caching.lookup_cache import (
+    _build_cache_payload, _cache_lookup_mappings, _cache_to_dataframe, _is_valid_cache_data
+)
+from util_modules.utils.caching.columnar_cache import ColumnarCacheReader, write_columnar_cache
+from util_modules.utils.caching.cache_keys import CacheKeyManager, derive_cache_keys
+from util_modules.terminology_server import connection_pool, nhs_terminology_client
+from util_modules.terminology_server.nhs_terminology_client import NHSTerminologyClient, ExpansionResult, ExpandedConcept
+from util_modules.terminology_server.expansion_store import ExpansionStore
+from util_modules.terminology_server import async_expansion
+from util_modules.terminology_server.async_expansion import AsyncExpansionEngine, run_async
+from util_modules.terminology_server.concurrency_controller import AdaptiveConcurrencyController
+from util_modules.terminology_server.expansion_planner import plan_expansions, expand_with_plan, derive_nested_results
+from util_modules.terminology_server.expansion_jobs import start_expansion_job, get_expansion_job
+from util_modules.terminology_server.expansion_table import ExpansionTable, build_source_frame
+from tests.terminology_standin import StandInServer, SyntheticHierarchy
+from util_modules.xml_parsers.namespace_handler import (
+    NamespaceHandler, detect_namespace_mode, namespace_mode_scope,
+    NAMESPACE_MODE_MIXED, NAMESPACE_MODE_NAMESPACED, NAMESPACE_MODE_PLAIN
+)
 
 
 class TestPerformanceOptimizations(unittest.TestCase):
@@ -239,6 +283,34 @@ class TestPerformanceOptimizations(unittest.TestCase):
         self.assertGreater(len(large_emis_guids), 400)  # 100 valuesets * 5 values each
         self.assertLess(large_parse_time, 2.0)  # Should complete within 2 seconds
 
+    
+    def test_extraction_source_attribution(self):
+        """Test source-attributed extraction matches per-report parsing."""
+        valueset = """<valueSet><id>vs-{0}</id><codeSystem>SNOMED_CONCEPT</codeSystem>
+            <values><value>guid-{0}</value><displayName>Code {0}</displayName>
+            <includeChildren>false</includeChildren></values></valueSet>"""
+        search = f"""<report><id>search-1</id><population><criteriaGroup><definition><criteria>
+            <criterion><table>EVENTS</table><filterAttribute><columnValue><column>READCODE</column>
+            {valueset.format('a')}</columnValue></filterAttribute></criterion>
+            </criteria></definition></criteriaGroup></population></report>"""
+        list_report = f"""<report><id>report-1</id><listReport><columnGroups><columnGroup>
+            <columnGroupCriteria><table>EVENTS</table>{valueset.format('b')}</columnGroupCriteria>
+            </columnGroup></columnGroups></listReport></report>"""
+        xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+        <enquiryDocument xmlns="http://www.e-mis.com/emisopen"><reports>{search}{list_report}</reports></enquiryDocument>"""
+        
+        results = extract_emis_guids_by_source(xml)
+        
+        self.assertEqual([r['emis_guid'] for r in results], ['guid-a', 'guid-b'])
+        self.assertEqual([r['source_guid'] for r in results], ['search-1', 'report-1'])
+        
+        # Same guid_info dicts as parsing each report on its own
+        root = ET.fromstring(xml)
+        ns = {'emis': 'http://www.e-mis.com/emisopen'}
+        search_elem = root.find('.//emis:report', ns)
+        expected = parse_xml_for_emis_guids(
+            f"<root>{ET.tostring(search_elem, encoding='unicode')}</root>", source_guid='search-1')
+        self.assertEqual(results[0], expected[0])
 
 class TestMemoryOptimization(unittest.TestCase):
     """Test memory optimization features."""
@@ -287,6 +359,1476 @@ class TestMemoryOptimization(unittest.TestCase):
         self.assertLess(memory_increase, 50)
 
 
+
+class TestValueSetContextScaling(unittest.TestCase):
+    """Regression benchmark for valueSet -> parent criterion context resolution."""
+    
+    def _generate_criteria_xml(self, num_valuesets: int) -> str:
+        """Generate XML where table/column context lives on the parent criterion, not the valueSet."""
+        criteria = ''.join(
+            f"""<criterion><table>EVENTS</table><filterAttribute><columnValue>
+            <column>READCODE</column><valueSet><id>vs-{i}</id><codeSystem>SNOMED_CONCEPT</codeSystem>
+            <values><value>guid-{i}</value><displayName>Code {i}</displayName></values>
+            </valueSet></columnValue></filterAttribute></criterion>"""
+            for i in range(num_valuesets)
+        )
+        return f'<search>{criteria}</search>'
+    
+    def _best_parse_time(self, xml_content: str, runs: int = 3) -> float:
+        """Return the fastest of several parse runs to reduce timing noise."""
+        timings = []
+        for _ in range(runs):
+            start_time = time.perf_counter()
+            parse_xml_for_emis_guids(xml_content)
+            timings.append(time.perf_counter() - start_time)
+        return min(timings)
+    
+    def test_context_resolution_scales_linearly(self):
+        """Test parse time grows linearly with valueSet count up to 10k valueSets."""
+        small_xml = self._generate_criteria_xml(1000)
+        large_xml = self._generate_criteria_xml(10000)
+        
+        # Context must still come from the enclosing criterion
+        results = parse_xml_for_emis_guids(large_xml)
+        self.assertEqual(len(results), 10000)
+        self.assertEqual(results[-1]['table_context'], 'EVENTS')
+        self.assertEqual(results[-1]['column_context'], 'READCODE')
+        
+        small_time = self._best_parse_time(small_xml)
+        large_time = self._best_parse_time(large_xml, runs=1)
+        
+        # 10x the valueSets should cost roughly 10x the time; a per-valueSet scan
+        # of every criterion would be ~100x
+        self.assertLess(large_time / small_time, 30)
+        self.assertLess(large_time, 10.0)
+
+
+class TestParsedDocumentSharing(unittest.TestCase):
+    """Test the shared parse-once document model."""
+    
+    XML = """<?xml version="1.0" encoding="UTF-8"?>
+    <enquiryDocument xmlns="http://www.e-mis.com/emisopen">
+        <id>doc-1</id><creationTime>2025-01-01</creationTime>
+        <reportFolder><id>folder-1</id><name>QOF</name></reportFolder>
+        <report><id>search-1</id><name>Search</name><folder>folder-1</folder>
+            <population><criteriaGroup><definition><criteria><criterion><table>EVENTS</table>
+            </criterion></criteria></definition></criteriaGroup></population></report>
+        <report><id>report-1</id><name>List</name><folder>folder-1</folder>
+            <listReport><columnGroups/></listReport></report>
+    </enquiryDocument>"""
+    
+    def tearDown(self):
+        clear_parsed_document_cache()
+    
+    def test_document_is_parsed_once_and_indexed(self):
+        """Test repeated requests for the same content share one ParsedDocument."""
+        document = get_parsed_document(self.XML)
+        
+        self.assertIs(get_parsed_document(self.XML), document)
+        self.assertIs(get_parsed_document(document), document)
+        self.assertEqual(document.document_id, 'doc-1')
+        self.assertEqual(len(document.search_elements), 1)
+        self.assertEqual(len(document.list_elements), 1)
+        self.assertIn('folder-1', document.folder_index)
+        self.assertIs(document.element_index['report-1'], document.list_elements[0])
+        
+        # Analyzers consume the shared document rather than re-parsing
+        with patch('xml.etree.ElementTree.fromstring', side_effect=AssertionError("re-parsed")):
+            analysis = analyze_search_rules(self.XML)
+        self.assertEqual(sorted(r.id for r in analysis.reports), ['report-1', 'search-1'])
+
+
+class TestNamespaceResolution(unittest.TestCase):
+    """Test compiled namespace resolution and per-document namespace detection."""
+    
+    EMIS = 'http://www.e-mis.com/emisopen'
+    
+    def _build_criteria(self, count: int) -> ET.Element:
+        root = ET.Element(f'{{{self.EMIS}}}search')
+        for i in range(count):
+            criterion = ET.SubElement(root, f'{{{self.EMIS}}}criterion')
+            ET.SubElement(criterion, f'{{{self.EMIS}}}id').text = f'criterion-{i}'
+            ET.SubElement(criterion, f'{{{self.EMIS}}}table').text = 'EVENTS'
+        return root
+    
+    def test_mode_detection_and_mixed_documents(self):
+        """Test detection picks a single strategy only when a document allows it."""
+        namespaced = self._build_criteria(2)
+        self.assertEqual(detect_namespace_mode(namespaced), NAMESPACE_MODE_NAMESPACED)
+        self.assertEqual(detect_namespace_mode(ET.fromstring('<search><criterion/></search>')), NAMESPACE_MODE_PLAIN)
+        
+        # Namespaced parent with non-namespaced children still resolves both variants
+        mixed = ET.fromstring(f'<emis:columnGroup xmlns:emis="{self.EMIS}"><logicalTableName>EVENTS</logicalTableName>'
+                              f'<emis:displayName>Events</emis:displayName></emis:columnGroup>')
+        self.assertEqual(detect_namespace_mode(mixed), NAMESPACE_MODE_MIXED)
+        handler = NamespaceHandler.for_document(mixed)
+        self.assertEqual(handler.get_text_from_child(mixed, 'logicalTableName'), 'EVENTS')
+        self.assertEqual(handler.get_text_from_child(mixed, 'displayName'), 'Events')
+        
+        with namespace_mode_scope(NAMESPACE_MODE_NAMESPACED):
+            self.assertEqual(len(NamespaceHandler().findall_with_path(namespaced, './/criterion')), 2)
+    
+    def test_find_micro_benchmark(self):
+        """Test compiled, mode-aware lookups beat the try-both prefixed lookups they replace."""
+        root = self._build_criteria(500)
+        criteria = list(root)
+        namespaces = {'emis': self.EMIS}
+        handler = NamespaceHandler.for_document(root)
+        names = ('table', 'id', 'negation')
+        
+        def legacy_lookups():
+            for criterion in criteria:
+                for name in names:
+                    element = criterion.find(name)
+                    if element is None:
+                        element = criterion.find(f'emis:{name}', namespaces)
+        
+        def handler_lookups():
+            for criterion in criteria:
+                for name in names:
+                    handler.find(criterion, name)
+        
+        def best_time(func):
+            timings = []
+            for _ in range(5):
+                start_time = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start_time)
+            return min(timings)
+        
+        legacy_time = best_time(legacy_lookups)
+        handler_time = best_time(handler_lookups)
+        
+        self.assertLess(handler_time, legacy_time * 0.75)
+
+
+class TestBatchTranslation(unittest.TestCase):
+    """Test the batch translation engine against the per-dict translation rules."""
+    
+    GUID_TO_SNOMED = {
+        guid: {'snomed_code': code, 'source_type': source_type, 'has_qualifier': 'No',
+               'is_parent': 'No', 'descendants': '0', 'code_type': 'Concept'}
+        for guid, code, source_type in [
+            ('guid1', '123456789', 'Clinical'), ('guid2', '987654321', 'Medication'),
+            ('guid3', '111222333', 'Clinical'), ('guid4', '444555666', 'Medication'),
+            ('guid5', '777888999', 'Clinical')
+        ]
+    }
+    
+    @staticmethod
+    def _occurrence(guid, valueset, source, code_system='SNOMED_CONCEPT', display='N/A', description='N/A',
+                    refset=False, pseudo=False, table=None, column=None):
+        return {
+            'valueSet_guid': valueset, 'valueSet_description': description, 'code_system': code_system,
+            'emis_guid': guid, 'xml_display_name': display, 'include_children': False,
+            'is_refset': refset, 'is_pseudorefset': pseudo, 'is_pseudomember': pseudo,
+            'table_context': table, 'column_context': column, 'source_guid': source
+        }
+    
+    def _occurrences(self):
+        occurrence = self._occurrence
+        return [
+            occurrence('guid1', 'vs-1', 'search-1'),
+            occurrence('guid1', 'vs-2', 'search-2', display='Asthma', description='Asthma codes', table='EVENTS', column='READCODE'),
+            occurrence('guid2', 'vs-3', 'search-1', code_system='SCT_DRGGRP'),
+            occurrence('guid2', 'vs-4', 'search-2'),
+            occurrence('guid5', 'vs-4', 'search-2', code_system='EMISINTERNAL'),
+            occurrence('999000', 'vs-5', 'search-1', refset=True, description='Refset'),
+            occurrence('999000', 'vs-5', 'search-2', refset=True, description='Refset'),
+            occurrence('guid3', 'vs-p', 'search-1', pseudo=True),
+            occurrence('guid4', 'vs-p', 'search-1', code_system='FOO', pseudo=True),
+            occurrence('guid3', 'vs-p', 'search-2', display='Member', pseudo=True),
+            occurrence('missing', 'vs-1', 'search-2')
+        ]
+    
+    def _summary(self, results):
+        summary = {
+            category: [(entry.get('EMIS GUID', entry.get('SNOMED Code')), entry['source_guid'], entry['ValueSet GUID'])
+                       for entry in entries]
+            for category, entries in results.items() if category != 'pseudo_refset_members'
+        }
+        summary['pseudo_refset_members'] = {
+            valueset: [(member['EMIS GUID'], member['source_guid']) for member in members]
+            for valueset, members in results['pseudo_refset_members'].items()
+        }
+        return summary
+    
+    def test_unique_codes_matches_per_dict_rules(self):
+        """Test the most complete duplicate wins, medication context beats clinical and refsets dedupe by code."""
+        results = translate_emis_guids_batch(self._occurrences(), self.GUID_TO_SNOMED, {}, 'unique_codes')
+        
+        self.assertEqual(self._summary(results), {
+            'clinical': [('guid1', 'search-2', 'vs-2'), ('missing', 'search-2', 'vs-1')],
+            'medications': [('guid2', 'search-1', 'vs-3')],
+            'clinical_pseudo_members': [('guid3', 'search-2', 'vs-p')],
+            'medication_pseudo_members': [('guid4', 'search-1', 'vs-p')],
+            'refsets': [('999000', 'search-1', 'vs-5')],
+            'pseudo_refsets': [(None, 'search-1', 'vs-p')],
+            'pseudo_refset_members': {'vs-p': [('guid3', 'search-2'), ('guid4', 'search-1')]}
+        })
+        self.assertEqual(results['clinical'][1]['SNOMED Code'], 'Not Found')
+        self.assertEqual(results['medications'][0]['Medication Type'], 'SCT_DRGGRP (Drug Group)')
+        self.assertEqual(results['medication_pseudo_members'][0]['Medication Type'], 'Standard Medication')
+        self.assertEqual(results['pseudo_refsets'][0]['Member Count'], 2)
+    
+    def test_unique_per_entity_keeps_first_per_source(self):
+        """Test per-entity mode keeps the first occurrence of each (source, code) pair."""
+        results = translate_emis_guids_batch(self._occurrences(), self.GUID_TO_SNOMED, {}, 'unique_per_entity')
+        summary = self._summary(results)
+        
+        self.assertEqual(summary['clinical'], [
+            ('guid1', 'search-1', 'vs-1'), ('guid1', 'search-2', 'vs-2'),
+            ('guid2', 'search-2', 'vs-4'), ('missing', 'search-2', 'vs-1')
+        ])
+        self.assertEqual(summary['medications'], [('guid2', 'search-1', 'vs-3')])
+        self.assertEqual(summary['clinical_pseudo_members'], [('guid3', 'search-1', 'vs-p'), ('guid3', 'search-2', 'vs-p')])
+    
+    def test_large_batch_translation(self):
+        """Test 50k GUID occurrences translate well under a second."""
+        occurrences = [
+            self._occurrence(f'guid{i % 5000}', f'vs-{i % 2500}', f'search-{i % 40}',
+                             code_system='SCT_CONST' if i % 7 == 0 else 'SNOMED_CONCEPT',
+                             display=f'Code {i % 5000}' if i % 3 else 'N/A', pseudo=i % 2500 == 0)
+            for i in range(50000)
+        ]
+        
+        start_time = time.perf_counter()
+        results = translate_emis_guids_batch(occurrences, self.GUID_TO_SNOMED, {}, 'unique_codes')
+        elapsed = time.perf_counter() - start_time
+        
+        self.assertEqual(len(results['clinical']) + len(results['medications']), 5000 - 2)
+        self.assertLess(elapsed, 1.0)
+
+
+class TestLookupTableHandle(unittest.TestCase):
+    """Test cached lookup calls key on the table's version fingerprint, not its contents."""
+    
+    def setUp(self):
+        self.lookup_df = pd.DataFrame({
+            'EMIS_GUID': [f'guid{i}' for i in range(5000)],
+            'SNOMED_Code': [str(100000 + i) for i in range(5000)],
+            'Source_Type': ['Clinical', 'Medication'] * 2500
+        })
+        get_lookup_statistics.clear()
+    
+    def test_fingerprint_sources(self):
+        """Test fingerprints come from version info, falling back to the full key columns."""
+        version_info = {'emis_version': '2025.1', 'snomed_version': '20250201'}
+        handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', version_info)
+        same_version = LookupTableHandle.create(self.lookup_df.copy(), 'EMIS_GUID', 'SNOMED_Code', dict(version_info))
+        new_version = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', {'emis_version': '2025.2'})
+        self.assertEqual(handle.fingerprint, same_version.fingerprint)
+        self.assertNotEqual(handle.fingerprint, new_version.fingerprint)
+        
+        hashed = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code')
+        self.assertEqual(hashed.fingerprint, LookupTableHandle.create(self.lookup_df.copy(), 'EMIS_GUID', 'SNOMED_Code').fingerprint)
+        for row in (0, 7):
+            changed_df = self.lookup_df.copy()
+            changed_df.loc[row, 'SNOMED_Code'] = '999999'
+            self.assertNotEqual(hashed.fingerprint, LookupTableHandle.create(changed_df, 'EMIS_GUID', 'SNOMED_Code').fingerprint)
+    
+    def test_fingerprint_from_cached_table_version_info(self):
+        """Test tables loaded from the lookup cache key on the table_hash recorded with them."""
+        cached_info = {'cache_created_at': '2025-02-01', 'record_count': 5000, 'table_hash': 'abc123', 'available_columns': []}
+        handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', cached_info)
+        updated = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', dict(cached_info, table_hash='def456'))
+        self.assertTrue(handle.fingerprint.startswith('abc123:'))
+        self.assertNotEqual(handle.fingerprint, updated.fingerprint)
+    
+    def test_cached_statistics_key_on_fingerprint(self):
+        """Test a handle with the same fingerprint hits the cache without the table being hashed."""
+        handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', {'emis_version': '2025.1'})
+        stats = get_lookup_statistics(handle)
+        self.assertEqual(stats['total_count'], 5000)
+        
+        # Same fingerprint, different frame: served from cache, so the frame is never inspected
+        stale_handle = LookupTableHandle(self.lookup_df.head(10), 'EMIS_GUID', 'SNOMED_Code', handle.fingerprint)
+        self.assertEqual(get_lookup_statistics(stale_handle)['total_count'], 5000)
+
+
+class TestLookupIndex(unittest.TestCase):
+    """Test the array-backed lookup indexes behave like the old per-row dictionaries."""
+    
+    def setUp(self):
+        self.lookup_df = pd.DataFrame({
+            'EMIS_GUID': ['g1', ' g2 ', 'g3', 'g1', '', 'g5', 'g6'],
+            'SNOMED_Code': [1001.0, 1002.0, None, 1004.0, 1005.0, 1002.0, 1006.5],
+            'Source_Type': ['Clinical', 'Medication', 'Clinical', 'Refset', 'Clinical', 'Clinical', 'Clinical'],
+            'HasQualifier': ['0', '1', '0', '0', '0', '0', '0']
+        })
+    
+    def test_records_match_dictionary_semantics(self):
+        """Test cleaning, last-row-wins duplicates, defaults for missing columns and the get/in interface."""
+        guid_index, snomed_index = create_lookup_dictionaries.__wrapped__(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code')
+        self.assertIsInstance(guid_index, LookupIndex)
+        
+        self.assertEqual(sorted(guid_index), ['g1', 'g2', 'g5', 'g6'])
+        self.assertEqual(guid_index['g1'], {
+            'snomed_code': '1004', 'source_type': 'Refset', 'has_qualifier': '0',
+            'is_parent': 'Unknown', 'descendants': '0', 'code_type': 'Unknown'
+        })
+        self.assertEqual(guid_index.get('g6')['snomed_code'], '1006.5')
+        self.assertIn('g2', guid_index)
+        self.assertNotIn('g3', guid_index)
+        self.assertIsNone(guid_index.get('missing'))
+        self.assertIsNone(guid_index.get(None))
+        
+        # SNOMED 1002 appears for g2 and g5 - the later row wins
+        self.assertEqual(len(snomed_index), 4)
+        self.assertEqual(snomed_index['1002']['source_type'], 'Clinical')
+        
+        # Indexes survive the pickling st.cache_data does
+        restored = pickle.loads(pickle.dumps(guid_index))
+        self.assertEqual(restored.get('g2'), guid_index.get('g2'))
+    
+    def test_string_snomed_column(self):
+        """Test SNOMED codes stored as strings (pandas str dtype) are handled."""
+        lookup_df = self.lookup_df.assign(SNOMED_Code=['1001', '1002', None, '1004', '1005', '1002', ' 1006 '])
+        guid_index, snomed_index = create_lookup_dictionaries.__wrapped__(lookup_df, 'EMIS_GUID', 'SNOMED_Code')
+        self.assertEqual(guid_index['g6']['snomed_code'], '1006')
+        self.assertIn('1004', snomed_index)
+    
+    def test_large_table_build_budget(self):
+        """Test building the indexes for a large table stays within a cold-start budget."""
+        rows = 200000
+        lookup_df = pd.DataFrame({
+            'EMIS_GUID': [f'{{GUID-{i:08d}}}' for i in range(rows)],
+            'SNOMED_Code': [float(100000000 + i // 2) for i in range(rows)],
+            'Source_Type': ['Clinical', 'Medication', 'Constituent', 'DM+D'] * (rows // 4),
+            'Descendants': [str(i % 50) for i in range(rows)]
+        })
+        
+        start_time = time.time()
+        guid_index, snomed_index = create_lookup_dictionaries.__wrapped__(lookup_df, 'EMIS_GUID', 'SNOMED_Code')
+        build_time = time.time() - start_time
+        
+        self.assertEqual(len(guid_index), rows)
+        self.assertEqual(len(snomed_index), rows // 2)
+        self.assertEqual(guid_index['{GUID-00000101}']['descendants'], '1')
+        self.assertLess(build_time, 5.0, "Lookup index build should not loop over rows in Python")
+
+
+class TestColumnarLookupCache(unittest.TestCase):
+    """Test the columnar lookup cache payload matches the legacy dict layout without per-row dicts."""
+    
+    def setUp(self):
+        self.lookup_df = pd.DataFrame({
+            'EMIS_GUID': ['a', ' b ', 'c', 'd', 'e', ''],
+            'SNOMED_Code': [123.0, 456.0, None, 123.0, 1.5, 9.0],
+            'Descendants': [1, 2, 3, 4, 5, 6],
+            'Note': ['x', None, 'z', 'w', 'v', 'u']
+        })
+    
+    def _write_and_read(self, payload, key):
+        """Write a payload to a columnar cache file and read it back as a payload dict."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = os.path.join(cache_dir, 'emis_lookup_hash.lkc')
+            metadata = {k: v for k, v in payload.items() if k != 'tables'}
+            write_columnar_cache(cache_file, metadata, payload['tables'], key)
+            
+            reader = ColumnarCacheReader(cache_file, key)
+            cache_data = {k: v for k, v in reader.metadata.items() if k != 'sections'}
+            cache_data['tables'] = {name: reader.read_table(name) for name in ('table', 'mapping')}
+            return cache_data
+    
+    def test_payload_round_trip(self):
+        """Test mappings and records keep legacy keys, values and order, and the table rebuilds exactly."""
+        payload = _build_cache_payload(self.lookup_df, 'SNOMED_Code', 'EMIS_GUID', 'hash')
+        payload = self._write_and_read(payload, os.urandom(32))
+        self.assertTrue(_is_valid_cache_data(payload))
+        self.assertEqual(payload['valid_mapping_count'], 4)
+        
+        lookup_mapping, lookup_records = _cache_lookup_mappings(payload)
+        self.assertEqual(dict(lookup_mapping), {'123': 'd', '456': 'b', '1.5': 'e'})
+        self.assertEqual(list(lookup_records['123'].items()), [
+            ('emis_guid', 'd'), ('descendants', 4), ('has_qualifier', ''), ('is_parent', ''),
+            ('source_type', ''), ('code_type', ''), ('Descendants', 4), ('Note', 'w')
+        ])
+        self.assertNotIn('9', lookup_records)
+        
+        rebuilt = _cache_to_dataframe(payload)
+        pd.testing.assert_frame_equal(rebuilt, self.lookup_df)
+    
+    def test_tampered_or_truncated_file_rejected(self):
+        """Test encrypted chunks fail authentication when modified, truncated or read without the key."""
+        payload = _build_cache_payload(self.lookup_df, 'SNOMED_Code', 'EMIS_GUID', 'hash')
+        key = os.urandom(32)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = os.path.join(cache_dir, 'emis_lookup_hash.lkc')
+            write_columnar_cache(cache_file, {'format_version': 3}, payload['tables'], key)
+            with open(cache_file, 'rb') as f:
+                content = f.read()
+            
+            tampered = bytearray(content)
+            tampered[-1] ^= 0xFF
+            with self.assertRaises(Exception):
+                ColumnarCacheReader(bytes(tampered), key).read_table('mapping')
+            with self.assertRaises(Exception):
+                ColumnarCacheReader(content[:-10], key)
+            with self.assertRaises(ValueError):
+                ColumnarCacheReader(content)
+            with self.assertRaises(Exception):
+                ColumnarCacheReader(content, os.urandom(32))
+    
+    def test_legacy_payload_still_served(self):
+        """Test caches written in the old dict layout are returned as stored."""
+        legacy = {'lookup_mapping': {'123': 'a'}, 'lookup_records': {'123': {'emis_guid': 'a'}}}
+        self.assertTrue(_is_valid_cache_data(legacy))
+        self.assertEqual(_cache_lookup_mappings(legacy), (legacy['lookup_mapping'], legacy['lookup_records']))
+    
+    def test_large_table_payload_budget(self):
+        """Test a 500k-row payload builds from columns within budget and stays compact."""
+        rows = 500000
+        lookup_df = pd.DataFrame({
+            'EMIS_GUID': [f'{{GUID-{i:08d}}}' for i in range(rows)],
+            'SNOMED_Code': [str(100000000 + i // 2) for i in range(rows)],
+            'Source_Type': ['Clinical', 'Medication', 'Constituent', 'DM+D'] * (rows // 4),
+            'Descendants': [str(i % 50) for i in range(rows)]
+        })
+        
+        start_time = time.time()
+        payload = _build_cache_payload(lookup_df, 'SNOMED_Code', 'EMIS_GUID', 'hash')
+        build_time = time.time() - start_time
+        
+        self.assertEqual(payload['tables']['mapping'].num_rows, rows // 2)
+        self.assertLess(build_time, 10.0, "Cache payload should be built from columns, not row by row")
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = os.path.join(cache_dir, 'emis_lookup_hash.lkc')
+            metadata = {k: v for k, v in payload.items() if k != 'tables'}
+            write_columnar_cache(cache_file, metadata, payload['tables'], os.urandom(32))
+            self.assertLess(os.path.getsize(cache_file), rows * 20)
+
+
+
+class TestCacheKeyManager(unittest.TestCase):
+    """Test cache keys are derived once per secret rather than on every encrypt/decrypt."""
+    
+    def test_keys_derived_once_per_secret(self):
+        """Test repeated reads reuse the derived keys and memoized Fernet, and a new secret derives fresh keys."""
+        manager = CacheKeyManager()
+        with patch('util_modules.utils.caching.cache_keys.derive_cache_keys', wraps=derive_cache_keys) as derive, \
+                patch.object(manager, '_read_secret', return_value='token-1') as read_secret:
+            fernet = manager.get_fernet()
+            for _ in range(5):
+                self.assertIs(manager.get_fernet(), fernet)
+                manager.get_chunk_key()
+            self.assertEqual(derive.call_count, 1)
+            self.assertEqual(fernet.decrypt(manager.get_fernet().encrypt(b'data')), b'data')
+            
+            read_secret.return_value = 'token-2'
+            self.assertIsNot(manager.get_fernet(), fernet)
+            self.assertEqual(derive.call_count, 2)
+    
+    def test_no_secret_means_no_keys(self):
+        """Test a missing GZIP_TOKEN leaves the cache unencrypted."""
+        manager = CacheKeyManager()
+        with patch.object(manager, '_read_secret', return_value=None):
+            self.assertIsNone(manager.get_fernet())
+            self.assertIsNone(manager.get_chunk_key())
+
+
+
+class TestTerminologyConnectionPool(unittest.TestCase):
+    """Test terminology clients share one token and one keep-alive session."""
+    
+    def setUp(self):
+        self.session = Mock()
+        token_response = Mock(status_code=200)
+        token_response.json.return_value = {'access_token': 'token-1', 'expires_in': 1800}
+        self.session.post.side_effect = lambda *args, **kwargs: (time.sleep(0.05), token_response)[1]
+        fhir_response = Mock(status_code=200)
+        fhir_response.json.return_value = {'resourceType': 'Parameters'}
+        self.session.get.return_value = fhir_response
+        
+        client = NHSTerminologyClient('id', 'secret')
+        self.pool = connection_pool.ConnectionPool(client.auth_url, 'id', 'secret', session=self.session)
+        pool_patch = patch.dict(connection_pool._pools, {(client.auth_url, 'id', 'secret'): self.pool})
+        pool_patch.start()
+        self.addCleanup(pool_patch.stop)
+    
+    def test_concurrent_workers_share_one_token(self):
+        """Test worker-style clients created per code authenticate once and reuse the session."""
+        def worker():
+            client = NHSTerminologyClient('id', 'secret')
+            return client._make_request('CodeSystem/$lookup', {'code': '123'})
+        
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda _: worker(), range(64)))
+        
+        self.assertTrue(all(data == {'resourceType': 'Parameters'} for data, error in results))
+        self.assertEqual(self.session.post.call_count, 1)
+        self.assertEqual(self.session.get.call_count, 64)
+    
+    def test_rejected_token_refreshed_once(self):
+        """Test a 401 refreshes the shared token only if no other worker already has."""
+        tokens = self.pool.tokens
+        self.assertEqual(tokens.get_token(), 'token-1')
+        tokens.access_token = 'token-0'
+        self.assertEqual(tokens.refresh(stale_token='token-1'), 'token-0')
+        self.assertEqual(tokens.refresh(stale_token='token-0'), 'token-1')
+        self.assertEqual(self.session.post.call_count, 2)
+
+
+
+class TestPagedExpansion(unittest.TestCase):
+    """Test ValueSet $expand results beyond one page are fetched in full."""
+    
+    def _fake_server(self, total, page_cap=1000, fail_offset=None):
+        """Fake _make_request serving a hierarchy of `total` concepts, tracking concurrent page requests."""
+        state = {'in_flight': 0, 'max_in_flight': 0, 'offsets': []}
+        lock = threading.Lock()
+        
+        def make_request(endpoint, params=None, timeout=None):
+            if endpoint == 'CodeSystem/$lookup':
+                return {'parameter': [{'name': 'display', 'valueString': 'Parent'}]}, None
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+                state['offsets'].append(params['offset'])
+            time.sleep(0.02)
+            with lock:
+                state['in_flight'] -= 1
+            offset = params['offset']
+            if offset == fail_offset:
+                return None, "Terminology server error"
+            count = min(params['count'], page_cap)
+            contains = [{'code': str(i), 'display': f'Child {i}'} for i in range(offset, min(offset + count, total))]
+            return {'expansion': {'total': total, 'contains': contains}}, None
+        
+        return make_request, state
+    
+    def test_large_expansion_fetches_every_page(self):
+        """Test all pages are fetched concurrently (bounded) and returned in order, with a server-capped page size."""
+        client = NHSTerminologyClient('id', 'secret')
+        make_request, state = self._fake_server(total=5250, page_cap=500)
+        with patch.object(client, '_make_request', side_effect=make_request):
+            result = client._expand_concept_uncached('73211009')
+        
+        self.assertIsNone(result.error)
+        self.assertEqual([child.code for child in result.children], [str(i) for i in range(5250)])
+        self.assertEqual(sorted(state['offsets']), list(range(0, 5250, 500)))
+        self.assertGreater(state['max_in_flight'], 1)
+        self.assertLessEqual(state['max_in_flight'], 4)
+
+    def test_extra_pages_borrow_controller_slots(self):
+        """Test pages past the caller's own slot only run in spare controller slots."""
+        for limit, expected_max in ((2, 2), (1, 1)):
+            controller = AdaptiveConcurrencyController(initial_limit=limit, max_limit=limit)
+            client = NHSTerminologyClient('id', 'secret')
+            make_request, state = self._fake_server(total=5000)
+            with controller.slot(), \
+                    patch.object(nhs_terminology_client, 'get_concurrency_controller', return_value=controller), \
+                    patch.object(client, '_make_request', side_effect=make_request):
+                result = client._expand_concept_uncached('73211009')
+                self.assertEqual(controller.in_flight, 1)
+
+            self.assertIsNone(result.error)
+            self.assertEqual(len(result.children), 5000)
+            self.assertEqual(state['max_in_flight'], expected_max)
+
+    def test_failed_page_is_reported(self):
+        """Test a failed later page marks the expansion as incomplete instead of silently truncating it."""
+        client = NHSTerminologyClient('id', 'secret')
+        make_request, state = self._fake_server(total=3000, fail_offset=2000)
+        with patch.object(client, '_make_request', side_effect=make_request):
+            result = client.expand_concept('73211009')
+        
+        self.assertIn('Incomplete expansion', result.error)
+        self.assertEqual(len(result.children), 2000)
+
+
+class TestExpansionStore(unittest.TestCase):
+    """Test the host-wide expansion store shared across sessions."""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'expansions.sqlite')
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _result(self, code, count, edition='edition-1'):
+        children = [
+            ExpandedConcept(code=f'{code}{i}', display=f'Child {i}', inactive=(i % 7 == 0), parent_code=code)
+            for i in range(count)
+        ]
+        return ExpansionResult(
+            source_code=code, source_display=f'Parent {code}', children=children,
+            total_count=count, expansion_timestamp=datetime.now(), edition=edition
+        )
+    
+    def test_round_trip_keyed_by_edition(self):
+        """Test results survive a new store instance and only match the same code, flag and edition."""
+        ExpansionStore(self.path).put(self._result('73211009', 2500), include_inactive=False)
+        
+        store = ExpansionStore(self.path)
+        cached = store.get('73211009', False, 'edition-1')
+        self.assertEqual(cached.source_display, 'Parent 73211009')
+        self.assertEqual(cached.children, self._result('73211009', 2500).children)
+        self.assertIsNone(store.get('73211009', True, 'edition-1'))
+        self.assertIsNone(store.get('73211009', False, 'edition-2'))
+        
+        # A result from a newer edition drops everything stored for older ones
+        store.put(self._result('44054006', 10, edition='edition-2'), include_inactive=False)
+        self.assertIsNone(store.get('73211009', False, 'edition-1'))
+        self.assertEqual(store.current_edition(), 'edition-2')
+    
+    def test_lru_eviction_bounds_size(self):
+        """Test the store stays under max_bytes by evicting least recently used entries."""
+        store = ExpansionStore(self.path, max_bytes=20_000)
+        for i in range(20):
+            store.put(self._result(f'1000{i:02d}', 500), include_inactive=False)
+            store.get('100000', False, 'edition-1')  # Keep the first entry hot
+        
+        stats = store.stats()
+        self.assertLessEqual(stats['size_bytes'], 20_000)
+        self.assertLess(stats['entries'], 20)
+        self.assertIsNotNone(store.get('100000', False, 'edition-1'))
+        self.assertIsNone(store.get('100001', False, 'edition-1'))
+
+
+
+class TestAsyncExpansionEngine(unittest.TestCase):
+    """Test the asyncio expansion engine used by perform_expansion."""
+    
+    def _fake_client(self, flaky_codes=(), missing_codes=(), delay=0.01):
+        """Client whose expansions fail transiently once for flaky codes and permanently for missing ones."""
+        state = {'in_flight': 0, 'max_in_flight': 0, 'calls': {}}
+        lock = threading.Lock()
+        
+        def expand(code, include_inactive=False, include_hierarchy=False, timeout=None):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+                state['calls'][code] = state['calls'].get(code, 0) + 1
+                calls = state['calls'][code]
+            time.sleep(delay)
+            with lock:
+                state['in_flight'] -= 1
+            error = None
+            if code in missing_codes:
+                error = "Code does not exist in terminology server"
+            elif code in flaky_codes and calls == 1:
+                error = "Terminology server error"
+            return ExpansionResult(
+                source_code=code, source_display=f'Concept {code}',
+                children=[] if error else [ExpandedConcept(code=f'{code}1', display='Child')],
+                total_count=0 if error else 1, expansion_timestamp=datetime.now(), error=error
+            )
+        
+        client = Mock()
+        client._expand_concept_uncached.side_effect = expand
+        return client, state
+    
+    def _run(self, engine, codes):
+        async def collect():
+            return [outcome async for outcome in engine.expand([{'SNOMED Code': code} for code in codes])]
+        return run_async(collect())
+    
+    def test_bounded_concurrency_and_retries(self):
+        """Test every code completes under the concurrency bound, retrying only transient errors."""
+        codes = [str(100000 + i) for i in range(60)]
+        client, state = self._fake_client(flaky_codes=codes[:5], missing_codes=codes[5:7])
+        engine = AsyncExpansionEngine('id', 'secret', max_concurrency=8, client=client)
+        
+        with patch.object(async_expansion, 'backoff_delay', return_value=0):
+            outcomes = self._run(engine, codes)
+        
+        self.assertEqual(sorted(outcome.snomed_code for outcome in outcomes), sorted(codes))
+        self.assertLessEqual(state['max_in_flight'], 8)
+        self.assertGreater(state['max_in_flight'], 1)
+        by_code = {outcome.snomed_code: outcome for outcome in outcomes}
+        self.assertTrue(all(by_code[code].success and by_code[code].attempts == 2 for code in codes[:5]))
+        self.assertTrue(all(not by_code[code].success and by_code[code].attempts == 1 for code in codes[5:7]))
+        self.assertEqual(engine.retries, 5)
+    
+    def test_attempt_timeout_is_retried_then_reported(self):
+        """Test a hung attempt times out without stalling the other codes."""
+        client, state = self._fake_client(delay=0.3)
+        engine = AsyncExpansionEngine('id', 'secret', max_concurrency=4, request_timeout=0.05, max_retries=1, client=client)
+        
+        with patch.object(async_expansion, 'backoff_delay', return_value=0):
+            outcomes = self._run(engine, ['1', '2'])
+        
+        self.assertEqual(len(outcomes), 2)
+        self.assertTrue(all('Timed out' in outcome.error and outcome.attempts == 2 for outcome in outcomes))
+        self.assertEqual(client._expand_concept_uncached.call_args.kwargs['timeout'], 0.05)
+
+    def test_timed_out_attempt_holds_slot_until_finished(self):
+        """Test an abandoned attempt keeps its controller slot while its thread is still running."""
+        client, state = self._fake_client(delay=0.3)
+        controller = AdaptiveConcurrencyController(initial_limit=2, max_limit=2)
+        engine = AsyncExpansionEngine('id', 'secret', request_timeout=0.05, max_retries=0,
+                                      client=client, controller=controller)
+
+        outcomes = self._run(engine, ['1'])
+
+        self.assertIn('Timed out', outcomes[0].error)
+        self.assertEqual(controller.in_flight, 1)
+        time.sleep(0.5)
+        self.assertEqual(controller.in_flight, 0)
+
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    """Test the AIMD controller that sets terminology server concurrency."""
+    
+    def _saturate(self, controller):
+        """Hold every slot so the limit counts as the bottleneck."""
+        while controller.try_acquire():
+            pass
+    
+    def _round(self, controller, latency, status=200):
+        self._saturate(controller)
+        for _ in range(max(controller.limit, 5)):
+            controller.record(latency, status)
+        for _ in range(controller.in_flight):
+            controller.release()
+    
+    def test_increases_while_healthy_and_halves_on_errors(self):
+        """Test additive increase on healthy rounds, multiplicative decrease on 5xx/429 or slow p95."""
+        controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=10)
+        for _ in range(20):
+            self._round(controller, 0.1)
+        self.assertEqual(controller.limit, 10)
+        
+        self._round(controller, 0.1, status=503)
+        self.assertEqual(controller.limit, 5)
+        self._round(controller, 0.1, status=429)
+        self.assertEqual(controller.limit, 2)
+        
+        # p95 far above the best healthy median also backs off
+        self._round(controller, 0.1)
+        self._round(controller, 5.0)
+        self.assertEqual(controller.limit, 1)
+        
+        snapshot = controller.snapshot()
+        self.assertEqual(snapshot['limit'], 1)
+        self.assertGreater(snapshot['decreases'], 2)
+    
+    def test_unsaturated_limit_does_not_grow(self):
+        """Test the limit only rises while callers are actually waiting on it."""
+        controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=10)
+        for _ in range(50):
+            controller.record(0.1, 200)
+        self.assertEqual(controller.limit, 4)
+    
+    def test_engine_follows_controller_limit(self):
+        """Test the async engine never has more codes in flight than the controller allows."""
+        controller = AdaptiveConcurrencyController(initial_limit=3, max_limit=3)
+        state = {'in_flight': 0, 'max_in_flight': 0}
+        lock = threading.Lock()
+        
+        def expand(code, include_inactive=False, include_hierarchy=False, timeout=None):
+            with lock:
+                state['in_flight'] += 1
+                state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            time.sleep(0.01)
+            with lock:
+                state['in_flight'] -= 1
+            return ExpansionResult(code, code, [], 0, datetime.now())
+        
+        client = Mock()
+        client._expand_concept_uncached.side_effect = expand
+        engine = AsyncExpansionEngine('id', 'secret', max_concurrency=16, client=client, controller=controller)
+        
+        async def collect():
+            return [outcome async for outcome in engine.expand([{'SNOMED Code': str(i)} for i in range(30)])]
+        
+        self.assertEqual(len(run_async(collect())), 30)
+        self.assertEqual(state['max_in_flight'], 3)
+        self.assertEqual(controller.in_flight, 0)
+
+
+
+class TestExpansionPlanner(unittest.TestCase):
+    """Test nested includeChildren codes are derived from their container's expansion."""
+    
+    # parent -> children; 5 has two parents
+    HIERARCHY = {'1': ['2', '3'], '2': ['4', '5'], '3': ['5'], '5': ['6'], '7': ['8']}
+    
+    def _descendants(self, code):
+        found = []
+        for child in self.HIERARCHY.get(code, []):
+            if child not in found:
+                found.append(child)
+            found.extend(grandchild for grandchild in self._descendants(child) if grandchild not in found)
+        return found
+    
+    def _fake_client(self):
+        parents = {}
+        for parent, children in self.HIERARCHY.items():
+            for child in children:
+                parents.setdefault(child, []).append(parent)
+        calls = []
+        
+        def expand(code, include_inactive=False, include_hierarchy=False, timeout=None):
+            calls.append((code, include_hierarchy))
+            children = [
+                ExpandedConcept(code=child, display=f'Concept {child}', parent_code=code,
+                                parents=tuple(parents[child]) if include_hierarchy else None)
+                for child in self._descendants(code)
+            ]
+            return ExpansionResult(code, f'Concept {code}', children, len(children), datetime.now(), edition='e1')
+        
+        client = Mock()
+        client._expand_concept_uncached.side_effect = expand
+        client.find_subsumed_codes.side_effect = lambda candidates, ancestors: {
+            code for code in candidates if any(code in self._descendants(a) for a in ancestors)
+        }
+        client.find_subsuming_codes.side_effect = lambda candidates, descendants: {
+            code for code in candidates if any(d in self._descendants(code) for d in descendants)
+        }
+        return client, calls
+    
+    def test_only_top_most_codes_are_expanded(self):
+        """Test nested codes are derived locally with the same descendants the server would return."""
+        client, calls = self._fake_client()
+        requested = ['1', '2', '5', '7']
+        plan = plan_expansions(client, requested)
+        self.assertEqual(plan.top_codes, ['1', '7'])
+        self.assertEqual(plan.nested_codes, {'2', '5'})
+        self.assertEqual(plan.container_codes, {'1'})
+        
+        engine = AsyncExpansionEngine('id', 'secret', client=client, controller=AdaptiveConcurrencyController())
+        
+        async def collect():
+            entries = [{'SNOMED Code': code} for code in requested]
+            return [outcome async for outcome in expand_with_plan(engine, entries, plan)]
+        
+        outcomes = {outcome.snomed_code: outcome for outcome in run_async(collect())}
+        self.assertEqual(sorted(calls), [('1', True), ('7', False)])
+        self.assertEqual(set(outcomes), set(requested))
+        for code in requested:
+            self.assertEqual(sorted(c.code for c in outcomes[code].result.children), sorted(self._descendants(code)))
+        self.assertEqual(outcomes['2'].derived_from, '1')
+        self.assertEqual(outcomes['5'].result.source_display, 'Concept 5')
+        self.assertTrue(all(child.parents is None for child in outcomes['1'].result.children))
+    
+    def test_missing_parent_data_falls_back_to_server(self):
+        """Test nested codes are still expanded when the container came back without parent data."""
+        client, calls = self._fake_client()
+        container = client._expand_concept_uncached('1')
+        self.assertEqual(derive_nested_results(container, {'2'}), {})
+        self.assertEqual(plan_expansions(client, ['1', '2'], include_inactive=True).nested_codes, set())
+
+
+
+class TestSingleRequestExpansion(unittest.TestCase):
+    """Test the source display comes from the expansion itself instead of a separate $lookup."""
+    
+    def _make_request(self, include_focus):
+        endpoints = []
+        
+        def make_request(endpoint, params=None, timeout=None):
+            endpoints.append(endpoint)
+            if endpoint == 'CodeSystem/$lookup':
+                return {'parameter': [{'name': 'display', 'valueString': 'Looked up'}]}, None
+            contains = [{'code': '73211009', 'display': 'Diabetes mellitus'}] if include_focus else []
+            contains += [{'code': '44054006', 'display': 'Type 2 diabetes'}, {'code': '46635009', 'display': 'Type 1 diabetes'}]
+            return {'expansion': {'total': len(contains), 'contains': contains}}, None
+        
+        return make_request, endpoints
+    
+    def test_one_round_trip_per_code(self):
+        """Test the focus concept is split out of the << expansion and no $lookup is made."""
+        client = NHSTerminologyClient('id', 'secret')
+        make_request, endpoints = self._make_request(include_focus=True)
+        with patch.object(client, '_make_request', side_effect=make_request):
+            result = client.expand_concept('73211009')
+        
+        self.assertEqual(endpoints, ['ValueSet/$expand'])
+        self.assertEqual(result.source_display, 'Diabetes mellitus')
+        self.assertEqual([child.code for child in result.children], ['44054006', '46635009'])
+    
+    def test_lookup_only_when_focus_missing(self):
+        """Test an inactive focus concept (filtered by activeOnly) still gets its display via $lookup."""
+        client = NHSTerminologyClient('id', 'secret')
+        make_request, endpoints = self._make_request(include_focus=False)
+        with patch.object(client, '_make_request', side_effect=make_request):
+            result = client.expand_concept('73211009')
+        
+        self.assertEqual(endpoints, ['ValueSet/$expand', 'CodeSystem/$lookup'])
+        self.assertEqual(result.source_display, 'Looked up')
+        self.assertEqual(len(result.children), 2)
+
+
+
+class TestExpansionTable(unittest.TestCase):
+    """Test expansion results are held column-wise and joined to EMIS GUIDs in one lookup."""
+    
+    def _result(self, code, children, inactive=()):
+        concepts = [ExpandedConcept(child, f'Concept {child}', inactive=child in inactive) for child in children]
+        return ExpansionResult(code, f'Parent {code}', concepts, len(concepts), datetime.now(), edition='e1')
+    
+    def test_table_replaces_reexpanded_parents(self):
+        """Test extend() keeps one copy of each parent with categorical parent codes."""
+        table = ExpansionTable.from_results([
+            self._result('100', ['101', '102']),
+            self._result('200', ['201'], inactive={'201'}),
+            ExpansionResult('300', '300', [], 0, datetime.now(), error='Not found')
+        ])
+        self.assertEqual(table.codes, {'100', '200'})
+        self.assertEqual(str(table.children['Parent Code'].dtype), 'category')
+        
+        table = table.extend([self._result('200', ['202', '203'])])
+        self.assertEqual(len(table), 4)
+        self.assertEqual(sorted(table.children.loc[table.children['Parent Code'] == '200', 'Child Code']), ['202', '203'])
+        self.assertEqual(table.header_results()['200'].total_count, 2)
+        self.assertEqual(table.subset(['100']).codes, {'100'})
+    
+    def test_emis_join_and_source_views(self):
+        """Test GUIDs come from a LookupIndex or dict, and per-source views repeat rows per source."""
+        lookup = LookupIndex(pd.Series(['101', '202']), LookupColumns({'emis_guid': pd.Series(['G101', 'G202'])}), 'emis_guid')
+        sources = build_source_frame({'100': [
+            {'Source Type': 'Search', 'Source Name': 'A', 'Source Container': 'Rule 1'},
+            {'Source Type': 'Report', 'Source Name': 'B', 'Source Container': 'Column 1'}
+        ]}, [{'SNOMED Code': '200', 'Source Type': 'Search', 'Source Name': 'C'}])
+        
+        for emis_lookup in (lookup, {'101': 'G101', '202': 'G202'}):
+            table = ExpansionTable.from_results([self._result('100', ['101', '102']), self._result('200', ['202'])])
+            table = table.with_emis_guids(emis_lookup).with_sources(sources)
+            
+            unique = table.child_view()
+            self.assertEqual(list(unique.columns), ['Parent Code', 'Parent Display', 'Child Code', 'Child Display', 'EMIS GUID', 'Inactive'])
+            self.assertEqual(dict(zip(unique['Child Code'], unique['EMIS GUID'])),
+                             {'101': 'G101', '102': 'Not in EMIS lookup table', '202': 'G202'})
+            
+            per_source = table.child_view(per_source=True)
+            self.assertEqual(len(per_source), 5)
+            self.assertEqual(sorted(per_source.loc[per_source['Parent Code'] == '200', 'Source Container']), ['Unknown'])
+
+
+
+class TestExpansionJobs(unittest.TestCase):
+    """Test background expansion jobs survive reruns, run once, and resume after cancellation."""
+    
+    def _fake_client(self, delay=0.0):
+        calls = []
+        
+        def expand(code, include_inactive=False, include_hierarchy=False, timeout=None):
+            calls.append(code)
+            time.sleep(delay)
+            child = ExpandedConcept(code=f'{code}1', display='Child', parent_code=code)
+            return ExpansionResult(code, f'Concept {code}', [child], 1, datetime.now())
+        
+        client = Mock(client_id='id', client_secret='secret')
+        client._expand_concept_uncached.side_effect = expand
+        client.find_subsumed_codes.return_value = set()
+        return client, calls
+    
+    def _start(self, codes, client, session_id=None):
+        return start_expansion_job([{'SNOMED Code': code} for code in codes], client=client,
+                                   controller=AdaptiveConcurrencyController(initial_limit=2, max_limit=2),
+                                   session_id=session_id)
+    
+    def test_job_checkpoints_every_code(self):
+        """Test a job expands each code once and a re-attaching reader can replay every outcome."""
+        client, calls = self._fake_client()
+        job = self._start(['100', '200', '300'], client)
+        self.assertTrue(job.wait(timeout=10))
+        
+        self.assertIs(get_expansion_job(job.job_id), job)
+        self.assertEqual(job.progress()['state'], 'completed')
+        self.assertEqual(job.progress()['succeeded'], 3)
+        self.assertEqual(sorted(outcome.snomed_code for outcome in job.outcomes_since(0)), ['100', '200', '300'])
+        self.assertEqual(len(job.outcomes_since(2)), 1)
+        self.assertEqual(sorted(calls), ['100', '200', '300'])
+    
+    def test_same_request_attaches_to_running_job(self):
+        """Test starting an identical request while it runs returns the running job."""
+        client, calls = self._fake_client(delay=0.2)
+        job = self._start(['400', '500'], client)
+        self.assertIs(self._start(['500', '400'], client), job)
+        job.wait(timeout=10)
+        self.assertEqual(sorted(calls), ['400', '500'])
+    
+    def test_cancelled_job_resumes_from_checkpoint(self):
+        """Test cancellation stops the job and the next run only expands the remaining codes."""
+        codes = [str(code) for code in range(600, 620)]
+        client, calls = self._fake_client(delay=0.05)
+        job = self._start(codes, client)
+        while job.progress()['completed'] < 3:
+            time.sleep(0.01)
+        job.cancel()
+        self.assertTrue(job.wait(timeout=10))
+        self.assertEqual(job.state, 'cancelled')
+        finished = job.completed_codes
+        self.assertLess(len(finished), len(codes))
+        
+        calls.clear()
+        resumed = self._start(codes, client)
+        self.assertIsNot(resumed, job)
+        self.assertTrue(resumed.wait(timeout=10))
+        self.assertEqual(resumed.progress()['succeeded'], len(codes))
+        self.assertEqual(resumed.progress()['resumed'], len(finished))
+        self.assertFalse(finished & set(calls))
+    
+    def test_cancel_only_detaches_while_other_sessions_follow(self):
+        """Test one session cancelling a shared job leaves it running until the last session detaches."""
+        client, calls = self._fake_client(delay=0.05)
+        codes = [str(code) for code in range(700, 720)]
+        job = self._start(codes, client, session_id='session-a')
+        self.assertIs(self._start(codes, client, session_id='session-b'), job)
+        
+        self.assertFalse(job.detach('session-a'))
+        time.sleep(0.1)
+        self.assertFalse(job.done)
+        self.assertTrue(job.detach('session-b'))
+        self.assertTrue(job.wait(timeout=10))
+        self.assertEqual(job.state, 'cancelled')
+
+
+
+class TestTerminologyStandIn(unittest.TestCase):
+    """Test the expansion pipeline end to end against the local terminology server stand-in."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.hierarchy = SyntheticHierarchy(2000)
+        cls.server = StandInServer(cls.hierarchy, page_cap=100).start()  # Force paging
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        connection_pool.clear_connection_pools()
+    
+    def _client(self):
+        return NHSTerminologyClient('id', 'secret', base_url=self.server.base_url, auth_url=self.server.auth_url)
+    
+    def test_paged_expansion_matches_hierarchy(self):
+        """Test a multi-page expansion returns every active descendant and the focus display."""
+        code = max(self.hierarchy.codes[1:50], key=lambda c: len(self.hierarchy.descendants(c)))
+        expected = {c for c in self.hierarchy.descendants(code) if c not in self.hierarchy.inactive}
+        self.assertGreater(len(expected), 300)
+        
+        result = self._client().expand_concept(code)
+        self.assertIsNone(result.error)
+        self.assertEqual(result.source_display, self.hierarchy.display[code])
+        self.assertEqual({child.code for child in result.children}, expected)
+        self.assertTrue(result.edition)
+    
+    def test_planned_expansion_matches_independent(self):
+        """Test derived nested expansions equal the ones the server returns directly."""
+        client = self._client()
+        top = self.hierarchy.sample_codes(1, min_descendants=20)[0]
+        nested = self.hierarchy.children[top][0]
+        requested = [top, nested, self.hierarchy.sample_codes(2, seed=5)[1]]
+        plan = plan_expansions(client, requested)
+        self.assertEqual(plan.nested_codes, {nested})
+        
+        engine = AsyncExpansionEngine('id', 'secret', client=client, controller=AdaptiveConcurrencyController())
+        
+        async def collect():
+            return [outcome async for outcome in expand_with_plan(engine, [{'SNOMED Code': c} for c in requested], plan)]
+        
+        outcomes = {outcome.snomed_code: outcome for outcome in run_async(collect())}
+        self.assertEqual(outcomes[nested].derived_from, top)
+        direct = client.expand_concept(nested)
+        self.assertEqual({c.code for c in outcomes[nested].result.children}, {c.code for c in direct.children})
+
+
+class TestSharedLookup(unittest.TestCase):
+    """Test background tasks read the lookup table from shared memory instead of pickling it per task."""
+    
+    def setUp(self):
+        self.lookup_df = pd.DataFrame({
+            'EMIS_GUID': [f'guid{i}' for i in range(2000)] + ['guid7'],
+            'SNOMED_Code': [str(100000 + i // 2) for i in range(2000)] + ['555'],
+            'Source_Type': ['Clinical', 'Medication', 'Constituent', 'DM+D'] * 500 + ['Refset'],
+            'Descendants': [str(i % 7) for i in range(2001)]
+        })
+        self.guid_index, self.snomed_index = create_lookup_dictionaries.__wrapped__(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code')
+    
+    def test_shared_indexes_match_originals(self):
+        """Test attached indexes give the same records, field views and misses as the in-process ones."""
+        table = SharedLookupTable('v1', self.guid_index, self.snomed_index)
+        try:
+            guid_index, snomed_index = attach_shared_lookup(table.ref)
+            self.assertIsInstance(guid_index, SharedLookupIndex)
+            self.assertIsInstance(guid_index, LookupIndex)
+            
+            keys = ['guid7', 'guid1999', 'missing', None, 'guid10', 'guid7x', '']
+            self.assertEqual(guid_index.get_many(keys), self.guid_index.get_many(keys))
+            self.assertEqual(guid_index['guid7'], self.guid_index['guid7'])
+            self.assertNotIn('guid2000', guid_index)
+            self.assertIsNone(guid_index.get(123))
+            self.assertEqual(sorted(guid_index), sorted(self.guid_index))
+            self.assertEqual(snomed_index.field_view('source_type').get('100001'), self.snomed_index['100001']['source_type'])
+            self.assertEqual(len(snomed_index), len(self.snomed_index))
+            
+            # The reference is all a task carries
+            self.assertLess(len(pickle.dumps(table.ref)), 2000)
+        finally:
+            table.close()
+    
+    def test_processor_translates_with_published_lookup(self):
+        """Test a worker translation matches the in-process one and republishing a version is a no-op."""
+        handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', {'emis_version': 'shared-1'})
+        occurrence = TestBatchTranslation._occurrence
+        occurrences = [
+            occurrence('guid1', 'vs-1', 'search-1'),
+            occurrence('guid2', 'vs-2', 'search-1', code_system='SCT_DRGGRP'),
+            occurrence('guid7', 'vs-3', 'search-2', display='Member', pseudo=True),
+            occurrence('100000', 'vs-4', 'search-2', refset=True, description='Refset'),
+            occurrence('missing', 'vs-1', 'search-2')
+        ]
+        processor = BackgroundProcessor(max_workers=1)
+        try:
+            lookup_ref = processor.publish_lookup(handle)
+            self.assertIs(processor.publish_lookup(handle), lookup_ref)
+            
+            processor.submit_task('translate', 'Translate', translate_with_shared_lookup,
+                                  lookup_ref=lookup_ref, emis_guids=occurrences)
+            deadline = time.time() + 60
+            while processor.get_task_status('translate').status == TaskStatus.RUNNING and time.time() < deadline:
+                time.sleep(0.05)
+            task = processor.get_task_status('translate')
+            self.assertEqual(task.status, TaskStatus.COMPLETED, task.error)
+            expected = translate_emis_guids_batch(occurrences, self.guid_index, self.snomed_index, 'unique_codes')
+            self.assertEqual(task.result, expected)
+        finally:
+            processor.shutdown()
+
+    def test_replaced_lookup_outlives_tasks_submitted_before(self):
+        """Test a republished lookup keeps the old block until earlier tasks finish, and later tasks still run."""
+        old_handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', {'emis_version': 'shared-1'})
+        new_handle = LookupTableHandle.create(self.lookup_df, 'EMIS_GUID', 'SNOMED_Code', {'emis_version': 'shared-2'})
+        processor = BackgroundProcessor(max_workers=1)
+        try:
+            old_ref = processor.publish_lookup(old_handle)
+            processor.submit_task('slow', 'Slow', time.sleep, 0.5)
+            new_ref = processor.publish_lookup(new_handle)
+            self.assertNotEqual(new_ref.block_name, old_ref.block_name)
+            _open_block(old_ref.block_name).close()
+
+            processor.submit_task('translate', 'Translate', translate_with_shared_lookup,
+                                  lookup_ref=new_ref, emis_guids=[TestBatchTranslation._occurrence('guid1', 'vs-1', 'search-1')])
+            deadline = time.time() + 60
+            while processor.get_task_status('translate').status == TaskStatus.RUNNING and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(processor.get_task_status('translate').status, TaskStatus.COMPLETED)
+            with self.assertRaises(FileNotFoundError):
+                _open_block(old_ref.block_name)
+        finally:
+            processor.shutdown()
+    
+    def test_shared_text_round_trip(self):
+        """Test XML placed in shared memory reads back intact and is released with its task."""
+        xml_content = '<enquiryDocument>\u00e9' + 'x' * 100000 + '</enquiryDocument>'
+        block, xml_ref = share_text(xml_content)
+        self.assertEqual(read_shared_text(xml_ref), xml_content)
+        
+        processor = BackgroundProcessor(max_workers=1)
+        processor.retain_buffer('finished-task', block)
+        # No running task holds it, so it is released at once
+        with self.assertRaises(FileNotFoundError):
+            read_shared_text(xml_ref)
+
+
+def _slow_counting_task(steps, delay):
+    """Background task that reports progress every step (module-level so workers can unpickle it)"""
+    for step in range(steps):
+        time.sleep(delay)
+        report_progress(step + 1, steps)
+    return steps
+
+
+class TestTaskControl(unittest.TestCase):
+    """Test background tasks report progress across processes and stop when cancelled."""
+    
+    def tearDown(self):
+        install_channels(None)
+        clear_parsed_document_cache()
+    
+    def test_nested_progress_and_cancellation_checkpoints(self):
+        """Test progress ranges nest, calls outside a task are no-ops and cancellation escapes broad handlers."""
+        report_progress(5, 10)  # Not in a task: nothing to report to
+        
+        channels = TaskChannels(slots=2)
+        install_channels(channels)
+        slot = channels.acquire_slot()
+        with task_scope(slot):
+            with progress_range(0.2, 0.6):
+                report_progress(1, 2)
+                self.assertAlmostEqual(channels.read_progress(slot), 0.4)
+                with progress_range(0.5, 1.0):
+                    report_progress(1, 4)
+                    self.assertAlmostEqual(channels.read_progress(slot), 0.45)
+            self.assertAlmostEqual(channels.read_progress(slot), 0.6)
+            
+            # Analysis reports progress as it goes and a cancelled task stops inside it
+            analyze_search_rules(TestParsedDocumentSharing.XML)
+            self.assertGreaterEqual(channels.read_progress(slot), 0.95)
+            channels.request_cancel(slot)
+            clear_parsed_document_cache()
+            with self.assertRaises(TaskCancelled):
+                try:
+                    analyze_search_rules(TestParsedDocumentSharing.XML)
+                except Exception:
+                    self.fail("Cancellation was swallowed as an ordinary error")
+    
+    def test_running_task_reports_progress_and_cancels(self):
+        """Test a running worker task shows live progress and cancelling it frees the worker."""
+        processor = BackgroundProcessor(max_workers=1)
+        try:
+            processor.submit_task('slow', 'Slow task', _slow_counting_task, 2000, 0.005)
+            deadline = time.time() + 30
+            while processor.get_task_status('slow').progress == 0 and time.time() < deadline:
+                time.sleep(0.02)
+            progress = processor.get_task_status('slow').progress
+            self.assertGreater(progress, 0)
+            self.assertLess(progress, 100)
+            
+            self.assertTrue(processor.cancel_task('slow'))
+            self.assertEqual(processor.get_task_status('slow').status, TaskStatus.CANCELLED)
+            
+            # The single worker is free again long before the abandoned task would have finished
+            started = time.time()
+            processor.submit_task('quick', 'Quick task', _slow_counting_task, 1, 0)
+            while processor.get_task_status('quick').status == TaskStatus.RUNNING and time.time() < deadline:
+                time.sleep(0.02)
+            self.assertEqual(processor.get_task_status('quick').status, TaskStatus.COMPLETED)
+            self.assertEqual(processor.get_task_status('quick').result, 1)
+            self.assertLess(time.time() - started, 5)
+        finally:
+            processor.shutdown()
+
+
+class TestDependencyGraph(unittest.TestCase):
+    """Test the shared dependency graph engine used by the analyzers."""
+    
+    @staticmethod
+    def _chain_export(count, fan_in=3):
+        """Searches where each one depends on the previous fan_in searches (a dense DAG)"""
+        searches = [SimpleNamespace(id=f's{i}', name=f'Search {i}', parent_guid=None, criteria_groups=[], folder_path=[],
+                                    direct_dependencies=[f's{j}' for j in range(max(0, i - fan_in), i)], dependents=[])
+                    for i in range(count)]
+        for search in searches:
+            for dependency in search.direct_dependencies:
+                searches[int(dependency[1:])].dependents.append(search.id)
+        return searches
+    
+    def test_cycles_order_and_depth(self):
+        """Test SCC cycle detection, topological order and memoized depths, ignoring unknown ids."""
+        graph = DependencyGraph(
+            ['a', 'b', 'c', 'd', 'e', 'f'],
+            [('a', 'b'), ('b', 'c'), ('c', 'b'), ('c', 'd'), ('a', 'd'), ('e', 'e'), ('d', 'missing'), ('a', 'b')]
+        )
+        self.assertEqual(graph.cycles, [['b', 'c'], ['e']])
+        self.assertTrue(graph.in_cycle('c'))
+        self.assertFalse(graph.in_cycle('a'))
+        self.assertEqual(graph.children('a'), ('b', 'd'))
+        
+        order = graph.topological_order()
+        self.assertLess(order.index('a'), order.index('b'))
+        self.assertLess(order.index('c'), order.index('d'))
+        # a -> {b, c} -> d: the cycle counts each member once
+        self.assertEqual([graph.depth(node) for node in 'abcdef'], [4, 3, 3, 1, 1, 1])
+        self.assertEqual(graph.max_depth(['a', 'f']), 4)
+        self.assertEqual(graph.max_depth([]), 1)
+    
+    def test_tree_shares_subtrees_and_stubs_cycles(self):
+        """Test a diamond's shared child is one dict and edges back into a cycle become stubs."""
+        graph = DependencyGraph(['root', 'left', 'right', 'shared', 'x', 'y'], [
+            ('root', 'left'), ('root', 'right'), ('left', 'shared'), ('right', 'shared'),
+            ('shared', 'x'), ('x', 'y'), ('y', 'x')
+        ])
+        make_node = lambda node, children: {'id': node, 'children': children}
+        root, = graph.build_tree(['root'], make_node, lambda node: {'id': node, 'circular': True})
+        
+        left, right = root['children']
+        self.assertIs(left['children'][0], right['children'][0])
+        x_node = left['children'][0]['children'][0]
+        self.assertEqual(x_node['id'], 'x')
+        self.assertEqual(x_node['children'][0]['id'], 'y')
+        self.assertEqual(x_node['children'][0]['children'], [{'id': 'x', 'circular': True}])
+        
+        # Without a stub builder the back edge is omitted
+        root, = graph.build_tree(['root'], make_node)
+        self.assertEqual(root['children'][0]['children'][0]['children'][0]['children'][0]['children'], [])
+    
+    def test_dense_enterprise_export(self):
+        """Test a 2,000-search dense export builds every analyzer tree in milliseconds."""
+        searches = self._chain_export(2000)
+        
+        start_time = time.perf_counter()
+        search_tree = SearchAnalyzer()._build_search_dependency_tree(searches)
+        rule_tree = _build_dependency_tree(searches)
+        complete_tree = _build_complete_dependency_tree(searches)
+        elapsed = time.perf_counter() - start_time
+        
+        self.assertEqual(search_tree['max_depth'], 2000)
+        self.assertEqual(rule_tree['max_depth'], 2000)
+        self.assertEqual(complete_tree['max_depth'], 2000)
+        self.assertEqual([root['id'] for root in search_tree['roots']], ['s0'])
+        self.assertEqual([root['id'] for root in rule_tree['roots']], ['s0'])
+        self.assertEqual(search_tree['roots'][0]['children'][0]['id'], 's1')
+        self.assertLess(elapsed, 0.5)
+
+
+class TestParallelParsing(unittest.TestCase):
+    """Test process-parallel parsing of search and report elements."""
+    
+    @staticmethod
+    def _generate_pack(num_searches: int, num_lists: int) -> str:
+        """Search pack with chained searches (each with a value set) and list reports on them"""
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<enquiryDocument xmlns="http://www.e-mis.com/emisopen">',
+                 '<id>doc-1</id><creationTime>2025-01-01</creationTime>',
+                 '<reportFolder><id>folder-1</id><name>QOF</name></reportFolder>']
+        for i in range(num_searches):
+            parent = f'<parent parentType="POP"><SearchIdentifier reportGuid="search-{i - 1}"/></parent>' if i else ''
+            parts.append(
+                f'<report><id>search-{i}</id><name>Search {i}</name><folder>folder-1</folder>{parent}'
+                f'<population><criteriaGroup><id>group-{i}</id><definition><memberOperator>AND</memberOperator>'
+                f'<criteria><criterion><id>criterion-{i}</id><table>EVENTS</table><filterAttribute><columnValue>'
+                f'<column>READCODE</column><valueSet><id>vs-{i}</id><codeSystem>SNOMED_CONCEPT</codeSystem>'
+                f'<values><value>{1000 + i}</value><displayName>Code {i}</displayName></values></valueSet>'
+                f'</columnValue></filterAttribute></criterion></criteria></definition>'
+                f'<actionIfTrue>SELECT</actionIfTrue><actionIfFalse>REJECT</actionIfFalse></criteriaGroup>'
+                f'</population></report>\n'
+            )
+        for i in range(num_lists):
+            parts.append(
+                f'<report><id>list-{i}</id><name>List {i}</name><folder>folder-1</folder>'
+                f'<parent parentType="POP"><SearchIdentifier reportGuid="search-{i}"/></parent>'
+                f'<listReport><columnGroups><columnGroup><id>columns-{i}</id><logicalTableName>PATIENTS</logicalTableName>'
+                f'<columnar><listColumn><column>NHS</column><displayName>NHS</displayName></listColumn></columnar>'
+                f'</columnGroup></columnGroups></listReport></report>\n'
+            )
+        parts.append('</enquiryDocument>')
+        return ''.join(parts)
+    
+    def setUp(self):
+        self.document = get_parsed_document(self._generate_pack(180, 40))
+        self.serial = AnalysisOrchestrator(parallel_workers=1, report_cache=ReportResultCache()).analyze_complete_xml(self.document)
+    
+    def tearDown(self):
+        clear_parsed_document_cache()
+    
+    def _assert_matches_serial(self, results):
+        self.assertEqual(results.searches, self.serial.searches)
+        self.assertEqual(results.reports, self.serial.reports)
+        self.assertEqual(results.report_clinical_codes, self.serial.report_clinical_codes)
+        self.assertEqual(results.search_dependencies['max_depth'], self.serial.search_dependencies['max_depth'])
+    
+    def test_parallel_results_match_serial(self):
+        """Test sharded parsing merges to the same searches, reports and dependencies in document order."""
+        orchestrator = AnalysisOrchestrator(parallel_workers=2, report_cache=ReportResultCache())
+        self.assertTrue(orchestrator.parallel_parser.should_parallelize(220))
+        
+        results = orchestrator.analyze_complete_xml(self.document)
+        self._assert_matches_serial(results)
+        self.assertEqual(len(results.searches), 180)
+        self.assertEqual(results.searches[5].parent_guid, 'search-4')
+        self.assertEqual(results.searches[0].dependents, ['search-1'])
+        self.assertEqual(results.reports[180].parent_guid, 'search-0')
+    
+    def test_parallel_parsing_is_opt_in(self):
+        """Test the default orchestrator parses in-process, and analysis opts in only from the main process."""
+        self.assertFalse(AnalysisOrchestrator().parallel_parser.should_parallelize(10000))
+        with patch.object(parallel_parsing.multiprocessing, 'cpu_count', return_value=4):
+            self.assertEqual(parallel_parsing.default_parallel_workers(), 4)
+            with patch.object(parallel_parsing.multiprocessing, 'parent_process', return_value=Mock()):
+                self.assertEqual(parallel_parsing.default_parallel_workers(), 1)
+    
+    def test_serialized_subtrees_without_fork(self):
+        """Test workers re-parse serialized subtrees in a pool that is never forked."""
+        element = self.document.search_elements[0]
+        self.assertEqual(element.tail, '\n')
+        self.assertEqual(ET.tostring(ET.fromstring(parallel_parsing.serialize_element(element))), ET.tostring(element).strip())
+        self.assertNotEqual(parallel_parsing._pool_context().get_start_method(), 'fork')
+        
+        with patch.object(parallel_parsing.multiprocessing, 'get_all_start_methods', return_value=['spawn']):
+            results = AnalysisOrchestrator(parallel_workers=2, report_cache=ReportResultCache()).analyze_complete_xml(self.document)
+        self._assert_matches_serial(results)
+    
+    def test_pool_failure_falls_back_to_serial(self):
+        """Test a pool that can't start leaves parsing to the current process."""
+        with patch.object(parallel_parsing.concurrent.futures, 'ProcessPoolExecutor', side_effect=OSError("no processes")):
+            results = AnalysisOrchestrator(parallel_workers=4, report_cache=ReportResultCache()).analyze_complete_xml(self.document)
+        self._assert_matches_serial(results)
+
+
+class TestIncrementalReanalysis(unittest.TestCase):
+    """Test per-report fingerprints and reuse of results for re-uploaded documents."""
+    
+    def setUp(self):
+        clear_report_cache()
+        self.original = TestParallelParsing._generate_pack(60, 20)
+        self.edited = self.original.replace('<name>Search 30</name>', '<name>Search 30 (edited)</name>')
+    
+    def tearDown(self):
+        clear_parsed_document_cache()
+        clear_report_cache()
+    
+    def test_fingerprints_follow_report_content(self):
+        """Test each report's fingerprint covers its raw text, nested reports included, and only changes with it."""
+        nested = (b'<doc><reportFolder><id>f</id></reportFolder><report><id>outer</id>'
+                  b'<report><id>inner</id></report><e:report xmlns:e="x"/></report></doc>')
+        outer, inner, prefixed = (nested.find(b'<report><id>outer'), nested.find(b'<report><id>inner'), nested.find(b'<e:report'))
+        self.assertEqual(scan_report_spans(nested), [(outer, len(nested) - len(b'</doc>')),
+                                                     (inner, prefixed), (prefixed, nested.find(b'</report></doc>'))])
+        self.assertIsNone(scan_report_spans(b'<report><id>a</id>'))
+        
+        original = get_parsed_document(self.original).report_fingerprints
+        edited = get_parsed_document(self.edited).report_fingerprints
+        self.assertEqual(len(original), 80)
+        changed = {value.split(':')[0] for value in set(edited.values()) - set(original.values())}
+        self.assertEqual(changed, {'search-30'})
+        
+        # Report tags the scan can't match to the tree (here inside a comment) disable fingerprinting
+        commented = self.original.replace('<id>doc-1</id>', '<id>doc-1</id><!-- <report> -->')
+        self.assertEqual(get_parsed_document(commented).report_fingerprints, {})
+    
+    def test_reupload_parses_only_changed_reports(self):
+        """Test a re-upload re-parses just the edited search and matches a full analysis."""
+        cache = ReportResultCache()
+        AnalysisOrchestrator(parallel_workers=1, report_cache=cache).analyze_complete_xml(self.original)
+        
+        with patch.object(SearchAnalyzer, '_parse_search_report', autospec=True,
+                          side_effect=SearchAnalyzer._parse_search_report) as parse_search:
+            results = AnalysisOrchestrator(parallel_workers=1, report_cache=cache).analyze_complete_xml(self.edited)
+            again = AnalysisOrchestrator(parallel_workers=1, report_cache=cache).analyze_complete_xml(self.edited)
+        self.assertEqual(parse_search.call_count, 1)
+        
+        full = AnalysisOrchestrator(parallel_workers=1, report_cache=ReportResultCache()).analyze_complete_xml(self.edited)
+        for incremental in (results, again):
+            self.assertEqual(incremental.searches, full.searches)
+            self.assertEqual(incremental.reports, full.reports)
+            self.assertEqual(incremental.dependency_tree, full.dependency_tree)
+        self.assertEqual(results.searches[30].name, 'Search 30 (edited)')
+        # Reused objects are copies, so dependency building doesn't accumulate across runs
+        self.assertEqual(again.searches[0].dependents, ['search-1'])
+        self.assertIsNot(again.searches[0], results.searches[0])
+    
+    def test_guid_extraction_reuses_unchanged_reports(self):
+        """Test GUID extraction walks only edited reports and never caches reports that failed."""
+        baseline = extract_emis_guids_by_source(self.original)
+        cache = get_report_cache()
+        hits = cache.hits
+        
+        edited = self.original.replace('<value>1007</value>', '<value>77777</value>')
+        results = extract_emis_guids_by_source(edited)
+        self.assertEqual(cache.hits - hits, 79)
+        clear_report_cache()
+        self.assertEqual(results, extract_emis_guids_by_source(edited))
+        self.assertEqual(len(results), len(baseline))
+        self.assertIn('77777', [guid_info['emis_guid'] for guid_info in results])
+        
+        # Returned dicts are copies of the cached ones
+        results[0]['emis_guid'] = 'changed'
+        self.assertNotEqual(extract_emis_guids_by_source(edited)[0]['emis_guid'], 'changed')
+        
+        errors = []
+        clear_report_cache()
+        with patch('util_modules.xml_parsers.xml_utils.extract_emis_guids_from_element', side_effect=ValueError("bad")):
+            extract_emis_guids_by_source(get_parsed_document(edited), on_error=lambda kind, e: errors.append(kind))
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(errors)
+
+
 if __name__ == '__main__':
     # Run performance tests with verbose output
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -3,68 +3,152 @@ Analysis Orchestrator - Coordinates the complete XML analysis flow
 Handles initial classification and orchestrates specialized analyzers
 """
 
+import copy
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union
 from .xml_element_classifier import XMLElementClassifier, ClassifiedElements
 from .search_analyzer import SearchAnalyzer, SearchAnalysisResult
 from .report_analyzer import ReportAnalyzer, ReportAnalysisResult
 from .common_structures import CompleteAnalysisResult, ReportFolder
+from .dependency_graph import DependencyGraph
+from .parallel_parsing import ParallelElementParser
+from ..xml_parsers.parsed_document import ParsedDocument, get_parsed_document
+from ..xml_parsers.namespace_handler import NamespaceHandler, namespace_mode_scope
+from ..xml_parsers.report_cache import ReportResultCache, get_report_cache
+from ..core.task_control import check_cancelled, progress_range
+
+
+def _copy_parsed(parsed, folder_path: Optional[List[str]] = None):
+    """Copy of a parsed search/report with its own relationship lists (dependency building appends to them)"""
+    clone = copy.copy(parsed)
+    clone.direct_dependencies = list(parsed.direct_dependencies)
+    clone.dependents = list(parsed.dependents)
+    if folder_path is not None:
+        clone.folder_path = folder_path
+    return clone
 
 
 class AnalysisOrchestrator:
     """Orchestrates the complete XML analysis process"""
     
-    def __init__(self):
+    def __init__(self, parallel_workers: int = 1, report_cache: Optional[ReportResultCache] = None):
+        """
+        Args:
+            parallel_workers: Processes for parsing large documents (the default of 1 parses in-process)
+            report_cache: Per-report parse results kept across uploads (defaults to the shared cache)
+        """
         self.classifier = XMLElementClassifier()
         self.search_analyzer = SearchAnalyzer()
         self.report_analyzer = ReportAnalyzer()
+        self.parallel_parser = ParallelElementParser(parallel_workers)
+        self.report_cache = report_cache if report_cache is not None else get_report_cache()
+        self.ns = NamespaceHandler()
     
-    def analyze_complete_xml(self, xml_content: str) -> CompleteAnalysisResult:
+    def analyze_complete_xml(self, xml_content: Union[str, ParsedDocument]) -> CompleteAnalysisResult:
         """
         Perform complete analysis of XML content
         
         Args:
-            xml_content: Raw XML content
+            xml_content: Raw XML content, or the shared ParsedDocument for it
             
         Returns:
             CompleteAnalysisResult with combined search and report analysis
         """
         try:
-            # Step 1: Classify all elements by type
-            classified = self.classifier.classify_elements(xml_content)
+            # Parse once; every lookup below uses the document's detected namespace strategy
+            document = get_parsed_document(xml_content)
+            with namespace_mode_scope(document.namespace_mode):
+                return self._analyze_document(document)
             
-            # Step 2: Analyze searches if any exist
+        except Exception as e:
+            raise Exception(f"Error in analysis orchestration: {str(e)}")
+    
+    def _analyze_document(self, document: ParsedDocument) -> CompleteAnalysisResult:
+        """Run classification and the specialized analyzers over a parsed document"""
+        # Step 1: Classify all elements by type
+        with progress_range(0.0, 0.1):
+            classified = self.classifier.classify_elements(document)
+        
+        # Combine all report elements
+        all_report_elements = (classified.audit_elements + 
+                             classified.list_elements + 
+                             classified.aggregate_elements)
+        
+        # Step 2: Parse searches and reports, reusing those unchanged since an earlier upload
+        cached_searches, search_elements = self._cached_parses('search', classified.search_elements, document)
+        cached_reports, report_elements = self._cached_parses('report', all_report_elements, document)
+        check_cancelled()  # Parsing may have nothing left to do, so check here too
+        with progress_range(0.1, 0.85):
+            parsed_searches, parsed_reports = self.parallel_parser.parse(
+                search_elements,
+                report_elements,
+                classified.namespaces,
+                classified.folders,
+                document.namespace_mode,
+                self.search_analyzer,
+                self.report_analyzer
+            )
+        searches = self._merge_parses('search', classified.search_elements, document, cached_searches,
+                                      parsed_searches, self.search_analyzer, classified.folders)
+        reports = self._merge_parses('report', all_report_elements, document, cached_reports,
+                                     parsed_reports, self.report_analyzer, classified.folders)
+        
+        # Step 3: Build relationships, flows and trees over the complete lists
+        with progress_range(0.85, 0.9):
             search_results = None
             if classified.search_elements:
-                search_results = self.search_analyzer.analyze_searches(
-                    classified.search_elements, 
-                    classified.namespaces, 
-                    classified.folders
-                )
+                search_results = self.search_analyzer.analyze_parsed_searches(searches)
             
-            # Step 3: Analyze reports if any exist  
             report_results = None
-            if classified.audit_elements or classified.list_elements or classified.aggregate_elements:
-                # Combine all report elements
-                all_report_elements = (classified.audit_elements + 
-                                     classified.list_elements + 
-                                     classified.aggregate_elements)
-                
-                report_results = self.report_analyzer.analyze_reports(
-                    all_report_elements,
-                    classified.namespaces,
-                    classified.folders
-                )
-            
-            # Step 4: Combine results
-            combined_results = self._combine_analysis_results(
-                classified, search_results, report_results
-            )
-            
-            return combined_results
+            if all_report_elements:
+                report_results = self.report_analyzer.analyze_parsed_reports(reports)
+        
+        # Step 4: Combine results
+        combined_results = self._combine_analysis_results(
+            classified, search_results, report_results
+        )
+        
+        return combined_results
+    
+    def _cached_parses(self, kind: str, elements: List, document: ParsedDocument) -> Tuple[List, List]:
+        """
+        Parse results kept from earlier uploads for elements whose fingerprint is unchanged
+        
+        Returns:
+            (cached result or None for each element, elements that still need parsing)
+        """
+        cached = []
+        missing = []
+        for element in elements:
+            fingerprint = document.report_fingerprints.get(element)
+            parsed = self.report_cache.get(kind, (document.namespace_mode, fingerprint)) if fingerprint else None
+            cached.append(parsed)
+            if parsed is None:
+                missing.append(element)
+        return cached, missing
+    
+    def _merge_parses(self, kind: str, elements: List, document: ParsedDocument, cached: List, parsed: List,
+                      analyzer: Union[SearchAnalyzer, ReportAnalyzer], folders: List[ReportFolder]) -> List:
+        """Combine reused and newly parsed results in document order, keeping the new ones for next time"""
+        merged = []
+        fresh = iter(parsed)
+        pending = next(fresh, None)
+        for element, reused in zip(elements, cached):
+            if reused is not None:
+                # Folders can move between uploads even when the report itself is unchanged
+                merged.append(_copy_parsed(reused, folder_path=analyzer._build_folder_path(reused.folder_id, folders)))
+                continue
             
-        except Exception as e:
-            raise Exception(f"Error in analysis orchestration: {str(e)}")
+            # Elements that failed to parse have no result; the rest line up by report id
+            id_elem = self.ns.find(element, 'id')
+            if pending is None or pending.id != (id_elem.text if id_elem is not None else "Unknown"):
+                continue
+            fingerprint = document.report_fingerprints.get(element)
+            if fingerprint:
+                self.report_cache.put(kind, (document.namespace_mode, fingerprint), _copy_parsed(pending))
+            merged.append(pending)
+            pending = next(fresh, None)
+        return merged
     
     def _combine_analysis_results(self, 
                                 classified: ClassifiedElements,
@@ -144,75 +228,37 @@ class AnalysisOrchestrator:
         
         # Build integrated tree where searches can be parents of reports
         all_entities = list(search_map.values()) + list(report_map.values())
-        
-        # Track which entities are children so we don't add them as roots
-        child_entity_ids = set()
-        
-        for entity in all_entities:
-            parent_guid = getattr(entity, 'parent_guid', None)
-            if parent_guid and (parent_guid in search_map or parent_guid in report_map):
-                child_entity_ids.add(entity.id)
+        entity_map = {entity.id: entity for entity in all_entities}
+        graph = DependencyGraph.from_parents(all_entities)
         
         # Only add entities as roots if they're not children of other entities
-        for entity in all_entities:
-            if entity.id not in child_entity_ids:
-                combined_tree['roots'].append(self._create_combined_node(entity, search_map, report_map, all_entities))
+        root_ids = [entity.id for entity in all_entities if not graph.has_parents(entity.id)]
+        combined_tree['roots'] = graph.build_tree(
+            root_ids,
+            lambda entity_id, children: self._create_combined_node(entity_map[entity_id], children)
+        )
         
         # Calculate max depth
-        combined_tree['max_depth'] = self._calculate_combined_max_depth(combined_tree['roots'])
+        combined_tree['max_depth'] = graph.max_depth(root_ids, default=1)
         
         return combined_tree
     
-    def _create_combined_node(self, entity, search_map: Dict, report_map: Dict, all_entities: List, visited: set = None) -> Dict[str, Any]:
+    def _create_combined_node(self, entity, children: List[Dict[str, Any]]) -> Dict[str, Any]:
         """Create a dependency node that can contain both searches and reports"""
-        if visited is None:
-            visited = set()
-        
-        if entity.id in visited:
-            return {'id': entity.id, 'name': entity.name, 'circular': True}
-        
-        visited.add(entity.id)
-        
         # Determine entity type and create base node
         if hasattr(entity, 'report_type'):
             # This is a report - clean up the type display
             clean_type = entity.report_type.strip('[]').title()
-            node = {
-                'id': entity.id,
-                'name': entity.name,
-                'type': clean_type,
-                'children': []
-            }
         else:
             # This is a search
-            node = {
-                'id': entity.id,
-                'name': entity.name,
-                'type': 'Search',
-                'children': []
-            }
+            clean_type = 'Search'
         
-        # Find children (entities that have this entity as parent)
-        for child_entity in all_entities:
-            child_parent_guid = getattr(child_entity, 'parent_guid', None)
-            if child_parent_guid == entity.id and child_entity.id not in visited:
-                child_node = self._create_combined_node(child_entity, search_map, report_map, all_entities, visited.copy())
-                node['children'].append(child_node)
-        
-        return node
-    
-    def _calculate_combined_max_depth(self, roots: List[Dict]) -> int:
-        """Calculate maximum depth of combined dependency tree"""
-        if not roots:
-            return 1
-        
-        def get_depth(node: Dict) -> int:
-            children = node.get('children', [])
-            if not children:
-                return 1
-            return 1 + max(get_depth(child) for child in children)
-        
-        return max(get_depth(root) for root in roots)
+        return {
+            'id': entity.id,
+            'name': entity.name,
+            'type': clean_type,
+            'children': children
+        }
     
     def _update_report_dependencies_with_search_names(self, combined_tree: Dict, search_results: SearchAnalysisResult):
         """Update report dependency tree with proper search names from search analysis"""
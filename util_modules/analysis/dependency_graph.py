@@ -0,0 +1,232 @@
+"""
+Dependency Graph - Shared engine for search and report dependency analysis
+
+The analyzers used to walk dependencies recursively with a copied visited set
+per path and no memoization, which repeats every shared subtree (exponential
+on dense exports) and rebuilt lookup maps at each node. DependencyGraph builds
+the adjacency index once and answers everything from it:
+
+- Strongly connected components (iterative Tarjan), so cycles are found once
+- Topological order of the components
+- Memoized longest-path depth
+- Dependency trees whose node dicts are built once per entity and shared
+  wherever the entity appears
+
+Edges point from an entity to the entities that depend on it (its children in
+the dependency trees). Edges to ids outside the graph are ignored.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class DependencyGraph:
+    """Directed graph over entity ids with cycle-aware traversal helpers"""
+
+    def __init__(self, nodes: Iterable[str], edges: Iterable[Tuple[str, str]]):
+        """
+        Args:
+            nodes: Entity ids, in display order
+            edges: (entity id, dependent id) pairs; duplicates and unknown ids are dropped
+        """
+        self.nodes: List[str] = list(dict.fromkeys(nodes))
+        self._order = {node: position for position, node in enumerate(self.nodes)}
+        children: Dict[str, Dict[str, None]] = {node: {} for node in self.nodes}
+        for node, dependent in edges:
+            if node in children and dependent in children:
+                children[node][dependent] = None
+        self._children = {node: tuple(dependents) for node, dependents in children.items()}
+
+        self._components: Optional[List[List[str]]] = None
+        self._component_of: Dict[str, int] = {}
+        self._depths: Optional[Dict[str, int]] = None
+        self._with_parents: Optional[set] = None
+
+    @classmethod
+    def from_dependents(cls, entities: Iterable[Any]) -> 'DependencyGraph':
+        """Graph following each entity's `dependents` list"""
+        entities = list(entities)
+        return cls((entity.id for entity in entities),
+                   ((entity.id, dependent) for entity in entities for dependent in entity.dependents))
+
+    @classmethod
+    def from_dependencies(cls, entities: Iterable[Any]) -> 'DependencyGraph':
+        """Graph reversing each entity's `direct_dependencies` (children in entity order)"""
+        entities = list(entities)
+        return cls((entity.id for entity in entities),
+                   ((dependency, entity.id) for entity in entities for dependency in entity.direct_dependencies))
+
+    @classmethod
+    def from_parents(cls, entities: Iterable[Any]) -> 'DependencyGraph':
+        """Graph of parent_guid links: each entity is a child of its parent (children in entity order)"""
+        entities = list(entities)
+        return cls((entity.id for entity in entities),
+                   ((entity.parent_guid, entity.id) for entity in entities if getattr(entity, 'parent_guid', None)))
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._children
+
+    def children(self, node: str) -> Tuple[str, ...]:
+        """Ids that depend on node, in edge order"""
+        return self._children.get(node, ())
+
+    def has_parents(self, node: str) -> bool:
+        """Whether any entity in the graph has node as a child"""
+        if self._with_parents is None:
+            self._with_parents = {child for children in self._children.values() for child in children}
+        return node in self._with_parents
+
+    @property
+    def components(self) -> List[List[str]]:
+        """Strongly connected components, dependents before the entities they depend on"""
+        if self._components is None:
+            self._components = self._strongly_connected_components()
+            self._component_of = {
+                node: position for position, component in enumerate(self._components) for node in component
+            }
+        return self._components
+
+    def _strongly_connected_components(self) -> List[List[str]]:
+        """Iterative Tarjan (no recursion limit on long chains); components come out sinks first"""
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack = set()
+        components = []
+
+        for root in self.nodes:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._children[root]))]
+            while work:
+                node, pending = work[-1]
+                for child in pending:
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._children[child])))
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(sorted(component, key=self._order.__getitem__))
+        return components
+
+    def _is_cyclic(self, component: List[str]) -> bool:
+        return len(component) > 1 or component[0] in self._children[component[0]]
+
+    @property
+    def cycles(self) -> List[List[str]]:
+        """Components that form dependency cycles (including self-references)"""
+        return [component for component in self.components if self._is_cyclic(component)]
+
+    def in_cycle(self, node: str) -> bool:
+        components = self.components
+        return node in self._component_of and self._is_cyclic(components[self._component_of[node]])
+
+    def topological_order(self) -> List[str]:
+        """Entities before their dependents (members of a cycle are kept together)"""
+        return [node for component in reversed(self.components) for node in component]
+
+    def depth(self, node: str) -> int:
+        """
+        Longest chain of entities starting at node (1 for an entity with no dependents)
+
+        A cycle counts each of its members once.
+        """
+        if self._depths is None:
+            component_depth = []
+            for component in self.components:
+                position = len(component_depth)
+                below = 0
+                for member in component:
+                    for child in self._children[member]:
+                        child_component = self._component_of[child]
+                        if child_component != position:
+                            below = max(below, component_depth[child_component])
+                component_depth.append(len(component) + below)
+            self._depths = {node: component_depth[self._component_of[node]] for node in self.nodes}
+        return self._depths.get(node, 0)
+
+    def max_depth(self, roots: Iterable[str], default: int = 1) -> int:
+        """Deepest chain starting at any of roots (default when there are none)"""
+        return max((self.depth(root) for root in roots), default=default)
+
+    def build_tree(self, roots: Iterable[str], make_node: Callable[[str, List[Dict]], Dict],
+                   circular_node: Optional[Callable[[str], Optional[Dict]]] = None) -> List[Dict]:
+        """
+        Dependency tree node dicts for roots
+
+        Each entity's node is built once and the same dict is reused wherever the
+        entity appears, so shared subtrees cost nothing extra. Inside a cycle the
+        members are expanded along one spanning path and the remaining edges back
+        into the cycle become circular_node() stubs (omitted when it returns None).
+
+        Args:
+            roots: Ids to return nodes for
+            make_node: Builds a node from an id and its already-built child nodes
+            circular_node: Builds the stub for an edge back into a cycle
+
+        Returns:
+            Node dicts for roots, in order
+        """
+        built: Dict[str, Dict] = {}
+
+        def children_of(node: str, expanded: Callable[[str], bool]) -> List[Dict]:
+            nodes = []
+            for child in self._children[node]:
+                if expanded(child):
+                    nodes.append(built[child])
+                elif circular_node is not None:
+                    stub = circular_node(child)
+                    if stub is not None:
+                        nodes.append(stub)
+            return nodes
+
+        for component in self.components:
+            if not self._is_cyclic(component):
+                node = component[0]
+                built[node] = make_node(node, [built[child] for child in self._children[node]])
+                continue
+
+            # Spanning DFS through the cycle from its first member; members are built after their subtree
+            members = set(component)
+            tree_edges = set()
+            visited = {component[0]}
+            post_order = []
+            work = [(component[0], iter(self._children[component[0]]))]
+            while work:
+                node, pending = work[-1]
+                for child in pending:
+                    if child in members and child not in visited:
+                        visited.add(child)
+                        tree_edges.add((node, child))
+                        work.append((child, iter(self._children[child])))
+                        break
+                else:
+                    work.pop()
+                    post_order.append(node)
+            for node in post_order:
+                built[node] = make_node(node, children_of(
+                    node, lambda child, node=node: child not in members or (node, child) in tree_edges
+                ))
+
+        return [built[root] for root in roots if root in built]
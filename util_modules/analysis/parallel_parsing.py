@@ -0,0 +1,181 @@
+"""
+Parallel Parsing - Shards search and report elements across worker processes
+
+SearchAnalyzer and ReportAnalyzer parse their elements one after another on a
+single core, yet each report subtree is independent once the folder structure
+is known. ParallelElementParser splits the elements into shards for a process
+pool; each worker runs the analyzers' usual parsing over its shard and returns
+SearchReport/Report dataclasses. Shards are merged back in document order, so
+dependency building and everything after it sees exactly the lists the serial
+path would produce.
+
+Workers are never forked: the caller may be the multi-threaded Streamlit
+server or a BackgroundProcessor worker, and a forked child inherits its locks
+in whatever state other threads left them. The pool uses the forkserver start
+method (spawn where that is unavailable), and each element is sent as its
+serialized subtree and re-parsed by the worker.
+
+Parallel parsing is opt-in (max_workers > 1): analyze_search_rules asks for
+default_parallel_workers(), which is the CPU count in the main (Streamlit)
+process and 1 inside worker processes such as BackgroundProcessor's, so pools
+are never nested. Small documents are parsed in-process, where starting a pool costs more than it saves, and any pool
+failure falls back to in-process parsing.
+"""
+
+import concurrent.futures
+import copy
+import math
+import multiprocessing
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+from .common_structures import ReportFolder
+from .search_analyzer import SearchAnalyzer, SearchReport
+from .report_analyzer import ReportAnalyzer, Report
+from ..xml_parsers.namespace_handler import namespace_mode_scope
+from ..core.task_control import progress_range, report_progress
+
+
+# Below this many elements the whole document is parsed in-process
+PARALLEL_MIN_ELEMENTS = 200
+
+# Shards per worker, so a slow shard doesn't leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+SEARCH_SHARD = 'search'
+REPORT_SHARD = 'report'
+
+
+def serialize_element(element: ET.Element) -> bytes:
+    """Standalone XML for an element's subtree (without the text that follows it in its parent)"""
+    detached = copy.copy(element)
+    detached.tail = None
+    return ET.tostring(detached)
+
+
+def default_parallel_workers() -> int:
+    """Parsing workers for the calling process: the CPU count in the main process, 1 in any child process"""
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return multiprocessing.cpu_count()
+
+
+def _pool_context():
+    """Start method for parsing pools: forkserver where available, otherwise spawn (never fork)"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+# Analyzers reused by every shard a worker process parses
+_worker_analyzers: Dict[str, object] = {}
+
+
+def _parse_shard(kind: str, shard: List[bytes], namespaces: Dict, folders: Optional[List[ReportFolder]],
+                 namespace_mode: Optional[str]) -> List:
+    """Worker entry point: parse one shard of serialized search or report elements"""
+    elements = [ET.fromstring(payload) for payload in shard]
+    with namespace_mode_scope(namespace_mode):
+        if kind == SEARCH_SHARD:
+            analyzer = _worker_analyzers.setdefault(SEARCH_SHARD, SearchAnalyzer())
+            return analyzer._parse_search_elements(elements, namespaces, folders)
+        analyzer = _worker_analyzers.setdefault(REPORT_SHARD, ReportAnalyzer())
+        return analyzer._parse_report_elements(elements, namespaces, folders)
+
+
+class ParallelElementParser:
+    """Parses search and report elements in a process pool for large documents"""
+
+    def __init__(self, max_workers: int = 1, min_elements: int = PARALLEL_MIN_ELEMENTS):
+        """
+        Args:
+            max_workers: Worker processes (the default of 1 parses in-process)
+            min_elements: Smallest document, in elements, worth starting a pool for
+        """
+        self.max_workers = max(1, max_workers)
+        self.min_elements = min_elements
+
+    def should_parallelize(self, element_count: int) -> bool:
+        return self.max_workers > 1 and element_count >= max(self.min_elements, 2)
+
+    def parse(self, search_elements: List[ET.Element], report_elements: List[ET.Element], namespaces: Dict,
+              folders: Optional[List[ReportFolder]], namespace_mode: Optional[str],
+              search_analyzer: SearchAnalyzer, report_analyzer: ReportAnalyzer) -> Tuple[List[SearchReport], List[Report]]:
+        """
+        Parse search and report elements, in parallel when the document is large enough
+
+        Args:
+            search_elements: Pre-filtered search elements
+            report_elements: Pre-filtered list/audit/aggregate report elements
+            namespaces: XML namespaces
+            folders: Parsed folder structure
+            namespace_mode: The document's namespace strategy, applied in the workers
+            search_analyzer: Analyzer used for in-process parsing
+            report_analyzer: Analyzer used for in-process parsing
+
+        Returns:
+            (searches, reports) in document order, as the analyzers' own parsing returns them
+        """
+        element_count = len(search_elements) + len(report_elements)
+        if self.should_parallelize(element_count):
+            try:
+                return self._parse_in_pool(search_elements, report_elements, namespaces, folders, namespace_mode)
+            except Exception:
+                # Pool unavailable (no process support, broken worker, unpicklable result): parse here instead
+                pass
+
+        search_share = len(search_elements) / element_count if element_count else 0.5
+        with progress_range(0.0, search_share):
+            searches = search_analyzer._parse_search_elements(search_elements, namespaces, folders)
+        with progress_range(search_share, 1.0):
+            reports = report_analyzer._parse_report_elements(report_elements, namespaces, folders)
+        return searches, reports
+
+    def _parse_in_pool(self, search_elements: List[ET.Element], report_elements: List[ET.Element], namespaces: Dict,
+                       folders: Optional[List[ReportFolder]], namespace_mode: Optional[str]) -> Tuple[List[SearchReport], List[Report]]:
+        """Parse shards of both element types in one pool, merging each type's shards in order"""
+        elements_by_kind = {SEARCH_SHARD: search_elements, REPORT_SHARD: report_elements}
+        element_count = len(search_elements) + len(report_elements)
+        shard_size = max(1, math.ceil(element_count / (self.max_workers * SHARDS_PER_WORKER)))
+        ranges = [
+            (kind, start, min(start + shard_size, len(elements)))
+            for kind, elements in elements_by_kind.items()
+            for start in range(0, len(elements), shard_size)
+        ]
+        workers = min(self.max_workers, len(ranges))
+
+        executor = concurrent.futures.ProcessPoolExecutor(workers, _pool_context())
+        shards = [
+            (kind, [serialize_element(element) for element in elements_by_kind[kind][start:stop]])
+            for kind, start, stop in ranges
+        ]
+        return self._run_shards(executor, shards, [stop - start for _, start, stop in ranges],
+                                namespaces, folders, namespace_mode)
+
+    def _run_shards(self, executor: concurrent.futures.ProcessPoolExecutor, shards: List[Tuple[str, List[bytes]]],
+                    sizes: List[int], namespaces: Dict, folders: Optional[List[ReportFolder]],
+                    namespace_mode: Optional[str]) -> Tuple[List[SearchReport], List[Report]]:
+        """Submit shards to the executor, reporting progress as they finish, and shut it down"""
+        try:
+            futures = {
+                executor.submit(_parse_shard, kind, shard, namespaces, folders, namespace_mode): position
+                for position, (kind, shard) in enumerate(shards)
+            }
+            results: List[Optional[List]] = [None] * len(shards)
+            parsed = 0
+            total = sum(sizes)
+            for future in concurrent.futures.as_completed(futures):
+                position = futures[future]
+                results[position] = future.result()
+                parsed += sizes[position]
+                report_progress(parsed, total)
+        except BaseException:
+            # Failed or cancelled: drop queued shards without waiting for running ones
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        searches: List[SearchReport] = []
+        reports: List[Report] = []
+        for (kind, _), shard_results in zip(shards, results):
+            (searches if kind == SEARCH_SHARD else reports).extend(shard_results)
+        return searches, reports
@@ -10,6 +10,8 @@ from ..xml_parsers.criterion_parser import SearchCriterion, CriterionParser
 from ..xml_parsers.report_parser import ReportParser
 from ..xml_parsers.namespace_handler import NamespaceHandler
 from .common_structures import CriteriaGroup, PopulationCriterion, ReportFolder
+from .dependency_graph import DependencyGraph
+from ..core.task_control import progress_range, report_progress
 import sys
 import os
 from ..xml_parsers.xml_utils import is_pseudo_refset_from_xml_structure
@@ -119,8 +121,24 @@ class ReportAnalyzer:
         """
         try:
             # Parse report elements
-            reports = self._parse_report_elements(report_elements, namespaces, folders)
+            with progress_range(0.0, 0.9):
+                reports = self._parse_report_elements(report_elements, namespaces, folders)
+        except Exception as e:
+            raise Exception(f"Error analyzing reports: {str(e)}")
+        
+        return self.analyze_parsed_reports(reports)
+    
+    def analyze_parsed_reports(self, reports: List[Report]) -> ReportAnalysisResult:
+        """
+        Analyze reports that have already been parsed (e.g. by the parallel parser)
+        
+        Args:
+            reports: Parsed reports in document order
             
+        Returns:
+            ReportAnalysisResult containing report-only analysis
+        """
+        try:
             # Build report relationships
             reports = self._build_report_dependencies(reports)
             
@@ -154,7 +172,7 @@ class ReportAnalyzer:
         """Parse pre-filtered report elements"""
         reports = []
         
-        for report_elem in report_elements:
+        for position, report_elem in enumerate(report_elements):
             # Use ReportParser to get report structure
             report_structure = self.report_parser.parse_report_structure(report_elem)
             
@@ -162,6 +180,7 @@ class ReportAnalyzer:
             report = self._parse_report(report_elem, namespaces, folders, report_structure)
             if report:
                 reports.append(report)
+            report_progress(position + 1, len(report_elements))
         
         return reports
     
@@ -660,14 +679,10 @@ class ReportAnalyzer:
     
     def _build_report_dependency_tree(self, reports: List[Report]) -> Dict[str, Any]:
         """Build dependency tree for reports"""
-        def build_dependency_node(report: Report, all_reports: List[Report], visited: set = None) -> Dict[str, Any]:
-            if visited is None:
-                visited = set()
-            
-            if report.id in visited:
-                return {'id': report.id, 'name': report.name, 'circular': True}
-            
-            visited.add(report.id)
+        report_map = {r.id: r for r in reports}
+        
+        def build_dependency_node(report_id: str, child_reports: List[Dict]) -> Dict[str, Any]:
+            report = report_map[report_id]
             
             # Build children from both search dependencies and child reports
             children = []
@@ -684,9 +699,7 @@ class ReportAnalyzer:
                     })
             
             # Add child reports that have this report's ID as their parent_guid
-            child_reports = [r for r in all_reports if r.parent_guid == report.id]
-            for child_report in child_reports:
-                children.append(build_dependency_node(child_report, all_reports, visited.copy()))
+            children.extend(child_reports)
             
             return {
                 'id': report.id,
@@ -695,6 +708,9 @@ class ReportAnalyzer:
                 'children': children
             }
         
+        def circular_node(report_id: str) -> Dict[str, Any]:
+            return {'id': report_id, 'name': report_map[report_id].name, 'circular': True}
+        
         # Find true root reports (no parent_guid) and build hierarchy
         root_reports = [r for r in reports if not r.parent_guid]
         
@@ -702,41 +718,14 @@ class ReportAnalyzer:
         if not root_reports:
             root_reports = reports
         
+        parent_graph = DependencyGraph.from_parents(reports)
         return {
-            'roots': [build_dependency_node(report, reports) for report in root_reports],
+            'roots': parent_graph.build_tree([r.id for r in root_reports], build_dependency_node, circular_node),
             'total_reports': len(reports),
             'max_depth': self._calculate_max_report_depth(reports)
         }
     
     def _calculate_max_report_depth(self, reports: List[Report]) -> int:
         """Calculate maximum dependency depth for reports"""
-        report_map = {r.id: r for r in reports}
-        max_depth = 1
-        
-        def get_depth(report: Report, visited: set = None) -> int:
-            if visited is None:
-                visited = set()
-            
-            if report.id in visited:
-                return 0  # Circular reference
-            
-            visited.add(report.id)
-            
-            if not report.dependents:
-                return 1
-            
-            max_dependent_depth = 0
-            for dep_id in report.dependents:
-                dependent = report_map.get(dep_id)
-                if dependent:
-                    depth = get_depth(dependent, visited.copy())
-                    max_dependent_depth = max(max_dependent_depth, depth)
-            
-            return 1 + max_dependent_depth
-        
-        for report in reports:
-            if not report.direct_dependencies:  # Root report
-                depth = get_depth(report)
-                max_depth = max(max_depth, depth)
-        
-        return max_depth
\ No newline at end of file
+        graph = DependencyGraph.from_dependents(reports)
+        return graph.max_depth((r.id for r in reports if not r.direct_dependencies), default=1)
\ No newline at end of file
@@ -9,6 +9,8 @@ from typing import List, Dict, Any, Optional
 from ..xml_parsers.criterion_parser import SearchCriterion, CriterionParser
 from ..xml_parsers.namespace_handler import NamespaceHandler
 from .common_structures import CriteriaGroup, PopulationCriterion, ReportFolder
+from .dependency_graph import DependencyGraph
+from ..core.task_control import progress_range, report_progress
 
 
 @dataclass
@@ -63,8 +65,24 @@ class SearchAnalyzer:
         """
         try:
             # Parse search elements
-            searches = self._parse_search_elements(search_elements, namespaces, folders)
+            with progress_range(0.0, 0.9):
+                searches = self._parse_search_elements(search_elements, namespaces, folders)
+        except Exception as e:
+            raise Exception(f"Error analyzing searches: {str(e)}")
+        
+        return self.analyze_parsed_searches(searches)
+    
+    def analyze_parsed_searches(self, searches: List[SearchReport]) -> SearchAnalysisResult:
+        """
+        Analyze searches that have already been parsed (e.g. by the parallel parser)
+        
+        Args:
+            searches: Parsed searches in document order
             
+        Returns:
+            SearchAnalysisResult containing search-only analysis
+        """
+        try:
             # Build search relationships
             searches = self._build_search_dependencies(searches)
             
@@ -91,10 +109,11 @@ class SearchAnalyzer:
         """Parse pre-filtered search elements"""
         searches = []
         
-        for search_elem in search_elements:
+        for position, search_elem in enumerate(search_elements):
             search = self._parse_search_report(search_elem, namespaces, folders)
             if search:
                 searches.append(search)
+            report_progress(position + 1, len(search_elements))
         
         return searches
     
@@ -378,67 +397,31 @@ class SearchAnalyzer:
     
     def _build_search_dependency_tree(self, searches: List[SearchReport]) -> Dict[str, Any]:
         """Build dependency tree for searches"""
-        def build_dependency_node(search: SearchReport, visited: set = None) -> Dict[str, Any]:
-            if visited is None:
-                visited = set()
-            
-            if search.id in visited:
-                return {'id': search.id, 'name': search.name, 'circular': True}
-            
-            visited.add(search.id)
-            search_map = {s.id: s for s in searches}
-            
-            children = []
-            for dep_id in search.dependents:
-                dependent = search_map.get(dep_id)
-                if dependent:
-                    children.append(build_dependency_node(dependent, visited.copy()))
-            
+        search_map = {s.id: s for s in searches}
+        graph = DependencyGraph.from_dependents(searches)
+        
+        def build_dependency_node(search_id: str, children: List[Dict]) -> Dict[str, Any]:
             return {
-                'id': search.id,
-                'name': search.name,
+                'id': search_id,
+                'name': search_map[search_id].name,
                 'type': 'Search',
                 'children': children
             }
         
+        def circular_node(search_id: str) -> Dict[str, Any]:
+            return {'id': search_id, 'name': search_map[search_id].name, 'circular': True}
+        
         # Find root searches (no dependencies)
-        root_searches = [s for s in searches if not s.direct_dependencies]
+        root_ids = [s.id for s in searches if not s.direct_dependencies]
         
         return {
-            'roots': [build_dependency_node(search) for search in root_searches],
+            'roots': graph.build_tree(root_ids, build_dependency_node, circular_node),
             'total_searches': len(searches),
-            'max_depth': self._calculate_max_search_depth(searches)
+            'max_depth': self._calculate_max_search_depth(searches, graph)
         }
     
-    def _calculate_max_search_depth(self, searches: List[SearchReport]) -> int:
+    def _calculate_max_search_depth(self, searches: List[SearchReport], graph: Optional[DependencyGraph] = None) -> int:
         """Calculate maximum dependency depth for searches"""
-        search_map = {s.id: s for s in searches}
-        max_depth = 1
-        
-        def get_depth(search: SearchReport, visited: set = None) -> int:
-            if visited is None:
-                visited = set()
-            
-            if search.id in visited:
-                return 0  # Circular reference
-            
-            visited.add(search.id)
-            
-            if not search.dependents:
-                return 1
-            
-            max_dependent_depth = 0
-            for dep_id in search.dependents:
-                dependent = search_map.get(dep_id)
-                if dependent:
-                    depth = get_depth(dependent, visited.copy())
-                    max_dependent_depth = max(max_dependent_depth, depth)
-            
-            return 1 + max_dependent_depth
-        
-        for search in searches:
-            if not search.direct_dependencies:  # Root search
-                depth = get_depth(search)
-                max_depth = max(max_depth, depth)
-        
-        return max_depth
\ No newline at end of file
+        if graph is None:
+            graph = DependencyGraph.from_dependents(searches)
+        return graph.max_depth((s.id for s in searches if not s.direct_dependencies), default=1)
\ No newline at end of file
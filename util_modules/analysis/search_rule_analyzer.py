@@ -4,7 +4,7 @@ Extracts and analyzes search logic, filtering rules, and criteria relationships
 """
 
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
 from dataclasses import dataclass, field
 
 # Import new modular XML parsers
@@ -13,8 +13,10 @@ from ..xml_parsers.value_set_parser import ValueSetParser
 from ..xml_parsers.restriction_parser import RestrictionParser, SearchRestriction as ParsedSearchRestriction
 from ..xml_parsers.linked_criteria_parser import LinkedCriteriaParser
 from ..xml_parsers.report_parser import ReportParser
-from ..xml_parsers.namespace_handler import NamespaceHandler
+from ..xml_parsers.namespace_handler import NamespaceHandler, namespace_mode_scope
 from ..xml_parsers.base_parser import get_namespaces
+from ..xml_parsers.parsed_document import ParsedDocument, get_parsed_document
+from .dependency_graph import DependencyGraph
 
 @dataclass
 class ReportFolder:
@@ -90,47 +92,38 @@ class SearchRuleAnalysis:
     folder_tree: Dict[str, Any]  # Folder hierarchy structure
     complexity_metrics: Dict[str, Any]
 
-def analyze_search_rules(xml_content: str) -> SearchRuleAnalysis:
-    """Parse XML content and extract complete search rule analysis"""
+def analyze_search_rules(xml_content: Union[str, ParsedDocument]) -> SearchRuleAnalysis:
+    """Parse XML content (or reuse its shared ParsedDocument) and extract complete search rule analysis"""
     try:
-        root = ET.fromstring(xml_content)
+        document = get_parsed_document(xml_content)
         
         # Define namespaces
-        namespaces = {'emis': 'http://www.e-mis.com/emisopen'}
-        
-        # Extract document metadata using namespace handler
-        ns = NamespaceHandler()
-        doc_id_elem = ns.find(root, 'id')
-        doc_id = doc_id_elem.text if doc_id_elem is not None else "Unknown"
-        creation_time_elem = ns.find(root, 'creationTime')
-        creation_time = creation_time_elem.text if creation_time_elem is not None else "Unknown"
-        
-        # Parse folders first
-        folders = []
-        # Try both namespaced and unnamespaced folder finding
-        folder_elements = root.findall('.//emis:reportFolder', namespaces)
-        if not folder_elements:
-            folder_elements = root.findall('.//reportFolder')
-        
-        for folder_elem in folder_elements:
-            folder = _parse_folder(folder_elem, namespaces)
-            if folder:
-                folders.append(folder)
-        
-        # Build folder relationships and paths
-        folders = _build_folder_relationships(folders)
-        
-        # Parse reports
-        reports = []
-        # Try both namespaced and unnamespaced report finding
-        report_elements = root.findall('.//emis:report', namespaces)
-        if not report_elements:
-            report_elements = root.findall('.//report')
-        
-        for report_elem in report_elements:
-            report = _parse_report(report_elem, namespaces, folders)
-            if report:
-                reports.append(report)
+        namespaces = document.namespaces
+        
+        # Document metadata comes from the shared parse
+        doc_id = document.document_id
+        creation_time = document.creation_time
+        
+        # Element lookups use the namespace strategy detected during the shared parse
+        with namespace_mode_scope(document.namespace_mode):
+            # Parse folders first (already indexed by the shared parse)
+            folders = []
+            for folder_elem in document.folder_elements:
+                folder = _parse_folder(folder_elem, namespaces)
+                if folder:
+                    folders.append(folder)
+            
+            # Build folder relationships and paths
+            folders = _build_folder_relationships(folders)
+            
+            # Parse reports
+            reports = []
+            report_elements = document.report_elements
+            
+            for report_elem in report_elements:
+                report = _parse_report(report_elem, namespaces, folders)
+                if report:
+                    reports.append(report)
         
         # Build report dependency relationships
         reports = _build_report_dependencies(reports)
@@ -475,40 +468,18 @@ def _map_reports_to_folders(reports: List[SearchReport], folders: List[ReportFol
 def _build_dependency_tree(reports: List[SearchReport]) -> Dict[str, Any]:
     """Build dependency tree showing report relationships including all report types"""
     report_map = {r.id: r for r in reports}
-    
-    # Find reports that should be displayed as roots:
-    # 1. Reports with no dependencies (true roots)
-    # 2. Reports with dependencies but not referenced by anyone (orphaned dependents)
-    root_reports = []
-    all_referenced_ids = set()
-    
-    # Collect all report IDs that are referenced by others
-    for report in reports:
-        all_referenced_ids.update(report.dependents)
+    graph = DependencyGraph.from_dependents(reports)
     
     # Include as roots:
     # - Reports without dependencies (traditional roots)
     # - Reports that have dependencies but are never referenced by others (leaf nodes that depend on roots)
-    for report in reports:
-        if not report.direct_dependencies or report.id not in all_referenced_ids:
-            # This is either a true root or a leaf that should be shown
-            root_reports.append(report)
+    root_ids = [
+        report.id for report in reports
+        if not report.direct_dependencies or not graph.has_parents(report.id)
+    ]
     
-    def build_dependency_node(report, visited=None):
-        if visited is None:
-            visited = set()
-        
-        if report.id in visited:
-            return {'id': report.id, 'name': report.name, 'circular': True}
-        
-        visited.add(report.id)
-        
-        dependents = []
-        for dependent_id in report.dependents:
-            dependent = report_map.get(dependent_id)
-            if dependent:
-                dependents.append(build_dependency_node(dependent, visited.copy()))
-        
+    def build_dependency_node(report_id, dependents):
+        report = report_map[report_id]
         return {
             'id': report.id,
             'name': report.name,
@@ -518,46 +489,22 @@ def _build_dependency_tree(reports: List[SearchReport]) -> Dict[str, Any]:
             'complexity': len(report.criteria_groups)
         }
     
+    def circular_node(report_id):
+        return {'id': report_id, 'name': report_map[report_id].name, 'circular': True}
+    
     tree = {
-        'roots': [build_dependency_node(report) for report in root_reports],
+        'roots': graph.build_tree(root_ids, build_dependency_node, circular_node),
         'total_reports': len(reports),
-        'max_depth': _calculate_max_dependency_depth(reports)
+        'max_depth': _calculate_max_dependency_depth(reports, graph)
     }
     
     return tree
 
-def _calculate_max_dependency_depth(reports: List[SearchReport]) -> int:
+def _calculate_max_dependency_depth(reports: List[SearchReport], graph: Optional[DependencyGraph] = None) -> int:
     """Calculate maximum dependency chain depth"""
-    report_map = {r.id: r for r in reports}
-    max_depth = 0
-    
-    def get_depth(report, visited=None):
-        if visited is None:
-            visited = set()
-        
-        if report.id in visited:
-            return 0  # Circular reference
-        
-        visited.add(report.id)
-        
-        if not report.dependents:
-            return 1
-        
-        max_dependent_depth = 0
-        for dependent_id in report.dependents:
-            dependent = report_map.get(dependent_id)
-            if dependent:
-                depth = get_depth(dependent, visited.copy())
-                max_dependent_depth = max(max_dependent_depth, depth)
-        
-        return 1 + max_dependent_depth
-    
-    for report in reports:
-        if not report.direct_dependencies:  # Root report
-            depth = get_depth(report)
-            max_depth = max(max_depth, depth)
-    
-    return max_depth
+    if graph is None:
+        graph = DependencyGraph.from_dependents(reports)
+    return graph.max_depth((report.id for report in reports if not report.direct_dependencies), default=0)
 
 def _generate_rule_flow(reports: List[SearchReport], folders: List[ReportFolder] = None) -> List[Dict]:
     """Generate step-by-step execution flow with proper parent-child hierarchy"""
@@ -5,9 +5,10 @@ Handles upfront classification of XML elements before passing to specialized ana
 
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
 from .common_structures import ReportFolder
 from ..xml_parsers.namespace_handler import NamespaceHandler
+from ..xml_parsers.parsed_document import ParsedDocument, get_parsed_document, determine_report_type
 
 
 @dataclass
@@ -38,38 +39,37 @@ class XMLElementClassifier:
     def __init__(self):
         self.ns = NamespaceHandler()
     
-    def classify_elements(self, xml_content: str) -> ClassifiedElements:
+    def classify_elements(self, xml_content: Union[str, ParsedDocument]) -> ClassifiedElements:
         """
         Parse XML and classify elements by type
         
         Args:
-            xml_content: Raw XML content
+            xml_content: Raw XML content, or the shared ParsedDocument for it
             
         Returns:
             ClassifiedElements containing sorted elements and shared metadata
         """
         try:
-            root = ET.fromstring(xml_content)
-            namespaces = {'emis': 'http://www.e-mis.com/emisopen'}
+            # Reuse the shared single parse (report elements are already classified)
+            document = get_parsed_document(xml_content)
+            root = document.root
+            namespaces = document.namespaces
             
             # Extract document metadata
             document_id, creation_time = self._extract_document_metadata(root, namespaces)
             
             # Extract folder structure (shared)
-            folders, folder_tree = self._extract_folder_structure(root, namespaces)
-            
-            # Classify all report elements
-            search_elements, audit_elements, list_elements, aggregate_elements = self._classify_report_elements(root, namespaces)
+            folders, folder_tree = self._extract_folder_structure(root, namespaces, document.folder_elements)
             
             return ClassifiedElements(
                 document_id=document_id,
                 creation_time=creation_time,
                 folders=folders,
                 folder_tree=folder_tree,
-                search_elements=search_elements,
-                audit_elements=audit_elements,
-                list_elements=list_elements,
-                aggregate_elements=aggregate_elements,
+                search_elements=list(document.search_elements),
+                audit_elements=list(document.audit_elements),
+                list_elements=list(document.list_elements),
+                aggregate_elements=list(document.aggregate_elements),
                 namespaces=namespaces,
                 root_element=root
             )
@@ -89,12 +89,14 @@ class XMLElementClassifier:
         
         return document_id, creation_time
     
-    def _extract_folder_structure(self, root: ET.Element, namespaces: Dict) -> Tuple[List[ReportFolder], Dict[str, Any]]:
+    def _extract_folder_structure(self, root: ET.Element, namespaces: Dict,
+                                  folder_elements: Optional[List[ET.Element]] = None) -> Tuple[List[ReportFolder], Dict[str, Any]]:
         """Extract shared folder structure"""
         folders = []
         
-        # Find folder elements using namespace handler
-        folder_elements = self.ns.findall_with_path(root, './/reportFolder')
+        # Find folder elements using namespace handler (unless already indexed)
+        if folder_elements is None:
+            folder_elements = self.ns.findall_with_path(root, './/reportFolder')
         if not folder_elements:
             folder_elements = self.ns.findall_with_path(root, './/folder')
         
@@ -170,21 +172,7 @@ class XMLElementClassifier:
         """Determine the type of a report element"""
         # ONLY check for explicit content structure indicators
         # parentType just indicates parent relationship, not element type
-        
-        # Check for explicit report type indicators using namespace handler
-        if self.ns.find(report_elem, 'auditReport') is not None:
-            return 'audit'
-        elif self.ns.find(report_elem, 'aggregateReport') is not None:
-            return 'aggregate'
-        elif self.ns.find(report_elem, 'listReport') is not None:
-            # Has listReport structure - this is definitely a list report
-            return 'list'
-        elif self.ns.find(report_elem, 'population') is not None:
-            # Has population criteria - this is a search
-            return 'search'
-        else:
-            # No specific structure indicators - default to search
-            return 'search'
+        return determine_report_type(report_elem, self.ns)
     
     def get_classification_summary(self, classified: ClassifiedElements) -> Dict[str, Any]:
         """Get summary of classification results"""
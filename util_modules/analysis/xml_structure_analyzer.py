@@ -4,14 +4,16 @@ Combines search and report analysis to provide complete EMIS XML analysis.
 Maintains compatibility with existing interfaces while using specialized analyzers.
 """
 
-import xml.etree.ElementTree as ET
 from dataclasses import dataclass, field
 from typing import List, Dict, Any, Optional, Union
 from .search_analyzer import SearchAnalyzer, SearchReport
 from .report_analyzer import ReportAnalyzer, Report
 from .common_structures import CompleteAnalysisResult, ReportFolder
+from .dependency_graph import DependencyGraph
 from ..core import ReportClassifier, FolderManager
+from ..core.task_control import progress_range
 from ..xml_parsers.namespace_handler import NamespaceHandler
+from ..xml_parsers.parsed_document import ParsedDocument, get_parsed_document
 
 
 # Legacy compatibility - expose the old SearchReport structure
@@ -141,45 +143,29 @@ def _build_folder_tree(folders: List[ReportFolder]) -> Dict[str, Any]:
     return tree
 
 
-def analyze_search_rules(xml_content: str) -> SearchRuleAnalysis:
+def analyze_search_rules(xml_content: Union[str, ParsedDocument]) -> SearchRuleAnalysis:
     """
     Main entry point for XML analysis - maintains backward compatibility
     
     Args:
-        xml_content: Raw EMIS XML content
+        xml_content: Raw EMIS XML content, or the shared ParsedDocument for it
         
     Returns:
         SearchRuleAnalysis: Complete analysis results in legacy format
     """
     try:
-        root = ET.fromstring(xml_content)
-        namespaces = {'emis': 'http://www.e-mis.com/emisopen'}
-        
-        # Extract document metadata using namespace handler
-        ns = NamespaceHandler()
-        doc_id_elem = ns.find(root, 'id')
-        doc_id = doc_id_elem.text if doc_id_elem is not None else "Unknown"
-        creation_time_elem = ns.find(root, 'creationTime')
-        creation_time = creation_time_elem.text if creation_time_elem is not None else "Unknown"
-        
-        # Parse folders first using namespace handler
-        folders = []
-        folder_elements = ns.findall_with_path(root, './/reportFolder')
-        
-        for folder_elem in folder_elements:
-            folder = _parse_folder(folder_elem, namespaces)
-            if folder:
-                folders.append(folder)
-        
-        # Build folder relationships
-        folders = _build_folder_relationships(folders)
+        # Parse once and share the document with the orchestrator and its analyzers
+        with progress_range(0.0, 0.1):
+            document = get_parsed_document(xml_content)
         
         # Use new orchestrator for complete analysis
         from .analysis_orchestrator import AnalysisOrchestrator
-        orchestrator = AnalysisOrchestrator()
+        from .parallel_parsing import default_parallel_workers
+        orchestrator = AnalysisOrchestrator(parallel_workers=default_parallel_workers())
         
         # Get complete analysis results using orchestrator
-        orchestrated_results = orchestrator.analyze_complete_xml(xml_content)
+        with progress_range(0.1, 0.95):
+            orchestrated_results = orchestrator.analyze_complete_xml(document)
         
         # Use orchestrated results directly (already combines searches + reports)
         all_reports = orchestrated_results.reports
@@ -342,75 +328,38 @@ def _combine_to_legacy_format(search_results, report_results) -> List[LegacySear
 
 def _build_complete_dependency_tree(all_entities: List) -> Dict[str, Any]:
     """Build complete dependency tree with cross-analyzer parent-child relationships"""
-    def build_dependency_node(entity, visited: set = None) -> Dict[str, Any]:
-        if visited is None:
-            visited = set()
-        
-        if entity.id in visited:
-            # Determine entity type for recursion prevention
-            if hasattr(entity, 'report_type'):
-                entity_type = f'{entity.report_type.title()} Report'
-            else:
-                entity_type = 'Search'
-            
-            return {
-                'id': entity.id,
-                'name': entity.name,
-                'type': entity_type,
-                'children': []  # Prevent infinite recursion
-            }
-        
-        visited.add(entity.id)
-        entity_map = {e.id: e for e in all_entities}
-        
-        # Find all entities that depend on this one (children)
-        children = []
-        for other_entity in all_entities:
-            if entity.id in other_entity.direct_dependencies:
-                children.append(build_dependency_node(other_entity, visited.copy()))
-        
+    entity_map = {e.id: e for e in all_entities}
+    # Children of an entity are all entities that depend on it
+    graph = DependencyGraph.from_dependencies(all_entities)
+    
+    def entity_type(entity_id: str) -> str:
         # Determine entity type based on class and attributes
+        entity = entity_map[entity_id]
         if hasattr(entity, 'report_type'):
             # This is a Report from report_analyzer
-            entity_type = f'{entity.report_type.title()} Report'
-        else:
-            # This is a SearchReport from search_analyzer
-            entity_type = 'Search'
-        
+            return f'{entity.report_type.title()} Report'
+        # This is a SearchReport from search_analyzer
+        return 'Search'
+    
+    def build_dependency_node(entity_id: str, children: List[Dict]) -> Dict[str, Any]:
         return {
-            'id': entity.id,
-            'name': entity.name,
-            'type': entity_type,
+            'id': entity_id,
+            'name': entity_map[entity_id].name,
+            'type': entity_type(entity_id),
             'children': children
         }
     
-    # Find root entities (no dependencies)
-    root_entities = [e for e in all_entities if not e.direct_dependencies]
-    
-    # Calculate max depth
-    def calculate_depth(entity, visited=None):
-        if visited is None:
-            visited = set()
-        if entity.id in visited:
-            return 0
-        visited.add(entity.id)
-        
-        if not any(entity.id in other.direct_dependencies for other in all_entities):
-            return 1
-        
-        max_child_depth = 0
-        for other_entity in all_entities:
-            if entity.id in other_entity.direct_dependencies:
-                max_child_depth = max(max_child_depth, calculate_depth(other_entity, visited.copy()))
-        
-        return 1 + max_child_depth
+    def circular_node(entity_id: str) -> Dict[str, Any]:
+        # Leaf stub for a reference back into a cycle
+        return build_dependency_node(entity_id, [])
     
-    max_depth = max([calculate_depth(entity) for entity in root_entities]) if root_entities else 1
+    # Find root entities (no dependencies)
+    root_ids = [e.id for e in all_entities if not e.direct_dependencies]
     
     return {
-        'roots': [build_dependency_node(entity) for entity in root_entities],
+        'roots': graph.build_tree(root_ids, build_dependency_node, circular_node),
         'total_reports': len(all_entities),
-        'max_depth': max_depth
+        'max_depth': graph.max_depth(root_ids, default=1)
     }
 
 
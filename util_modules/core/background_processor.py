@@ -9,13 +9,20 @@ import concurrent.futures
 import threading
 import time
 import multiprocessing
-from typing import Dict, Any, Callable, Optional, List
+from typing import Dict, Any, Callable, Optional, List, Set, Tuple
 from dataclasses import dataclass
 from enum import Enum
 import traceback
 import os
 import psutil
 
+from .task_control import TaskChannels, TaskCancelled, install_channels, task_scope
+from ..utils.lookup import LookupTableHandle, LookupIndex, get_lookup_dictionaries
+from ..utils.shared_buffers import (
+    SharedLookupRef, SharedLookupTable, SharedTextRef, attach_shared_lookup,
+    share_text, read_shared_text, release_shared_text
+)
+
 
 class TaskStatus(Enum):
     """Task execution status enumeration."""
@@ -44,10 +51,58 @@ class BackgroundTask:
             self.metadata = {}
 
 
+# Worker-side entry points: module-level so they pickle by reference
+def _initialize_worker(channels: TaskChannels):
+    """Give each new worker the progress/cancellation channels (lookup tables attach per task, from its ref)"""
+    install_channels(channels)
+
+
+def _execute_task(func: Callable, args: tuple, kwargs: Dict[str, Any], slot: Optional[int] = None) -> Any:
+    """
+    Wrapped execution with error handling.
+    This runs in the separate process; progress reported by func goes to its slot.
+    """
+    try:
+        with task_scope(slot):
+            return func(*args, **kwargs)
+    except TaskCancelled:
+        return {'cancelled': True}
+    except Exception as e:
+        # Return error info that can be pickled
+        return {
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }
+
+
+def translate_with_shared_lookup(lookup_ref: SharedLookupRef, emis_guids: List[Dict],
+                                 deduplication_mode: str = 'unique_codes') -> Dict[str, Any]:
+    """Translate EMIS GUIDs in a worker against the lookup table published in shared memory"""
+    from .translator import translate_emis_guids_batch
+    guid_index, snomed_index = attach_shared_lookup(lookup_ref)
+    return translate_emis_guids_batch(emis_guids, guid_index, snomed_index, deduplication_mode)
+
+
+def analyze_shared_xml(xml_ref: SharedTextRef):
+    """Analyze an XML document placed in shared memory by create_xml_analysis_task"""
+    from ..analysis.xml_structure_analyzer import analyze_search_rules
+    return analyze_search_rules(xml_content=read_shared_text(xml_ref))
+
+
 class BackgroundProcessor:
     """
     Background processor using ProcessPoolExecutor for heavy computation.
     Optimized for Streamlit Cloud compatibility with progress tracking.
+    
+    The lookup table is published to shared memory once per version
+    (publish_lookup) and workers attach to it on their first task that
+    references it, so tasks carry only a SharedLookupRef and their GUID lists.
+    A replaced version stays published until the tasks already submitted,
+    which may still reference it, have finished.
+    
+    Each task also gets a slot in TaskChannels: the worker writes its progress
+    there (task_control.report_progress) and stops at its next checkpoint
+    once cancel_task flags the slot.
     """
     
     def __init__(self, max_workers: int = None):
@@ -60,15 +115,77 @@ class BackgroundProcessor:
         self.executor = None
         self.futures: Dict[str, concurrent.futures.Future] = {}
         self.tasks: Dict[str, BackgroundTask] = {}
-        self._lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._lookup: Optional[SharedLookupTable] = None
+        self._retired_lookups: List[Tuple[SharedLookupTable, Set[concurrent.futures.Future]]] = []  # replaced tables, with the tasks that may still read them
+        self._in_flight: Set[concurrent.futures.Future] = set()
+        self._task_buffers: Dict[str, Any] = {}  # task_id -> shared-memory block the task reads
+        self._channels = TaskChannels()
+        self._task_slots: Dict[str, Optional[int]] = {}  # task_id -> progress/cancellation slot
         
     def _ensure_executor(self):
         """Lazy initialization of ProcessPoolExecutor."""
         if self.executor is None:
             self.executor = concurrent.futures.ProcessPoolExecutor(
-                max_workers=self.max_workers
+                max_workers=self.max_workers,
+                initializer=_initialize_worker,
+                initargs=(self._channels,)
             )
     
+    def publish_lookup(self, lookup: LookupTableHandle) -> SharedLookupRef:
+        """
+        Publish a lookup table to shared memory for the workers.
+        
+        A table is published once per fingerprint; publishing a new version
+        replaces the previous block (workers pick the new one up on their next
+        task that references it). The previous block is unlinked once every
+        task submitted before the new version has finished.
+        
+        Args:
+            lookup: Lookup table handle
+            
+        Returns:
+            Reference to pass to translate_with_shared_lookup tasks
+        """
+        with self._lock:
+            if self._lookup is not None and self._lookup.fingerprint == lookup.fingerprint:
+                return self._lookup.ref
+            
+            guid_index, snomed_index = get_lookup_dictionaries(lookup)
+            if isinstance(guid_index, LookupIndex):
+                table = SharedLookupTable(lookup.fingerprint, guid_index, snomed_index)
+            else:
+                table = SharedLookupTable.empty(lookup.fingerprint)
+            
+            if self._lookup is not None:
+                self._retired_lookups.append((self._lookup, set(self._in_flight)))
+                self._close_retired_lookups()
+            self._lookup = table
+            return table.ref
+    
+    def _close_retired_lookups(self):
+        """Unlink replaced lookup tables no unfinished task can still reference (lock held)"""
+        still_read = []
+        for table, readers in self._retired_lookups:
+            if readers:
+                still_read.append((table, readers))
+            else:
+                table.close()
+        self._retired_lookups = still_read
+    
+    def retain_buffer(self, task_id: str, block) -> None:
+        """Keep a shared-memory block alive until the task reading it finishes"""
+        with self._lock:
+            task = self.tasks.get(task_id)
+            self._task_buffers[task_id] = block
+            if task is None or task.status not in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                self._release_buffer(task_id)
+    
+    def _release_buffer(self, task_id: str):
+        block = self._task_buffers.pop(task_id, None)
+        if block is not None:
+            release_shared_text(block)
+    
     def submit_task(
         self, 
         task_id: str, 
@@ -106,27 +223,26 @@ class BackgroundProcessor:
             
             # Submit to executor
             self._ensure_executor()
-            future = self.executor.submit(self._wrapped_execution, func, *args, **kwargs)
+            slot = self._channels.acquire_slot()
+            future = self.executor.submit(_execute_task, func, args, kwargs, slot)
+            self._in_flight.add(future)
+            # The slot (and any replaced lookup table) is only released once the worker has actually finished with it
+            future.add_done_callback(lambda done, slot=slot: self._task_finished(done, slot))
             self.futures[task_id] = future
+            self._task_slots[task_id] = slot
             
             # Update status
             task.status = TaskStatus.RUNNING
             
             return task
     
-    def _wrapped_execution(self, func: Callable, *args, **kwargs) -> Any:
-        """
-        Wrapped execution with error handling.
-        This runs in the separate process.
-        """
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            # Return error info that can be pickled
-            return {
-                'error': str(e),
-                'traceback': traceback.format_exc()
-            }
+    def _task_finished(self, future: concurrent.futures.Future, slot: Optional[int]):
+        with self._lock:
+            self._channels.release_slot(slot)
+            self._in_flight.discard(future)
+            for _, readers in self._retired_lookups:
+                readers.discard(future)
+            self._close_retired_lookups()
     
     def get_task_status(self, task_id: str) -> Optional[BackgroundTask]:
         """Get current status of a background task."""
@@ -144,8 +260,11 @@ class BackgroundProcessor:
                     try:
                         result = future.result(timeout=0.1)
                         
-                        # Check if result indicates an error
-                        if isinstance(result, dict) and 'error' in result:
+                        # Check if result indicates cancellation or an error
+                        if isinstance(result, dict) and result.get('cancelled') is True:
+                            task.status = TaskStatus.CANCELLED
+                            task.result = None
+                        elif isinstance(result, dict) and 'error' in result:
                             task.status = TaskStatus.FAILED
                             task.error = result['error']
                             task.result = None
@@ -159,6 +278,8 @@ class BackgroundProcessor:
                         
                         # Cleanup future
                         del self.futures[task_id]
+                        self._task_slots.pop(task_id, None)
+                        self._release_buffer(task_id)
                         
                     except concurrent.futures.TimeoutError:
                         # Still running
@@ -168,15 +289,28 @@ class BackgroundProcessor:
                         task.error = str(e)
                         task.end_time = time.time()
                         del self.futures[task_id]
+                        self._task_slots.pop(task_id, None)
+                        self._release_buffer(task_id)
+                else:
+                    task.progress = self._channels.read_progress(self._task_slots.get(task_id)) * 100.0
             
             return task
     
     def cancel_task(self, task_id: str) -> bool:
-        """Cancel a running background task."""
+        """
+        Cancel a background task.
+        
+        A task that has not started is dropped from the pool; a running one is
+        flagged and stops at its next progress checkpoint, freeing its worker.
+        """
         with self._lock:
             if task_id in self.futures:
                 future = self.futures[task_id]
                 cancelled = future.cancel()
+                slot = self._task_slots.pop(task_id, None)
+                if not cancelled and not future.done() and slot is not None:
+                    self._channels.request_cancel(slot)
+                    cancelled = True
                 
                 if cancelled and task_id in self.tasks:
                     self.tasks[task_id].status = TaskStatus.CANCELLED
@@ -184,6 +318,7 @@ class BackgroundProcessor:
                 
                 if task_id in self.futures:
                     del self.futures[task_id]
+                self._release_buffer(task_id)
                 
                 return cancelled
             
@@ -211,13 +346,26 @@ class BackgroundProcessor:
             return self.tasks.copy()
     
     def shutdown(self, wait: bool = True):
-        """Shutdown the background processor."""
+        """Shutdown the background processor, stopping running tasks at their next checkpoint."""
+        with self._lock:
+            for slot in self._task_slots.values():
+                self._channels.request_cancel(slot)
         if self.executor:
-            self.executor.shutdown(wait=wait)
+            self.executor.shutdown(wait=wait, cancel_futures=True)
             self.executor = None
         
         with self._lock:
             self.futures.clear()
+            self._task_slots.clear()
+            for task_id in list(self._task_buffers):
+                self._release_buffer(task_id)
+            self._in_flight.clear()
+            for table, _ in self._retired_lookups:
+                table.close()
+            self._retired_lookups = []
+            if self._lookup is not None:
+                self._lookup.close()
+                self._lookup = None
 
 
 @st.cache_resource
@@ -336,6 +484,9 @@ def create_xml_analysis_task(
     """
     Create a background task for XML analysis.
     
+    The XML is placed in shared memory for the worker to read rather than
+    pickled into the task.
+    
     Args:
         xml_content: XML content to analyze
         xml_filename: Name of the XML file
@@ -344,17 +495,21 @@ def create_xml_analysis_task(
     Returns:
         Task ID for monitoring
     """
-    from ..analysis.xml_structure_analyzer import analyze_search_rules
-    
     processor = get_background_processor()
     task_id = f"{task_type}_{hash(xml_content)}_{int(time.time())}"
     
-    task = processor.submit_task(
-        task_id=task_id,
-        name=f"Analyzing {xml_filename}",
-        func=analyze_search_rules,
-        xml_content=xml_content
-    )
+    block, xml_ref = share_text(xml_content)
+    try:
+        processor.submit_task(
+            task_id=task_id,
+            name=f"Analyzing {xml_filename}",
+            func=analyze_shared_xml,
+            xml_ref=xml_ref
+        )
+    except Exception:
+        release_shared_text(block)
+        raise
+    processor.retain_buffer(task_id, block)
     
     return task_id
 
@@ -362,36 +517,41 @@ def create_xml_analysis_task(
 def create_snomed_lookup_task(
     emis_guids: List[Dict],
     lookup_df,
-    emis_guid_col: str,
-    snomed_code_col: str,
+    emis_guid_col: Optional[str] = None,
+    snomed_code_col: Optional[str] = None,
     deduplication_mode: str = 'unique_codes'
 ) -> str:
     """
     Create a background task for SNOMED code lookup.
     
+    The lookup table is published to shared memory once per version; the task
+    itself carries only the table reference and the GUID list.
+    
     Args:
         emis_guids: List of EMIS GUID dictionaries
-        lookup_df: DataFrame with SNOMED mappings
-        emis_guid_col: Column name for EMIS GUIDs
-        snomed_code_col: Column name for SNOMED codes
+        lookup_df: LookupTableHandle (preferred), or a DataFrame with SNOMED mappings
+        emis_guid_col: Column name for EMIS GUIDs (taken from the handle if omitted)
+        snomed_code_col: Column name for SNOMED codes (taken from the handle if omitted)
         deduplication_mode: Deduplication strategy
         
     Returns:
         Task ID for monitoring
     """
-    from .translator import translate_emis_to_snomed
+    if isinstance(lookup_df, LookupTableHandle):
+        lookup = lookup_df
+    else:
+        lookup = LookupTableHandle.create(lookup_df, emis_guid_col, snomed_code_col)
     
     processor = get_background_processor()
+    lookup_ref = processor.publish_lookup(lookup)
     task_id = f"snomed_lookup_{hash(str(emis_guids))}_{int(time.time())}"
     
-    task = processor.submit_task(
+    processor.submit_task(
         task_id=task_id,
         name=f"Translating {len(emis_guids)} codes to SNOMED",
-        func=translate_emis_to_snomed,
+        func=translate_with_shared_lookup,
+        lookup_ref=lookup_ref,
         emis_guids=emis_guids,
-        lookup_df=lookup_df,
-        emis_guid_col=emis_guid_col,
-        snomed_code_col=snomed_code_col,
         deduplication_mode=deduplication_mode
     )
     
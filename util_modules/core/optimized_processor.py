@@ -30,7 +30,8 @@ from ..ui.async_components import (
 )
 from ..utils.lookup import (
     get_optimized_lookup_cache,
-    batch_translate_emis_guids
+    batch_translate_emis_guids,
+    get_lookup_handle
 )
 
 
@@ -152,9 +153,11 @@ class OptimizedProcessor:
             # Pre-load lookup cache for faster processing
             self.lookup_cache.load_from_dataframe(lookup_df, emis_guid_col, snomed_code_col)
             
-            # Create background task for translation
+            # Create background task for translation (the session's handle keeps the
+            # shared-memory copy of the table from being republished for each task)
             task_id = create_snomed_lookup_task(
-                emis_guids, lookup_df, emis_guid_col, snomed_code_col, deduplication_mode
+                emis_guids, get_lookup_handle(lookup_df, emis_guid_col, snomed_code_col),
+                deduplication_mode=deduplication_mode
             )
             
             self.active_translation_tasks[guid_hash] = task_id
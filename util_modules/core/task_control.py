@@ -0,0 +1,152 @@
+"""
+Progress Reporting and Cooperative Cancellation for Background Tasks
+
+Long-running functions call report_progress() at natural checkpoints. Outside
+a background task the calls do nothing. Inside a BackgroundProcessor worker
+they write the task's progress to its slot in shared memory, where the
+processor reads it without a round trip, and raise TaskCancelled once the
+processor has flagged the slot, so an abandoned task stops at its next
+checkpoint and frees the worker.
+
+Stages map their own done/total onto part of the caller's range with
+progress_range(), so nested loops report one overall fraction.
+"""
+
+import contextvars
+import multiprocessing
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+class TaskCancelled(BaseException):
+    """
+    Raised at a progress checkpoint of a cancelled task.
+
+    A BaseException (like asyncio.CancelledError) so the broad `except Exception`
+    handlers in the analysis code don't turn it into an ordinary failure.
+    """
+
+
+class TaskChannels:
+    """
+    Progress and cancellation slots shared between the processor and its workers.
+
+    Created by the processor before its pool starts and handed to every worker
+    through the pool initializer. Slot allocation happens in the processor only
+    (under its lock); workers just read and write their task's slot.
+    """
+
+    def __init__(self, slots: int = 64):
+        self.progress = multiprocessing.RawArray('d', slots)
+        self.cancelled = multiprocessing.RawArray('b', slots)
+        self._free: List[int] = list(range(slots - 1, -1, -1))
+
+    def acquire_slot(self) -> Optional[int]:
+        """Reset and hand out a free slot, or None when all are in use (the task then runs untracked)"""
+        if not self._free:
+            return None
+        slot = self._free.pop()
+        self.progress[slot] = 0.0
+        self.cancelled[slot] = 0
+        return slot
+
+    def release_slot(self, slot: Optional[int]):
+        """Return a slot once its task's future has finished"""
+        if slot is not None:
+            self._free.append(slot)
+
+    def request_cancel(self, slot: Optional[int]):
+        if slot is not None:
+            self.cancelled[slot] = 1
+
+    def read_progress(self, slot: Optional[int]) -> float:
+        """Fraction complete (0-1) last reported by the task in a slot"""
+        return self.progress[slot] if slot is not None else 0.0
+
+    def __getstate__(self):
+        # Workers only need the shared arrays
+        return {'progress': self.progress, 'cancelled': self.cancelled, '_free': []}
+
+
+@dataclass(frozen=True)
+class _TaskScope:
+    channels: TaskChannels
+    slot: int
+    start: float = 0.0
+    end: float = 1.0
+
+
+# Channels installed in this worker process by the pool initializer
+_channels: Optional[TaskChannels] = None
+_scope: contextvars.ContextVar[Optional[_TaskScope]] = contextvars.ContextVar('task_scope', default=None)
+
+
+def install_channels(channels: Optional[TaskChannels]):
+    """Make the processor's channels available to tasks run in this process (worker initializer)"""
+    global _channels
+    _channels = channels
+
+
+@contextmanager
+def task_scope(slot: Optional[int]):
+    """Route report_progress() calls in this block to a task slot (no-op without channels or a slot)"""
+    if _channels is None or slot is None:
+        yield
+        return
+    token = _scope.set(_TaskScope(_channels, slot))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def progress_range(start: float, end: float):
+    """
+    Map progress reported inside the block onto [start, end] of the enclosing range
+
+    Args:
+        start: Fraction of the enclosing range where the block begins
+        end: Fraction of the enclosing range where the block ends
+    """
+    scope = _scope.get()
+    if scope is None:
+        yield
+        return
+    span = scope.end - scope.start
+    inner = _TaskScope(scope.channels, scope.slot, scope.start + span * start, scope.start + span * end)
+    token = _scope.set(inner)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+    # A finished stage counts in full even if it reported nothing itself
+    inner.channels.progress[inner.slot] = inner.end
+
+
+def report_progress(done: float, total: float = 1.0):
+    """
+    Report progress through the current range and check for cancellation
+
+    Args:
+        done: Units of work finished
+        total: Units of work in the current range
+
+    Raises:
+        TaskCancelled: The task has been cancelled
+    """
+    scope = _scope.get()
+    if scope is None:
+        return
+    if scope.channels.cancelled[scope.slot]:
+        raise TaskCancelled()
+    fraction = min(max(done / total, 0.0), 1.0) if total else 1.0
+    scope.channels.progress[scope.slot] = scope.start + (scope.end - scope.start) * fraction
+
+
+def check_cancelled():
+    """Raise TaskCancelled if the current task has been cancelled (no-op outside a task)"""
+    scope = _scope.get()
+    if scope is not None and scope.channels.cancelled[scope.slot]:
+        raise TaskCancelled()
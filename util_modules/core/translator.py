@@ -1,464 +1,501 @@
+import operator
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
 import streamlit as st
 from ..xml_parsers.xml_utils import is_pseudo_refset, get_medication_type_flag, is_medication_code_system, is_clinical_code_system
-from ..utils.lookup import create_lookup_dictionaries
+from .task_control import report_progress
+from ..utils.lookup import create_lookup_dictionaries, get_lookup_dictionaries, LookupTableHandle, LookupIndex, LOOKUP_HASH_FUNCS
 
-@st.cache_data(ttl=1800, max_entries=100)  # Cache translations for 30 minutes
-def translate_emis_to_snomed(emis_guids, lookup_df, emis_guid_col, snomed_code_col, deduplication_mode='unique_codes'):
+@st.cache_data(ttl=1800, max_entries=100, hash_funcs=LOOKUP_HASH_FUNCS)  # Cache translations for 30 minutes
+def translate_emis_to_snomed(emis_guids, lookup_df, emis_guid_col=None, snomed_code_col=None, deduplication_mode='unique_codes'):
     """
     Translate EMIS GUIDs to SNOMED codes using lookup DataFrame.
     
     Args:
         emis_guids: List of EMIS GUID dictionaries from XML parsing
-        lookup_df: DataFrame with EMIS GUID to SNOMED code mappings
-        emis_guid_col: Column name for EMIS GUIDs in lookup_df
-        snomed_code_col: Column name for SNOMED codes in lookup_df
+        lookup_df: LookupTableHandle (preferred - the cache keys on its fingerprint instead
+            of hashing the table), or a DataFrame with EMIS GUID to SNOMED code mappings
+        emis_guid_col: Column name for EMIS GUIDs in lookup_df (taken from the handle if omitted)
+        snomed_code_col: Column name for SNOMED codes in lookup_df (taken from the handle if omitted)
         deduplication_mode: 'unique_codes' (dedupe by SNOMED code) or 'unique_per_entity' (dedupe by entity+code)
     
     Returns:
         Dict with categorized results based on deduplication mode
     """
     # Create lookup dictionaries for faster lookups
-    guid_to_snomed_dict, snomed_to_info_dict = create_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col)
+    if isinstance(lookup_df, LookupTableHandle):
+        guid_to_snomed_dict, snomed_to_info_dict = get_lookup_dictionaries(lookup_df)
+    else:
+        guid_to_snomed_dict, snomed_to_info_dict = create_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col)
     
-    # First pass: identify pseudo-refset containers and group codes by valueSet
-    valueset_groups = {}  # Group codes by valueSet GUID
-    pseudo_refset_valuesets = set()  # Track which valueSets are pseudo-refsets
+    return translate_emis_guids_batch(emis_guids, guid_to_snomed_dict, snomed_to_info_dict, deduplication_mode)
+
+
+# Lookup source types treated as medications when the XML codeSystem/context is inconclusive
+MEDICATION_SOURCE_TYPES = ('Medication', 'Constituent', 'DM+D')
+
+# Completeness score weights used to pick the best duplicate (unique_codes mode only)
+COMPLETENESS_WEIGHTS = {
+    'ValueSet GUID': 20,        # Actual ValueSet GUID vs N/A - highest priority
+    'ValueSet Description': 10,
+    'SNOMED Description': 5,    # XML display name
+    'Table Context': 2,
+    'Column Context': 1         # Lowest priority
+}
+
+
+def translate_emis_guids_batch(emis_guids, guid_to_snomed_dict, snomed_to_info_dict, deduplication_mode='unique_codes'):
+    """
+    Batch translation engine behind translate_emis_to_snomed.
     
-    for guid_info in emis_guids:
-        valueset_guid = guid_info['valueSet_guid']
-        emis_guid = guid_info['emis_guid']
-        
-        # Group all codes by their valueSet
-        if valueset_guid not in valueset_groups:
-            valueset_groups[valueset_guid] = {
-                'info': guid_info,  # Store valueSet info
-                'codes': []
-            }
-        valueset_groups[valueset_guid]['codes'].append(guid_info)
-        
-        # Check if this code indicates a pseudo-refset container or member using XML structure-based flags
-        if guid_info.get('is_pseudorefset', False):
-            pseudo_refset_valuesets.add(valueset_guid)
+    Loads the GUID occurrences into columnar arrays, joins the distinct GUIDs against
+    the lookup mappings once, applies the deduplication rules as grouped array
+    operations and only builds result dicts for the entries that survive.
+    
+    Args:
+        emis_guids: List of EMIS GUID dictionaries from XML parsing
+        guid_to_snomed_dict: EMIS GUID -> mapping info (from create_lookup_dictionaries)
+        snomed_to_info_dict: SNOMED code -> mapping info (from create_lookup_dictionaries)
+        deduplication_mode: 'unique_codes' (dedupe by SNOMED code) or 'unique_per_entity' (dedupe by entity+code)
     
-    # Separate results by type
-    clinical_codes = []  # Standalone clinical codes
-    medications = []     # Standalone medications
-    clinical_pseudo_members = []  # Clinical codes that are part of pseudo-refsets
-    medication_pseudo_members = []  # Medications that are part of pseudo-refsets
-    refsets = []
-    pseudo_refsets = []  # Containers for pseudo-refsets
-    pseudo_refset_members = {}  # Members of each pseudo-refset (for detailed view)
+    Returns:
+        Dict with categorized results based on deduplication mode
+    """
+    results = {
+        'clinical': [],
+        'medications': [],
+        'clinical_pseudo_members': [],
+        'medication_pseudo_members': [],
+        'refsets': [],
+        'pseudo_refsets': [],
+        'pseudo_refset_members': {}
+    }
+    if not emis_guids:
+        return results
     
-    # Track which refset SNOMED codes we've already added to avoid duplicates
-    added_refset_snomed_codes = set()
+    frame = OccurrenceFrame.from_guids(emis_guids, guid_to_snomed_dict, deduplication_mode)
+    report_progress(0.4)
+    prefer_complete = deduplication_mode == 'unique_codes'
     
-    # Track unique codes to avoid duplicates in all categories
-    # Deduplication key depends on mode: emis_guid (unique_codes) or (source_guid, emis_guid) (unique_per_entity)
-    if deduplication_mode == 'unique_codes':
-        # Deduplicate by SNOMED code only - one instance per code across entire XML
-        unique_clinical_codes = {}  # key: emis_guid, value: code_info
-        unique_medications = {}     # key: emis_guid, value: code_info
-        unique_clinical_pseudo = {} # key: emis_guid, value: code_info
-        unique_medication_pseudo = {} # key: emis_guid, value: code_info
-    else:  # unique_per_entity
-        # Deduplicate by (source_guid, emis_guid) - one instance per code per search/report
-        unique_clinical_codes = {}  # key: (source_guid, emis_guid), value: code_info
-        unique_medications = {}     # key: (source_guid, emis_guid), value: code_info
-        unique_clinical_pseudo = {} # key: (source_guid, emis_guid), value: code_info
-        unique_medication_pseudo = {} # key: (source_guid, emis_guid), value: code_info
+    refset_rows = frame.is_refset
+    member_rows = ~refset_rows & frame.in_pseudo_refset
+    standalone_rows = ~refset_rows & ~frame.in_pseudo_refset
+    medication_rows = frame.category == 'medication'
+    clinical_rows = frame.category == 'clinical'
     
-    def get_deduplication_key(guid_info):
-        """Get the appropriate deduplication key based on mode"""
-        if deduplication_mode == 'unique_codes':
-            return guid_info['emis_guid']  # Dedupe by SNOMED code only
-        else:  # unique_per_entity
-            source_guid = guid_info.get('source_guid', 'unknown_source')
-            return (source_guid, guid_info['emis_guid'])  # Dedupe by (source, code)
+    # True refsets - the emis_guid IS the SNOMED code, one entry per code whatever the mode
+    for position in _first_occurrences(np.flatnonzero(refset_rows), frame.guid_code):
+        results['refsets'].append(_build_refset_entry(emis_guids[position], snomed_to_info_dict))
     
-    def should_replace_entry(existing_entry, new_entry):
-        """Determine if new entry has better details than existing entry (for unique_codes mode only)"""
-        if deduplication_mode != 'unique_codes':
-            return False  # Don't replace in per_entity mode
-        
-        # Priority factors (higher score = better entry):
-        # 1. Has ValueSet Description (not N/A or empty)
-        # 2. Has XML Display Name (not N/A or empty) 
-        # 3. Has Table/Column Context
-        
-        def calculate_completeness_score(entry):
-            score = 0
-            
-            # ValueSet GUID - HIGHEST priority (actual GUID vs N/A)
-            vs_guid = entry.get('ValueSet GUID', 'N/A')
-            if vs_guid and vs_guid != 'N/A' and vs_guid.strip():
-                score += 20  # Highest priority for actual ValueSet GUID
-            
-            # ValueSet Description - high priority
-            vs_desc = entry.get('ValueSet Description', 'N/A')
-            if vs_desc and vs_desc != 'N/A' and vs_desc.strip():
-                score += 10
-            
-            # SNOMED Description (XML display name) - medium priority
-            snomed_desc = entry.get('SNOMED Description', 'N/A')
-            if snomed_desc and snomed_desc != 'N/A' and snomed_desc != 'No display name in XML' and snomed_desc.strip():
-                score += 5
-            
-            # Table Context - lower priority
-            table_ctx = entry.get('Table Context', 'N/A')
-            if table_ctx and table_ctx != 'N/A' and table_ctx.strip():
-                score += 2
-            
-            # Column Context - lowest priority  
-            col_ctx = entry.get('Column Context', 'N/A')
-            if col_ctx and col_ctx != 'N/A' and col_ctx.strip():
-                score += 1
-            
-            return score
-        
-        existing_score = calculate_completeness_score(existing_entry)
-        new_score = calculate_completeness_score(new_entry)
-        
-        return new_score > existing_score
+    # Pseudo-refset containers, in order of first appearance (member count covers every distinct code)
+    container_rows = np.flatnonzero(frame.in_pseudo_refset)
+    member_pairs = frame.valueset_code[container_rows] * frame.guid_count + frame.guid_code[container_rows]
+    member_counts = np.bincount(np.unique(member_pairs) // frame.guid_count, minlength=frame.valueset_count)
+    for position in _first_occurrences(container_rows, frame.valueset_code):
+        container = _build_pseudo_refset_entry(emis_guids[position], int(member_counts[frame.valueset_code[position]]))
+        results['pseudo_refsets'].append(container)
+        results['pseudo_refset_members'][container['ValueSet GUID']] = []
     
-    # Create pseudo-refset containers first
-    for valueset_guid in pseudo_refset_valuesets:
-        valueset_info = valueset_groups[valueset_guid]['info']
-        member_codes = valueset_groups[valueset_guid]['codes']
-        
-        # Count unique member codes (avoid counting duplicates)
-        unique_member_codes = set()
-        for code_info in member_codes:
-            unique_member_codes.add(code_info['emis_guid'])
+    # Detailed pseudo-refset member view: one entry per (valueSet, code), latest occurrence wins
+    detail_rows = np.flatnonzero(member_rows)
+    detail_pairs = frame.valueset_code * frame.guid_count + frame.guid_code
+    for position in _latest_occurrences(detail_rows, detail_pairs):
+        guid_info = emis_guids[position]
+        results['pseudo_refset_members'][guid_info['valueSet_guid']].append(
+            _build_pseudo_member_detail(guid_info, frame.fields_for(guid_info['emis_guid']))
+        )
+    
+    report_progress(0.6)
+    
+    # Pseudo-refset members also appear in the main tabs (medication and clinical deduplicated independently)
+    by_code_system = frame.by_code_system.tolist()
+    results['medication_pseudo_members'] = [
+        _build_pseudo_member_record(emis_guids[position], by_code_system[position], 'medication', frame)
+        for position in frame.select_entries(member_rows & medication_rows, prefer_complete)
+    ]
+    results['clinical_pseudo_members'] = [
+        _build_pseudo_member_record(emis_guids[position], by_code_system[position], 'clinical', frame)
+        for position in frame.select_entries(member_rows & clinical_rows, prefer_complete)
+    ]
+    
+    report_progress(0.75)
+    
+    # Standalone codes - medication context always wins over clinical for the same key
+    standalone_medications = standalone_rows & medication_rows
+    medication_keys = np.isin(frame.dedupe_key, frame.dedupe_key[standalone_medications])
+    results['medications'] = [
+        _build_standalone_record(emis_guids[position], by_code_system[position], 'medication', frame)
+        for position in frame.select_entries(standalone_medications, prefer_complete)
+    ]
+    results['clinical'] = [
+        _build_standalone_record(emis_guids[position], by_code_system[position], 'clinical', frame)
+        for position in frame.select_entries(standalone_rows & clinical_rows & ~medication_keys, prefer_complete)
+    ]
+    
+    return results
+
+
+@dataclass
+class OccurrenceFrame:
+    """Columnar view of the GUID occurrences extracted from one XML document (one row per occurrence)"""
+    guid_code: np.ndarray           # Factorized emis_guid
+    valueset_code: np.ndarray       # Factorized valueSet_guid
+    dedupe_key: np.ndarray          # emis_guid (unique_codes) or (source_guid, emis_guid) (unique_per_entity)
+    is_refset: np.ndarray
+    in_pseudo_refset: np.ndarray
+    category: np.ndarray            # 'medication', 'clinical' or 'skip'
+    by_code_system: np.ndarray      # Category decided by XML codeSystem/context rather than lookup source type
+    score: np.ndarray               # Completeness score of the record the occurrence would produce
+    guid_count: int
+    valueset_count: int
+    mappings: Dict[Any, Optional[Dict[str, Any]]] = field(default_factory=dict)   # Lookup mapping per distinct GUID
+    _fields_cache: Dict[Any, Dict[str, Any]] = field(default_factory=dict, repr=False)
+    
+    @classmethod
+    def from_guids(cls, emis_guids, guid_to_snomed_dict, deduplication_mode='unique_codes'):
+        """Load GUID occurrences and join the distinct GUIDs against the lookup mappings"""
+        # Pseudo-refset valueSets are flagged by any of their codes
+        pseudo_refset_valuesets = {guid_info['valueSet_guid'] for guid_info in emis_guids if guid_info.get('is_pseudorefset', False)}
         
-        # Inherit source information from the first member code (they should all be from the same source)
-        source_info = {}
-        if member_codes:
-            first_member = member_codes[0]
-            source_info = {
-                'source_guid': first_member.get('source_guid', ''),
-                'source_name': first_member.get('source_name', ''),
-                'source_container': first_member.get('source_container', ''),
-                'source_type': first_member.get('source_type', ''),
-                'report_type': first_member.get('report_type', '')
-            }
+        def required_column(key):
+            return _object_column(list(map(operator.itemgetter(key), emis_guids)))
         
-        # Create pseudo-refset entry preserving original XML data
-        pseudo_refset_entry = valueset_info.copy()  # Start with all original XML data
-        pseudo_refset_entry.update({
-            'ValueSet GUID': valueset_guid,
-            'ValueSet Description': valueset_info['valueSet_description'],
-            'Code System': valueset_info['code_system'],
-            'Type': 'Pseudo-Refset',
-            'Usage': '⚠️ Can only be used by listing member codes, not by SNOMED code reference',
-            'Status': 'Not in EMIS database - requires member code listing',
-            'Member Count': len(unique_member_codes)
-        })
+        emis_guid = required_column('emis_guid')
+        valueset_guid = required_column('valueSet_guid')
+        is_refset = required_column('is_refset')
+        code_system = required_column('code_system')
+        valueset_description = required_column('valueSet_description')
+        xml_display_name = required_column('xml_display_name')
+        table_context = _object_column([guid_info.get('table_context') for guid_info in emis_guids])
+        column_context = _object_column([guid_info.get('column_context') for guid_info in emis_guids])
+        guid_code, unique_guids = _factorize(emis_guid)
+        valueset_code, unique_valuesets = _factorize(valueset_guid)
+        in_pseudo_refset = np.array([valueset in pseudo_refset_valuesets for valueset in unique_valuesets], dtype=bool)[valueset_code]
         
-        # Add source information to the pseudo-refset container
-        pseudo_refset_entry.update(source_info)
-        pseudo_refsets.append(pseudo_refset_entry)
+        # Join each distinct GUID against the lookup once
+        if isinstance(guid_to_snomed_dict, LookupIndex):
+            mappings = guid_to_snomed_dict.get_many(list(unique_guids))
+        else:
+            mappings = [guid_to_snomed_dict.get(guid) for guid in unique_guids]
+        lookup_source_type = _object_column([
+            mapping['source_type'] if mapping is not None else 'Unknown' for mapping in mappings
+        ])[guid_code]
         
-        # Initialize member dict for this pseudo-refset (for deduplication)
-        pseudo_refset_members[valueset_guid] = {}
-    
-    # Process all individual codes
-    for guid_info in emis_guids:
-        emis_guid = guid_info['emis_guid']
-        is_refset = guid_info['is_refset']
-        valueset_guid = guid_info['valueSet_guid']
+        # Classify each distinct (codeSystem, context, source type) combination once
+        combination_code = _combine_codes(
+            _factorize(code_system)[0],
+            _factorize(table_context)[0],
+            _factorize(column_context)[0],
+            _factorize(lookup_source_type)[0]
+        )
+        _, first_rows, combination_index = np.unique(combination_code, return_index=True, return_inverse=True)
+        classified = [
+            _classify_code(code_system[row], table_context[row], column_context[row], lookup_source_type[row])
+            for row in first_rows
+        ]
+        category = _object_column([category for category, _ in classified])[combination_index]
+        by_code_system = np.array([by_code_system for _, by_code_system in classified], dtype=bool)[combination_index]
         
-        # For true refsets, the emis_guid IS the SNOMED code
-        if is_refset:
-            snomed_code = emis_guid
-            
-            # Only add this refset if we haven't already added this specific SNOMED code
-            if snomed_code not in added_refset_snomed_codes:
-                # Try to get additional info from lookup table
-                if snomed_code in snomed_to_info_dict:
-                    source_info = snomed_to_info_dict[snomed_code]
-                    refset_source_type = source_info['source_type']
-                else:
-                    refset_source_type = 'Refset'
-                
-                # Create refset entry preserving original XML data
-                refset_entry = guid_info.copy()  # Start with all original XML data
-                refset_entry.update({
-                    'ValueSet GUID': valueset_guid,
-                    'ValueSet Description': guid_info['valueSet_description'], 
-                    'Code System': guid_info['code_system'],
-                    'SNOMED Code': snomed_code,
-                    'SNOMED Description': guid_info['valueSet_description'],
-                    'Type': 'True Refset',
-                    'Source Type': refset_source_type,
-                    # Add source information from the GUID info
-                    'source_guid': guid_info.get('source_guid', ''),
-                    'source_name': guid_info.get('source_name', ''),
-                    'source_container': guid_info.get('source_container', ''),
-                    'source_type': guid_info.get('source_type', ''),
-                    'report_type': guid_info.get('report_type', '')
-                })
-                
-                refsets.append(refset_entry)
-                
-                # Mark this SNOMED code as already added
-                added_refset_snomed_codes.add(snomed_code)
-            continue
+        # Completeness score of the record each occurrence would produce (only used by unique_codes)
+        if deduplication_mode == 'unique_codes':
+            dedupe_key = guid_code
+            score = (
+                _filled_flags(valueset_guid) * COMPLETENESS_WEIGHTS['ValueSet GUID'] +
+                _filled_flags(valueset_description) * COMPLETENESS_WEIGHTS['ValueSet Description'] +
+                _filled_flags(xml_display_name, ('N/A', 'No display name in XML')) * COMPLETENESS_WEIGHTS['SNOMED Description'] +
+                _filled_flags(table_context) * COMPLETENESS_WEIGHTS['Table Context'] +
+                _filled_flags(column_context) * COMPLETENESS_WEIGHTS['Column Context']
+            )
+            # Pseudo-refset member records carry no table/column context of their own
+            member_positions = np.flatnonzero(in_pseudo_refset)
+            if member_positions.size:
+                member_context = [emis_guids[position] for position in member_positions]
+                score[member_positions] += (
+                    _filled_flags(_object_column([guid_info.get('Table Context', 'N/A') for guid_info in member_context])) * COMPLETENESS_WEIGHTS['Table Context'] +
+                    _filled_flags(_object_column([guid_info.get('Column Context', 'N/A') for guid_info in member_context])) * COMPLETENESS_WEIGHTS['Column Context'] -
+                    _filled_flags(table_context[member_positions]) * COMPLETENESS_WEIGHTS['Table Context'] -
+                    _filled_flags(column_context[member_positions]) * COMPLETENESS_WEIGHTS['Column Context']
+                )
+        else:
+            source_guid = _object_column([guid_info.get('source_guid', 'unknown_source') for guid_info in emis_guids])
+            dedupe_key = _combine_codes(_factorize(source_guid)[0], guid_code)
+            score = np.zeros(len(emis_guids), dtype=np.int64)
         
-        # For regular codes, check if they belong to a pseudo-refset
-        if valueset_guid in pseudo_refset_valuesets:
-            # This code is a member of a pseudo-refset
-            if emis_guid in guid_to_snomed_dict:
-                mapping = guid_to_snomed_dict[emis_guid]
-                snomed_code = mapping['snomed_code']
-                source_type = mapping['source_type']
-                has_qualifier = mapping.get('has_qualifier', 'Unknown')
-                is_parent = mapping.get('is_parent', 'Unknown')
-                descendants = mapping.get('descendants', '0')
-                code_type = mapping.get('code_type', 'Unknown')
-                mapping_found = True
-            else:
-                snomed_code = 'Not Found'
-                source_type = 'Unknown'
-                has_qualifier = 'Unknown'
-                is_parent = 'Unknown'
-                descendants = '0'
-                code_type = 'Unknown'
-                mapping_found = False
-            
-            # Always use XML display name for description (whether found or not)
-            description = guid_info['xml_display_name']
-            if description == "N/A" or not description:
-                description = "No display name in XML"
-            
-            # Create the base member record preserving original XML data
-            member_record = guid_info.copy()  # Start with all original XML data
-            member_record.update({
-                'ValueSet GUID': valueset_guid,
-                'ValueSet Description': guid_info['valueSet_description'],
-                'EMIS GUID': emis_guid,
-                'SNOMED Code': snomed_code,
-                'SNOMED Description': description,
-                'Mapping Found': 'Found' if mapping_found else 'Not Found'
-            })
-            
-            # Add to pseudo-refset members (for detailed view) - deduplicate by emis_guid
-            detailed_member = member_record.copy()
-            detailed_member['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
-            pseudo_refset_members[valueset_guid][emis_guid] = detailed_member
-            
-            # Also add to appropriate category list for display in main tabs
-            code_system = guid_info['code_system']
-            table_context = guid_info.get('table_context')
-            column_context = guid_info.get('column_context')
-            
-            # Use XML codeSystem and context as primary indicator of type
-            dedupe_key = get_deduplication_key(guid_info)
-            if is_medication_code_system(code_system, table_context, column_context):
-                member_record['Medication Type'] = get_medication_type_flag(code_system)
-                # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                member_record['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                member_record['source_guid'] = guid_info.get('source_guid', '')
-                member_record['source_name'] = guid_info.get('source_name', '')
-                member_record['source_container'] = guid_info.get('source_container', '')
-                member_record['source_type'] = guid_info.get('source_type', '')
-                member_record['report_type'] = guid_info.get('report_type', '')
-                # Add to unique medications pseudo dict
-                if dedupe_key in unique_medication_pseudo:
-                    # Replace existing entry if new one has better details
-                    if should_replace_entry(unique_medication_pseudo[dedupe_key], member_record):
-                        unique_medication_pseudo[dedupe_key] = member_record
-                else:
-                    unique_medication_pseudo[dedupe_key] = member_record
-            elif is_clinical_code_system(code_system, table_context, column_context):
-                member_record['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
-                member_record['Has Qualifier'] = has_qualifier
-                member_record['Is Parent'] = is_parent
-                member_record['Descendants'] = descendants
-                member_record['Code Type'] = code_type
-                # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                member_record['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                member_record['source_guid'] = guid_info.get('source_guid', '')
-                member_record['source_name'] = guid_info.get('source_name', '')
-                member_record['source_container'] = guid_info.get('source_container', '')
-                member_record['source_type'] = guid_info.get('source_type', '')
-                member_record['report_type'] = guid_info.get('report_type', '')
-                # Add to unique clinical pseudo dict
-                if dedupe_key in unique_clinical_pseudo:
-                    # Replace existing entry if new one has better details
-                    if should_replace_entry(unique_clinical_pseudo[dedupe_key], member_record):
-                        unique_clinical_pseudo[dedupe_key] = member_record
-                else:
-                    unique_clinical_pseudo[dedupe_key] = member_record
-            else:
-                # Skip EMIS internal codes entirely - they're not medical codes
-                if code_system.upper() == 'EMISINTERNAL':
-                    continue  # Skip this pseudo-refset member entirely
-                
-                # Fall back to lookup table source type for unknown code systems
-                if source_type in ['Medication', 'Constituent', 'DM+D']:
-                    member_record['Medication Type'] = 'Standard Medication'
-                    # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                    member_record['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                    if dedupe_key in unique_medication_pseudo:
-                        # Replace existing entry if new one has better details
-                        if should_replace_entry(unique_medication_pseudo[dedupe_key], member_record):
-                            unique_medication_pseudo[dedupe_key] = member_record
-                    else:
-                        unique_medication_pseudo[dedupe_key] = member_record
-                else:
-                    member_record['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
-                    member_record['Has Qualifier'] = has_qualifier
-                    member_record['Is Parent'] = is_parent
-                    member_record['Descendants'] = descendants
-                    member_record['Code Type'] = code_type
-                    # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                    member_record['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                    if dedupe_key in unique_clinical_pseudo:
-                        # Replace existing entry if new one has better details
-                        if should_replace_entry(unique_clinical_pseudo[dedupe_key], member_record):
-                            unique_clinical_pseudo[dedupe_key] = member_record
-                    else:
-                        unique_clinical_pseudo[dedupe_key] = member_record
-            
-            continue  # Don't add to standalone codes
+        return cls(
+            guid_code=guid_code,
+            valueset_code=valueset_code,
+            dedupe_key=dedupe_key,
+            is_refset=np.array([bool(value) for value in is_refset], dtype=bool),
+            in_pseudo_refset=in_pseudo_refset,
+            category=category,
+            by_code_system=by_code_system,
+            score=score,
+            guid_count=len(unique_guids),
+            valueset_count=len(unique_valuesets),
+            mappings=dict(zip(unique_guids, mappings))
+        )
+    
+    def fields_for(self, emis_guid):
+        """Lookup fields for a GUID (SNOMED code, source type, qualifiers), built on first use"""
+        fields = self._fields_cache.get(emis_guid)
+        if fields is None:
+            fields = self._fields_cache[emis_guid] = _mapping_fields(self.mappings.get(emis_guid))
+        return fields
+    
+    def select_entries(self, rows, prefer_complete):
+        """
+        Pick one occurrence per dedupe key among the selected rows, in order of each key's first appearance.
         
-        # For standalone codes (not in pseudo-refsets)
+        With prefer_complete the earliest occurrence with the highest completeness score
+        wins (the unique_codes rule), otherwise the first occurrence is kept.
+        """
+        positions = np.flatnonzero(rows)
+        if positions.size == 0:
+            return []
+        keys = self.dedupe_key[positions]
+        if prefer_complete:
+            order = np.lexsort((positions, -self.score[positions], keys))
         else:
-            if emis_guid in guid_to_snomed_dict:
-                mapping = guid_to_snomed_dict[emis_guid]
-                snomed_code = mapping['snomed_code']
-                source_type = mapping['source_type']
-                has_qualifier = mapping.get('has_qualifier', 'Unknown')
-                is_parent = mapping.get('is_parent', 'Unknown')
-                descendants = mapping.get('descendants', '0')
-                code_type = mapping.get('code_type', 'Unknown')
-                mapping_found = True
-            else:
-                snomed_code = 'Not Found'
-                source_type = 'Unknown'
-                has_qualifier = 'Unknown'
-                is_parent = 'Unknown'
-                descendants = '0'
-                code_type = 'Unknown'
-                mapping_found = False
-            
-            # Always use XML display name for description (whether found or not)
-            description = guid_info['xml_display_name']
-            if description == "N/A" or not description:
-                description = "No display name in XML"
-            
-            # Start with all original XML data to preserve pseudo-refset flags and other metadata
-            result = guid_info.copy()
-            result.update({
-                'ValueSet GUID': valueset_guid,
-                'ValueSet Description': guid_info['valueSet_description'],
-                'Code System': guid_info['code_system'],
-                'EMIS GUID': emis_guid,
-                'SNOMED Code': snomed_code,
-                'SNOMED Description': description,
-                'Mapping Found': 'Found' if mapping_found else 'Not Found',
-                'Table Context': guid_info.get('table_context', 'N/A'),
-                'Column Context': guid_info.get('column_context', 'N/A')
-            })
-            
-            # Classify as clinical or medication based on XML codeSystem and context
-            code_system = guid_info['code_system']
-            table_context = guid_info.get('table_context')
-            column_context = guid_info.get('column_context')
-            
-            # Use XML codeSystem and context as primary indicator of type
-            dedupe_key = get_deduplication_key(guid_info)
-            if is_medication_code_system(code_system, table_context, column_context):
-                result['Medication Type'] = get_medication_type_flag(code_system)
-                # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                result['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                # Always prioritize medication context - remove from clinical if it exists there
-                if dedupe_key in unique_clinical_codes:
-                    del unique_clinical_codes[dedupe_key]
-                # Check if we already have this medication
-                if dedupe_key in unique_medications:
-                    # Replace existing entry if new one has better details
-                    if should_replace_entry(unique_medications[dedupe_key], result):
-                        unique_medications[dedupe_key] = result
-                else:
-                    # First time seeing this medication, add it
-                    unique_medications[dedupe_key] = result
-            elif is_clinical_code_system(code_system, table_context, column_context):
-                result['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
-                result['Has Qualifier'] = has_qualifier
-                result['Is Parent'] = is_parent
-                result['Descendants'] = descendants
-                result['Code Type'] = code_type
-                # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                result['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                # Only add to clinical if it's not already in medications (medication context takes priority)
-                if dedupe_key not in unique_medications:
-                    # Check if we already have this clinical code
-                    if dedupe_key in unique_clinical_codes:
-                        # Replace existing entry if new one has better details
-                        if should_replace_entry(unique_clinical_codes[dedupe_key], result):
-                            unique_clinical_codes[dedupe_key] = result
-                    else:
-                        # First time seeing this code, add it
-                        unique_clinical_codes[dedupe_key] = result
-            else:
-                # Skip EMIS internal codes entirely - they're not medical codes
-                if code_system.upper() == 'EMISINTERNAL':
-                    continue  # Skip this code entirely
-                
-                # Fall back to lookup table source type for unknown code systems
-                if source_type in ['Medication', 'Constituent', 'DM+D']:
-                    result['Medication Type'] = 'Standard Medication'
-                    # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                    result['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                    # Remove from clinical if it exists there
-                    if dedupe_key in unique_clinical_codes:
-                        del unique_clinical_codes[dedupe_key]
-                    # Check if we already have this medication
-                    if dedupe_key in unique_medications:
-                        # Replace existing entry if new one has better details
-                        if should_replace_entry(unique_medications[dedupe_key], result):
-                            unique_medications[dedupe_key] = result
-                    else:
-                        # First time seeing this medication, add it
-                        unique_medications[dedupe_key] = result
-                else:
-                    result['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
-                    result['Has Qualifier'] = has_qualifier
-                    result['Is Parent'] = is_parent
-                    result['Descendants'] = descendants
-                    result['Code Type'] = code_type
-                    # Add source info for both modes (will be hidden in UI for unique_codes mode)
-                    result['Source GUID'] = guid_info.get('source_guid', 'Unknown')
-                    # Only add to clinical if it's not already in medications
-                    if dedupe_key not in unique_medications:
-                        # Check if we already have this clinical code
-                        if dedupe_key in unique_clinical_codes:
-                            # Replace existing entry if new one has better details
-                            if should_replace_entry(unique_clinical_codes[dedupe_key], result):
-                                unique_clinical_codes[dedupe_key] = result
-                        else:
-                            # First time seeing this code, add it
-                            unique_clinical_codes[dedupe_key] = result
+            order = np.lexsort((positions, keys))
+        sorted_keys = keys[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        winners = positions[order[group_starts]]
+        first_seen = np.minimum.reduceat(positions[order], group_starts)
+        return winners[np.argsort(first_seen, kind='stable')].tolist()
+
+
+def _object_column(values):
+    """Object array that keeps None and strings exactly as extracted"""
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _factorize(values):
+    """Integer code per row plus the distinct values (None kept as its own value rather than dropped)"""
+    codes, uniques = pd.factorize(values)
+    uniques = list(uniques)
+    missing = codes < 0
+    if missing.any():
+        codes = np.where(missing, len(uniques), codes)
+        uniques.append(None)
+    return codes, uniques
+
+
+def _combine_codes(*codes):
+    """Combine several factorized columns into one integer key per row"""
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    for code in codes:
+        combined = combined * (int(code.max()) + 1 if len(code) else 1) + code
+    return combined
+
+
+def _first_occurrences(positions, codes):
+    """Positions of the first occurrence of each code among positions, in document order"""
+    if positions.size == 0:
+        return []
+    _, first_index = np.unique(codes[positions], return_index=True)
+    return positions[np.sort(first_index)].tolist()
+
+
+def _latest_occurrences(positions, codes):
+    """Positions of the last occurrence of each code, ordered by the code's first appearance"""
+    if positions.size == 0:
+        return []
+    selected = codes[positions]
+    _, first_index = np.unique(selected, return_index=True)
+    _, last_index_reversed = np.unique(selected[::-1], return_index=True)
+    last_index = positions.size - 1 - last_index_reversed
+    return positions[last_index[np.argsort(first_index, kind='stable')]].tolist()
+
+
+def _classify_code(code_system, table_context, column_context, lookup_source_type):
+    """
+    Classify a code as 'medication', 'clinical' or 'skip'.
     
-    # Convert dictionaries back to lists (now deduplicated)
-    clinical_codes = list(unique_clinical_codes.values())
-    medications = list(unique_medications.values())
-    clinical_pseudo_members = list(unique_clinical_pseudo.values())
-    medication_pseudo_members = list(unique_medication_pseudo.values())
+    Returns:
+        Tuple of (category, decided_by_code_system)
+    """
+    # Use XML codeSystem and context as primary indicator of type
+    if is_medication_code_system(code_system, table_context, column_context):
+        return 'medication', True
+    if is_clinical_code_system(code_system, table_context, column_context):
+        return 'clinical', True
     
-    # Convert pseudo_refset_members dictionaries to lists
-    deduplicated_pseudo_refset_members = {}
-    for valueset_guid, members_dict in pseudo_refset_members.items():
-        deduplicated_pseudo_refset_members[valueset_guid] = list(members_dict.values())
+    # Skip EMIS internal codes entirely - they're not medical codes
+    if code_system.upper() == 'EMISINTERNAL':
+        return 'skip', False
     
+    # Fall back to lookup table source type for unknown code systems
+    if lookup_source_type in MEDICATION_SOURCE_TYPES:
+        return 'medication', False
+    return 'clinical', False
+
+
+def _filled_flags(values, placeholders=('N/A',)):
+    """
+    Per-row check that a record field holds a real value (not empty, whitespace or a placeholder).
+    Evaluated once per distinct value and broadcast back to the rows.
+    """
+    codes, uniques = _factorize(values)
+    flags = np.array([bool(value and value not in placeholders and value.strip()) for value in uniques], dtype=bool)
+    return flags[codes]
+
+
+def _mapping_fields(mapping):
+    """Lookup details for a code, with the defaults used when no mapping exists"""
+    if mapping is not None:
+        return {
+            'snomed_code': mapping['snomed_code'],
+            'source_type': mapping['source_type'],
+            'has_qualifier': mapping.get('has_qualifier', 'Unknown'),
+            'is_parent': mapping.get('is_parent', 'Unknown'),
+            'descendants': mapping.get('descendants', '0'),
+            'code_type': mapping.get('code_type', 'Unknown'),
+            'mapping_found': True
+        }
+    return {
+        'snomed_code': 'Not Found',
+        'source_type': 'Unknown',
+        'has_qualifier': 'Unknown',
+        'is_parent': 'Unknown',
+        'descendants': '0',
+        'code_type': 'Unknown',
+        'mapping_found': False
+    }
+
+
+def _display_description(guid_info):
+    """Always use XML display name for description (whether found or not)"""
+    description = guid_info['xml_display_name']
+    if description == "N/A" or not description:
+        description = "No display name in XML"
+    return description
+
+
+def _clinical_fields(guid_info, fields):
+    """Clinical-only columns of a translated record"""
+    return {
+        'Include Children': 'Yes' if guid_info['include_children'] else 'No',
+        'Has Qualifier': fields['has_qualifier'],
+        'Is Parent': fields['is_parent'],
+        'Descendants': fields['descendants'],
+        'Code Type': fields['code_type']
+    }
+
+
+def _source_fields(guid_info):
+    """Search/report source attribution columns of a record"""
+    return {
+        'source_guid': guid_info.get('source_guid', ''),
+        'source_name': guid_info.get('source_name', ''),
+        'source_container': guid_info.get('source_container', ''),
+        'source_type': guid_info.get('source_type', ''),
+        'report_type': guid_info.get('report_type', '')
+    }
+
+
+def _build_refset_entry(guid_info, snomed_to_info_dict):
+    """Build a True Refset entry (the emis_guid is the SNOMED code)"""
+    snomed_code = guid_info['emis_guid']
     
+    # Try to get additional info from lookup table
+    refset_info = snomed_to_info_dict.get(snomed_code)
+    refset_source_type = refset_info['source_type'] if refset_info is not None else 'Refset'
+    
+    # Create refset entry preserving original XML data
     return {
-        'clinical': clinical_codes,
-        'medications': medications,
-        'clinical_pseudo_members': clinical_pseudo_members,
-        'medication_pseudo_members': medication_pseudo_members,
-        'refsets': refsets,
-        'pseudo_refsets': pseudo_refsets,
-        'pseudo_refset_members': deduplicated_pseudo_refset_members
-    }
\ No newline at end of file
+        **guid_info,
+        'ValueSet GUID': guid_info['valueSet_guid'],
+        'ValueSet Description': guid_info['valueSet_description'],
+        'Code System': guid_info['code_system'],
+        'SNOMED Code': snomed_code,
+        'SNOMED Description': guid_info['valueSet_description'],
+        'Type': 'True Refset',
+        'Source Type': refset_source_type,
+        **_source_fields(guid_info)
+    }
+
+
+def _build_pseudo_refset_entry(valueset_info, member_count):
+    """Build a pseudo-refset container from the first code seen in its valueSet"""
+    return {
+        **valueset_info,
+        'ValueSet GUID': valueset_info['valueSet_guid'],
+        'ValueSet Description': valueset_info['valueSet_description'],
+        'Code System': valueset_info['code_system'],
+        'Type': 'Pseudo-Refset',
+        'Usage': '⚠️ Can only be used by listing member codes, not by SNOMED code reference',
+        'Status': 'Not in EMIS database - requires member code listing',
+        'Member Count': member_count,
+        # Inherit source information from the first member code
+        **_source_fields(valueset_info)
+    }
+
+
+def _base_member_record(guid_info, fields):
+    """Pseudo-refset member record preserving original XML data"""
+    return {
+        **guid_info,
+        'ValueSet GUID': guid_info['valueSet_guid'],
+        'ValueSet Description': guid_info['valueSet_description'],
+        'EMIS GUID': guid_info['emis_guid'],
+        'SNOMED Code': fields['snomed_code'],
+        'SNOMED Description': _display_description(guid_info),
+        'Mapping Found': 'Found' if fields['mapping_found'] else 'Not Found'
+    }
+
+
+def _build_pseudo_member_detail(guid_info, fields):
+    """Member entry for the detailed pseudo-refset view"""
+    detailed_member = _base_member_record(guid_info, fields)
+    detailed_member['Include Children'] = 'Yes' if guid_info['include_children'] else 'No'
+    return detailed_member
+
+
+def _build_pseudo_member_record(guid_info, by_code_system, category, frame):
+    """Pseudo-refset member entry for the main clinical/medication tabs"""
+    fields = frame.fields_for(guid_info['emis_guid'])
+    member_record = _base_member_record(guid_info, fields)
+    
+    if category == 'medication':
+        member_record['Medication Type'] = get_medication_type_flag(guid_info['code_system']) if by_code_system else 'Standard Medication'
+    else:
+        member_record.update(_clinical_fields(guid_info, fields))
+    
+    # Add source info for both modes (will be hidden in UI for unique_codes mode)
+    member_record['Source GUID'] = guid_info.get('source_guid', 'Unknown')
+    if by_code_system:
+        member_record.update(_source_fields(guid_info))
+    return member_record
+
+
+def _build_standalone_record(guid_info, by_code_system, category, frame):
+    """Entry for a code that is not part of a pseudo-refset"""
+    fields = frame.fields_for(guid_info['emis_guid'])
+    
+    # Start with all original XML data to preserve pseudo-refset flags and other metadata
+    result = {
+        **guid_info,
+        'ValueSet GUID': guid_info['valueSet_guid'],
+        'ValueSet Description': guid_info['valueSet_description'],
+        'Code System': guid_info['code_system'],
+        'EMIS GUID': guid_info['emis_guid'],
+        'SNOMED Code': fields['snomed_code'],
+        'SNOMED Description': _display_description(guid_info),
+        'Mapping Found': 'Found' if fields['mapping_found'] else 'Not Found',
+        'Table Context': guid_info.get('table_context', 'N/A'),
+        'Column Context': guid_info.get('column_context', 'N/A')
+    }
+    
+    if category == 'medication':
+        result['Medication Type'] = get_medication_type_flag(guid_info['code_system']) if by_code_system else 'Standard Medication'
+    else:
+        result.update(_clinical_fields(guid_info, fields))
+    
+    # Add source info for both modes (will be hidden in UI for unique_codes mode)
+    result['Source GUID'] = guid_info.get('source_guid', 'Unknown')
+    return result
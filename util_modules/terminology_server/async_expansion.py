@@ -0,0 +1,206 @@
+"""
+Asyncio SNOMED Expansion Engine
+
+Expands many codes concurrently without a thread per code:
+
+- Each code is an asyncio task; the adaptive concurrency controller (see
+  concurrency_controller.py) decides how many are in flight, under a per-run cap
+- The blocking terminology client calls run on one reused thread pool sized to
+  that cap, over the shared keep-alive session (see connection_pool.py)
+- Every attempt has its own timeout, which also bounds each of its HTTP
+  requests; an attempt abandoned by a timeout keeps its controller slot until
+  its thread actually finishes, so the server never sees more than the limit
+- Transient failures (server errors, rate limiting, connection problems,
+  timeouts, incomplete paging) are retried with full-jitter exponential backoff
+- Outcomes are delivered through an async iterator in completion order, so the
+  Streamlit orchestrator can update progress as each code finishes
+"""
+
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from .nhs_terminology_client import NHSTerminologyClient, ExpansionResult
+from .concurrency_controller import AdaptiveConcurrencyController, get_concurrency_controller
+
+
+# Longest wait for a controller slot before re-checking (slots can free up in other sessions)
+SLOT_POLL_INTERVAL = 0.05
+
+# Seconds allowed for one expansion attempt (all of its pages), and for each of its requests
+DEFAULT_REQUEST_TIMEOUT = 120.0
+
+# Retries after the first attempt for transient failures
+DEFAULT_MAX_RETRIES = 3
+
+# Backoff before retry n is uniform in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+# Error text from NHSTerminologyClient that is worth retrying
+_TRANSIENT_ERRORS = (
+    "Terminology server error",
+    "Connection error",
+    "API request failed: 429",
+    "API request failed: 408",
+    "Incomplete expansion",
+    "Timed out",
+)
+
+
+def is_transient_error(error: Optional[str]) -> bool:
+    """Whether an expansion error may succeed on retry (e.g. not an unknown code)"""
+    return bool(error) and any(marker in error for marker in _TRANSIENT_ERRORS)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Full-jitter exponential backoff before retry number attempt (0-based)"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+@dataclass
+class ExpansionOutcome:
+    """Final result for one requested code after any retries"""
+    snomed_code: str
+    code_entry: Dict
+    result: Optional[ExpansionResult]
+    error: Optional[str]
+    attempts: int
+    derived_from: Optional[str] = None  # Container code this result was derived from locally (see expansion_planner.py)
+
+    @property
+    def success(self) -> bool:
+        return self.result is not None and not self.error
+
+
+class AsyncExpansionEngine:
+    """Bounded-concurrency expansion of many codes with timeouts and retries"""
+
+    def __init__(self, client_id: str, client_secret: str, include_inactive: bool = False,
+                 max_concurrency: Optional[int] = None,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 client: Optional[NHSTerminologyClient] = None,
+                 controller: Optional[AdaptiveConcurrencyController] = None):
+        """
+        Args:
+            client_id: Terminology server credentials (read from Streamlit secrets by the caller)
+            client_secret: Secret matching client_id
+            include_inactive: Whether to include inactive concepts
+            max_concurrency: Cap on codes being expanded at once by this run; the
+                controller's current limit applies below it (default: its max_limit)
+            request_timeout: Seconds allowed per expansion attempt
+            max_retries: Retries for transient failures
+            client: Client to use instead of one built from the credentials (e.g. in tests)
+            controller: Adaptive limit to follow (default: the process-wide controller)
+        """
+        self.include_inactive = include_inactive
+        self.controller = controller or get_concurrency_controller()
+        self.max_concurrency = max(1, max_concurrency or self.controller.max_limit)
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        # Clients share one token and keep-alive session per credentials, so one is enough
+        self.client = client or NHSTerminologyClient(client_id, client_secret)
+        self.attempts = 0
+        self.retries = 0
+
+    async def _acquire_slot(self, released: asyncio.Condition):
+        """Wait for a slot under the controller's current limit"""
+        async with released:
+            while not self.controller.try_acquire():
+                try:
+                    await asyncio.wait_for(released.wait(), timeout=SLOT_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release_slot(self, released: asyncio.Condition):
+        self.controller.release()
+        async with released:
+            released.notify_all()
+
+    async def _expand_one(self, code_entry: Dict, semaphore: asyncio.Semaphore, released: asyncio.Condition,
+                          executor: ThreadPoolExecutor, include_hierarchy: bool = False) -> ExpansionOutcome:
+        """Expand one code, retrying transient failures with jittered backoff"""
+        snomed_code = code_entry.get('SNOMED Code', '').strip()
+        if not snomed_code:
+            return ExpansionOutcome(snomed_code, code_entry, None, 'No SNOMED code provided', 0)
+
+        result = None
+        error = None
+        attempt = 0
+        while True:
+            async with semaphore:
+                await self._acquire_slot(released)
+                self.attempts += 1
+                attempt_future = executor.submit(
+                    self.client._expand_concept_uncached, snomed_code, self.include_inactive,
+                    include_hierarchy, timeout=self.request_timeout
+                )
+                try:
+                    result = await asyncio.wait_for(asyncio.wrap_future(attempt_future), timeout=self.request_timeout)
+                    error = result.error if result else 'No expansion result returned'
+                except asyncio.TimeoutError:
+                    result, error = None, f"Timed out after {self.request_timeout:.0f}s"
+                except Exception as e:
+                    result, error = None, str(e)
+                finally:
+                    if attempt_future.done():
+                        await self._release_slot(released)
+                    else:
+                        # Abandoned but still running: hold the slot until its thread finishes
+                        attempt_future.add_done_callback(lambda _: self.controller.release())
+
+            attempt += 1
+            if not error or attempt > self.max_retries or not is_transient_error(error):
+                break
+            # Back off outside the semaphore so other codes keep the slot busy
+            self.retries += 1
+            await asyncio.sleep(backoff_delay(attempt - 1))
+
+        return ExpansionOutcome(snomed_code, code_entry, result, error, attempt)
+
+    async def expand(self, code_entries: List[Dict], hierarchy_codes: Optional[Set[str]] = None) -> AsyncIterator[ExpansionOutcome]:
+        """
+        Expand every code, yielding each outcome as soon as it completes
+
+        Args:
+            code_entries: Clinical code dicts with a 'SNOMED Code' key
+            hierarchy_codes: Codes to expand with each child's direct parents
+
+        Yields:
+            ExpansionOutcome per entry, in completion order
+        """
+        if not code_entries:
+            return
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        released = asyncio.Condition()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="snomed-expand")
+        tasks = [
+            asyncio.ensure_future(self._expand_one(
+                entry, semaphore, released, executor,
+                include_hierarchy=bool(hierarchy_codes) and entry.get('SNOMED Code', '').strip() in hierarchy_codes
+            ))
+            for entry in code_entries
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Don't block on attempts abandoned by a timeout; their threads finish on their own
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_async(coroutine):
+    """Run a coroutine to completion from synchronous (Streamlit script) code"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # Already inside an event loop - run on a private loop in a helper thread
+    with ThreadPoolExecutor(max_workers=1) as runner:
+        return runner.submit(asyncio.run, coroutine).result()
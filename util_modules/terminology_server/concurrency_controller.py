@@ -0,0 +1,214 @@
+"""
+Adaptive Concurrency for the NHS Terminology Server
+
+One AdaptiveConcurrencyController per process decides how many codes may be
+expanded at once, across every session and both expansion paths
+(AsyncExpansionEngine and NHSTerminologyClient.batch_expand_concepts).
+
+It is an AIMD feedback loop driven by the requests themselves:
+
+- NHSTerminologyClient._make_request records the latency and status of every
+  terminology server request
+- After each round (about one request per slot), the controller looks at the
+  recent window: if the p95 latency and the 5xx/429/connection-error rate are
+  healthy it adds one slot, otherwise it halves the limit
+- "Healthy" latency is relative to the best median seen so far, so the limit
+  settles at the fastest rate this server tolerates rather than a guessed constant
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+# Limits in requests in flight: one per code being expanded, plus spare slots borrowed for extra pages
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 20
+
+# Recent requests considered when judging server health
+WINDOW_SIZE = 50
+
+# Fewest new samples before the limit is adjusted again
+MIN_ROUND_SAMPLES = 5
+
+# Back off when more than this fraction of recent requests failed or were throttled
+MAX_ERROR_RATE = 0.05
+
+# Back off when p95 latency exceeds this multiple of the best median seen (never below the floor)
+LATENCY_TOLERANCE = 3.0
+LATENCY_FLOOR = 2.0
+
+
+def _is_unhealthy_status(status_code: int) -> bool:
+    """Server errors, throttling and connection failures (status 0) mean slow down"""
+    return status_code == 0 or status_code == 429 or status_code >= 500
+
+
+def _percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class AdaptiveConcurrencyController:
+    """
+    Thread-safe AIMD concurrency limit with slot accounting.
+
+    Callers hold a slot per code being expanded (slot() for threads,
+    try_acquire()/release() for asyncio) and report every request through
+    record().
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT, min_limit: int = DEFAULT_MIN_LIMIT,
+                 max_limit: int = DEFAULT_MAX_LIMIT, latency_target: Optional[float] = None):
+        """
+        Args:
+            initial_limit: Concurrency to start at
+            min_limit: Never go below this many slots
+            max_limit: Never go above this many slots
+            latency_target: Fixed p95 latency (seconds) to stay under; relative to
+                the best observed median when None
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self._limit = max(min_limit, min(initial_limit, max_limit))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._samples = deque(maxlen=WINDOW_SIZE)  # (latency_seconds, unhealthy)
+        self._since_adjust = 0
+        self._best_median: Optional[float] = None
+        self.total_requests = 0
+        self.total_errors = 0
+        self.increases = 0
+        self.decreases = 0
+        self.last_adjusted: Optional[float] = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def try_acquire(self) -> bool:
+        """Take a slot if one is free under the current limit"""
+        with self._condition:
+            if self._in_flight < self._limit:
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """Block until a slot is free, then take it"""
+        with self._condition:
+            # Wake periodically as well: the limit can rise without a release
+            while self._in_flight >= self._limit:
+                self._condition.wait(timeout=0.05)
+            self._in_flight += 1
+
+    def release(self):
+        """Give back a slot taken by acquire() or try_acquire()"""
+        with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of a block (thread callers)"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, latency: float, status_code: int):
+        """
+        Report one terminology server request
+
+        Args:
+            latency: Seconds the request took
+            status_code: HTTP status, or 0 if the request never got a response
+        """
+        unhealthy = _is_unhealthy_status(status_code)
+        with self._condition:
+            self._samples.append((latency, unhealthy))
+            self.total_requests += 1
+            if unhealthy:
+                self.total_errors += 1
+            self._since_adjust += 1
+            if self._since_adjust >= max(self._limit, MIN_ROUND_SAMPLES):
+                self._adjust()
+
+    def _latency_ceiling(self) -> float:
+        if self.latency_target is not None:
+            return self.latency_target
+        if self._best_median is None:
+            return math.inf
+        return max(LATENCY_FLOOR, self._best_median * LATENCY_TOLERANCE)
+
+    def _adjust(self):
+        """End of a round: additive increase when healthy, multiplicative decrease otherwise (lock held)"""
+        latencies = sorted(latency for latency, _ in self._samples)
+        error_rate = sum(1 for _, unhealthy in self._samples if unhealthy) / len(self._samples)
+        p95 = _percentile(latencies, 0.95)
+        median = _percentile(latencies, 0.5)
+        if error_rate == 0 and (self._best_median is None or median < self._best_median):
+            self._best_median = median
+
+        if error_rate > MAX_ERROR_RATE or p95 > self._latency_ceiling():
+            new_limit = max(self.min_limit, self._limit // 2)
+            if new_limit < self._limit:
+                self.decreases += 1
+            # Judge the lower limit on fresh samples only
+            self._samples.clear()
+        elif self._in_flight >= self._limit:
+            # Only grow while the current limit is actually the bottleneck
+            new_limit = min(self.max_limit, self._limit + 1)
+            if new_limit > self._limit:
+                self.increases += 1
+        else:
+            new_limit = self._limit
+
+        self._limit = new_limit
+        self._since_adjust = 0
+        self.last_adjusted = time.time()
+        self._condition.notify_all()
+
+    def snapshot(self) -> Dict:
+        """Current limit and observed latencies for display"""
+        with self._condition:
+            latencies = sorted(latency for latency, _ in self._samples)
+            errors = sum(1 for _, unhealthy in self._samples if unhealthy)
+            return {
+                'limit': self._limit,
+                'in_flight': self._in_flight,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'p50_ms': _percentile(latencies, 0.5) * 1000 if latencies else None,
+                'p95_ms': _percentile(latencies, 0.95) * 1000 if latencies else None,
+                'error_rate': errors / len(latencies) if latencies else 0.0,
+                'total_requests': self.total_requests,
+                'total_errors': self.total_errors,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
+
+
+_controller: Optional[AdaptiveConcurrencyController] = None
+_controller_lock = threading.Lock()
+
+
+def get_concurrency_controller() -> AdaptiveConcurrencyController:
+    """Get or create the process-wide concurrency controller for the terminology server"""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdaptiveConcurrencyController()
+    return _controller
@@ -0,0 +1,146 @@
+"""
+Shared Connections for the NHS Terminology Server
+
+Every NHSTerminologyClient (including the short-lived ones built by expansion
+worker threads) shares one ConnectionPool per set of credentials:
+
+- a TokenCache holding the OAuth access token, refreshed single-flight so
+  concurrent workers trigger one token request between them
+- a keep-alive requests.Session whose connection pool is sized for the
+  expansion workers, so requests reuse TLS connections instead of opening
+  a new one per call
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Connections kept alive per host - enough for the largest expansion worker pool
+POOL_MAXSIZE = 32
+
+# Refresh tokens this long before the server says they expire
+TOKEN_EXPIRY_BUFFER = timedelta(minutes=5)
+
+
+def create_session(pool_maxsize: int = POOL_MAXSIZE) -> requests.Session:
+    """Keep-alive session with a connection pool large enough for concurrent workers"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class TokenCache:
+    """
+    Thread-safe OAuth client-credentials token with single-flight refresh.
+    
+    Readers get the cached token without locking. When it is missing, close to
+    expiry, or rejected by the server, one thread requests a new token while
+    the others wait for it and reuse the result.
+    """
+    
+    def __init__(self, session: requests.Session, auth_url: str, client_id: str, client_secret: str):
+        self._session = session
+        self._auth_url = auth_url
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._lock = threading.Lock()
+        self.access_token: Optional[str] = None
+        self.token_expires: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.refresh_count = 0
+    
+    def is_valid(self) -> bool:
+        """Check if the cached access token is still valid"""
+        if not self.access_token or not self.token_expires:
+            return False
+        return datetime.now() < (self.token_expires - TOKEN_EXPIRY_BUFFER)
+    
+    def get_token(self) -> Optional[str]:
+        """Cached token, refreshing it first if it is missing or about to expire"""
+        token = self.access_token
+        if token and self.is_valid():
+            return token
+        return self.refresh(stale_token=token)
+    
+    def refresh(self, stale_token: Optional[str] = None) -> Optional[str]:
+        """
+        Request a new token unless another thread already replaced stale_token.
+        
+        Args:
+            stale_token: The token the caller found missing, expired or rejected
+        
+        Returns:
+            The current access token, or None if authentication failed
+        """
+        with self._lock:
+            if self.access_token and self.access_token != stale_token and self.is_valid():
+                # Another thread refreshed while we waited for the lock
+                return self.access_token
+            
+            auth_data = {
+                'grant_type': 'client_credentials',
+                'client_id': self._client_id,
+                'client_secret': self._client_secret
+            }
+            
+            try:
+                response = self._session.post(
+                    self._auth_url,
+                    data=auth_data,
+                    headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                    timeout=30
+                )
+            except Exception as e:
+                self.last_error = f"Authentication error: {str(e)}"
+                return None
+            
+            if response.status_code != 200:
+                self.last_error = f"Authentication failed: {response.status_code} - {response.text}"
+                return None
+            
+            token_data = response.json()
+            expires_in = token_data.get('expires_in', 1800)  # Default 30 minutes
+            self.token_expires = datetime.now() + timedelta(seconds=expires_in)
+            self.access_token = token_data.get('access_token')
+            self.last_error = None
+            self.refresh_count += 1
+            return self.access_token
+
+
+class ConnectionPool:
+    """Shared session and token cache for one set of terminology server credentials"""
+    
+    def __init__(self, auth_url: str, client_id: str, client_secret: str, session: Optional[requests.Session] = None):
+        self.session = session if session is not None else create_session()
+        self.tokens = TokenCache(self.session, auth_url, client_id, client_secret)
+
+
+_pools: Dict[Tuple[str, str, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(auth_url: str, client_id: str, client_secret: str) -> ConnectionPool:
+    """Get or create the process-wide connection pool for these credentials"""
+    key = (auth_url, client_id, client_secret)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(auth_url, client_id, client_secret)
+                _pools[key] = pool
+    return pool
+
+
+def clear_connection_pools():
+    """Close and forget all shared sessions (e.g. after credentials change)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.session.close()
+        _pools.clear()
@@ -0,0 +1,302 @@
+"""
+Background SNOMED Expansion Jobs
+
+A Streamlit rerun (any widget interaction) stops the script where it is, so an
+expansion driven from the script restarts from scratch each time. Expansion
+jobs run outside the script instead:
+
+- Each job runs the planner and AsyncExpansionEngine on its own daemon thread
+  and event loop, and lives in a process-wide registry under a job id
+- Every finished code is checkpointed on the job (and saved to the shared
+  expansion store), so a rerun re-attaches by job id and replays the outcomes
+  it has not shown yet while the job carries on
+- Starting the same request again while it runs attaches to the running job,
+  so each expansion happens exactly once however the UI is used
+- Jobs are shared by every session that asked for the same request, so a
+  session cancelling only detaches itself; the job stops (between codes) once
+  no session is attached. Starting the same request afterwards resumes from
+  its checkpoint rather than starting over
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from .nhs_terminology_client import NHSTerminologyClient
+from .async_expansion import AsyncExpansionEngine, ExpansionOutcome
+from .concurrency_controller import AdaptiveConcurrencyController
+from .expansion_planner import plan_expansions, expand_with_plan
+from .expansion_store import get_expansion_store
+
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+# How often a running job checks for cancellation while waiting on the server
+CANCEL_POLL_INTERVAL = 0.1
+
+# Finished jobs are kept this long so a returning session can still collect them
+JOB_RETENTION_SECONDS = 3600
+MAX_RETAINED_JOBS = 20
+
+
+def _job_key(code_entries: List[Dict], include_inactive: bool) -> Tuple:
+    """Identity of an expansion request, independent of entry order"""
+    codes = sorted({entry.get('SNOMED Code', '').strip() for entry in code_entries} - {''})
+    return (include_inactive, tuple(codes))
+
+
+class ExpansionJob:
+    """
+    One expansion request running on a background thread.
+
+    Outcomes are checkpointed in completion order; readers poll progress() and
+    outcomes_since() from the Streamlit script, which never blocks on the job.
+    """
+
+    def __init__(self, code_entries: List[Dict], include_inactive: bool, client: NHSTerminologyClient,
+                 store_edition: Optional[str] = None, max_concurrency: Optional[int] = None,
+                 controller: Optional[AdaptiveConcurrencyController] = None,
+                 checkpoint: Optional[List[ExpansionOutcome]] = None):
+        """
+        Args:
+            code_entries: Clinical code dicts with a 'SNOMED Code' key
+            include_inactive: Whether to include inactive concepts
+            client: Terminology client built with explicit credentials
+            store_edition: Edition to save results under in the shared store (None = don't save)
+            max_concurrency: Cap on codes expanded at once by this job
+            controller: Adaptive limit to follow (default: the process-wide controller)
+            checkpoint: Successful outcomes from an earlier run of the same request
+        """
+        self.job_id = uuid.uuid4().hex[:12]
+        self.key = _job_key(code_entries, include_inactive)
+        self.code_entries = code_entries
+        self.include_inactive = include_inactive
+        self.client = client
+        self.store_edition = store_edition
+        self.max_concurrency = max_concurrency
+        self.controller = controller
+        self.state = JOB_PENDING
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.derived_count = 0
+        self.resumed_count = len(checkpoint or [])
+
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._sessions = set()
+        self._outcomes: List[ExpansionOutcome] = list(checkpoint or [])
+        self._completed_codes = {outcome.snomed_code for outcome in self._outcomes}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def total(self) -> int:
+        """Unique codes in the request"""
+        return len(self.key[1])
+
+    @property
+    def done(self) -> bool:
+        return self.state in (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+
+    @property
+    def completed_codes(self) -> set:
+        with self._lock:
+            return set(self._completed_codes)
+
+    def start(self) -> "ExpansionJob":
+        self.state = JOB_RUNNING
+        self._thread = threading.Thread(target=self._run, name=f"expansion-job-{self.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Ask the job to stop; codes already finished stay checkpointed"""
+        self._cancel_event.set()
+
+    def attach(self, session_id: str):
+        """Record a session following this job"""
+        with self._lock:
+            self._sessions.add(session_id)
+
+    def detach(self, session_id: Optional[str]) -> bool:
+        """
+        Stop following the job from one session, cancelling it once no session is left
+
+        Returns:
+            True if the job was cancelled, False if other sessions keep it running
+        """
+        with self._lock:
+            self._sessions.discard(session_id)
+            if self._sessions:
+                return False
+            self._cancel_event.set()
+            return True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job finishes (for tests and scripts); True if it did"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.done
+
+    def outcomes_since(self, index: int) -> List[ExpansionOutcome]:
+        """Outcomes checkpointed after the first index, in completion order"""
+        with self._lock:
+            return self._outcomes[index:]
+
+    def successful_outcomes(self) -> List[ExpansionOutcome]:
+        with self._lock:
+            return [outcome for outcome in self._outcomes if outcome.success]
+
+    def progress(self) -> Dict:
+        """Snapshot for progress display"""
+        with self._lock:
+            completed = len(self._outcomes)
+            succeeded = sum(1 for outcome in self._outcomes if outcome.success)
+        end = self.finished or time.time()
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'total': self.total,
+            'completed': completed,
+            'succeeded': succeeded,
+            'failed': completed - succeeded,
+            'derived': self.derived_count,
+            'resumed': self.resumed_count,
+            'elapsed': end - self.created,
+            'error': self.error,
+        }
+
+    def _record(self, outcome: ExpansionOutcome):
+        with self._lock:
+            if outcome.snomed_code in self._completed_codes:
+                return
+            self._outcomes.append(outcome)
+            self._completed_codes.add(outcome.snomed_code)
+            if outcome.derived_from:
+                self.derived_count += 1
+        if outcome.success and self.store_edition:
+            store = get_expansion_store()
+            if store is not None:
+                store.put(outcome.result, self.include_inactive, self.store_edition)
+
+    def _run(self):
+        """Thread body: plan, expand, and record the final state"""
+        state = JOB_FAILED
+        try:
+            completed = self.completed_codes
+            pending = [entry for entry in self.code_entries
+                       if entry.get('SNOMED Code', '').strip() not in completed]
+            if pending and not self._cancel_event.is_set():
+                plan = plan_expansions(
+                    self.client,
+                    [entry.get('SNOMED Code', '').strip() for entry in pending],
+                    self.include_inactive
+                )
+                asyncio.run(self._expand_until_cancelled(pending, plan))
+            state = JOB_CANCELLED if self._cancel_event.is_set() else JOB_COMPLETED
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # finished is set before state so a done job always has it
+            self.finished = time.time()
+            self.state = state
+
+    async def _expand_until_cancelled(self, pending: List[Dict], plan):
+        engine = AsyncExpansionEngine(
+            self.client.client_id, self.client.client_secret, self.include_inactive,
+            max_concurrency=self.max_concurrency, client=self.client, controller=self.controller
+        )
+
+        async def consume():
+            async for outcome in expand_with_plan(engine, pending, plan):
+                self._record(outcome)
+
+        consumer = asyncio.ensure_future(consume())
+        while not consumer.done():
+            if self._cancel_event.is_set():
+                consumer.cancel()
+                break
+            await asyncio.wait({consumer}, timeout=CANCEL_POLL_INTERVAL)
+        try:
+            await consumer
+        except asyncio.CancelledError:
+            pass
+
+
+_jobs: Dict[str, ExpansionJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _prune_jobs():
+    """Forget finished jobs past their retention (lock held)"""
+    now = time.time()
+    finished = sorted((job for job in _jobs.values() if job.done), key=lambda job: job.finished)
+    for job in finished:
+        if now - job.finished > JOB_RETENTION_SECONDS or len(_jobs) > MAX_RETAINED_JOBS:
+            del _jobs[job.job_id]
+
+
+def start_expansion_job(code_entries: List[Dict], include_inactive: bool = False,
+                        client_id: Optional[str] = None, client_secret: Optional[str] = None,
+                        store_edition: Optional[str] = None, max_concurrency: Optional[int] = None,
+                        client: Optional[NHSTerminologyClient] = None,
+                        controller: Optional[AdaptiveConcurrencyController] = None,
+                        session_id: Optional[str] = None) -> ExpansionJob:
+    """
+    Start an expansion job, or attach to the one already running this request
+
+    A cancelled or failed earlier job for the same request is resumed: its
+    successful outcomes seed the new job and only the remaining codes are expanded.
+
+    Args:
+        code_entries: Clinical code dicts with a 'SNOMED Code' key
+        include_inactive: Whether to include inactive concepts
+        client_id: Terminology server credentials (read from Streamlit secrets by the caller)
+        client_secret: Secret matching client_id
+        store_edition: Edition to save results under in the shared store (None = don't save)
+        max_concurrency: Cap on codes expanded at once by this job
+        client: Client to use instead of one built from the credentials (e.g. in tests)
+        controller: Adaptive limit to follow (default: the process-wide controller)
+        session_id: Session to attach to the job, so its cancel only detaches it
+
+    Returns:
+        The running ExpansionJob for this request
+    """
+    key = _job_key(code_entries, include_inactive)
+    with _jobs_lock:
+        _prune_jobs()
+        previous = [job for job in _jobs.values() if job.key == key]
+        running = next((job for job in previous if not job.done), None)
+        if running is not None:
+            if session_id is not None:
+                running.attach(session_id)
+            return running
+
+        resumable = max((job for job in previous if job.state in (JOB_CANCELLED, JOB_FAILED)),
+                        key=lambda job: job.created, default=None)
+        job = ExpansionJob(
+            code_entries, include_inactive,
+            client or NHSTerminologyClient(client_id, client_secret),
+            store_edition=store_edition,
+            max_concurrency=max_concurrency,
+            controller=controller,
+            checkpoint=resumable.successful_outcomes() if resumable else None
+        )
+        if session_id is not None:
+            job.attach(session_id)
+        _jobs[job.job_id] = job
+    return job.start()
+
+
+def get_expansion_job(job_id: Optional[str]) -> Optional[ExpansionJob]:
+    """Job by id, if it is still retained"""
+    if not job_id:
+        return None
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,166 @@
+"""
+Subsumption-Aware Expansion Planning
+
+When a search uses includeChildren on both a concept and one of its
+descendants, expanding each independently downloads the nested hierarchy
+twice. The planner avoids that:
+
+1. One cheap ECL check per chunk pair finds requested codes nested under other
+   requested codes, and a second finds which top-most codes contain them
+2. Only the top-most codes are expanded; those containing nested codes are
+   expanded with property=parent so each child carries its direct parents
+3. Each nested code's descendants are derived locally from its container's
+   parent/child data, as soon as that container's expansion arrives
+4. Nested codes that could not be derived (container failed, or the server
+   returned no parent data) are expanded normally afterwards
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from .nhs_terminology_client import NHSTerminologyClient, ExpansionResult, ExpandedConcept
+from .async_expansion import AsyncExpansionEngine, ExpansionOutcome
+
+
+@dataclass
+class ExpansionPlan:
+    """Which requested codes to expand and which to derive locally"""
+    top_codes: List[str]
+    nested_codes: Set[str] = field(default_factory=set)
+    container_codes: Set[str] = field(default_factory=set)  # Top codes with nested codes beneath them
+
+    @property
+    def saved_expansions(self) -> int:
+        return len(self.nested_codes)
+
+
+def plan_expansions(client: NHSTerminologyClient, snomed_codes: List[str], include_inactive: bool = False) -> ExpansionPlan:
+    """
+    Find containment among the requested codes
+
+    Falls back to expanding every code independently when the checks fail, and
+    when inactive concepts are included (they sit outside the active hierarchy,
+    so parent data can't account for them).
+
+    Args:
+        client: Terminology client for the subsumption checks
+        snomed_codes: Unique codes that need expanding
+        include_inactive: Whether expansions include inactive concepts
+
+    Returns:
+        ExpansionPlan covering every requested code
+    """
+    codes = list(dict.fromkeys(code for code in snomed_codes if code))
+    independent = ExpansionPlan(top_codes=codes)
+    if len(codes) < 2 or include_inactive:
+        return independent
+
+    nested = client.find_subsumed_codes(codes, codes)
+    if not nested:
+        return independent
+
+    top_codes = [code for code in codes if code not in nested]
+    containers = client.find_subsuming_codes(top_codes, sorted(nested))
+    if not containers:
+        return independent
+
+    return ExpansionPlan(top_codes=top_codes, nested_codes=set(nested), container_codes=set(containers))
+
+
+def derive_nested_results(container: ExpansionResult, nested_codes: Set[str]) -> Dict[str, ExpansionResult]:
+    """
+    Descendant sets of nested codes found in a container's expansion
+
+    Args:
+        container: Expansion fetched with include_hierarchy=True
+        nested_codes: Codes to derive if they appear beneath the container
+
+    Returns:
+        ExpansionResult per nested code found; empty if the expansion carries no parent data
+    """
+    present = {child.code: child for child in container.children if child.code in nested_codes}
+    if not present or all(child.parents is None for child in container.children):
+        return {}
+
+    # parent -> direct children, in the server's order
+    children_of: Dict[str, List[ExpandedConcept]] = {}
+    for child in container.children:
+        for parent in child.parents or ():
+            children_of.setdefault(parent, []).append(child)
+
+    results = {}
+    for code, concept in present.items():
+        # Walk down the hierarchy; concepts with several parents are reached once
+        seen = {code}
+        descendants = []
+        stack = [code]
+        while stack:
+            for child in children_of.get(stack.pop(), ()):
+                if child.code not in seen:
+                    seen.add(child.code)
+                    descendants.append(child)
+                    stack.append(child.code)
+
+        results[code] = ExpansionResult(
+            source_code=code,
+            source_display=concept.display or code,
+            children=[
+                ExpandedConcept(
+                    code=child.code,
+                    display=child.display,
+                    system=child.system,
+                    inactive=child.inactive,
+                    parent_code=code
+                )
+                for child in descendants
+            ],
+            total_count=len(descendants),
+            expansion_timestamp=datetime.now(),
+            edition=container.edition
+        )
+    return results
+
+
+async def expand_with_plan(engine: AsyncExpansionEngine, code_entries: List[Dict],
+                           plan: Optional[ExpansionPlan]) -> AsyncIterator[ExpansionOutcome]:
+    """
+    Expand code entries following a plan, yielding outcomes as they complete
+
+    Derived outcomes have attempts=0 and derived_from set to the container code.
+
+    Args:
+        engine: Engine that performs the server expansions
+        code_entries: Clinical code dicts with a 'SNOMED Code' key
+        plan: Result of plan_expansions, or None to expand every entry independently
+    """
+    if plan is None or not plan.nested_codes:
+        async for outcome in engine.expand(code_entries):
+            yield outcome
+        return
+
+    nested_entries = {}
+    top_entries = []
+    for entry in code_entries:
+        code = entry.get('SNOMED Code', '').strip()
+        if code in plan.nested_codes:
+            nested_entries.setdefault(code, []).append(entry)
+        else:
+            top_entries.append(entry)
+
+    async for outcome in engine.expand(top_entries, hierarchy_codes=plan.container_codes):
+        if outcome.success and outcome.snomed_code in plan.container_codes:
+            pending = {code for code in nested_entries}
+            for code, result in derive_nested_results(outcome.result, pending).items():
+                for entry in nested_entries.pop(code):
+                    yield ExpansionOutcome(code, entry, result, None, 0, derived_from=outcome.snomed_code)
+            # Parent data has served its purpose; don't keep it in session state
+            for child in outcome.result.children:
+                child.parents = None
+        yield outcome
+
+    # Anything not derived is expanded the ordinary way
+    leftovers = [entry for entries in nested_entries.values() for entry in entries]
+    if leftovers:
+        async for outcome in engine.expand(leftovers):
+            yield outcome
@@ -16,6 +16,7 @@ import json
 from dataclasses import asdict
 
 from .nhs_terminology_client import get_terminology_client, ExpansionResult, ExpandedConcept
+from .expansion_store import get_expansion_store
 from ..utils.caching.lookup_cache import get_cached_emis_lookup
 
 
@@ -70,11 +71,32 @@ class ExpansionService:
                     children=children,
                     total_count=result_dict['total_count'],
                     expansion_timestamp=expansion_timestamp,
-                    error=result_dict.get('error')
+                    error=result_dict.get('error'),
+                    edition=result_dict.get('edition')
                 )
         
         return None
     
+    def current_edition(self) -> Optional[str]:
+        """SNOMED edition the shared expansion store is keyed on (checked against the server periodically)"""
+        store = get_expansion_store()
+        if store is None:
+            return None
+        return store.current_edition(self.client.get_snomed_edition)
+    
+    def get_stored_expansion(self, snomed_code: str, include_inactive: bool = False, edition: Optional[str] = None) -> Optional[ExpansionResult]:
+        """Expansion from the host-wide store shared by all sessions, if present for this edition"""
+        store = get_expansion_store()
+        if store is None:
+            return None
+        return store.get(snomed_code, include_inactive, edition or self.current_edition())
+    
+    def store_expansion(self, result: ExpansionResult, include_inactive: bool = False, edition: Optional[str] = None):
+        """Save a successful expansion to the host-wide store"""
+        store = get_expansion_store()
+        if store is not None:
+            store.put(result, include_inactive, edition)
+    
     def expand_snomed_code(self, snomed_code: str, include_inactive: bool = False, use_cache: bool = True) -> ExpansionResult:
         """
         Expand a SNOMED code to get all child concepts
@@ -91,6 +113,13 @@ class ExpansionService:
             cached_result = self._get_cached_expansion(snomed_code, include_inactive)
             if cached_result:
                 return cached_result
+            
+            # Another session (or an earlier run) may already have expanded it
+            edition = self.current_edition()
+            stored_result = self.get_stored_expansion(snomed_code, include_inactive, edition)
+            if stored_result:
+                self._cache_expansion_result(stored_result, include_inactive)
+                return stored_result
         
         # Perform expansion
         result = self.client.expand_concept(snomed_code, include_inactive)
@@ -98,6 +127,7 @@ class ExpansionService:
         # Cache the result
         if use_cache:
             self._cache_expansion_result(result, include_inactive)
+            self.store_expansion(result, include_inactive, edition)
         
         return result
     
@@ -211,7 +241,7 @@ class ExpansionService:
         Create a summary DataFrame of expansion results
         
         Args:
-            expansions: Dictionary of code -> ExpansionResult
+            expansions: Dictionary of code -> ExpansionResult (children may be omitted; total_count is used)
             original_codes: Original clinical data to get descriptions from
             
         Returns:
@@ -254,7 +284,7 @@ class ExpansionService:
                     description = original_descriptions.get(code, result.source_display)
             else:
                 # No error - check if we got children
-                if len(result.children) > 0:
+                if result.total_count > 0:
                     status = 'Matched'
                     # Use the description from terminology server if we got children
                     description = result.source_display if result.source_display != code else original_descriptions.get(code, result.source_display)
@@ -277,14 +307,14 @@ class ExpansionService:
                     result_status = "Error - Failed to connect to terminology server"
                 else:
                     result_status = f"Error - {result.error}"
-            elif status == 'Matched' and len(result.children) > 0:
-                result_status = f"Matched - Found {len(result.children)} children"
-            elif status == 'Matched' and len(result.children) == 0:
+            elif status == 'Matched' and result.total_count > 0:
+                result_status = f"Matched - Found {result.total_count} children"
+            elif status == 'Matched' and result.total_count == 0:
                 result_status = "Matched - Valid concept but has no children"
             elif status == 'Unmatched':
                 result_status = "Unmatched - No concept found on terminology server for that ID"
             else:
-                result_status = f"Unknown - Please report this: children={len(result.children)}, error={result.error}"
+                result_status = f"Unknown - Please report this: children={result.total_count}, error={result.error}"
             
             # Get EMIS child count from lookup records
             emis_child_count = 'N/A'
@@ -299,7 +329,7 @@ class ExpansionService:
                 'SNOMED Code': code,
                 'Description': description,
                 'EMIS Child Count': emis_child_count,
-                'Term Server Child Count': len(result.children),
+                'Term Server Child Count': result.total_count,
                 'Result Status': result_status,
                 'Expanded At': result.expansion_timestamp.strftime('%Y-%m-%d %H:%M:%S')
             })
@@ -0,0 +1,307 @@
+"""
+Persistent SNOMED Expansion Store
+
+Expansion results shared by every session and app restart on the host, kept
+in a local SQLite file next to the lookup cache (.cache/snomed_expansions.sqlite).
+
+- Entries are keyed by SNOMED code, include_inactive and the SNOMED CT edition
+  the terminology server expanded against, so a new UK edition release never
+  serves stale hierarchies
+- Child lists are stored column-wise (codes, displays, inactive positions) and
+  zlib-compressed in a single blob per entry
+- The store is size-bounded: once the stored blobs exceed max_bytes the least
+  recently used entries are evicted
+- Any SQLite failure degrades to a cache miss; expansion never depends on it
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .nhs_terminology_client import ExpansionResult, ExpandedConcept
+
+
+SNOMED_SYSTEM = "http://snomed.info/sct"
+
+# Total size of stored child blobs before least recently used entries are evicted
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Evict down to this fraction of max_bytes so every put doesn't trigger eviction
+EVICT_TO_FRACTION = 0.9
+
+# How long the server's reported edition is trusted before asking again
+EDITION_CHECK_INTERVAL = 6 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS expansions (
+    code TEXT NOT NULL,
+    include_inactive INTEGER NOT NULL,
+    edition TEXT NOT NULL,
+    source_display TEXT NOT NULL,
+    child_count INTEGER NOT NULL,
+    children BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expanded_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (code, include_inactive, edition)
+);
+CREATE INDEX IF NOT EXISTS expansions_last_used ON expansions (last_used);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def encode_children(children: List[ExpandedConcept]) -> bytes:
+    """Pack child concepts into one compressed column-wise blob"""
+    columns = {
+        'code': [child.code for child in children],
+        'display': [child.display for child in children],
+        'inactive': [i for i, child in enumerate(children) if child.inactive],
+    }
+    # Children are almost always SNOMED; only record the exceptions
+    other_systems = {str(i): child.system for i, child in enumerate(children) if child.system != SNOMED_SYSTEM}
+    if other_systems:
+        columns['system'] = other_systems
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def decode_children(blob: bytes, parent_code: str) -> List[ExpandedConcept]:
+    """Rebuild child concepts from a blob written by encode_children"""
+    columns = json.loads(zlib.decompress(blob).decode('utf-8'))
+    inactive = set(columns.get('inactive', ()))
+    systems = columns.get('system', {})
+    return [
+        ExpandedConcept(
+            code=code,
+            display=display,
+            system=systems.get(str(i), SNOMED_SYSTEM),
+            inactive=i in inactive,
+            parent_code=parent_code
+        )
+        for i, (code, display) in enumerate(zip(columns['code'], columns['display']))
+    ]
+
+
+class ExpansionStore:
+    """
+    SQLite-backed expansion results shared across sessions and processes.
+
+    Each thread gets its own connection; SQLite's WAL mode lets several
+    Streamlit processes on the host read while one writes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._edition_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection to the store"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: str):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def current_edition(self, fetch_edition: Optional[Callable[[], Optional[str]]] = None) -> Optional[str]:
+        """
+        SNOMED edition that cached expansions must match
+
+        Args:
+            fetch_edition: Asks the terminology server for its current edition;
+                called at most once per EDITION_CHECK_INTERVAL per host
+
+        Returns:
+            The edition, or None if it has never been seen (every lookup misses)
+        """
+        try:
+            edition = self._get_meta('edition')
+            checked_at = float(self._get_meta('edition_checked_at') or 0)
+            if fetch_edition is None or time.time() - checked_at < EDITION_CHECK_INTERVAL:
+                return edition
+
+            with self._edition_lock:
+                # Another thread may have checked while we waited
+                if time.time() - float(self._get_meta('edition_checked_at') or 0) < EDITION_CHECK_INTERVAL:
+                    return self._get_meta('edition')
+                fetched = fetch_edition()
+                if fetched:
+                    self.note_edition(fetched)
+                    return fetched
+            # Server unreachable - keep serving the last known edition
+            return edition
+        except sqlite3.Error:
+            return None
+
+    def note_edition(self, edition: str):
+        """Record the edition the server is currently expanding against, dropping older editions"""
+        try:
+            conn = self._connect()
+            with conn:
+                if self._get_meta('edition') != edition:
+                    conn.execute("DELETE FROM expansions WHERE edition != ?", (edition,))
+                self._set_meta(conn, 'edition', edition)
+                self._set_meta(conn, 'edition_checked_at', str(time.time()))
+        except sqlite3.Error:
+            pass
+
+    def get(self, snomed_code: str, include_inactive: bool, edition: Optional[str]) -> Optional[ExpansionResult]:
+        """Stored expansion for this code and edition, or None"""
+        if not edition:
+            self.misses += 1
+            return None
+        key = (snomed_code, int(include_inactive), edition)
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT source_display, child_count, children, expanded_at FROM expansions "
+                "WHERE code = ? AND include_inactive = ? AND edition = ?",
+                key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute(
+                    "UPDATE expansions SET last_used = ? WHERE code = ? AND include_inactive = ? AND edition = ?",
+                    (time.time(),) + key
+                )
+            source_display, child_count, blob, expanded_at = row
+            children = decode_children(blob, snomed_code)
+        except (sqlite3.Error, zlib.error, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return ExpansionResult(
+            source_code=snomed_code,
+            source_display=source_display,
+            children=children,
+            total_count=child_count,
+            expansion_timestamp=datetime.fromtimestamp(expanded_at),
+            error=None,
+            edition=edition
+        )
+
+    def put(self, result: ExpansionResult, include_inactive: bool, edition: Optional[str] = None) -> bool:
+        """
+        Store a successful expansion
+
+        Args:
+            result: Expansion to store; results with errors are never stored
+            include_inactive: Whether the expansion included inactive concepts
+            edition: Fallback when the result doesn't say which edition it came from
+
+        Returns:
+            True if the result was stored
+        """
+        edition = result.edition or edition
+        if result.error or not edition:
+            return False
+
+        blob = encode_children(result.children)
+        now = time.time()
+        try:
+            conn = self._connect()
+            if result.edition and self._get_meta('edition') != result.edition:
+                # The server moved to a new edition; everything older is stale
+                self.note_edition(result.edition)
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO expansions "
+                    "(code, include_inactive, edition, source_display, child_count, children, size, expanded_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (result.source_code, int(include_inactive), edition, result.source_display,
+                     len(result.children), blob, len(blob), result.expansion_timestamp.timestamp(), now)
+                )
+            self._evict_if_needed(conn)
+        except sqlite3.Error:
+            return False
+        return True
+
+    def _evict_if_needed(self, conn: sqlite3.Connection):
+        """Drop least recently used entries once the store is over max_bytes"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM expansions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * EVICT_TO_FRACTION
+        doomed = []
+        for rowid, size in conn.execute("SELECT rowid, size FROM expansions ORDER BY last_used"):
+            if total <= target:
+                break
+            doomed.append((rowid,))
+            total -= size
+        with conn:
+            conn.executemany("DELETE FROM expansions WHERE rowid = ?", doomed)
+
+    def stats(self) -> Dict:
+        """Entry count and stored size, plus this process's hit/miss counts"""
+        try:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM expansions"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        return {
+            'entries': entries,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+            'edition': self.current_edition(),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        """Remove every stored expansion"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM expansions")
+        except sqlite3.Error:
+            pass
+
+
+_expansion_store = None
+_expansion_store_lock = threading.Lock()
+
+
+def _get_store_path() -> str:
+    """Store file in the shared .cache directory used by the lookup cache"""
+    cache_dir = os.path.join(os.path.dirname(__file__), "..", "..", ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, "snomed_expansions.sqlite")
+
+
+def get_expansion_store() -> Optional[ExpansionStore]:
+    """Get or create the host-wide expansion store (None if it can't be opened)"""
+    global _expansion_store
+    if _expansion_store is None:
+        with _expansion_store_lock:
+            if _expansion_store is None:
+                try:
+                    _expansion_store = ExpansionStore(_get_store_path())
+                except (sqlite3.Error, OSError):
+                    return None
+    return _expansion_store
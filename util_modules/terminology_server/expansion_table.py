@@ -0,0 +1,266 @@
+"""
+Columnar Storage for SNOMED Expansion Results
+
+Expansions used to be held as one ExpandedConcept per child plus a 9-key dict
+per child (repeating the parent display and source strings), both kept in
+session state. ExpansionTable holds them as three DataFrames instead:
+
+- parents: one row per expanded parent code (display, child count, timestamp, edition)
+- children: one row per parent/child pair, with the parent code as a categorical
+- sources: where each parent code was used in the XML, with categorical columns
+
+Parent and source details are joined on only when a view is rendered or
+exported, and EMIS GUIDs are attached with a single vectorized lookup.
+"""
+
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .nhs_terminology_client import ExpansionResult
+from ..utils.lookup_index import LookupIndex
+
+
+NOT_IN_EMIS_LOOKUP = 'Not in EMIS lookup table'
+
+PARENT_COLUMNS = ['Parent Code', 'Parent Display', 'Child Count', 'Expanded At', 'Edition']
+CHILD_COLUMNS = ['Parent Code', 'Child Code', 'Child Display', 'Inactive']
+SOURCE_COLUMNS = ['Source Type', 'Source Name', 'Source Container']
+
+# Column order of the rendered child code views (matches the old per-child dicts)
+VIEW_COLUMNS = ['Parent Code', 'Parent Display', 'Child Code', 'Child Display', 'EMIS GUID', 'Inactive'] + SOURCE_COLUMNS
+
+
+def _empty_parents() -> pd.DataFrame:
+    return pd.DataFrame({
+        'Parent Code': pd.Series(dtype=object),
+        'Parent Display': pd.Series(dtype=object),
+        'Child Count': pd.Series(dtype=np.int64),
+        'Expanded At': pd.Series(dtype='datetime64[ns]'),
+        'Edition': pd.Series(dtype=object),
+    })
+
+
+def _empty_children() -> pd.DataFrame:
+    return pd.DataFrame({
+        'Parent Code': pd.Categorical([]),
+        'Child Code': pd.Series(dtype=object),
+        'Child Display': pd.Series(dtype=object),
+        'Inactive': pd.Series(dtype=bool),
+    })
+
+
+def lookup_emis_guids(snomed_codes: pd.Series, emis_lookup: Optional[Mapping]) -> pd.Series:
+    """
+    EMIS GUID for each SNOMED code in one vectorized lookup
+
+    Args:
+        snomed_codes: Codes to map
+        emis_lookup: SNOMED -> EMIS GUID mapping (a LookupIndex view or a plain dict)
+
+    Returns:
+        Series aligned with snomed_codes, NOT_IN_EMIS_LOOKUP where there is no GUID
+    """
+    if not emis_lookup or snomed_codes.empty:
+        return pd.Series(NOT_IN_EMIS_LOOKUP, index=snomed_codes.index, dtype=object)
+    codes = snomed_codes.astype(str).str.strip()
+    if isinstance(emis_lookup, LookupIndex):
+        guids = pd.Series(emis_lookup.get_many(codes.tolist()), index=snomed_codes.index, dtype=object)
+    else:
+        guids = codes.map(emis_lookup)
+    # Empty GUIDs count as missing, as the old per-child lookup did
+    return guids.where(guids.notna() & (guids.astype(str) != ''), NOT_IN_EMIS_LOOKUP)
+
+
+def build_source_frame(code_sources: Optional[Dict[str, List[Dict]]] = None,
+                       code_entries: Optional[List[Dict]] = None) -> pd.DataFrame:
+    """
+    Where each parent code appears in the XML, one row per source
+
+    Args:
+        code_sources: SNOMED code -> source info dicts (from render_expansion_controls)
+        code_entries: Clinical code dicts, used for codes missing from code_sources
+
+    Returns:
+        DataFrame with 'Parent Code' and categorical source columns
+    """
+    rows = []
+    covered = set()
+    for snomed_code, sources in (code_sources or {}).items():
+        covered.add(snomed_code)
+        for source in sources:
+            rows.append([snomed_code] + [source.get(column, 'Unknown') for column in SOURCE_COLUMNS])
+    for entry in code_entries or []:
+        snomed_code = entry.get('SNOMED Code', '').strip()
+        if snomed_code and snomed_code not in covered:
+            covered.add(snomed_code)
+            rows.append([snomed_code] + [entry.get(column, 'Unknown') for column in SOURCE_COLUMNS])
+
+    sources = pd.DataFrame(rows, columns=['Parent Code'] + SOURCE_COLUMNS)
+    for column in SOURCE_COLUMNS:
+        sources[column] = sources[column].astype('category')
+    return sources.drop_duplicates(ignore_index=True)
+
+
+class ExpansionTable:
+    """
+    Expansion results for many parent codes, stored column-wise.
+
+    Tables are treated as immutable: extend(), subset() and with_*() return new
+    tables, so one held in session state is never changed underneath a render.
+    """
+
+    __slots__ = ('parents', 'children', 'sources')
+
+    def __init__(self, parents: Optional[pd.DataFrame] = None, children: Optional[pd.DataFrame] = None,
+                 sources: Optional[pd.DataFrame] = None):
+        self.parents = parents if parents is not None else _empty_parents()
+        self.children = children if children is not None else _empty_children()
+        self.sources = sources
+
+    @classmethod
+    def from_results(cls, results: Iterable[ExpansionResult]) -> 'ExpansionTable':
+        """Build a table from successful expansion results (errors are skipped)"""
+        parent_rows = []
+        counts = []
+        child_codes = []
+        child_displays = []
+        inactive = []
+        for result in results:
+            if result is None or result.error:
+                continue
+            children = result.children
+            parent_rows.append((result.source_code, result.source_display, len(children),
+                                result.expansion_timestamp, result.edition))
+            counts.append(len(children))
+            child_codes.extend(child.code for child in children)
+            child_displays.extend(child.display for child in children)
+            inactive.extend(child.inactive for child in children)
+
+        if not parent_rows:
+            return cls()
+
+        parents = pd.DataFrame(parent_rows, columns=PARENT_COLUMNS)
+        # A code expanded twice keeps its latest result
+        keep = ~parents['Parent Code'].duplicated(keep='last').to_numpy()
+        row_of_child = np.repeat(np.arange(len(parent_rows)), counts)
+        child_keep = keep[row_of_child]
+        parents = parents[keep].reset_index(drop=True)
+
+        # Category code of each child is its parent's row in the deduplicated parents
+        kept_position = np.cumsum(keep) - 1
+        parent_codes = pd.Categorical.from_codes(kept_position[row_of_child[child_keep]], categories=parents['Parent Code'])
+        children = pd.DataFrame({
+            'Parent Code': parent_codes,
+            'Child Code': pd.Series(child_codes, dtype=object)[child_keep].to_numpy(),
+            'Child Display': pd.Series(child_displays, dtype=object)[child_keep].to_numpy(),
+            'Inactive': np.asarray(inactive, dtype=bool)[child_keep],
+        })
+        return cls(parents, children)
+
+    def __contains__(self, snomed_code: str) -> bool:
+        return snomed_code in self.codes
+
+    def __len__(self) -> int:
+        """Number of parent/child rows"""
+        return len(self.children)
+
+    @property
+    def codes(self) -> set:
+        """Parent codes in the table"""
+        return set(self.parents['Parent Code'])
+
+    def extend(self, results: Iterable[ExpansionResult]) -> 'ExpansionTable':
+        """New table with these results added; a parent already present is replaced"""
+        added = ExpansionTable.from_results(results)
+        if not len(added.parents):
+            return self
+        if not len(self.parents):
+            return ExpansionTable(added.parents, added.children, self.sources)
+
+        replaced = set(added.parents['Parent Code'])
+        kept = self.subset(self.codes - replaced)
+        parents = pd.concat([kept.parents, added.parents], ignore_index=True)
+        parent_codes = union_categoricals([kept.children['Parent Code'], added.children['Parent Code']])
+        children = pd.concat([
+            kept.children.drop(columns=['Parent Code']),
+            added.children.drop(columns=['Parent Code'])
+        ], ignore_index=True)
+        children.insert(0, 'Parent Code', parent_codes)
+        return ExpansionTable(parents, children, self.sources)
+
+    def subset(self, snomed_codes: Iterable[str]) -> 'ExpansionTable':
+        """New table with only these parent codes"""
+        wanted = set(snomed_codes)
+        parents = self.parents[self.parents['Parent Code'].isin(wanted)].reset_index(drop=True)
+        children = self.children[self.children['Parent Code'].isin(wanted)].reset_index(drop=True)
+        children['Parent Code'] = children['Parent Code'].cat.remove_unused_categories()
+        return ExpansionTable(parents, children, self.sources)
+
+    def with_emis_guids(self, emis_lookup: Optional[Mapping]) -> 'ExpansionTable':
+        """New table with an 'EMIS GUID' column mapped from the child codes"""
+        children = self.children.copy()
+        children['EMIS GUID'] = lookup_emis_guids(children['Child Code'], emis_lookup)
+        return ExpansionTable(self.parents, children, self.sources)
+
+    def with_sources(self, sources: pd.DataFrame) -> 'ExpansionTable':
+        """New table carrying where each parent code was used (see build_source_frame)"""
+        return ExpansionTable(self.parents, self.children, sources)
+
+    def header_results(self) -> Dict[str, ExpansionResult]:
+        """Children-free ExpansionResult per parent, for the summary table"""
+        headers = {}
+        for code, display, count, expanded_at, edition in self.parents[PARENT_COLUMNS].itertuples(index=False):
+            headers[code] = ExpansionResult(
+                source_code=code,
+                source_display=display,
+                children=[],
+                total_count=int(count),
+                expansion_timestamp=pd.Timestamp(expanded_at).to_pydatetime() if pd.notna(expanded_at) else datetime.now(),
+                edition=edition
+            )
+        return headers
+
+    def child_view(self, per_source: bool = False) -> pd.DataFrame:
+        """
+        Child code rows for display and export
+
+        Args:
+            per_source: One row per source the parent was used in (otherwise one
+                row per parent/child pair, without source columns)
+
+        Returns:
+            DataFrame with VIEW_COLUMNS (source columns only when per_source)
+        """
+        view = self.children.merge(
+            self.parents[['Parent Code', 'Parent Display']].astype({'Parent Code': self.children['Parent Code'].dtype}),
+            on='Parent Code', how='left'
+        )
+        if 'EMIS GUID' not in view.columns:
+            view['EMIS GUID'] = NOT_IN_EMIS_LOOKUP
+
+        if per_source:
+            sources = self.sources if self.sources is not None else build_source_frame()
+            sources = sources[sources['Parent Code'].isin(self.codes)]
+            view['Parent Code'] = view['Parent Code'].astype(object)
+            view = view.merge(sources, on='Parent Code', how='left')
+            for column in SOURCE_COLUMNS:
+                view[column] = view[column].astype(object).fillna('Unknown')
+            columns = VIEW_COLUMNS
+        else:
+            columns = VIEW_COLUMNS[:-len(SOURCE_COLUMNS)]
+        view['Parent Code'] = view['Parent Code'].astype(object)
+        # Text flags, as in the exported CSVs
+        view['Inactive'] = np.where(view['Inactive'].astype(bool), 'True', 'False')
+        return view[columns]
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the table"""
+        total = int(self.parents.memory_usage(deep=True).sum() + self.children.memory_usage(deep=True).sum())
+        if self.sources is not None:
+            total += int(self.sources.memory_usage(deep=True).sum())
+        return total
@@ -7,79 +7,33 @@ the NHS Terminology Server expansion functionality.
 
 import streamlit as st
 import pandas as pd
-from typing import List, Dict, Optional, Tuple
+import numpy as np
+from typing import List, Dict, Optional
 from datetime import datetime
 import io
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
-import queue
-import time
 import gc
+import time
+import uuid
 
 from .expansion_service import get_expansion_service
+from .expansion_jobs import start_expansion_job, get_expansion_job, JOB_CANCELLED, JOB_FAILED
+from .concurrency_controller import get_concurrency_controller
+from .expansion_table import ExpansionTable, build_source_frame, NOT_IN_EMIS_LOOKUP, SOURCE_COLUMNS
 from .nhs_terminology_client import get_terminology_client
 from ..utils.caching.lookup_cache import get_cached_emis_lookup
 
 
-def _pure_worker_expand_code(code_entry, include_inactive, result_queue, worker_id, client_id, client_secret):
-    """Pure worker function - API calls only, no EMIS processing or caching"""
-    try:
-        snomed_code = code_entry.get('SNOMED Code', '').strip()
-        print(f"DEBUG Worker {worker_id}: Starting with code {snomed_code}")
-        
-        if not snomed_code:
-            print(f"DEBUG Worker {worker_id}: No SNOMED code")
-            result_queue.put({
-                'worker_id': worker_id,
-                'snomed_code': snomed_code,
-                'code_entry': code_entry,
-                'success': False,
-                'error': 'No SNOMED code provided',
-                'raw_result': None
-            })
-            return
-        
-        # Create terminology client with explicit credentials (no Streamlit dependencies)
-        from .nhs_terminology_client import NHSTerminologyClient
-        client = NHSTerminologyClient()
-        # Override credentials directly
-        client.client_id = client_id
-        client.client_secret = client_secret
-        
-        # Perform expansion (pure API call) - no caching, no processing
-        print(f"DEBUG Worker {worker_id}: Calling API...")
-        expansion_result = client._expand_concept_uncached(snomed_code, include_inactive)
-        print(f"DEBUG Worker {worker_id}: API call done, result: {expansion_result is not None}")
-        
-        # Determine success status
-        success = expansion_result is not None and not expansion_result.error
-        error_msg = expansion_result.error if expansion_result else 'No expansion result returned'
-        print(f"DEBUG Worker {worker_id}: Success: {success}, Error: {error_msg[:50] if error_msg else 'None'}")
-        
-        # Put raw result in queue for main thread processing
-        result_queue.put({
-            'worker_id': worker_id,
-            'snomed_code': snomed_code,
-            'code_entry': code_entry,
-            'success': success,
-            'error': error_msg,
-            'raw_result': expansion_result
-        })
-        print(f"DEBUG Worker {worker_id}: Result queued")
-        
-    except Exception as e:
-        print(f"DEBUG Worker {worker_id}: Exception: {str(e)}")
-        # Put error in queue
-        result_queue.put({
-            'worker_id': worker_id,
-            'snomed_code': code_entry.get('SNOMED Code', 'unknown'),
-            'code_entry': code_entry,
-            'success': False,
-            'error': str(e),
-            'raw_result': None
-        })
+# Seconds between progress refreshes while following a background expansion job
+JOB_POLL_INTERVAL = 0.25
+
+
+def _expansion_session_id() -> str:
+    """Identifies this browser session to the expansion jobs it follows"""
+    if 'expansion_session_id' not in st.session_state:
+        st.session_state.expansion_session_id = uuid.uuid4().hex[:12]
+    return st.session_state.expansion_session_id
 
 
 def _clean_dataframe_for_export(df: pd.DataFrame) -> pd.DataFrame:
@@ -130,55 +84,65 @@ def _create_xml_output(emis_guid: str, description: str) -> str:
     return xml_output
 
 
-def _create_hierarchical_json(all_child_codes: List[Dict], view_mode: str) -> Dict:
+def _apply_view_mode(child_df: pd.DataFrame, view_mode: str, sort: bool = True) -> pd.DataFrame:
+    """
+    Shape per-source child code rows for the selected view mode
+    
+    Args:
+        child_df: Rows from ExpansionTable.child_view(per_source=True)
+        view_mode: "🔀 Unique Codes" collapses to one row per parent-child pair
+            without source columns (they are misleading when deduplicating)
+        sort: Sort rows for display
+    
+    Returns:
+        DataFrame for display or export
+    """
+    if view_mode == "🔀 Unique Codes":
+        # Deduplicate by parent-child combination, keeping first occurrence
+        child_df = child_df.drop_duplicates(['Parent Code', 'Child Code']).drop(columns=SOURCE_COLUMNS)
+        sort_columns = ['Parent Code', 'Child Code']
+    else:
+        # Sort by Source Type, Source Name, Parent Code, then Child Code for intuitive source grouping
+        sort_columns = ['Source Type', 'Source Name', 'Parent Code', 'Child Code']
+    if sort:
+        child_df = child_df.sort_values(sort_columns, kind='stable')
+    return child_df
+
+
+def _session_emis_lookup():
+    """SNOMED -> EMIS GUID mapping for the lookup table loaded in this session ({} if unavailable)"""
+    lookup_df = getattr(st.session_state, 'lookup_df', None)
+    snomed_code_col = getattr(st.session_state, 'snomed_code_col', 'SNOMED Code')
+    emis_guid_col = getattr(st.session_state, 'emis_guid_col', 'EMIS GUID')
+    version_info = getattr(st.session_state, 'lookup_version_info', None)
+    cached_data = get_cached_emis_lookup(lookup_df, snomed_code_col, emis_guid_col, version_info)
+    return cached_data['lookup_mapping'] if cached_data is not None else {}
+
+
+def _create_hierarchical_json(child_df: pd.DataFrame, view_mode: str) -> Dict:
     """
     Create hierarchical JSON structure showing parent-child relationships.
     Ignores filters and shows unique parents only with their child codes.
     
     Args:
-        all_child_codes: List of all child code dictionaries
+        child_df: All child code rows (ExpansionTable.child_view(per_source=True))
         view_mode: Current view mode (affects structure organization)
     
     Returns:
         Dict: Hierarchical JSON structure with parent-child relationships
     """
-    # Group children by parent
-    parent_children_map = {}
-    
-    for child in all_child_codes:
-        # Get clean codes (remove emojis)
-        parent_code = str(child.get('Parent Code', '')).replace('🩺 ', '').strip()
-        parent_display = str(child.get('Parent Display', '')).strip()
-        child_code = str(child.get('Child Code', '')).replace('🩺 ', '').strip()
-        child_display = str(child.get('Child Display', '')).strip()
-        
-        # Skip if we don't have essential data
-        if not parent_code or not child_code:
-            continue
-        
-        # Initialize parent entry if not exists
-        if parent_code not in parent_children_map:
-            parent_children_map[parent_code] = {
-                'parent_code': parent_code,
-                'parent_display': parent_display,
-                'children': []
-            }
-        
-        # Add child (avoid duplicates in unique mode)
-        child_entry = {
-            'code': child_code,
-            'display': child_display
-        }
-        
-        # In unique mode, avoid duplicate children
-        if view_mode == "🔀 Unique Codes":
-            # Check if this child already exists for this parent
-            existing_codes = [c['code'] for c in parent_children_map[parent_code]['children']]
-            if child_code not in existing_codes:
-                parent_children_map[parent_code]['children'].append(child_entry)
-        else:
-            # In per-source mode, include all instances
-            parent_children_map[parent_code]['children'].append(child_entry)
+    columns = child_df[['Parent Code', 'Parent Display', 'Child Code', 'Child Display']].astype(str)
+    columns = columns.apply(lambda column: column.str.strip())
+    
+    # Skip if we don't have essential data
+    columns = columns[(columns['Parent Code'] != '') & (columns['Child Code'] != '')]
+    
+    # In unique mode, avoid duplicate children; per-source mode includes all instances
+    if view_mode == "🔀 Unique Codes":
+        columns = columns.drop_duplicates(['Parent Code', 'Child Code'])
+    
+    # Sort parents and children by code for consistent output
+    columns = columns.sort_values(['Parent Code', 'Child Code'], kind='stable')
     
     # Get source XML filename from session state
     source_xml_filename = st.session_state.get('xml_filename', 'Unknown XML file')
@@ -190,34 +154,40 @@ def _create_hierarchical_json(all_child_codes: List[Dict], view_mode: str) -> Di
             'export_timestamp': datetime.now().isoformat(),
             'source_xml_file': source_xml_filename,
             'view_mode': view_mode.replace('🔀 ', '').replace('📄 ', '').lower().replace(' ', '_'),
-            'total_unique_parents': len(parent_children_map),
-            'total_child_relationships': sum(len(p['children']) for p in parent_children_map.values()),
+            'total_unique_parents': int(columns['Parent Code'].nunique()),
+            'total_child_relationships': len(columns),
             'description': 'Parent-child SNOMED code relationships from NHS Terminology Server expansion'
         },
         'parent_child_hierarchy': []
     }
     
-    # Sort parents by code for consistent output
-    sorted_parents = sorted(parent_children_map.items(), key=lambda x: x[0])
-    
-    for parent_code, parent_data in sorted_parents:
-        # Sort children by code for consistent output
-        sorted_children = sorted(parent_data['children'], key=lambda x: x['code'])
-        
-        parent_entry = {
+    for parent_code, group in columns.groupby('Parent Code', sort=True):
+        children = [
+            {'code': code, 'display': display}
+            for code, display in zip(group['Child Code'], group['Child Display'])
+        ]
+        hierarchy['parent_child_hierarchy'].append({
             'parent': {
-                'code': parent_data['parent_code'],
-                'display': parent_data['parent_display']
+                'code': parent_code,
+                'display': group['Parent Display'].iloc[0]
             },
-            'children': sorted_children,
-            'child_count': len(sorted_children)
-        }
-        
-        hierarchy['parent_child_hierarchy'].append(parent_entry)
+            'children': children,
+            'child_count': len(children)
+        })
     
     return hierarchy
 
 
+def _format_concurrency_status(snapshot: Dict) -> str:
+    """One-line summary of the adaptive concurrency controller for progress text"""
+    status = f"{snapshot['in_flight']}/{snapshot['limit']} concurrent"
+    if snapshot['p95_ms'] is not None:
+        status += f", p95 {snapshot['p95_ms']:.0f} ms"
+    if snapshot['error_rate']:
+        status += f", {snapshot['error_rate']:.0%} errors"
+    return status
+
+
 # Also suppress Streamlit logging warnings about ScriptRunContext
 streamlit_logger = logging.getLogger('streamlit.runtime.scriptrunner.script_runner')
 streamlit_logger.setLevel(logging.ERROR)
@@ -265,6 +235,16 @@ def render_terminology_server_status():
                     st.success("🔑 Authenticated")
                 else:
                     st.warning("🔑 Not authenticated")
+            
+            # Adaptive concurrency: current limit and recently observed server latency
+            snapshot = get_concurrency_controller().snapshot()
+            if snapshot['total_requests']:
+                st.caption(
+                    f"⚡ Concurrency limit {snapshot['limit']} "
+                    f"(range {snapshot['min_limit']}-{snapshot['max_limit']}) · "
+                    f"p50 {snapshot['p50_ms'] or 0:.0f} ms · p95 {snapshot['p95_ms'] or 0:.0f} ms · "
+                    f"{snapshot['error_rate']:.0%} errors"
+                )
 
 
 def render_expansion_controls(clinical_data: List[Dict]) -> Optional[Dict]:
@@ -273,7 +253,7 @@ def render_expansion_controls(clinical_data: List[Dict]) -> Optional[Dict]:
     
     Args:
         clinical_data: List of clinical code dictionaries
-        
+    
     Returns:
         Dictionary with expansion results or None
     """
@@ -302,7 +282,7 @@ def render_expansion_controls(clinical_data: List[Dict]) -> Optional[Dict]:
         use_cache = st.checkbox(
             "Use cached results",
             value=True,
-            help="Use previously cached expansion results (24h expiry)"
+            help="Use expansion results already fetched by any session for the current SNOMED CT edition"
         )
     
     with col3:
@@ -365,95 +345,36 @@ def render_expansion_controls(clinical_data: List[Dict]) -> Optional[Dict]:
             st.info(f"Found {unique_count} codes that can be expanded to include child concepts")
         expandable_codes = list(unique_codes.values())
     
-    # Expansion button with protection against double-clicks
-    if 'expansion_in_progress' not in st.session_state:
-        st.session_state.expansion_in_progress = False
-    
-    if st.button("🌳 Expand Child Codes", type="primary", disabled=st.session_state.expansion_in_progress):
-        if not st.session_state.expansion_in_progress:
-            st.session_state.expansion_in_progress = True
-            try:
-                result = perform_expansion(expandable_codes, include_inactive, use_cache, code_sources)
-                return result
-            finally:
-                st.session_state.expansion_in_progress = False
-    
-    return None
+    # An expansion job started by an earlier run keeps going through reruns - re-attach to it
+    job_request = st.session_state.get('expansion_job_request')
+    if job_request and get_expansion_job(st.session_state.get('expansion_job_id')) is not None:
+        st.button("🌳 Expand Child Codes", type="primary", disabled=True)
+        return perform_expansion(**job_request)
 
+    if st.button("🌳 Expand Child Codes", type="primary"):
+        st.session_state.expansion_job_request = {
+            'expandable_codes': expandable_codes,
+            'include_inactive': include_inactive,
+            'use_cache': use_cache,
+            'code_sources': code_sources
+        }
+        return perform_expansion(**st.session_state.expansion_job_request)
 
-def _expand_single_code_with_emis_lookup(code_entry: Dict, include_inactive: bool, use_cache: bool, service, emis_lookup: Dict, code_sources: Dict = None) -> Tuple[str, any, List[Dict]]:
-    """
-    Expand a single SNOMED code and immediately process EMIS GUIDs for children
-    
-    Args:
-        code_entry: Dictionary containing the code information
-        include_inactive: Whether to include inactive concepts
-        use_cache: Whether to use cached results
-        service: The expansion service instance
-        emis_lookup: Dictionary for SNOMED -> EMIS GUID mapping
-        
-    Returns:
-        Tuple of (snomed_code, expansion_result, processed_child_codes)
-    """
-    snomed_code = code_entry.get('SNOMED Code', '').strip()
-    if not snomed_code:
-        return snomed_code, None, []
-    
-    # Get expansion result from terminology server
-    result = service.expand_snomed_code(snomed_code, include_inactive, use_cache)
-    
-    # Immediately process child codes with EMIS GUID lookup and source tracking
-    processed_children = []
-    if not result.error and result.children:
-        # Get source information for this parent code
-        parent_sources = code_sources.get(snomed_code, []) if code_sources else []
-        
-        for child in result.children:
-            # Simple direct lookup - no normalization
-            child_code = str(child.code).strip()
-            emis_guid = emis_lookup.get(child_code)
-            emis_status = emis_guid if emis_guid else 'Not in EMIS lookup table'
-            
-            # Create child entries for each source this parent appears in
-            if parent_sources:
-                for source in parent_sources:
-                    processed_children.append({
-                        'Parent Code': snomed_code,
-                        'Parent Display': result.source_display,
-                        'Child Code': child.code,
-                        'Child Display': child.display,
-                        'EMIS GUID': emis_status,
-                        'Inactive': 'True' if child.inactive else 'False',
-                        'Source Type': source.get('Source Type', 'Unknown'),
-                        'Source Name': source.get('Source Name', 'Unknown'),
-                        'Source Container': source.get('Source Container', 'Unknown')
-                    })
-            else:
-                # Fallback if no source information
-                processed_children.append({
-                    'Parent Code': snomed_code,
-                    'Parent Display': result.source_display,
-                    'Child Code': child.code,
-                    'Child Display': child.display,
-                    'EMIS GUID': emis_status,
-                    'Inactive': 'True' if child.inactive else 'False',
-                    'Source Type': 'Unknown',
-                    'Source Name': 'Unknown',
-                    'Source Container': 'Unknown'
-                })
-    
-    return snomed_code, result, processed_children
+    return None
 
 
 def perform_expansion(expandable_codes: List[Dict], include_inactive: bool = False, use_cache: bool = True, code_sources: Dict = None) -> Dict:
     """
     Perform the actual expansion operation with concurrent processing and progress tracking
     
+    Codes not already cached are expanded by a background job (see expansion_jobs.py)
+    that outlives this script run; a rerun calls this again and re-attaches to it.
+    
     Args:
         expandable_codes: List of codes to expand
         include_inactive: Whether to include inactive concepts
         use_cache: Whether to use cached results
-        
+    
     Returns:
         Dictionary with expansion results
     """
@@ -499,62 +420,57 @@ def perform_expansion(expandable_codes: List[Dict], include_inactive: bool = Fal
     valid_codes = [code for code in expandable_codes if code.get('SNOMED Code', '').strip()]
     total_codes = len(valid_codes)
     
-    # Check session state for cached expansion results
-    session_cache_key = f"expansion_cache_{include_inactive}"
-    if session_cache_key not in st.session_state:
-        st.session_state[session_cache_key] = {}
-    
-    cached_results = {}
+    # Expansions already fetched by this session, held column-wise (see expansion_table.py)
+    session_table_key = f"expansion_table_{include_inactive}"
+    session_table = st.session_state.get(session_table_key)
+    if session_table is None:
+        # Not `or`: a table of leaf concepts has no child rows, so len() is 0 but its codes are cached
+        session_table = ExpansionTable()
+    session_codes = session_table.codes
+    
+    # A job started by an earlier run of the script reports its own codes, including finished ones
+    job = get_expansion_job(st.session_state.get('expansion_job_id'))
+    if job is not None and job.include_inactive != include_inactive:
+        job = None
+    job_codes = set(job.key[1]) if job is not None else set()
+    
+    cache_hits = 0
     uncached_codes = []
+    fetched_results = []  # Results not yet in the session table
     
     # Check which codes are already cached in session state
     for code_entry in valid_codes:
         snomed_code = code_entry.get('SNOMED Code', '').strip()
-        if snomed_code in st.session_state[session_cache_key]:
-            cached_results[snomed_code] = st.session_state[session_cache_key][snomed_code]
+        if snomed_code in job_codes:
+            continue
+        if snomed_code in session_codes:
+            cache_hits += 1
         else:
             uncached_codes.append(code_entry)
     
-    cache_hits = len(cached_results)
-    cache_misses = len(uncached_codes)
-    
-    status_text.text("Processing cached results...")
+    # Then the host-wide store shared by every session, for the server's current edition
+    edition = None
+    if use_cache and uncached_codes:
+        status_text.text("Checking shared expansion cache...")
+        edition = service.current_edition()
+        still_uncached = []
+        for code_entry in uncached_codes:
+            snomed_code = code_entry.get('SNOMED Code', '').strip()
+            stored_result = service.get_stored_expansion(snomed_code, include_inactive, edition) if edition else None
+            if stored_result:
+                fetched_results.append(stored_result)
+                cache_hits += 1
+            else:
+                still_uncached.append(code_entry)
+        uncached_codes = still_uncached
     
-    expansion_results = cached_results.copy()  # Start with cached results
-    all_processed_children = []
-    total_child_codes = 0
-    successful_expansions = cache_hits  # Count cached results as successful
-    completed_count = 0
+    cache_misses = len(uncached_codes)
     first_success_toast_shown = False
     
-    # Process cached results to generate processed children
-    if cached_results:
-        for snomed_code, cached_result in cached_results.items():
-            if cached_result and not cached_result.error:
-                # Find the original code entry for source information
-                code_entry = next((code for code in valid_codes if code.get('SNOMED Code', '').strip() == snomed_code), None)
-                
-                if code_entry and cached_result.children:
-                    for child in cached_result.children:
-                        child_code = str(child.code).strip()
-                        emis_guid = emis_lookup.get(child_code, 'Not in EMIS lookup table')
-                        
-                        child_data = {
-                            'Parent Code': snomed_code,
-                            'Parent Display': cached_result.source_display,
-                            'Child Code': child.code,
-                            'Child Display': child.display,
-                            'EMIS GUID': emis_guid,
-                            'Inactive': 'True' if child.inactive else 'False',
-                            'Source Type': code_entry.get('Source Type', 'Unknown'),
-                            'Source Name': code_entry.get('Source Name', 'Unknown'),
-                            'Source Container': code_entry.get('Source Container', 'Unknown')
-                        }
-                        all_processed_children.append(child_data)
-                        total_child_codes += 1
-    
     # Show cache statistics if any cache hits
-    if cache_hits > 0:
+    if job is not None:
+        status_text.text("Re-attaching to the running expansion...")
+    elif cache_hits > 0:
         status_text.text(f"✅ Using {cache_hits} cached results, fetching {cache_misses} new codes...")
     else:
         status_text.text("Starting terminology server connections...")
@@ -575,139 +491,88 @@ def perform_expansion(expandable_codes: List[Dict], include_inactive: bool = Fal
                 'results': {}
             }
         
-        # If no codes need fetching, skip worker setup
-        if not uncached_codes:
-            # All results were cached!
-            threads = []
-            max_workers = 0
-        else:
-            # Adaptive worker scaling based on uncached workload size
-            uncached_count = len(uncached_codes)
-            if uncached_count <= 100:
-                max_workers = 8   # Small workloads: conservative threading
-            elif uncached_count <= 300:
-                max_workers = 12  # Medium workloads: moderate threading  
-            elif uncached_count <= 500:
-                max_workers = 16  # Large workloads: high threading
-            else:
-                max_workers = 20  # Very large workloads: maximum threading
-            
-            max_workers = min(max_workers, uncached_count)  # Don't exceed available codes
-            result_queue = queue.Queue()
+        # The adaptive controller sets the live limit; never run more workers than codes
+        controller = get_concurrency_controller()
+        max_workers = min(controller.max_limit, max(1, len(uncached_codes)))
         
-            # Simple threading approach that works within memory limits
-            threads = []
-            for i, code_entry in enumerate(uncached_codes[:max_workers]):  # Start first batch
-                thread = threading.Thread(
-                    target=_pure_worker_expand_code,
-                    args=(code_entry, include_inactive, result_queue, i, client_id, client_secret),
-                    daemon=True
-                )
-                thread.start()
-                threads.append(thread)
+        def handle_outcome(outcome):
+            """Collect one finished expansion in the main thread (Streamlit calls are safe here)"""
+            nonlocal first_success_toast_shown
+            if not outcome.success:
+                return
+            
+            # Children stay on the result until it joins the session table
+            fetched_results.append(outcome.result)
             
-            # Keep track of remaining codes to process
-            remaining_codes = uncached_codes[max_workers:]
-            next_thread_id = max_workers
+            # Show toast for first successful connection during expansion
+            if not first_success_toast_shown:
+                st.toast("🔗 Connected to NHS Terminology Server for expansion!", icon="✅")
+                first_success_toast_shown = True
+                
+                # Update connection status in session state
+                st.session_state.nhs_connection_status = {
+                    'tested': True,
+                    'success': True,
+                    'message': 'Connected to NHS England Terminology Server',
+                    'timestamp': datetime.now().isoformat()
+                }
         
-        # Orchestrator loop: collect results and update UI in main thread
-        timeout_counter = 0
-        max_timeouts = 100  # Allow 10 seconds of timeouts before giving up
-        uncached_target = len(uncached_codes)  # Only need to wait for uncached results
+        session_id = _expansion_session_id()
+        if job is None and uncached_codes:
+            job = start_expansion_job(
+                uncached_codes, include_inactive, client_id, client_secret,
+                store_edition=edition if use_cache else None,
+                max_concurrency=max_workers,
+                session_id=session_id
+            )
         
-        while completed_count < uncached_target:
-            try:
-                # Non-blocking check for results with longer timeout
-                result = result_queue.get(timeout=1.0)  # Increased to 1 second
-                completed_count += 1
-                timeout_counter = 0  # Reset timeout counter on successful result
-                print(f"DEBUG: Got result {completed_count}/{total_codes}, success: {result.get('success')}, error: {result.get('error', 'None')[:50] if result.get('error') else 'None'}")
-                
-                # Process raw result in main thread (Streamlit calls are safe here)
-                if result['success'] and result['raw_result']:
-                    raw_expansion = result['raw_result']
-                    code_entry = result['code_entry']
-                    snomed_code = result['snomed_code']
-                    
-                    # Process children with EMIS lookup in main thread
-                    processed_children = []
-                    if raw_expansion and not raw_expansion.error:
-                        for child in raw_expansion.children:
-                            # Look up EMIS GUID for child code
-                            child_code = str(child.code).strip()
-                            emis_guid = emis_lookup.get(child_code, 'Not in EMIS lookup table')
-                            
-                            child_data = {
-                                'Parent Code': snomed_code,
-                                'Parent Display': raw_expansion.source_display,
-                                'Child Code': child.code,
-                                'Child Display': child.display,
-                                'EMIS GUID': emis_guid,
-                                'Inactive': 'True' if child.inactive else 'False',
-                                'Source Type': code_entry.get('Source Type', 'Unknown'),
-                                'Source Name': code_entry.get('Source Name', 'Unknown'),
-                                'Source Container': code_entry.get('Source Container', 'Unknown')
-                            }
-                            processed_children.append(child_data)
-                    
-                    # Store results
-                    expansion_results[snomed_code] = raw_expansion
-                    all_processed_children.extend(processed_children)
-                    successful_expansions += 1
-                    total_child_codes += len(processed_children)
-                    
-                    # Cache the result in session state for immediate reuse
-                    st.session_state[session_cache_key][snomed_code] = raw_expansion
-                    
-                    # Show toast for first successful connection during expansion
-                    if not first_success_toast_shown:
-                        st.toast("🔗 Connected to NHS Terminology Server for expansion!", icon="✅")
-                        first_success_toast_shown = True
-                        
-                        # Update connection status in session state
-                        st.session_state.nhs_connection_status = {
-                            'tested': True,
-                            'success': True,
-                            'message': 'Connected to NHS England Terminology Server',
-                            'timestamp': datetime.now().isoformat()
-                        }
-                
-                # Start next thread if there are remaining codes
-                if remaining_codes:
-                    next_code = remaining_codes.pop(0)
-                    thread = threading.Thread(
-                        target=_pure_worker_expand_code,
-                        args=(next_code, include_inactive, result_queue, next_thread_id, client_id, client_secret),
-                        daemon=True
-                    )
-                    thread.start()
-                    threads.append(thread)
-                    next_thread_id += 1
-                
-                # Update progress (safe in main thread)
-                progress = completed_count / total_codes
-                progress_bar.progress(progress)
-                status_text.text(f"Completed {completed_count}/{total_codes} expansions... (using {max_workers} concurrent workers)")
-                
-                # Periodic garbage collection to manage memory
-                if completed_count % 50 == 0:
-                    gc.collect()
+        if job is not None:
+            job.attach(session_id)
+            st.session_state.expansion_job_id = job.job_id
+            # Jobs are shared between sessions: cancelling only stops it once no other session follows it
+            detached = False
+            if not job.done and st.button("⏹️ Cancel Expansion", key="cancel_expansion_job"):
+                detached = not job.detach(session_id)
+            
+            # Follow the job: show each checkpointed outcome once, until it finishes
+            job_total = cache_hits + job.total
+            shown = 0
+            while True:
+                finished = job.done  # Read first, so outcomes recorded before finishing are all drained
+                for outcome in job.outcomes_since(shown):
+                    shown += 1
+                    handle_outcome(outcome)
                 
-            except queue.Empty:
-                # No results yet, continue polling
-                timeout_counter += 1
-                if timeout_counter >= max_timeouts:
-                    print(f"DEBUG: Timeout waiting for results after {timeout_counter} attempts, breaking")
+                progress = job.progress()
+                progress_bar.progress(min(1.0, (cache_hits + progress['completed']) / job_total))
+                status = f"Completed {cache_hits + progress['completed']}/{job_total} expansions... ({_format_concurrency_status(controller.snapshot())})"
+                if progress['derived']:
+                    status += f" · {progress['derived']} derived from nested hierarchies"
+                status_text.text(status)
+                if finished or detached:
                     break
-                time.sleep(0.01)  # Small sleep to prevent busy waiting
-                continue
-            except Exception as e:
-                completed_count += 1
-                continue
+                time.sleep(JOB_POLL_INTERVAL)
+            
+            st.session_state.expansion_job_id = None
+            if detached:
+                st.info(f"⏹️ Stopped following the expansion after {progress['completed']}/{job.total} codes - it keeps running for other sessions, and expanding again picks up its results")
+            elif job.state == JOB_CANCELLED:
+                st.warning(f"⏹️ Expansion cancelled after {progress['completed']}/{job.total} codes - expanding again resumes from there")
+            elif job.state == JOB_FAILED:
+                st.error(f"Expansion job failed: {job.error}")
         
-        # Ensure all threads complete
-        for thread in threads:
-            thread.join(timeout=1)  # Don't wait forever
+        # Fold new results into the session table, then keep this run's codes with EMIS GUIDs and sources
+        session_table = session_table.extend(fetched_results)
+        st.session_state[session_table_key] = session_table
+        fetched_results.clear()
+        run_codes = {code.get('SNOMED Code', '').strip() for code in valid_codes}
+        expansion_table = (
+            session_table.subset(run_codes)
+            .with_emis_guids(emis_lookup)
+            .with_sources(build_source_frame(code_sources, valid_codes))
+        )
+        successful_expansions = len(expansion_table.parents)
+        total_child_codes = len(expansion_table)
         
         # Show results summary with dynamic status indicators
         progress_bar.empty()
@@ -732,17 +597,17 @@ def perform_expansion(expandable_codes: List[Dict], include_inactive: bool = Fal
         
         with col2:
             st.info(f"📊 Total child codes discovered: {total_child_codes}")
-        
+
         
         return {
-            'expansion_results': expansion_results,
+            'expansion_results': expansion_table.header_results(),
+            'expansion_table': expansion_table,  # Child codes with EMIS GUIDs, read by rendering and export
             'total_child_codes': total_child_codes,
             'successful_expansions': successful_expansions,
             'include_inactive': include_inactive,
-            'original_codes': expandable_codes,  # Pass original codes for descriptions
-            'processed_children': all_processed_children  # Pre-processed child codes with EMIS GUIDs
+            'original_codes': expandable_codes  # Pass original codes for descriptions
         }
-        
+    
     except Exception as e:
         progress_bar.empty()
         status_text.empty()
@@ -785,50 +650,33 @@ def render_expansion_results(expansion_data: Dict):
             styled_summary = summary_df.style.apply(style_status, axis=1)
             st.dataframe(styled_summary, width='stretch', hide_index=True)
     
-    # Use pre-processed child codes if available (much faster!)
-    all_child_codes = expansion_data.get('processed_children', [])
+    # Child codes come from the columnar table built by perform_expansion
+    expansion_table = expansion_data.get('expansion_table')
+    if expansion_table is None:
+        # Results saved before the table existed still carry their children
+        expansion_table = ExpansionTable.from_results(expansion_results.values()).with_emis_guids(
+            _session_emis_lookup()
+        )
     
-    # If no pre-processed children, fall back to old method (for compatibility)
-    if not all_child_codes:
-        # Fallback: Create detailed child codes list with EMIS GUID lookup
-        lookup_df = getattr(st.session_state, 'lookup_df', None)
-        snomed_code_col = getattr(st.session_state, 'snomed_code_col', 'SNOMED Code')
-        emis_guid_col = getattr(st.session_state, 'emis_guid_col', 'EMIS GUID')
-        
-        emis_lookup = {}
-        if lookup_df is not None:
-            for _, row in lookup_df.iterrows():
-                snomed_code = str(row.get(snomed_code_col, '')).strip()
-                emis_guid = str(row.get(emis_guid_col, '')).strip()
-                if snomed_code and emis_guid:
-                    emis_lookup[snomed_code] = emis_guid
-        
-        for code, result in expansion_results.items():
-            if not result.error and result.children:
-                for child in result.children:
-                    emis_guid = emis_lookup.get(child.code)
-                    emis_status = emis_guid if emis_guid else 'Not in EMIS lookup table'
-                    
-                    all_child_codes.append({
-                        'Parent Code': code,
-                        'Parent Display': result.source_display,
-                        'Child Code': child.code,
-                        'Child Display': child.display,
-                        'EMIS GUID': emis_status,
-                        'Inactive': 'True' if child.inactive else 'False'
-                    })
+    # Every source row; the Unique Codes view collapses these per parent-child pair
+    all_child_df = expansion_table.child_view(per_source=True)
+    has_child_codes = not all_child_df.empty
     
     # Calculate EMIS GUID coverage statistics
-    if all_child_codes:
-        total_child_codes = len(all_child_codes)
-        missing_emis_guids = sum(1 for code in all_child_codes if code['EMIS GUID'] == 'Not in EMIS lookup table')
+    if has_child_codes:
+        unique_pairs = expansion_table.child_view()
+        total_child_codes = len(unique_pairs)
+        missing_emis_guids = int((unique_pairs['EMIS GUID'] == NOT_IN_EMIS_LOOKUP).sum())
         
         # Show helpful info about EMIS GUID coverage
         if missing_emis_guids > 0:
             coverage_rate = ((total_child_codes - missing_emis_guids) / total_child_codes) * 100
             st.info(f"ℹ️ EMIS GUID Coverage: {total_child_codes - missing_emis_guids}/{total_child_codes} child codes found in EMIS lookup table ({coverage_rate:.1f}%). Missing codes may be newer concepts not yet available in EMIS.")
     
-    if all_child_codes:
+    # View mode defaults to Unique Codes until the selector is shown
+    view_mode = "🔀 Unique Codes"
+    
+    if has_child_codes:
         # Child Codes table header and view mode selector (matching clinical codes pattern)
         col1, col2 = st.columns([4, 1])
         with col1:
@@ -860,77 +708,39 @@ def render_expansion_results(expansion_data: Dict):
                 key="show_inactive_children"
             )
         
-        # Apply filters
-        filtered_codes = all_child_codes.copy()
+        # Apply filters as column masks
+        filtered_df = all_child_df
         
         # Apply search filter
         if search_term:
-            filtered_codes = [
-                code for code in filtered_codes
-                if search_term.lower() in code['Child Code'].lower() or
-                   search_term.lower() in code['Child Display'].lower() or
-                   search_term.lower() in code['Parent Code'].lower() or
-                   search_term.lower() in code['Parent Display'].lower() or
-                   search_term.lower() in code.get('Source Name', '').lower()
-            ]
+            search_mask = pd.Series(False, index=filtered_df.index)
+            for column in ['Child Code', 'Child Display', 'Parent Code', 'Parent Display', 'Source Name']:
+                search_mask |= filtered_df[column].astype(str).str.contains(search_term, case=False, regex=False)
+            filtered_df = filtered_df[search_mask]
         
         # Apply inactive filter
         if not show_inactive:
-            filtered_codes = [code for code in filtered_codes if code['Inactive'] == 'False']
+            filtered_df = filtered_df[filtered_df['Inactive'] == 'False']
         
         # Apply view mode filter and sorting
-        if view_mode == "🔀 Unique Codes":
-            # Deduplicate by parent-child combination, keeping first occurrence
-            seen_combinations = set()
-            unique_codes = []
-            for code in filtered_codes:
-                combination = (code['Parent Code'], code['Child Code'])
-                if combination not in seen_combinations:
-                    seen_combinations.add(combination)
-                    unique_codes.append(code)
-            filtered_codes = unique_codes
-            
-            # Sort by Parent Code, then Child Code for unique mode
-            filtered_codes = sorted(filtered_codes, key=lambda x: (x['Parent Code'], x['Child Code']))
-        
-        else:  # Per Source mode
-            # Sort by Source Type, Source Name, Parent Code, then Child Code for intuitive source grouping
-            filtered_codes = sorted(filtered_codes, key=lambda x: (
-                x.get('Source Type', 'Unknown'),
-                x.get('Source Name', 'Unknown'), 
-                x['Parent Code'], 
-                x['Child Code']
-            ))
+        filtered_df = _apply_view_mode(filtered_df, view_mode)
         
         # Display filtered results with color coding and visual indicators
-        if filtered_codes:
-            child_df = pd.DataFrame(filtered_codes)
-            
-            # Hide source columns in Unique Codes mode (consistent with other tabs)
-            if view_mode == "🔀 Unique Codes":
-                # Remove source-related columns that are misleading when deduplicating
-                columns_to_remove = ['Source Type', 'Source Name', 'Source Container']
-                for col in columns_to_remove:
-                    if col in child_df.columns:
-                        child_df = child_df.drop(columns=[col])
+        if not filtered_df.empty:
+            child_df = filtered_df.copy()
             
             # Add visual indicators for code types (matching other tabs)
             child_df['Parent Code'] = '🩺 ' + child_df['Parent Code'].astype(str)
             child_df['Child Code'] = '🩺 ' + child_df['Child Code'].astype(str)
             
-            # Add visual indicators for EMIS GUID column
-            def format_emis_guid(guid):
-                if str(guid) == 'Not in EMIS lookup table':
-                    return f'❌ {guid}'  # Add red X for "not found" entries
-                else:
-                    return f'🔍 {guid}'  # Add EMIS GUID indicator
-            
-            child_df['EMIS GUID'] = child_df['EMIS GUID'].apply(format_emis_guid)
+            # Add visual indicators for EMIS GUID column: red X for "not found" entries
+            found = child_df['EMIS GUID'] != NOT_IN_EMIS_LOOKUP
+            child_df['EMIS GUID'] = np.where(found, '🔍 ', '❌ ') + child_df['EMIS GUID'].astype(str)
             
             # Style the child codes table based on EMIS GUID availability
             def style_emis_guid(row):
                 emis_guid = row['EMIS GUID']
-                if 'Not in EMIS lookup table' in str(emis_guid):
+                if NOT_IN_EMIS_LOOKUP in str(emis_guid):
                     return ['background-color: #f8d7da'] * len(row)  # Pink for not found
                 else:
                     return ['background-color: #d4edda'] * len(row)  # Green for found
@@ -941,9 +751,7 @@ def render_expansion_results(expansion_data: Dict):
     # Export options section (moved outside expander to prevent UI resets)
     st.markdown("### 📥 Export Options")
     # Check if we have source tracking for granular filters
-    has_source_tracking = all_child_codes and any(
-        'Source Type' in code for code in all_child_codes
-    )
+    has_source_tracking = has_child_codes and expansion_table.sources is not None
     
     col1, col2 = st.columns([1, 2])
     
@@ -979,56 +787,29 @@ def render_expansion_results(expansion_data: Dict):
             )
     
     with col2:
-        if all_child_codes:
+        if has_child_codes:
             # Apply export filter to child codes data
-            export_filtered_codes = []
-            
-            for code in all_child_codes:
-                include_code = False
-                
-                if export_filter == "All Child Codes":
-                    include_code = True
-                elif export_filter == "Only Matched":
-                    # Code is matched if it has an EMIS GUID
-                    emis_guid = code.get('EMIS GUID', 'Not in EMIS lookup table')
-                    include_code = emis_guid != 'Not in EMIS lookup table'
-                elif export_filter == "Only Unmatched":
-                    # Code is unmatched if it doesn't have an EMIS GUID
-                    emis_guid = code.get('EMIS GUID', 'Not in EMIS lookup table')
-                    include_code = emis_guid == 'Not in EMIS lookup table'
-                elif export_filter == "Only Child Codes from Searches" and has_source_tracking:
-                    # Filter for search sources
-                    source_type = code.get('Source Type', '')
-                    include_code = 'Search' in str(source_type)
-                elif export_filter == "Only Child Codes from Reports" and has_source_tracking:
-                    # Filter for report sources
-                    source_type = code.get('Source Type', '')
-                    include_code = 'Search' not in str(source_type) and source_type != 'Unknown'
-                
-                if include_code:
-                    export_filtered_codes.append(code)
+            matched = all_child_df['EMIS GUID'] != NOT_IN_EMIS_LOOKUP
+            from_search = all_child_df['Source Type'].astype(str).str.contains('Search', regex=False)
+            export_masks = {
+                "Only Matched": matched,
+                "Only Unmatched": ~matched,
+                "Only Child Codes from Searches": from_search,
+                "Only Child Codes from Reports": ~from_search & (all_child_df['Source Type'] != 'Unknown'),
+            }
+            export_df = all_child_df[export_masks[export_filter]] if export_filter in export_masks else all_child_df
             
-            # Apply view mode filtering to export data (hide source columns if in Unique Codes mode)
-            if export_filtered_codes:
-                export_df = pd.DataFrame(export_filtered_codes)
-                
-                # Hide source columns in Unique Codes mode (consistent with display)
-                if view_mode == "🔀 Unique Codes":
-                    columns_to_remove = ['Source Type', 'Source Name', 'Source Container']
-                    for col in columns_to_remove:
-                        if col in export_df.columns:
-                            export_df = export_df.drop(columns=[col])
+            # Apply view mode to export data (one row per pair without source columns in Unique Codes mode)
+            export_df = _apply_view_mode(export_df, view_mode, sort=False)
             
             # Generate timestamps and filename components
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             
             # Create SNOMED-only download
             st.markdown("**🩺 Download Child Codes (SNOMED Only)**")
-            if export_filtered_codes:
+            if not export_df.empty:
                 # Create SNOMED-only export (remove EMIS GUID column)
-                snomed_export_df = export_df.copy()
-                if 'EMIS GUID' in snomed_export_df.columns:
-                    snomed_export_df = snomed_export_df.drop(columns=['EMIS GUID'])
+                snomed_export_df = export_df.drop(columns=['EMIS GUID'])
                 
                 # Generate filename for SNOMED export with view mode
                 view_suffix = "unique" if view_mode == "🔀 Unique Codes" else "per_source"
@@ -1065,38 +846,30 @@ def render_expansion_results(expansion_data: Dict):
             
             # Create EMIS import download (only active codes)
             # First calculate match statistics for all export filtered codes
-            all_emis_export_codes = [code for code in export_filtered_codes if code.get('Inactive') == 'False']
-            all_emis_available = sum(1 for code in all_emis_export_codes 
-                                   if code.get('EMIS GUID') != 'Not in EMIS lookup table')
-            all_total_codes = len(all_emis_export_codes)
+            emis_export_df = export_df[export_df['Inactive'] == 'False']
+            all_emis_available = int((emis_export_df['EMIS GUID'] != NOT_IN_EMIS_LOOKUP).sum())
+            all_total_codes = len(emis_export_df)
             
             st.markdown(f"**🔍 Download Child Codes (inc EMIS GUID) - {all_emis_available}/{all_total_codes} matched**")
             
-            if all_emis_export_codes:
-                # Prepare EMIS import data
-                emis_import_data = []
-                for code in all_emis_export_codes:
-                    emis_guid = code.get('EMIS GUID', 'Not in EMIS lookup table')
-                    description = code['Child Display']
-                    
-                    emis_data = {
-                        'SNOMED Code': code['Child Code'],
-                        'EMIS GUID': emis_guid,
-                        'Description': description,
-                        'Parent Code': code['Parent Code'],
-                        'Parent Description': code['Parent Display'],
-                        'XML Output': _create_xml_output(emis_guid, description)
-                    }
-                    
-                    # Add source columns if in Per Source mode
-                    if view_mode == "📍 Per Source":
-                        emis_data.update({
-                            'Source Type': code.get('Source Type', 'Unknown'),
-                            'Source Name': code.get('Source Name', 'Unknown'),
-                            'Source Container': code.get('Source Container', 'Unknown')
-                        })
-                    
-                    emis_import_data.append(emis_data)
+            if all_total_codes:
+                # Prepare EMIS import data column-wise
+                emis_df = pd.DataFrame({
+                    'SNOMED Code': emis_export_df['Child Code'],
+                    'EMIS GUID': emis_export_df['EMIS GUID'],
+                    'Description': emis_export_df['Child Display'],
+                    'Parent Code': emis_export_df['Parent Code'],
+                    'Parent Description': emis_export_df['Parent Display'],
+                    'XML Output': [
+                        _create_xml_output(emis_guid, description)
+                        for emis_guid, description in zip(emis_export_df['EMIS GUID'], emis_export_df['Child Display'])
+                    ]
+                })
+                
+                # Add source columns if in Per Source mode
+                if view_mode == "📍 Per Source":
+                    for column in ['Source Type', 'Source Name', 'Source Container']:
+                        emis_df[column] = emis_export_df[column]
                 
                 # Generate filename for EMIS export with view mode
                 view_suffix = "unique" if view_mode == "🔀 Unique Codes" else "per_source"
@@ -1112,7 +885,6 @@ def render_expansion_results(expansion_data: Dict):
                 else:
                     emis_filename = f"emis_import_all_{view_suffix}_{timestamp}.csv"
                 
-                emis_df = pd.DataFrame(emis_import_data)
                 emis_csv = _clean_dataframe_for_export(emis_df).to_csv(index=False)
                 
                 st.download_button(
@@ -1128,31 +900,28 @@ def render_expansion_results(expansion_data: Dict):
             
             # JSON hierarchical export section
             st.markdown("**🌳 Download Hierarchical JSON (Parent-Child Structure)**")
-            if all_child_codes:
-                # Create hierarchical JSON structure for unique parents only
-                json_data = _create_hierarchical_json(all_child_codes, view_mode)
-                
-                # Generate filename for JSON export
-                view_suffix = "unique" if view_mode == "🔀 Unique Codes" else "per_source"
-                json_filename = f"child_hierarchy_{view_suffix}_{timestamp}.json"
-                
-                # Format JSON with proper indentation
-                json_string = json.dumps(json_data, indent=2, ensure_ascii=False)
-                
-                st.download_button(
-                    label="🌳 Hierarchical JSON",
-                    data=json_string,
-                    file_name=json_filename,
-                    mime="application/json",
-                    help="Parent-child code hierarchy in JSON format - ignores filters, shows unique parents only",
-                    key="json_download"
-                )
-            else:
-                st.info("No child codes available for JSON export")
+            # Create hierarchical JSON structure for unique parents only
+            json_data = _create_hierarchical_json(all_child_df, view_mode)
+            
+            # Generate filename for JSON export
+            view_suffix = "unique" if view_mode == "🔀 Unique Codes" else "per_source"
+            json_filename = f"child_hierarchy_{view_suffix}_{timestamp}.json"
+            
+            # Format JSON with proper indentation
+            json_string = json.dumps(json_data, indent=2, ensure_ascii=False)
+            
+            st.download_button(
+                label="🌳 Hierarchical JSON",
+                data=json_string,
+                file_name=json_filename,
+                mime="application/json",
+                help="Parent-child code hierarchy in JSON format - ignores filters, shows unique parents only",
+                key="json_download"
+            )
         else:
             st.info("No child codes available for export")
     
-    if not all_child_codes:
+    if not has_child_codes:
         st.warning("No child codes were found in the expansion results")
 
 
@@ -1273,5 +1042,5 @@ def render_expansion_tab_content(clinical_data: List[Dict]):
         - Requires active internet connection
         - Subject to NHS terminology server availability
         - Large hierarchies may take time to expand
-        - Results cached for 24 hours to improve performance
+        - Results cached on this host for the current SNOMED CT edition to improve performance
         """)
\ No newline at end of file
@@ -11,11 +11,68 @@ operations for concept expansion and hierarchy queries.
 import requests
 import json
 import time
-from typing import Dict, List, Optional, Set, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from urllib.parse import quote
 import streamlit as st
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from .connection_pool import ConnectionPool, get_connection_pool
+from .concurrency_controller import get_concurrency_controller
+
+
+NHS_FHIR_BASE_URL = "https://ontology.nhs.uk/production1/fhir"
+NHS_AUTH_URL = "https://ontology.nhs.uk/authorisation/auth/realms/nhs-digital-terminology/protocol/openid-connect/token"
+
+# Seconds allowed for one HTTP request to the terminology server
+REQUEST_TIMEOUT = 30
+
+# Concepts requested per ValueSet $expand page
+EXPAND_PAGE_SIZE = 1000
+
+# Most pages of one expansion fetched at once after the first (each past one needs a spare controller slot)
+MAX_EXPAND_PAGES_IN_FLIGHT = 4
+
+# SNOMED CT root concept, looked up to ask the server which edition it serves
+SNOMED_ROOT_CONCEPT = "138875005"
+
+# Codes per side of one ECL subsumption check, keeping the GET URL a few KB
+SUBSUMPTION_CHUNK_SIZE = 150
+
+# FHIR R4 carries R5 expansion.contains.property as this extension
+_CONTAINS_PROPERTY_EXTENSION = "http://hl7.org/fhir/5.0/StructureDefinition/extension-ValueSet.expansion.contains.property"
+
+
+def _concept_parents(concept: Dict) -> Tuple[str, ...]:
+    """Direct parent codes of an expansion entry returned with property=parent"""
+    parents = []
+    # R5-style contains[].property
+    for prop in concept.get('property', []):
+        if prop.get('code') == 'parent':
+            parents.append(prop.get('valueCode') or prop.get('valueString'))
+    # R4 servers return the same data as an extension
+    for extension in concept.get('extension', []):
+        if extension.get('url') != _CONTAINS_PROPERTY_EXTENSION:
+            continue
+        parts = {part.get('url'): part for part in extension.get('extension', [])}
+        if parts.get('code', {}).get('valueCode') == 'parent':
+            value = parts.get('value', {})
+            parents.append(value.get('valueCode') or value.get('valueString'))
+    return tuple(parent for parent in parents if parent)
+
+
+def _snomed_version(parameters: List[Dict]) -> Optional[str]:
+    """SNOMED edition/version URI from FHIR $expand or $lookup parameters"""
+    for param in parameters or []:
+        if param.get('name') != 'version':
+            continue
+        value = param.get('valueUri') or param.get('valueString')
+        if value and 'snomed.info/sct' in value:
+            # $expand reports "system|version", $lookup just the version
+            return value.split('|', 1)[-1]
+    return None
 
 
 @dataclass
@@ -26,6 +83,7 @@ class ExpandedConcept:
     system: str = "http://snomed.info/sct"
     inactive: bool = False
     parent_code: Optional[str] = None
+    parents: Optional[Tuple[str, ...]] = None  # Direct parents, only when the hierarchy was requested
 
 
 @dataclass
@@ -37,19 +95,29 @@ class ExpansionResult:
     total_count: int
     expansion_timestamp: datetime
     error: Optional[str] = None
+    edition: Optional[str] = None  # SNOMED CT edition/version the server expanded against
 
 
 class NHSTerminologyClient:
     """Client for NHS England Terminology Server with FHIR R4 API"""
     
-    def __init__(self):
-        self.base_url = "https://ontology.nhs.uk/production1/fhir"
-        self.auth_url = "https://ontology.nhs.uk/authorisation/auth/realms/nhs-digital-terminology/protocol/openid-connect/token"
-        self.client_id = None
-        self.client_secret = None
-        self.access_token = None
-        self.token_expires = None
-        self._load_credentials()
+    def __init__(self, client_id: Optional[str] = None, client_secret: Optional[str] = None,
+                 base_url: Optional[str] = None, auth_url: Optional[str] = None):
+        """
+        Args:
+            client_id: Explicit credentials (e.g. for worker threads); loaded from
+                Streamlit secrets when not given
+            client_secret: Secret matching client_id
+            base_url: FHIR endpoint, for pointing at another server (e.g. the local
+                stand-in in tests/terminology_standin.py); NHS production by default
+            auth_url: OAuth token endpoint matching base_url
+        """
+        self.base_url = base_url or NHS_FHIR_BASE_URL
+        self.auth_url = auth_url or NHS_AUTH_URL
+        self.client_id = client_id
+        self.client_secret = client_secret
+        if client_id is None or client_secret is None:
+            self._load_credentials()
     
     def _load_credentials(self):
         """Load credentials from Streamlit secrets"""
@@ -60,71 +128,79 @@ class NHSTerminologyClient:
             st.error(f"Missing NHS Terminology Server credentials: {e}")
             raise ValueError(f"Missing credential: {e}")
     
+    @property
+    def _pool(self) -> ConnectionPool:
+        """Session and token cache shared by every client using these credentials"""
+        return get_connection_pool(self.auth_url, self.client_id, self.client_secret)
+    
+    @property
+    def access_token(self) -> Optional[str]:
+        return self._pool.tokens.access_token
+    
+    @property
+    def token_expires(self) -> Optional[datetime]:
+        return self._pool.tokens.token_expires
+    
     def _is_token_valid(self) -> bool:
         """Check if current access token is still valid"""
-        if not self.access_token or not self.token_expires:
-            return False
-        # Add 5 minute buffer before expiry
-        return datetime.now() < (self.token_expires - timedelta(minutes=5))
+        return self._pool.tokens.is_valid()
     
-    def _authenticate(self) -> bool:
-        """Authenticate with NHS Terminology Server using system-to-system credentials"""
-        try:
-            auth_data = {
-                'grant_type': 'client_credentials',
-                'client_id': self.client_id,
-                'client_secret': self.client_secret
-            }
-            
-            response = requests.post(
-                self.auth_url,
-                data=auth_data,
-                headers={'Content-Type': 'application/x-www-form-urlencoded'},
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                self.access_token = token_data.get('access_token')
-                expires_in = token_data.get('expires_in', 1800)  # Default 30 minutes
-                self.token_expires = datetime.now() + timedelta(seconds=expires_in)
-                return True
-            else:
-                st.error(f"Authentication failed: {response.status_code} - {response.text}")
-                return False
-                
-        except Exception as e:
-            st.error(f"Authentication error: {str(e)}")
+    def _authenticate(self, stale_token: Optional[str] = None) -> bool:
+        """
+        Authenticate with NHS Terminology Server using system-to-system credentials
+        
+        Refreshes are single-flight: if another client already replaced stale_token,
+        its new token is reused instead of requesting another.
+        """
+        tokens = self._pool.tokens
+        if tokens.refresh(stale_token=stale_token) is None:
+            st.error(tokens.last_error)
             return False
+        return True
     
     def _ensure_authenticated(self) -> bool:
         """Ensure we have a valid access token"""
         if not self._is_token_valid():
-            return self._authenticate()
+            return self._authenticate(stale_token=self.access_token)
         return True
     
-    def _make_request(self, endpoint: str, params: Dict = None) -> Tuple[Optional[Dict], Optional[str]]:
-        """Make authenticated request to terminology server"""
+    def _timed_get(self, url: str, headers: Dict, params: Optional[Dict], timeout: float = REQUEST_TIMEOUT) -> requests.Response:
+        """GET over the shared session, reporting latency and status to the concurrency controller"""
+        controller = get_concurrency_controller()
+        start_time = time.perf_counter()
+        try:
+            response = self._pool.session.get(url, headers=headers, params=params, timeout=timeout)
+        except Exception:
+            controller.record(time.perf_counter() - start_time, 0)
+            raise
+        controller.record(time.perf_counter() - start_time, response.status_code)
+        return response
+    
+    def _make_request(self, endpoint: str, params: Dict = None, timeout: float = REQUEST_TIMEOUT) -> Tuple[Optional[Dict], Optional[str]]:
+        """Make authenticated request to terminology server over the shared keep-alive session"""
         if not self._ensure_authenticated():
             return None, "Authentication failed"
         
+        pool = self._pool
+        access_token = pool.tokens.access_token
+        
         headers = {
-            'Authorization': f'Bearer {self.access_token}',
+            'Authorization': f'Bearer {access_token}',
             'Accept': 'application/fhir+json',
             'Content-Type': 'application/fhir+json'
         }
         
         try:
             url = f"{self.base_url}/{endpoint}"
-            response = requests.get(url, headers=headers, params=params, timeout=30)
+            response = self._timed_get(url, headers, params, timeout)
             
             if response.status_code == 200:
                 return response.json(), None
             elif response.status_code == 401:
                 # Token might have expired, try re-authenticating once
-                if self._authenticate():
+                if self._authenticate(stale_token=access_token):
                     headers['Authorization'] = f'Bearer {self.access_token}'
-                    response = requests.get(url, headers=headers, params=params, timeout=30)
+                    response = self._timed_get(url, headers, params, timeout)
                     if response.status_code == 200:
                         return response.json(), None
             
@@ -135,75 +211,182 @@ class NHSTerminologyClient:
                 return None, "Terminology server error"
             else:
                 return None, f"API request failed: {response.status_code}"
-            
+        
         except Exception as e:
             return None, f"Connection error: {str(e)}"
     
-    def _expand_concept_uncached(self, snomed_code: str, include_inactive: bool = False) -> ExpansionResult:
-        """Uncached version for worker threads - identical logic to expand_concept"""
-        try:
-            # First, look up the concept to get its display name
-            source_display = snomed_code
-            try:
-                lookup_result = self._lookup_concept_uncached(snomed_code)
-                if lookup_result and 'parameter' in lookup_result:
-                    for param in lookup_result.get('parameter', []):
-                        if param.get('name') == 'display':
-                            source_display = param.get('valueString', snomed_code)
-                            break
-            except Exception:
-                # If lookup fails, continue with the code as display
-                pass
+    def _fetch_expansion_page(self, params: Dict, offset: int, timeout: float = REQUEST_TIMEOUT) -> Tuple[Optional[Dict], Optional[str]]:
+        """Fetch one page of a ValueSet $expand"""
+        return self._make_request("ValueSet/$expand", params=dict(params, offset=offset), timeout=timeout)
+    
+    def _iter_expansion_pages(self, params: Dict, info: Optional[Dict] = None,
+                              timeout: float = REQUEST_TIMEOUT) -> Iterator[Tuple[Optional[List[Dict]], Optional[str]]]:
+        """
+        Page through a ValueSet $expand, yielding (concepts, error) per page in offset order
+        
+        The first page gives expansion.total and the server's page size; the remaining
+        offsets are fetched concurrently, at most MAX_EXPAND_PAGES_IN_FLIGHT at a time,
+        and yielded as soon as each next page in order is ready. One page at a time runs
+        in the caller's own controller slot; every further page in flight borrows a spare
+        slot while it runs, so paging never takes the server past the concurrency limit
+        and falls back to one page at a time when no slot is spare. Stops after the first
+        page that fails, yielding (None, error) for it. The SNOMED edition reported by
+        the first page is stored in info['edition'] when info is given. Each page
+        request is allowed timeout seconds.
+        """
+        response_data, error_message = self._fetch_expansion_page(params, 0, timeout)
+        if not response_data:
+            yield None, error_message or "Unknown error"
+            return
+        
+        expansion = response_data.get('expansion', {})
+        concepts = expansion.get('contains', [])
+        if info is not None:
+            info['edition'] = _snomed_version(expansion.get('parameter'))
+        yield concepts, None
+        
+        # Servers may cap the page size below what was asked for, so step by what came back
+        page_size = len(concepts)
+        total = expansion.get('total')
+        if not page_size:
+            return
+        
+        if total is None:
+            # No total reported - keep paging sequentially until a short page
+            offset = page_size
+            while len(concepts) == page_size:
+                response_data, error_message = self._fetch_expansion_page(params, offset, timeout)
+                if not response_data:
+                    yield None, error_message or "Unknown error"
+                    return
+                concepts = response_data.get('expansion', {}).get('contains', [])
+                if concepts:
+                    yield concepts, None
+                offset += page_size
+            return
+        
+        controller = get_concurrency_controller()
+        offsets = iter(range(page_size, total, page_size))
+        with ThreadPoolExecutor(max_workers=MAX_EXPAND_PAGES_IN_FLIGHT) as executor:
+            pending = deque()
             
+            def fill_window():
+                while len(pending) < MAX_EXPAND_PAGES_IN_FLIGHT:
+                    # The first page in flight uses the caller's slot; the rest borrow one each
+                    borrowed = bool(pending)
+                    if borrowed and not controller.try_acquire():
+                        return
+                    offset = next(offsets, None)
+                    if offset is None:
+                        if borrowed:
+                            controller.release()
+                        return
+                    future = executor.submit(self._fetch_expansion_page, params, offset, timeout)
+                    if borrowed:
+                        future.add_done_callback(lambda _: controller.release())
+                    pending.append(future)
+            
+            fill_window()
+            while pending:
+                response_data, error_message = pending.popleft().result()
+                if not response_data:
+                    for future in pending:
+                        future.cancel()
+                    yield None, error_message or "Unknown error"
+                    return
+                
+                # Keep the in-flight window full
+                fill_window()
+                
+                yield response_data.get('expansion', {}).get('contains', []), None
+    
+    def _lookup_display(self, snomed_code: str, timeout: float = REQUEST_TIMEOUT) -> str:
+        """Display name from a CodeSystem $lookup, or the code itself if the lookup fails"""
+        try:
+            lookup_result = self._lookup_concept_uncached(snomed_code, timeout)
+            if lookup_result and 'parameter' in lookup_result:
+                for param in lookup_result.get('parameter', []):
+                    if param.get('name') == 'display':
+                        return param.get('valueString', snomed_code)
+        except Exception:
+            # If lookup fails, continue with the code as display
+            pass
+        return snomed_code
+    
+    def _expand_concept_uncached(self, snomed_code: str, include_inactive: bool = False, include_hierarchy: bool = False,
+                                 timeout: float = REQUEST_TIMEOUT) -> ExpansionResult:
+        """
+        Uncached version for worker threads - expand_concept delegates here
+        
+        The expansion uses ECL << (the concept and its descendants) so the source
+        concept's display comes back with its children in the same request; the
+        focus concept is split out of the results. A separate $lookup is only made
+        when the focus concept is missing (e.g. it is inactive and activeOnly is set).
+        
+        With include_hierarchy, each child also carries its direct parents so the
+        descendants of nested codes can be derived locally (see expansion_planner.py).
+        Each HTTP request is allowed timeout seconds.
+        """
+        try:
             # Use the correct FHIR ValueSet $expand operation with ECL
-            # ECL: < means "all descendants of" (children, grandchildren, etc.)
-            ecl_expression = f"< {snomed_code}"
+            # ECL: << means "this concept and all its descendants" (children, grandchildren, etc.)
+            ecl_expression = f"<< {snomed_code}"
             
             # Create an implicit ValueSet using ECL in the URL parameter
             params = {
                 'url': f'http://snomed.info/sct?fhir_vs=ecl/{quote(ecl_expression)}',
                 '_format': 'json',
-                'count': 1000,  # Limit to prevent timeouts
+                'count': EXPAND_PAGE_SIZE,  # Page size - larger expansions are fetched in pages
                 'offset': 0
             }
             
             if not include_inactive:
                 params['activeOnly'] = 'true'
+            if include_hierarchy:
+                params['property'] = 'parent'
             
-            # Make the ValueSet $expand request
-            response_data, error_message = self._make_request(
-                "ValueSet/$expand",
-                params=params
-            )
-            
-            if not response_data:
-                return ExpansionResult(
-                    source_code=snomed_code,
-                    source_display="Unknown",
-                    children=[],
-                    total_count=0,
-                    expansion_timestamp=datetime.now(),
-                    error=error_message or "Unknown error"
-                )
-            
-            # Parse expansion results
+            # Make the ValueSet $expand requests, one page at a time in offset order
+            source_display = None
             children = []
-            total_count = 0
-            
-            if 'expansion' in response_data:
-                expansion = response_data['expansion']
-                total_count = expansion.get('total', 0)
+            expansion_info = {}
+            for concepts, error_message in self._iter_expansion_pages(params, expansion_info, timeout):
+                if error_message:
+                    if not children:
+                        return ExpansionResult(
+                            source_code=snomed_code,
+                            source_display="Unknown",
+                            children=[],
+                            total_count=0,
+                            expansion_timestamp=datetime.now(),
+                            error=error_message
+                        )
+                    # A later page failed - keep what arrived but don't report it as complete
+                    return ExpansionResult(
+                        source_code=snomed_code,
+                        source_display=source_display or self._lookup_display(snomed_code, timeout),
+                        children=children,
+                        total_count=len(children),
+                        expansion_timestamp=datetime.now(),
+                        error=f"Incomplete expansion after {len(children)} concepts: {error_message}"
+                    )
                 
-                if 'contains' in expansion:
-                    for concept in expansion['contains']:
-                        # All concepts in the expansion are children (ECL < excludes the parent)
-                        children.append(ExpandedConcept(
-                            code=concept.get('code', ''),
-                            display=concept.get('display', ''),
-                            system=concept.get('system', 'http://snomed.info/sct'),
-                            inactive=concept.get('inactive', False),
-                            parent_code=snomed_code
-                        ))
+                for concept in concepts:
+                    code = concept.get('code', '')
+                    if code == snomed_code:
+                        # The focus concept itself (ECL << includes it) - only its display is needed
+                        source_display = concept.get('display') or snomed_code
+                        continue
+                    children.append(ExpandedConcept(
+                        code=code,
+                        display=concept.get('display', ''),
+                        system=concept.get('system', 'http://snomed.info/sct'),
+                        inactive=concept.get('inactive', False),
+                        parent_code=snomed_code,
+                        parents=_concept_parents(concept) if include_hierarchy else None
+                    ))
+            
+            if source_display is None:
+                source_display = self._lookup_display(snomed_code, timeout)
             
             return ExpansionResult(
                 source_code=snomed_code,
@@ -211,9 +394,10 @@ class NHSTerminologyClient:
                 children=children,
                 total_count=len(children),
                 expansion_timestamp=datetime.now(),
-                error=None
+                error=None,
+                edition=expansion_info.get('edition')
             )
-            
+        
         except Exception as e:
             return ExpansionResult(
                 source_code=snomed_code,
@@ -223,7 +407,7 @@ class NHSTerminologyClient:
                 expansion_timestamp=datetime.now(),
                 error=str(e)
             )
-
+    
     # @st.cache_data(ttl=3600, max_entries=2000)  # Disabled - _self conflicts with worker threads
     def expand_concept(self, snomed_code: str, include_inactive: bool = False) -> ExpansionResult:
         """
@@ -232,94 +416,13 @@ class NHSTerminologyClient:
         Args:
             snomed_code: The SNOMED CT code to expand
             include_inactive: Whether to include inactive concepts
-            
+        
         Returns:
             ExpansionResult with child concepts or error information
         """
-        try:
-            # First, look up the concept to get its display name
-            source_display = snomed_code
-            try:
-                lookup_result = self._lookup_concept_uncached(snomed_code)
-                if lookup_result and 'parameter' in lookup_result:
-                    for param in lookup_result.get('parameter', []):
-                        if param.get('name') == 'display':
-                            source_display = param.get('valueString', snomed_code)
-                            break
-            except Exception:
-                # If lookup fails, continue with the code as display
-                pass
-            
-            # Use the correct FHIR ValueSet $expand operation with ECL
-            # ECL: < means "all descendants of" (children, grandchildren, etc.)
-            ecl_expression = f"< {snomed_code}"
-            
-            # Create an implicit ValueSet using ECL in the URL parameter
-            params = {
-                'url': f'http://snomed.info/sct?fhir_vs=ecl/{quote(ecl_expression)}',
-                '_format': 'json',
-                'count': 1000,  # Limit to prevent timeouts
-                'offset': 0
-            }
-            
-            if not include_inactive:
-                params['activeOnly'] = 'true'
-            
-            # Make the ValueSet $expand request
-            response_data, error_message = self._make_request(
-                "ValueSet/$expand",
-                params=params
-            )
-            
-            if not response_data:
-                return ExpansionResult(
-                    source_code=snomed_code,
-                    source_display="Unknown",
-                    children=[],
-                    total_count=0,
-                    expansion_timestamp=datetime.now(),
-                    error=error_message or "Unknown error"
-                )
-            
-            # Parse expansion results
-            children = []
-            total_count = 0
-            
-            if 'expansion' in response_data:
-                expansion = response_data['expansion']
-                total_count = expansion.get('total', 0)
-                
-                if 'contains' in expansion:
-                    for concept in expansion['contains']:
-                        # All concepts in the expansion are children (ECL < excludes the parent)
-                        children.append(ExpandedConcept(
-                            code=concept.get('code', ''),
-                            display=concept.get('display', ''),
-                            system=concept.get('system', 'http://snomed.info/sct'),
-                            inactive=concept.get('inactive', False),
-                            parent_code=snomed_code
-                        ))
-            
-            return ExpansionResult(
-                source_code=snomed_code,
-                source_display=source_display,
-                children=children,
-                total_count=len(children),
-                expansion_timestamp=datetime.now(),
-                error=None
-            )
-            
-        except Exception as e:
-            return ExpansionResult(
-                source_code=snomed_code,
-                source_display="Unknown",
-                children=[],
-                total_count=0,
-                expansion_timestamp=datetime.now(),
-                error=str(e)
-            )
+        return self._expand_concept_uncached(snomed_code, include_inactive)
     
-    def _lookup_concept_uncached(self, snomed_code: str) -> Optional[Dict]:
+    def _lookup_concept_uncached(self, snomed_code: str, timeout: float = REQUEST_TIMEOUT) -> Optional[Dict]:
         """Uncached version for worker threads - identical logic to lookup_concept"""
         params = {
             'system': 'http://snomed.info/sct',
@@ -327,9 +430,9 @@ class NHSTerminologyClient:
             '_format': 'json'
         }
         
-        result, error = self._make_request("CodeSystem/$lookup", params)
+        result, error = self._make_request("CodeSystem/$lookup", params, timeout=timeout)
         return result
-
+    
     # @st.cache_data(ttl=3600, max_entries=1000)  # Temporarily disabled to debug _self issue
     def lookup_concept(self, snomed_code: str) -> Optional[Dict]:
         """
@@ -337,7 +440,7 @@ class NHSTerminologyClient:
         
         Args:
             snomed_code: The SNOMED CT code to look up
-            
+        
         Returns:
             Concept details or None if not found
         """
@@ -350,42 +453,110 @@ class NHSTerminologyClient:
         result, error = self._make_request("CodeSystem/$lookup", params)
         return result
     
+    def find_subsumed_codes(self, candidates: List[str], ancestors: List[str], include_inactive: bool = False) -> Optional[Set[str]]:
+        """
+        Candidate codes that are descendants of at least one of the ancestor codes
+        
+        One cheap ECL $expand per pair of chunks, returning only matching codes:
+        (candidates) AND < (ancestors). Pass the same list twice to find requested
+        codes nested under other requested codes.
+        
+        Returns:
+            Matching codes, or None if any check failed
+        """
+        return self._filter_codes_by_relation(candidates, '<', ancestors, include_inactive)
+    
+    def find_subsuming_codes(self, candidates: List[str], descendants: List[str], include_inactive: bool = False) -> Optional[Set[str]]:
+        """Candidate codes that are ancestors of at least one of the descendant codes (None on failure)"""
+        return self._filter_codes_by_relation(candidates, '>', descendants, include_inactive)
+    
+    def _filter_codes_by_relation(self, candidates: List[str], operator: str, targets: List[str], include_inactive: bool) -> Optional[Set[str]]:
+        """Codes in candidates matching ECL '(candidates) AND <operator> (targets)', checked in chunks"""
+        matches = set()
+        if not candidates or not targets:
+            return matches
+        
+        def chunks(codes):
+            return [codes[i:i + SUBSUMPTION_CHUNK_SIZE] for i in range(0, len(codes), SUBSUMPTION_CHUNK_SIZE)]
+        
+        for candidate_chunk in chunks(candidates):
+            for target_chunk in chunks(targets):
+                ecl_expression = f"({' OR '.join(candidate_chunk)}) AND {operator} ({' OR '.join(target_chunk)})"
+                params = {
+                    'url': f'http://snomed.info/sct?fhir_vs=ecl/{quote(ecl_expression)}',
+                    '_format': 'json',
+                    'count': EXPAND_PAGE_SIZE,
+                    'offset': 0
+                }
+                if not include_inactive:
+                    params['activeOnly'] = 'true'
+                for concepts, error_message in self._iter_expansion_pages(params):
+                    if error_message:
+                        return None
+                    matches.update(concept.get('code', '') for concept in concepts)
+        matches.discard('')
+        return matches
+    
+    def get_snomed_edition(self) -> Optional[str]:
+        """
+        SNOMED CT edition/version the server currently expands against
+        
+        Returns:
+            Version URI (e.g. http://snomed.info/sct/83821000000107/version/20250917), or None
+        """
+        result = self._lookup_concept_uncached(SNOMED_ROOT_CONCEPT)
+        if not result:
+            return None
+        return _snomed_version(result.get('parameter'))
+    
     def batch_expand_concepts(self, snomed_codes: List[str], include_inactive: bool = False) -> Dict[str, ExpansionResult]:
         """
         Expand multiple SNOMED concepts in batch
         
+        Codes are expanded concurrently at the adaptive concurrency controller's
+        current limit, which follows the server's latency and error rates.
+        
         Args:
             snomed_codes: List of SNOMED CT codes to expand
             include_inactive: Whether to include inactive concepts
-            
+        
         Returns:
             Dictionary mapping codes to their expansion results
         """
         results = {}
+        if not snomed_codes:
+            return results
+        
+        controller = get_concurrency_controller()
+        
+        def expand_with_slot(code: str) -> ExpansionResult:
+            with controller.slot():
+                return self._expand_concept_uncached(code, include_inactive)
         
         # Progress tracking for batch operations
         progress_bar = st.progress(0)
         status_text = st.empty()
         
         try:
-            for i, code in enumerate(snomed_codes):
-                status_text.text(f"Expanding {code} ({i+1}/{len(snomed_codes)})")
-                
-                result = self.expand_concept(code, include_inactive)
-                results[code] = result
-                
-                # Update progress
-                progress = (i + 1) / len(snomed_codes)
-                progress_bar.progress(progress)
-                
-                # Small delay to avoid overwhelming the server
-                time.sleep(0.1)
-                
+            # Authenticate here so worker threads never need Streamlit for errors
+            self._ensure_authenticated()
+            
+            with ThreadPoolExecutor(max_workers=min(controller.max_limit, len(snomed_codes))) as executor:
+                futures = {executor.submit(expand_with_slot, code): code for code in snomed_codes}
+                for i, future in enumerate(as_completed(futures)):
+                    code = futures[future]
+                    results[code] = future.result()
+                    
+                    # Update progress
+                    progress_bar.progress((i + 1) / len(snomed_codes))
+                    status_text.text(f"Expanded {code} ({i+1}/{len(snomed_codes)}, concurrency limit {controller.limit})")
+        
         finally:
             progress_bar.empty()
             status_text.empty()
         
-        return results
+        # Keep the caller's order
+        return {code: results[code] for code in snomed_codes if code in results}
     
     def test_connection(self) -> Tuple[bool, str]:
         """
@@ -405,7 +576,7 @@ class NHSTerminologyClient:
                 return True, "Successfully connected to NHS Terminology Server"
             else:
                 return False, error_message or "Connected but received unexpected response"
-                
+        
         except Exception as e:
             return False, f"Connection test failed: {str(e)}"
 
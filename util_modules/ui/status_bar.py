@@ -1,6 +1,6 @@
 import streamlit as st
 import re
-from ..utils.lookup import load_lookup_table, get_lookup_statistics
+from ..utils.lookup import load_lookup_table, get_lookup_statistics, get_lookup_handle
 from ..utils.caching.lookup_cache import get_cached_emis_lookup
 
 # NHS Terminology Server integration
@@ -64,8 +64,8 @@ def render_status_bar():
             # Clear status placeholder
             status_placeholder.empty()
                 
-            # Get lookup statistics
-            stats = get_lookup_statistics(lookup_df)
+            # Get lookup statistics (cache keyed on the table's version fingerprint, not its contents)
+            stats = get_lookup_statistics(get_lookup_handle(lookup_df, emis_guid_col, snomed_code_col, version_info))
             
             # Use cached status content for better performance
             status_message = _get_cached_status_content(
@@ -120,6 +120,7 @@ class BaseTab(ABC):
         """
         # Import here to avoid circular imports
         from ...core.translator import translate_emis_to_snomed
+        from ...utils.lookup import get_lookup_handle
         
         try:
             emis_guids = self.session_state.get('emis_guids', [])
@@ -127,9 +128,14 @@ class BaseTab(ABC):
             
             if emis_guids and lookup_df is not None:
                 # Trigger reprocessing with new deduplication mode
+                lookup_handle = get_lookup_handle(
+                    lookup_df,
+                    self.session_state.get('emis_guid_col'),
+                    self.session_state.get('snomed_code_col')
+                )
                 new_results = translate_emis_to_snomed(
                     emis_guids, 
-                    lookup_df, 
+                    lookup_handle, 
                     deduplication_mode=mode
                 )
                 
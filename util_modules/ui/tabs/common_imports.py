@@ -49,7 +49,7 @@ from ...export_handlers.report_export import ReportExportHandler
 
 # Core translation and lookup
 from ...core.translator import translate_emis_to_snomed
-from ...utils.lookup import get_optimized_lookup_cache
+from ...utils.lookup import get_optimized_lookup_cache, get_lookup_handle
 
 # Re-export commonly used functions for convenience
 __all__ = [
@@ -72,5 +72,5 @@ __all__ = [
     'UIExportManager', 'ReportExportHandler',
     
     # Translation and lookup
-    'translate_emis_to_snomed', 'get_optimized_lookup_cache'
+    'translate_emis_to_snomed', 'get_optimized_lookup_cache', 'get_lookup_handle'
 ]
\ No newline at end of file
@@ -53,7 +53,7 @@ def _reprocess_with_new_mode(deduplication_mode):
                 # Re-translate with new mode
                 translated_codes = translate_emis_to_snomed(
                     emis_guids, 
-                    lookup_df, 
+                    get_lookup_handle(lookup_df, emis_guid_col, snomed_code_col), 
                     emis_guid_col, 
                     snomed_code_col,
                     deduplication_mode
@@ -0,0 +1,115 @@
+"""
+Cache Encryption Key Management
+
+Derives the lookup cache keys from the GZIP_TOKEN secret. PBKDF2 is
+deliberately slow (100,000 iterations), so keys are derived once per process
+per secret and held alongside a memoized Fernet instance and the AES-GCM key
+used for columnar cache chunks. Every cache read/write path goes through
+get_cache_key_manager().
+"""
+
+import base64
+import hashlib
+import threading
+from typing import Dict, NamedTuple, Optional
+
+import streamlit as st
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+
+# Use a fixed salt for consistency across sessions
+CACHE_KEY_SALT = b'emis_cache_salt_2024'
+CACHE_KEY_ITERATIONS = 100000
+CHUNK_KEY_INFO = b'emis-lookup-cache-chunks'
+
+
+class CacheKeys(NamedTuple):
+    """Keys derived from one secret"""
+    fernet_key: bytes
+    fernet: Fernet
+    chunk_key: bytes
+
+
+def derive_cache_keys(secret: str) -> CacheKeys:
+    """Run the (slow) key derivation for a secret"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=CACHE_KEY_SALT,
+        iterations=CACHE_KEY_ITERATIONS,
+    )
+    master_key = kdf.derive(secret.encode())
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=CHUNK_KEY_INFO)
+    fernet_key = base64.urlsafe_b64encode(master_key)
+    return CacheKeys(fernet_key, Fernet(fernet_key), hkdf.derive(master_key))
+
+
+class CacheKeyManager:
+    """
+    Per-process store of derived cache keys.
+    
+    Keys are held per secret (by digest, so the secret itself is not kept),
+    which means a rotated GZIP_TOKEN derives fresh keys rather than reusing
+    stale ones.
+    """
+    
+    def __init__(self):
+        self._keys: Dict[str, CacheKeys] = {}
+        self._lock = threading.Lock()
+    
+    def _read_secret(self) -> Optional[str]:
+        """GZIP_TOKEN from Streamlit secrets, or None when it is not configured"""
+        try:
+            return st.secrets["GZIP_TOKEN"]
+        except KeyError:
+            # No encryption token available - cache will be unencrypted
+            return None
+        except Exception:
+            # Other errors - cache will be unencrypted
+            return None
+    
+    def get_keys(self, secret: Optional[str] = None) -> Optional[CacheKeys]:
+        """Keys for a secret (GZIP_TOKEN by default), deriving them on first use only"""
+        if secret is None:
+            secret = self._read_secret()
+        if not secret:
+            return None
+        
+        digest = hashlib.sha256(secret.encode()).hexdigest()
+        keys = self._keys.get(digest)
+        if keys is None:
+            # Derive under the lock so concurrent first reads only pay PBKDF2 once
+            with self._lock:
+                keys = self._keys.get(digest)
+                if keys is None:
+                    keys = derive_cache_keys(secret)
+                    self._keys[digest] = keys
+        return keys
+    
+    def get_fernet_key(self) -> Optional[bytes]:
+        keys = self.get_keys()
+        return keys.fernet_key if keys else None
+    
+    def get_fernet(self) -> Optional[Fernet]:
+        keys = self.get_keys()
+        return keys.fernet if keys else None
+    
+    def get_chunk_key(self) -> Optional[bytes]:
+        keys = self.get_keys()
+        return keys.chunk_key if keys else None
+    
+    def clear(self):
+        """Forget all derived keys"""
+        with self._lock:
+            self._keys = {}
+
+
+_cache_key_manager = CacheKeyManager()
+
+
+def get_cache_key_manager() -> CacheKeyManager:
+    """Get the process-wide cache key manager."""
+    return _cache_key_manager
@@ -0,0 +1,181 @@
+"""
+Chunked, Encrypted Columnar Cache Files
+
+On-disk format for the EMIS lookup cache. Tables are written as Arrow IPC
+record batches (zstd-compressed buffers), and each batch is sealed as its own
+AES-GCM chunk, so a reader can memory-map the file and decrypt one chunk at a
+time instead of holding the whole ciphertext, plaintext and unpickled copy of
+the table in memory at once.
+
+File layout:
+    MAGIC (8 bytes) | flags (1 byte) | file id (16 bytes)
+    chunk*: section (1) | index (4) | last (1) | length (4) | payload
+
+Chunk 0 of section 0 holds the JSON metadata (including the chunk count of
+every table section). Encrypted payloads are nonce (12 bytes) + ciphertext,
+authenticated with the file id, section, index and last flag so chunks cannot
+be reordered, truncated or spliced in from another file.
+"""
+
+import json
+import os
+import struct
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+COLUMNAR_CACHE_MAGIC = b'EMISLC03'
+
+# Rows per record batch (and so per encrypted chunk)
+CHUNK_ROWS = 65536
+
+_FLAG_ENCRYPTED = 0x01
+_PREAMBLE = struct.Struct('<8sB16s')
+_CHUNK_HEADER = struct.Struct('<BIBI')
+_NONCE_SIZE = 12
+_METADATA_SECTION = 0
+
+
+def _ipc_options() -> ipc.IpcWriteOptions:
+    """IPC write options, compressing buffers with the best codec this pyarrow build has"""
+    for codec in ('zstd', 'lz4'):
+        if pa.Codec.is_available(codec):
+            return ipc.IpcWriteOptions(compression=codec)
+    return ipc.IpcWriteOptions()
+
+
+def _serialize_batch(batch: pa.RecordBatch, options: ipc.IpcWriteOptions) -> bytes:
+    """Serialize one record batch as a self-contained IPC stream (schema + batch)"""
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, batch.schema, options=options) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _table_batches(table: pa.Table):
+    """Record batches of at most CHUNK_ROWS rows; empty tables still get one (empty) batch"""
+    batches = table.to_batches(max_chunksize=CHUNK_ROWS)
+    if not batches:
+        batches = [pa.RecordBatch.from_pylist([], schema=table.schema)]
+    return batches
+
+
+def _associated_data(file_id: bytes, section: int, index: int, last: bool) -> bytes:
+    return file_id + struct.pack('<BIB', section, index, int(last))
+
+
+def write_columnar_cache(path: str, metadata: Dict, tables: Dict[str, pa.Table], key: Optional[bytes] = None):
+    """
+    Write tables and metadata to a chunked columnar cache file.
+    
+    Args:
+        path: Destination file (written to a temporary file and moved into place)
+        metadata: JSON-serializable metadata stored in the first chunk
+        tables: Named Arrow tables, each written as a section of record batch chunks
+        key: 32-byte AES-GCM key, or None to write unencrypted chunks
+    """
+    cipher = AESGCM(key) if key is not None else None
+    file_id = os.urandom(16)
+    options = _ipc_options()
+    
+    # Chunk counts go in the metadata so readers can detect truncated sections
+    section_batches = {name: _table_batches(table) for name, table in tables.items()}
+    metadata = dict(metadata)
+    metadata['sections'] = [[name, len(batches)] for name, batches in section_batches.items()]
+    
+    def chunks() -> Iterable[Tuple[int, int, bool, bytes]]:
+        yield _METADATA_SECTION, 0, True, json.dumps(metadata).encode('utf-8')
+        for section, batches in enumerate(section_batches.values(), start=1):
+            for index, batch in enumerate(batches):
+                yield section, index, index == len(batches) - 1, _serialize_batch(batch, options)
+    
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(COLUMNAR_CACHE_MAGIC, _FLAG_ENCRYPTED if cipher else 0, file_id))
+        for section, index, last, plaintext in chunks():
+            if cipher is not None:
+                nonce = os.urandom(_NONCE_SIZE)
+                plaintext = nonce + cipher.encrypt(nonce, plaintext, _associated_data(file_id, section, index, last))
+            f.write(_CHUNK_HEADER.pack(section, index, int(last), len(plaintext)))
+            f.write(plaintext)
+    os.replace(temp_path, path)
+
+
+class ColumnarCacheReader:
+    """
+    Chunk-at-a-time reader for columnar cache files.
+    
+    Files are memory-mapped, so the ciphertext is paged in from disk as chunks
+    are read rather than loaded up front; only one decrypted chunk is held in
+    memory at a time on top of the Arrow batches being assembled.
+    """
+    
+    def __init__(self, source: Union[str, bytes], key: Optional[bytes] = None):
+        self._buffer = pa.memory_map(source).read_buffer() if isinstance(source, str) else pa.py_buffer(source)
+        if self._buffer.size < _PREAMBLE.size:
+            raise ValueError("Columnar cache file is truncated")
+        
+        magic, flags, self._file_id = _PREAMBLE.unpack(self._buffer.slice(0, _PREAMBLE.size).to_pybytes())
+        if magic != COLUMNAR_CACHE_MAGIC:
+            raise ValueError("Not a columnar cache file")
+        
+        self.encrypted = bool(flags & _FLAG_ENCRYPTED)
+        if self.encrypted and key is None:
+            raise ValueError("Columnar cache file is encrypted and no key is available")
+        self._cipher = AESGCM(key) if self.encrypted else None
+        
+        # Index chunk offsets without reading their payloads
+        self._chunks = {}
+        offset = _PREAMBLE.size
+        while offset < self._buffer.size:
+            header = self._buffer.slice(offset, _CHUNK_HEADER.size).to_pybytes()
+            if len(header) < _CHUNK_HEADER.size:
+                raise ValueError("Columnar cache file is truncated")
+            section, index, last, length = _CHUNK_HEADER.unpack(header)
+            offset += _CHUNK_HEADER.size
+            if offset + length > self._buffer.size:
+                raise ValueError("Columnar cache file is truncated")
+            self._chunks[(section, index)] = (offset, length, bool(last))
+            offset += length
+        
+        self.metadata = json.loads(self._read_chunk(_METADATA_SECTION, 0, expect_last=True).to_pybytes())
+        self._sections = {name: (section, count) for section, (name, count) in enumerate(self.metadata['sections'], start=1)}
+    
+    def _read_chunk(self, section: int, index: int, expect_last: bool) -> pa.Buffer:
+        """Authenticate and decrypt one chunk"""
+        if (section, index) not in self._chunks:
+            raise ValueError(f"Columnar cache chunk {section}/{index} is missing")
+        offset, length, last = self._chunks[(section, index)]
+        if last != expect_last:
+            raise ValueError(f"Columnar cache section {section} is truncated")
+        payload = self._buffer.slice(offset, length)
+        if self._cipher is None:
+            return payload
+        
+        payload = payload.to_pybytes()
+        plaintext = self._cipher.decrypt(payload[:_NONCE_SIZE], payload[_NONCE_SIZE:],
+                                         _associated_data(self._file_id, section, index, last))
+        return pa.py_buffer(plaintext)
+    
+    def has_section(self, name: str) -> bool:
+        return name in self._sections
+    
+    def iter_batches(self, name: str) -> Iterable[pa.RecordBatch]:
+        """Record batches of a section, decrypting one chunk at a time"""
+        section, count = self._sections[name]
+        for index in range(count):
+            with ipc.open_stream(self._read_chunk(section, index, expect_last=index == count - 1)) as reader:
+                yield from reader
+    
+    def read_table(self, name: str) -> pa.Table:
+        """Assemble a whole section into an Arrow table"""
+        batches = list(self.iter_batches(name))
+        return pa.Table.from_batches(batches)
+
+
+def is_columnar_cache(data: Union[bytes, memoryview]) -> bool:
+    """Check whether raw file content starts with the columnar cache magic"""
+    return bytes(data[:len(COLUMNAR_CACHE_MAGIC)]) == COLUMNAR_CACHE_MAGIC
@@ -7,6 +7,7 @@ optimizing performance for terminology server integrations and other lookup oper
 Supports both local caching (for development) and GitHub-based caching (for production).
 """
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import pickle
@@ -14,45 +15,49 @@ import gzip
 import hashlib
 import os
 import requests
+from collections.abc import Mapping
 from typing import Dict, Optional, Tuple
 from datetime import datetime
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-import base64
+import pyarrow as pa
+
+from .cache_keys import get_cache_key_manager
+from .columnar_cache import ColumnarCacheReader, write_columnar_cache, is_columnar_cache
+from ..lookup_index import LookupColumns, LookupIndex
+
+
+# Version of the columnar cache payload written by _build_cache_payload
+CACHE_FORMAT_VERSION = 3
+
+# Cache files: chunked columnar format (current) and pickled dicts (legacy, still read)
+COLUMNAR_CACHE_EXTENSION = ".lkc"
+LEGACY_CACHE_EXTENSION = ".pkl"
+
+# gzip level for cache files - level 9 is ~5x slower than 6 for a ~3% smaller file
+CACHE_COMPRESS_LEVEL = 6
+
+# Lookup record fields exposed by lookup_records, and the table column each one reads
+RECORD_FIELD_COLUMNS = (
+    ('descendants', 'Descendants'),
+    ('has_qualifier', 'HasQualifier'),
+    ('is_parent', 'IsParent'),
+    ('source_type', 'Source_Type'),
+    ('code_type', 'CodeType')
+)
 
 
 def _get_encryption_key() -> Optional[bytes]:
-    """Get encryption key from Streamlit secrets"""
-    try:
-        password = st.secrets["GZIP_TOKEN"]
-        # Use a fixed salt for consistency across sessions
-        salt = b'emis_cache_salt_2024'
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        return key
-    except KeyError:
-        # No encryption token available - cache will be unencrypted
-        return None
-    except Exception:
-        # Other errors - cache will be unencrypted
-        return None
+    """Get encryption key from Streamlit secrets (derived once per process)"""
+    return get_cache_key_manager().get_fernet_key()
 
 
 def _encrypt_data(data: bytes) -> bytes:
     """Encrypt data using the GZIP_TOKEN"""
-    encryption_key = _get_encryption_key()
-    if encryption_key is None:
+    fernet = get_cache_key_manager().get_fernet()
+    if fernet is None:
         # No encryption available - return data as-is
         return data
     
     try:
-        fernet = Fernet(encryption_key)
         return fernet.encrypt(data)
     except Exception:
         # Encryption failed - return data as-is
@@ -61,13 +66,12 @@ def _encrypt_data(data: bytes) -> bytes:
 
 def _decrypt_data(encrypted_data: bytes) -> bytes:
     """Decrypt data using the GZIP_TOKEN"""
-    encryption_key = _get_encryption_key()
-    if encryption_key is None:
+    fernet = get_cache_key_manager().get_fernet()
+    if fernet is None:
         # No encryption key - assume data is unencrypted
         return encrypted_data
     
     try:
-        fernet = Fernet(encryption_key)
         return fernet.decrypt(encrypted_data)
     except Exception:
         # Decryption failed - assume data is unencrypted and return as-is
@@ -102,6 +106,102 @@ def _get_lookup_table_hash(lookup_df: pd.DataFrame, version_info: Dict = None) -
     return _get_lookup_table_hash_from_version_info(version_info)
 
 
+def _stripped_strings(lookup_df: pd.DataFrame, column: str) -> pd.Series:
+    """Column values as stripped strings, the way str(value).strip() renders them ('nan' for missing)"""
+    if column not in lookup_df.columns:
+        return pd.Series('', index=lookup_df.index, dtype=object)
+    return lookup_df[column].astype(str).fillna('nan').str.strip()
+
+
+def _build_cache_payload(lookup_df: pd.DataFrame, snomed_code_col: str, emis_guid_col: str, table_hash: str) -> Dict:
+    """
+    Build the columnar cache payload for a lookup table.
+    
+    The table is kept as an Arrow table, and the SNOMED -> EMIS GUID mapping as a
+    second Arrow table of normalized SNOMED code, EMIS GUID and table row, so the
+    payload holds no per-row dicts.
+    """
+    snomed_codes = _stripped_strings(lookup_df, snomed_code_col)
+    emis_guids = _stripped_strings(lookup_df, emis_guid_col)
+    valid_mask = ((snomed_codes != '') & (snomed_codes != 'nan') & (emis_guids != '')).to_numpy(dtype=bool)
+    
+    # Normalize SNOMED codes by removing the .0 suffix float columns leave behind
+    snomed_codes = snomed_codes.where(~snomed_codes.str.endswith('.0'), snomed_codes.str[:-2])
+    
+    # One entry per SNOMED code in first-seen order, holding its last row (same as the old dict build)
+    valid_rows = np.flatnonzero(valid_mask)
+    code_ids, mapping_codes = pd.factorize(snomed_codes.to_numpy(dtype=object)[valid_rows])
+    mapping_rows = pd.Series(valid_rows).groupby(code_ids, sort=True).last().to_numpy()
+    
+    return {
+        'format_version': CACHE_FORMAT_VERSION,
+        'tables': {
+            'table': pa.Table.from_pandas(lookup_df, preserve_index=False),
+            'mapping': pa.table({
+                'snomed_code': pa.array(np.asarray(mapping_codes, dtype=object), type=pa.string()),
+                'emis_guid': pa.array(emis_guids.to_numpy(dtype=object)[mapping_rows], type=pa.string()),
+                'row': pa.array(mapping_rows, type=pa.int32())
+            })
+        },
+        'column_names': {
+            'snomed': snomed_code_col,
+            'emis': emis_guid_col
+        },
+        'created_at': datetime.now().isoformat(),
+        'record_count': len(lookup_df),  # Total records
+        'valid_mapping_count': int(valid_mask.sum()),  # Valid mappings only
+        'table_hash': table_hash,
+        'available_columns': [str(col) for col in lookup_df.columns]
+    }
+
+
+def _is_valid_cache_data(cache_data) -> bool:
+    """Check a loaded cache has either the columnar layout or the legacy dict layout"""
+    if not isinstance(cache_data, dict):
+        return False
+    if cache_data.get('format_version') == CACHE_FORMAT_VERSION:
+        return isinstance(cache_data.get('tables'), dict)
+    return 'lookup_mapping' in cache_data and 'lookup_records' in cache_data
+
+
+def _cache_lookup_mappings(cache_data: Dict) -> Tuple[Mapping, Mapping]:
+    """
+    SNOMED -> EMIS GUID mapping and SNOMED -> record mapping for a loaded cache.
+    
+    Columnar caches are served through LookupIndex views over the mapping table,
+    legacy caches return their stored dicts.
+    """
+    if cache_data.get('format_version') != CACHE_FORMAT_VERSION:
+        return cache_data['lookup_mapping'], cache_data['lookup_records']
+    
+    table = cache_data['tables']['table']
+    mapping = cache_data['tables']['mapping']
+    key_columns = (cache_data['column_names']['snomed'], cache_data['column_names']['emis'])
+    rows = mapping.column('row').to_numpy()
+    
+    def record_column(column):
+        return table.column(column).take(rows).to_pandas()
+    
+    # Record layout matches the legacy dicts: GUID, named fields, then all other columns
+    record_columns = {'emis_guid': mapping.column('emis_guid').to_pandas()}
+    for field, column in RECORD_FIELD_COLUMNS:
+        if column in table.column_names and column not in key_columns:
+            record_columns[field] = record_column(column)
+        else:
+            record_columns[field] = np.full(len(rows), '', dtype=object)
+    for column in table.column_names:
+        if column not in key_columns:
+            record_columns[column] = record_column(column)
+    
+    lookup_records = LookupIndex(mapping.column('snomed_code').to_pandas(), LookupColumns(record_columns))
+    return lookup_records.field_view('emis_guid'), lookup_records
+
+
+def _cache_to_dataframe(cache_data: Dict) -> pd.DataFrame:
+    """Rebuild the lookup table from a columnar cache (column dtypes restored from the Arrow schema)"""
+    return cache_data['tables']['table'].to_pandas()
+
+
 def _get_cache_directory() -> str:
     """Get or create the cache directory"""
     cache_dir = os.path.join(os.path.dirname(__file__), "..", "..", "..", ".cache")
@@ -109,53 +209,88 @@ def _get_cache_directory() -> str:
     return cache_dir
 
 
-def _get_github_cache_url(table_hash: str) -> str:
+def _get_cache_file(table_hash: str, extension: str = COLUMNAR_CACHE_EXTENSION) -> str:
+    """Get the local cache file path for a lookup table hash"""
+    return os.path.join(_get_cache_directory(), f"emis_lookup_{table_hash}{extension}")
+
+
+def _get_github_cache_url(table_hash: str, extension: str = LEGACY_CACHE_EXTENSION) -> str:
     """Get GitHub URL for the cache file"""
-    return f"https://raw.githubusercontent.com/triplebob/emis-xml-toolkit/main/.cache/emis_lookup_{table_hash}.pkl"
+    return f"https://raw.githubusercontent.com/triplebob/emis-xml-toolkit/main/.cache/emis_lookup_{table_hash}{extension}"
+
+
+def _get_chunk_encryption_key() -> Optional[bytes]:
+    """AES-GCM key for columnar cache chunks, derived from the GZIP_TOKEN cache key"""
+    return get_cache_key_manager().get_chunk_key()
+
+
+def _write_columnar_cache(cache_data: Dict, cache_file: str):
+    """Write a columnar cache payload as chunked (and, with GZIP_TOKEN, encrypted) Arrow batches"""
+    metadata = {key: value for key, value in cache_data.items() if key != 'tables'}
+    write_columnar_cache(cache_file, metadata, cache_data['tables'], _get_chunk_encryption_key())
+
+
+def _read_columnar_cache(source, sections: Tuple[str, ...] = ('table', 'mapping')) -> Dict:
+    """
+    Read a columnar cache file (path, memory-mapped) or downloaded content.
+    
+    Only the requested sections are decrypted, one chunk at a time, straight
+    into Arrow tables.
+    """
+    reader = ColumnarCacheReader(source, _get_chunk_encryption_key())
+    cache_data = {key: value for key, value in reader.metadata.items() if key != 'sections'}
+    cache_data['tables'] = {name: reader.read_table(name) for name in sections}
+    return cache_data
+
+
+def _read_legacy_cache(encrypted_data: bytes) -> Dict:
+    """Decrypt, decompress and unpickle a legacy .pkl cache file"""
+    try:
+        decrypted_data = _decrypt_data(encrypted_data)
+        
+        # Try gzip decompression first, fallback to uncompressed
+        try:
+            return pickle.loads(gzip.decompress(decrypted_data))
+        except (gzip.BadGzipFile, OSError):
+            # Fallback for old uncompressed cache files
+            return pickle.loads(decrypted_data)
+    except Exception:
+        # If decryption fails, try without decryption (backward compatibility)
+        try:
+            return pickle.loads(gzip.decompress(encrypted_data))
+        except (gzip.BadGzipFile, OSError):
+            return pickle.loads(encrypted_data)
 
 
 def _download_github_cache(table_hash: str) -> Optional[Dict]:
     """
     Download cache from GitHub repository
+    Tries the columnar cache file first, then the legacy pickle file
     
     Args:
         table_hash: Hash of the lookup table
-        
+    
     Returns:
         Cache data dict or None if not available
     """
-    try:
-        cache_url = _get_github_cache_url(table_hash)
-        response = requests.get(cache_url, timeout=10)
-        
-        if response.status_code == 200:
-            # Try decryption first, then gzip decompression
-            try:
-                # Attempt to decrypt the data
-                decrypted_data = _decrypt_data(response.content)
-                
-                # Try gzip decompression first, fallback to uncompressed
-                try:
-                    cache_data = pickle.loads(gzip.decompress(decrypted_data))
-                except (gzip.BadGzipFile, OSError):
-                    # Fallback for old uncompressed cache files
-                    cache_data = pickle.loads(decrypted_data)
-            except Exception:
-                # If decryption fails, try without decryption (backward compatibility)
-                try:
-                    cache_data = pickle.loads(gzip.decompress(response.content))
-                except (gzip.BadGzipFile, OSError):
-                    cache_data = pickle.loads(response.content)
+    for extension in (COLUMNAR_CACHE_EXTENSION, LEGACY_CACHE_EXTENSION):
+        try:
+            cache_url = _get_github_cache_url(table_hash, extension)
+            response = requests.get(cache_url, timeout=10)
             
-            # Validate cache structure
-            if (isinstance(cache_data, dict) and 
-                'lookup_mapping' in cache_data and 
-                'lookup_records' in cache_data):
-                return cache_data
+            if response.status_code == 200:
+                if is_columnar_cache(response.content):
+                    cache_data = _read_columnar_cache(response.content)
+                else:
+                    cache_data = _read_legacy_cache(response.content)
+                
+                # Validate cache structure
+                if _is_valid_cache_data(cache_data):
+                    return cache_data
         
-    except Exception as e:
-        # Silently fail - will fall back to local cache or building
-        pass
+        except Exception as e:
+            # Silently fail - will fall back to local cache or building
+            pass
     
     return None
 
@@ -163,34 +298,41 @@ def _download_github_cache(table_hash: str) -> Optional[Dict]:
 def _save_local_cache(cache_data: Dict, table_hash: str) -> bool:
     """
     Save cache data to local file system
+    Columnar payloads are written in the chunked columnar format, legacy payloads as pickles
     
     Args:
         cache_data: Complete cache data dictionary
         table_hash: Hash of the lookup table
-        
+    
     Returns:
         True if successful, False otherwise
     """
     try:
         cache_dir = _get_cache_directory()
-        cache_file = os.path.join(cache_dir, f"emis_lookup_{table_hash}.pkl")
         
-        # Compress first, then encrypt
-        compressed_data = gzip.compress(pickle.dumps(cache_data, protocol=pickle.HIGHEST_PROTOCOL))
-        encrypted_data = _encrypt_data(compressed_data)
-        
-        with open(cache_file, 'wb') as f:
-            f.write(encrypted_data)
+        if cache_data.get('format_version') == CACHE_FORMAT_VERSION:
+            cache_file = _get_cache_file(table_hash, COLUMNAR_CACHE_EXTENSION)
+            _write_columnar_cache(cache_data, cache_file)
+        else:
+            cache_file = _get_cache_file(table_hash, LEGACY_CACHE_EXTENSION)
+            
+            # Compress first, then encrypt
+            compressed_data = gzip.compress(pickle.dumps(cache_data, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=CACHE_COMPRESS_LEVEL)
+            encrypted_data = _encrypt_data(compressed_data)
+            
+            with open(cache_file, 'wb') as f:
+                f.write(encrypted_data)
         
         # Clean up old cache files (keep only the latest)
-        _cleanup_old_cache_files(cache_dir, table_hash)
+        _cleanup_old_cache_files(cache_dir, os.path.basename(cache_file))
         return True
-        
+    
     except Exception:
         return False
 
 
-def _load_local_cache(table_hash: str, snomed_code_col: str, emis_guid_col: str) -> Optional[Dict]:
+def _load_local_cache(table_hash: str, snomed_code_col: str, emis_guid_col: str,
+                      sections: Tuple[str, ...] = ('table', 'mapping')) -> Optional[Dict]:
     """
     Load cache from local file system
     
@@ -198,53 +340,45 @@ def _load_local_cache(table_hash: str, snomed_code_col: str, emis_guid_col: str)
         table_hash: Hash of the lookup table
         snomed_code_col: Expected SNOMED column name
         emis_guid_col: Expected EMIS GUID column name
-        
+        sections: Tables to read from a columnar cache file (an empty tuple reads metadata only)
+    
     Returns:
         Cache data dict or None if not available
     """
     try:
-        cache_dir = _get_cache_directory()
-        cache_file = os.path.join(cache_dir, f"emis_lookup_{table_hash}.pkl")
+        columnar_file = _get_cache_file(table_hash, COLUMNAR_CACHE_EXTENSION)
+        legacy_file = _get_cache_file(table_hash, LEGACY_CACHE_EXTENSION)
+        
+        if os.path.exists(columnar_file):
+            cached_data = _read_columnar_cache(columnar_file, sections)
+        elif os.path.exists(legacy_file):
+            with open(legacy_file, 'rb') as f:
+                cached_data = _read_legacy_cache(f.read())
+        else:
+            return None
         
-        if os.path.exists(cache_file):
-            with open(cache_file, 'rb') as f:
-                encrypted_data = f.read()
-                
-            # Decrypt first, then decompress
-            try:
-                decrypted_data = _decrypt_data(encrypted_data)
-                cached_data = pickle.loads(gzip.decompress(decrypted_data))
-            except Exception:
-                # Fallback for old unencrypted cache files
-                try:
-                    cached_data = pickle.loads(gzip.decompress(encrypted_data))
-                except (gzip.BadGzipFile, OSError):
-                    # Very old uncompressed files
-                    cached_data = pickle.loads(encrypted_data)
-                
-            # Validate cache structure and column names
-            if (isinstance(cached_data, dict) and 
-                'lookup_mapping' in cached_data and 
-                'lookup_records' in cached_data and
-                'column_names' in cached_data and
-                cached_data['column_names']['snomed'] == snomed_code_col and
-                cached_data['column_names']['emis'] == emis_guid_col):
-                
-                return cached_data
+        # Validate cache structure and column names
+        if (_is_valid_cache_data(cached_data) and
+            'column_names' in cached_data and
+            cached_data['column_names']['snomed'] == snomed_code_col and
+            cached_data['column_names']['emis'] == emis_guid_col):
+            
+            return cached_data
     except Exception:
         pass
     
     return None
 
 
-def _cleanup_old_cache_files(cache_dir: str, current_hash: str):
-    """Remove old cache files, keeping only the current one"""
+def _cleanup_old_cache_files(cache_dir: str, current_file: str):
+    """Remove old cache files (either format), keeping only the current one"""
     try:
         for filename in os.listdir(cache_dir):
-            if filename.startswith("emis_lookup_") and filename.endswith(".pkl"):
-                if current_hash not in filename:
-                    old_file = os.path.join(cache_dir, filename)
-                    os.remove(old_file)
+            if (filename.startswith("emis_lookup_") and
+                    filename.endswith((COLUMNAR_CACHE_EXTENSION, LEGACY_CACHE_EXTENSION)) and
+                    filename != current_file):
+                old_file = os.path.join(cache_dir, filename)
+                os.remove(old_file)
     except Exception:
         # Ignore cleanup errors
         pass
@@ -259,7 +393,7 @@ def build_emis_lookup_cache(lookup_df: pd.DataFrame, snomed_code_col: str, emis_
         lookup_df: The lookup table DataFrame
         snomed_code_col: Name of the SNOMED code column
         emis_guid_col: Name of the EMIS GUID column
-        
+    
     Returns:
         bool: True if cache is available (from any source), False otherwise
     """
@@ -269,8 +403,8 @@ def build_emis_lookup_cache(lookup_df: pd.DataFrame, snomed_code_col: str, emis_
     try:
         table_hash = _get_lookup_table_hash(lookup_df, version_info)
         
-        # Step 1: Check if local cache exists first (fastest)
-        local_cache = _load_local_cache(table_hash, snomed_code_col, emis_guid_col)
+        # Step 1: Check if local cache exists first (fastest - columnar files only read their metadata)
+        local_cache = _load_local_cache(table_hash, snomed_code_col, emis_guid_col, sections=())
         if local_cache is not None:
             # Local cache exists, no need to rebuild
             return True
@@ -282,73 +416,14 @@ def build_emis_lookup_cache(lookup_df: pd.DataFrame, snomed_code_col: str, emis_
             _save_local_cache(github_cache, table_hash)
             return True
         
-        # Build comprehensive lookup data - preserve ALL records
-        emis_lookup = {}
-        lookup_records = {}
-        all_records = []  # Store complete DataFrame records
-        lookup_count = 0
-        valid_mapping_count = 0
-        
-        for index, row in lookup_df.iterrows():
-            lookup_count += 1
-            
-            # Store complete record for DataFrame reconstruction
-            record_dict = {}
-            for col in lookup_df.columns:
-                record_dict[col] = row.get(col, '')
-            all_records.append(record_dict)
-            
-            # Also build mapping dictionaries for valid records only
-            snomed_code_raw = str(row.get(snomed_code_col, '')).strip()
-            emis_guid = str(row.get(emis_guid_col, '')).strip()
-            if snomed_code_raw and emis_guid and snomed_code_raw != 'nan':
-                valid_mapping_count += 1
-                
-                # Normalize SNOMED code by removing .0 suffix if present
-                snomed_code = snomed_code_raw[:-2] if snomed_code_raw.endswith('.0') else snomed_code_raw
-                
-                # Store normalized SNOMED -> EMIS GUID mapping
-                emis_lookup[snomed_code] = emis_guid
-                
-                # Store complete record data for advanced features
-                record_data = {}
-                for col in lookup_df.columns:
-                    if col not in [snomed_code_col, emis_guid_col]:  # Avoid duplication
-                        record_data[col] = row.get(col, '')
-                
-                # Store using normalized SNOMED code (without .0)
-                lookup_records[snomed_code] = {
-                    'emis_guid': emis_guid,
-                    'descendants': record_data.get('Descendants', ''),
-                    'has_qualifier': record_data.get('HasQualifier', ''),
-                    'is_parent': record_data.get('IsParent', ''),
-                    'source_type': record_data.get('Source_Type', ''),
-                    'code_type': record_data.get('CodeType', ''),
-                    **record_data  # Include all other columns
-                }
-        
-        # Step 3: Build cache from scratch
-        # Save to local cache
-        cache_data = {
-            'lookup_mapping': emis_lookup,  # SNOMED -> EMIS GUID mapping (valid only)
-            'lookup_records': lookup_records,  # SNOMED -> full record data (valid only)
-            'all_records': all_records,  # Complete DataFrame records (ALL records)
-            'column_names': {
-                'snomed': snomed_code_col,
-                'emis': emis_guid_col
-            },
-            'created_at': datetime.now().isoformat(),
-            'record_count': lookup_count,  # Total records
-            'valid_mapping_count': valid_mapping_count,  # Valid mappings only
-            'table_hash': table_hash,
-            'available_columns': list(lookup_df.columns)
-        }
+        # Step 3: Build cache from scratch - columnar payload preserving ALL records
+        cache_data = _build_cache_payload(lookup_df, snomed_code_col, emis_guid_col, table_hash)
         
         # Save locally
         saved_locally = _save_local_cache(cache_data, table_hash)
         
         return saved_locally
-        
+    
     except Exception as e:
         # If cache building fails, log but don't crash
         st.warning(f"Could not build EMIS lookup cache: {str(e)}")
@@ -369,7 +444,7 @@ def get_latest_cached_emis_lookup() -> Optional[Tuple[pd.DataFrame, str, str, Di
         # Find all cache files
         cache_files = []
         for filename in os.listdir(cache_dir):
-            if filename.startswith("emis_lookup_") and filename.endswith(".pkl"):
+            if filename.startswith("emis_lookup_") and filename.endswith((COLUMNAR_CACHE_EXTENSION, LEGACY_CACHE_EXTENSION)):
                 cache_file = os.path.join(cache_dir, filename)
                 mtime = os.path.getmtime(cache_file)
                 cache_files.append((mtime, cache_file, filename))
@@ -380,32 +455,24 @@ def get_latest_cached_emis_lookup() -> Optional[Tuple[pd.DataFrame, str, str, Di
         # Sort by modification time (newest first)
         cache_files.sort(reverse=True)
         latest_cache_file = cache_files[0][1]
-        # Load the latest cache file
-        with open(latest_cache_file, 'rb') as f:
-            encrypted_data = f.read()
-            
-        # Decrypt and decompress
-        try:
-            decrypted_data = _decrypt_data(encrypted_data)
-            cached_data = pickle.loads(gzip.decompress(decrypted_data))
-        except Exception:
-            # Fallback for old formats
-            try:
-                cached_data = pickle.loads(gzip.decompress(encrypted_data))
-            except (gzip.BadGzipFile, OSError):
-                cached_data = pickle.loads(encrypted_data)
+        # Load the latest cache file - columnar files only need the table section
+        if latest_cache_file.endswith(COLUMNAR_CACHE_EXTENSION):
+            cached_data = _read_columnar_cache(latest_cache_file, sections=('table',))
+        else:
+            with open(latest_cache_file, 'rb') as f:
+                cached_data = _read_legacy_cache(f.read())
         
         # Validate cache structure
-        if (isinstance(cached_data, dict) and 
-            'lookup_mapping' in cached_data and 
-            'lookup_records' in cached_data and
+        if (_is_valid_cache_data(cached_data) and
             'column_names' in cached_data):
             
             emis_guid_col = cached_data['column_names']['emis']
             snomed_code_col = cached_data['column_names']['snomed']
             
-            # Use complete records if available (new format), otherwise reconstruct from lookup_records (old format)
-            if 'all_records' in cached_data:
+            # Columnar format converts the Arrow table directly; older formats use record dicts
+            if cached_data.get('format_version') == CACHE_FORMAT_VERSION:
+                lookup_df = _cache_to_dataframe(cached_data)
+            elif 'all_records' in cached_data:
                 # New format - use complete DataFrame records
                 lookup_df = pd.DataFrame(cached_data['all_records'])
             else:
@@ -430,7 +497,7 @@ def get_latest_cached_emis_lookup() -> Optional[Tuple[pd.DataFrame, str, str, Di
             }
             
             return lookup_df, emis_guid_col, snomed_code_col, version_info
-            
+    
     except Exception:
         pass
     
@@ -446,7 +513,7 @@ def get_cached_emis_lookup(lookup_df: pd.DataFrame, snomed_code_col: str, emis_g
         lookup_df: The lookup table DataFrame (for hash validation)
         snomed_code_col: Name of the SNOMED code column
         emis_guid_col: Name of the EMIS GUID column
-        
+    
     Returns:
         Dict with 'lookup_mapping' and 'lookup_records' or None if not cached
     """
@@ -459,9 +526,10 @@ def get_cached_emis_lookup(lookup_df: pd.DataFrame, snomed_code_col: str, emis_g
         # Step 1: Try local cache first (fastest)
         local_cache = _load_local_cache(table_hash, snomed_code_col, emis_guid_col)
         if local_cache is not None:
+            lookup_mapping, lookup_records = _cache_lookup_mappings(local_cache)
             return {
-                'lookup_mapping': local_cache['lookup_mapping'],
-                'lookup_records': local_cache['lookup_records']
+                'lookup_mapping': lookup_mapping,
+                'lookup_records': lookup_records
             }
         
         # Step 2: Try to download from GitHub as fallback
@@ -471,14 +539,13 @@ def get_cached_emis_lookup(lookup_df: pd.DataFrame, snomed_code_col: str, emis_g
             _save_local_cache(github_cache, table_hash)
             
             # Validate and return
-            if (isinstance(github_cache, dict) and 
-                'lookup_mapping' in github_cache and 
-                'lookup_records' in github_cache):
+            if _is_valid_cache_data(github_cache):
+                lookup_mapping, lookup_records = _cache_lookup_mappings(github_cache)
                 return {
-                    'lookup_mapping': github_cache['lookup_mapping'],
-                    'lookup_records': github_cache['lookup_records']
+                    'lookup_mapping': lookup_mapping,
+                    'lookup_records': lookup_records
                 }
-        
+    
     except Exception as e:
         # If cache loading fails, just continue without cache
         pass
@@ -493,7 +560,7 @@ def get_cache_info(lookup_df: pd.DataFrame, version_info: Dict = None) -> Dict[s
     
     Args:
         lookup_df: The lookup table DataFrame
-        
+    
     Returns:
         Dict with cache status information
     """
@@ -504,8 +571,9 @@ def get_cache_info(lookup_df: pd.DataFrame, version_info: Dict = None) -> Dict[s
         table_hash = _get_lookup_table_hash(lookup_df, version_info)
         
         # Check local cache first (fastest)
-        cache_dir = _get_cache_directory()
-        cache_file = os.path.join(cache_dir, f"emis_lookup_{table_hash}.pkl")
+        cache_file = _get_cache_file(table_hash, COLUMNAR_CACHE_EXTENSION)
+        if not os.path.exists(cache_file):
+            cache_file = _get_cache_file(table_hash, LEGACY_CACHE_EXTENSION)
         
         if os.path.exists(cache_file):
             # Get local cache file info
@@ -535,7 +603,7 @@ def get_cache_info(lookup_df: pd.DataFrame, version_info: Dict = None) -> Dict[s
                 "message": "Cache not available - will need to build",
                 "hash": table_hash
             }
-            
+    
     except Exception as e:
         return {"status": "error", "message": f"Cache check failed: {str(e)}"}
 
@@ -552,7 +620,7 @@ def generate_cache_for_github(lookup_df: pd.DataFrame, snomed_code_col: str, emi
         snomed_code_col: Name of the SNOMED code column
         emis_guid_col: Name of the EMIS GUID column
         output_dir: Directory to save the cache file (default: current directory)
-        
+    
     Returns:
         bool: True if cache file was generated successfully
     """
@@ -562,78 +630,17 @@ def generate_cache_for_github(lookup_df: pd.DataFrame, snomed_code_col: str, emi
     
     try:
         table_hash = _get_lookup_table_hash(lookup_df, version_info)
-        output_file = os.path.join(output_dir, f"emis_lookup_{table_hash}.pkl")
+        output_file = os.path.join(output_dir, f"emis_lookup_{table_hash}{COLUMNAR_CACHE_EXTENSION}")
         
         print(f"Building encrypted EMIS lookup cache for GitHub deployment...")
         print(f"Processing {len(lookup_df)} lookup table records...")
         
-        # Build comprehensive lookup data - preserve ALL records (same logic as build_emis_lookup_cache)
-        emis_lookup = {}
-        lookup_records = {}
-        all_records = []  # Store complete DataFrame records
-        lookup_count = 0
-        valid_mapping_count = 0
+        # Build the columnar cache payload (same layout as build_emis_lookup_cache)
+        cache_data = _build_cache_payload(lookup_df, snomed_code_col, emis_guid_col, table_hash)
+        lookup_count = cache_data['record_count']
         
-        for index, row in lookup_df.iterrows():
-            lookup_count += 1
-            
-            # Store complete record for DataFrame reconstruction
-            record_dict = {}
-            for col in lookup_df.columns:
-                record_dict[col] = row.get(col, '')
-            all_records.append(record_dict)
-            
-            # Also build mapping dictionaries for valid records only
-            snomed_code_raw = str(row.get(snomed_code_col, '')).strip()
-            emis_guid = str(row.get(emis_guid_col, '')).strip()
-            if snomed_code_raw and emis_guid and snomed_code_raw != 'nan':
-                valid_mapping_count += 1
-                
-                # Normalize SNOMED code by removing .0 suffix if present
-                snomed_code = snomed_code_raw[:-2] if snomed_code_raw.endswith('.0') else snomed_code_raw
-                
-                # Store normalized SNOMED -> EMIS GUID mapping
-                emis_lookup[snomed_code] = emis_guid
-                
-                # Store complete record data for advanced features
-                record_data = {}
-                for col in lookup_df.columns:
-                    if col not in [snomed_code_col, emis_guid_col]:  # Avoid duplication
-                        record_data[col] = row.get(col, '')
-                
-                # Store using normalized SNOMED code (without .0)
-                lookup_records[snomed_code] = {
-                    'emis_guid': emis_guid,
-                    'descendants': record_data.get('Descendants', ''),
-                    'has_qualifier': record_data.get('HasQualifier', ''),
-                    'is_parent': record_data.get('IsParent', ''),
-                    'source_type': record_data.get('Source_Type', ''),
-                    'code_type': record_data.get('CodeType', ''),
-                    **record_data  # Include all other columns
-                }
-        
-        # Create cache data structure
-        cache_data = {
-            'lookup_mapping': emis_lookup,  # SNOMED -> EMIS GUID mapping (valid only)
-            'lookup_records': lookup_records,  # SNOMED -> full record data (valid only)
-            'all_records': all_records,  # Complete DataFrame records (ALL records)
-            'column_names': {
-                'snomed': snomed_code_col,
-                'emis': emis_guid_col
-            },
-            'created_at': datetime.now().isoformat(),
-            'record_count': lookup_count,  # Total records
-            'valid_mapping_count': valid_mapping_count,  # Valid mappings only
-            'table_hash': table_hash,
-            'available_columns': list(lookup_df.columns)
-        }
-        
-        # Save to file with compression and encryption
-        compressed_data = gzip.compress(pickle.dumps(cache_data, protocol=pickle.HIGHEST_PROTOCOL))
-        encrypted_data = _encrypt_data(compressed_data)
-        
-        with open(output_file, 'wb') as f:
-            f.write(encrypted_data)
+        # Save as chunked columnar file (compressed Arrow batches, encrypted per chunk)
+        _write_columnar_cache(cache_data, output_file)
         
         file_size = os.path.getsize(output_file) / 1024 / 1024  # MB
         
@@ -650,7 +657,7 @@ def generate_cache_for_github(lookup_df: pd.DataFrame, snomed_code_col: str, emi
         print(f"3. The encrypted cache will be automatically downloaded and decrypted by the app")
         
         return True
-        
+    
     except Exception as e:
         print(f"ERROR: Cache generation failed: {str(e)}")
         return False
\ No newline at end of file
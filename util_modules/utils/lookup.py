@@ -1,12 +1,86 @@
 import streamlit as st
 from .github_loader import GitHubLookupLoader
-from .caching.lookup_cache import get_cached_emis_lookup
+from .caching.lookup_cache import get_cached_emis_lookup, _get_lookup_table_hash_from_version_info
+from .lookup_index import LookupColumns, LookupIndex
+import sys
+import numpy as np
 import pandas as pd
-from typing import Dict, Tuple, Any, Optional, List
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Dict, Tuple, Any, Optional, List, Union
 import time
 from functools import lru_cache
 import hashlib
 
+
+@dataclass(frozen=True, eq=False)
+class LookupTableHandle:
+    """
+    Lookup table together with a stable version fingerprint.
+    
+    Cached functions take the handle instead of the DataFrame and key on the
+    fingerprint (see LOOKUP_HASH_FUNCS), so building a cache key is O(1) instead
+    of hashing every row of the table on each call.
+    """
+    lookup_df: pd.DataFrame
+    emis_guid_col: str
+    snomed_code_col: str
+    fingerprint: str
+    
+    @classmethod
+    def create(cls, lookup_df: pd.DataFrame, emis_guid_col: str, snomed_code_col: str,
+               version_info: Optional[Dict] = None) -> 'LookupTableHandle':
+        """Create a handle, fingerprinting the table from its version info where available"""
+        fingerprint = compute_lookup_fingerprint(lookup_df, emis_guid_col, snomed_code_col, version_info)
+        return cls(lookup_df, emis_guid_col, snomed_code_col, fingerprint)
+
+
+# Cache-key override for st.cache_data / st.cache_resource on functions taking a LookupTableHandle
+LOOKUP_HASH_FUNCS = {LookupTableHandle: lambda handle: handle.fingerprint}
+
+
+def compute_lookup_fingerprint(lookup_df: pd.DataFrame, emis_guid_col: str, snomed_code_col: str,
+                               version_info: Optional[Dict] = None) -> str:
+    """
+    Stable fingerprint of a lookup table.
+    
+    Uses the same version-info hash as the lookup cache files when version info is
+    available (or the table_hash recorded with a table loaded from those files),
+    otherwise hashes the full key columns. That O(n) pass runs once per handle,
+    i.e. once per table per session.
+    """
+    if lookup_df is None or lookup_df.empty:
+        return "empty"
+    
+    if version_info and any(version_info.get(key) for key in ('emis_version', 'snomed_version', 'extract_date')):
+        table_hash = _get_lookup_table_hash_from_version_info(version_info)
+    elif version_info and version_info.get('table_hash'):
+        table_hash = version_info['table_hash']
+    else:
+        digest = hashlib.md5(str(lookup_df.shape).encode())
+        digest.update(str(list(lookup_df.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(lookup_df[[emis_guid_col, snomed_code_col]], index=False).values.tobytes())
+        table_hash = f"content_{digest.hexdigest()[:12]}"
+    
+    return f"{table_hash}:{len(lookup_df)}:{emis_guid_col}:{snomed_code_col}"
+
+
+def get_lookup_handle(lookup_df: pd.DataFrame, emis_guid_col: str, snomed_code_col: str,
+                      version_info: Optional[Dict] = None) -> Optional[LookupTableHandle]:
+    """Return the session's handle for a lookup table, creating it only when the table changes"""
+    if lookup_df is None:
+        return None
+    
+    handle = st.session_state.get('lookup_handle')
+    if (handle is None or handle.lookup_df is not lookup_df or
+            handle.emis_guid_col != emis_guid_col or handle.snomed_code_col != snomed_code_col):
+        if version_info is None:
+            version_info = st.session_state.get('lookup_version_info')
+        handle = LookupTableHandle.create(lookup_df, emis_guid_col, snomed_code_col, version_info)
+        st.session_state.lookup_handle = handle
+    return handle
+
+
 @st.cache_resource(ttl=7200, max_entries=1)  # Cache lookup dictionaries for 2 hours
 def get_cached_lookup_dictionaries():
     """Get cached lookup dictionaries to avoid rebuilding them repeatedly."""
@@ -17,7 +91,7 @@ def get_cached_lookup_dictionaries():
         
         if lookup_df is None:
             return None, None
-            
+        
         return create_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col)
     except Exception:
         return None, None
@@ -92,15 +166,18 @@ def load_lookup_table():
                 pass
         
         return lookup_df, emis_guid_col, snomed_code_col, version_info
-        
+    
     except KeyError as e:
         raise Exception(f"Required secret not found: {e}. Please configure in Streamlit Cloud settings.")
     except Exception as e:
         raise Exception(f"Error loading lookup table: {str(e)}")
 
-@st.cache_data(ttl=3600)
-def get_lookup_statistics(lookup_df):
+@st.cache_data(ttl=3600, hash_funcs=LOOKUP_HASH_FUNCS)
+def get_lookup_statistics(lookup_df: Union[pd.DataFrame, LookupTableHandle]):
     """Calculate optimized statistics about the lookup table using vectorized operations."""
+    if isinstance(lookup_df, LookupTableHandle):
+        lookup_df = lookup_df.lookup_df
+    
     if lookup_df is None or lookup_df.empty:
         return {
             'total_count': 0,
@@ -174,8 +251,8 @@ class OptimizedLookupCache:
     
     def __init__(self):
         """Initialize the optimized lookup cache."""
-        self._guid_cache: Dict[str, Dict[str, Any]] = {}
-        self._snomed_cache: Dict[str, Dict[str, Any]] = {}
+        self._guid_cache: Mapping[str, Dict[str, Any]] = {}
+        self._snomed_cache: Mapping[str, Dict[str, Any]] = {}
         self._cache_hits = 0
         self._cache_misses = 0
         self._last_update = None
@@ -187,7 +264,7 @@ class OptimizedLookupCache:
         emis_guid_col: str, 
         snomed_code_col: str,
         force_reload: bool = False
-    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    ) -> Tuple[Mapping[str, Dict[str, Any]], Mapping[str, Dict[str, Any]]]:
         """
         Load lookup cache from DataFrame with intelligent caching.
         
@@ -196,7 +273,7 @@ class OptimizedLookupCache:
             emis_guid_col: EMIS GUID column name
             snomed_code_col: SNOMED code column name
             force_reload: Force cache reload even if data hasn't changed
-            
+        
         Returns:
             Tuple of (guid_to_snomed_dict, snomed_to_info_dict)
         """
@@ -249,7 +326,7 @@ class OptimizedLookupCache:
         
         Args:
             emis_guid: EMIS GUID to lookup
-            
+        
         Returns:
             SNOMED mapping dictionary or None
         """
@@ -266,7 +343,7 @@ class OptimizedLookupCache:
         
         Args:
             snomed_code: SNOMED code to lookup
-            
+        
         Returns:
             SNOMED info dictionary or None
         """
@@ -283,7 +360,7 @@ class OptimizedLookupCache:
         
         Args:
             emis_guids: List of EMIS GUIDs to lookup
-            
+        
         Returns:
             Dictionary mapping GUIDs to their SNOMED info (or None)
         """
@@ -312,8 +389,8 @@ class OptimizedLookupCache:
     
     def clear_cache(self):
         """Clear all cached data."""
-        self._guid_cache.clear()
-        self._snomed_cache.clear()
+        self._guid_cache = {}
+        self._snomed_cache = {}
         self._cache_hits = 0
         self._cache_misses = 0
         self._last_update = None
@@ -341,7 +418,10 @@ class OptimizedLookupCache:
     def _estimate_cache_memory(self) -> float:
         """Estimate cache memory usage in MB."""
         try:
-            import sys
+            if isinstance(self._guid_cache, LookupIndex) and isinstance(self._snomed_cache, LookupIndex):
+                # Both indexes share one set of columns, so only count it once
+                shared_size = self._guid_cache._columns.memory_usage()
+                return (self._guid_cache.memory_usage() + self._snomed_cache.memory_usage() - shared_size) / 1024 / 1024
             
             guid_size = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self._guid_cache.items())
             snomed_size = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self._snomed_cache.items())
@@ -371,7 +451,7 @@ def batch_translate_emis_guids(
         lookup_df: Lookup DataFrame
         emis_guid_col: EMIS GUID column name
         snomed_code_col: SNOMED code column name
-        
+    
     Returns:
         Dictionary mapping GUIDs to their SNOMED translation results
     """
@@ -451,78 +531,87 @@ def display_lookup_performance_metrics():
                     st.success("Lookup cache refreshed")
                     st.rerun()
 
+@st.cache_resource(ttl=7200, max_entries=2, show_spinner=False, hash_funcs=LOOKUP_HASH_FUNCS)
+def get_lookup_dictionaries(lookup: LookupTableHandle):
+    """
+    Lookup dictionaries for a lookup table handle, keyed by its fingerprint.
+    
+    Held as a shared resource so cache hits return the dictionaries directly
+    rather than an unpickled copy of them.
+    """
+    return _build_lookup_dictionaries(lookup.lookup_df, lookup.emis_guid_col, lookup.snomed_code_col)
+
+
 @st.cache_data(ttl=7200, show_spinner=False)  # Cache for 2 hours, no spinner
 def create_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col):
     """Create optimized lookup dictionaries for O(1) GUID to SNOMED translation."""
-    # GUID -> SNOMED mapping for clinical codes and medications
-    guid_to_snomed_dict = {}
-    # SNOMED -> SNOMED mapping for refsets (to get descriptions)
-    snomed_to_info_dict = {}
+    return _build_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col)
+
+
+def _column_or_default(lookup_df: pd.DataFrame, column: str, default: str) -> pd.Series:
+    """Cleaned string column, or a constant column when the table does not have it"""
+    if column in lookup_df.columns:
+        return lookup_df[column].astype(str).str.strip()
+    return pd.Series(default, index=lookup_df.index, dtype=object)
+
+
+def _clean_snomed_codes(snomed_values: pd.Series) -> pd.Series:
+    """SNOMED codes as strings, dropping the '.0' pandas adds to integer codes read as floats"""
+    if pd.api.types.is_float_dtype(snomed_values):
+        integer_floats = snomed_values.notna() & (snomed_values % 1 == 0)
+        if integer_floats.all():
+            return snomed_values.astype(np.int64).astype(str)
+        concept_ids = snomed_values.astype(str).str.strip()
+        concept_ids[integer_floats] = snomed_values[integer_floats].astype(np.int64).astype(str)
+        return concept_ids
+    return snomed_values.astype(str).str.strip()
+
+
+def _build_lookup_dictionaries(lookup_df, emis_guid_col, snomed_code_col):
+    """Build the GUID -> record and SNOMED -> record lookup indexes (uncached)"""
+    if lookup_df is None or lookup_df.empty:
+        return {}, {}
     
-    if lookup_df is not None and not lookup_df.empty:
-        # Vectorized operations for better performance
-        start_time = time.time()
-        
-        # Convert to numpy arrays for faster processing
-        code_ids = lookup_df[emis_guid_col].astype(str).str.strip()
-        snomed_values = lookup_df[snomed_code_col]
-        source_types = lookup_df.get('Source_Type', 'Unknown').astype(str).str.strip()
-        
-        # Handle SNOMED code conversion vectorized
-        concept_ids = pd.Series(index=snomed_values.index, dtype=str)
-        float_mask = pd.api.types.is_float_dtype(snomed_values) & snomed_values.notna()
-        integer_floats = float_mask & (snomed_values % 1 == 0)
-        
-        concept_ids[integer_floats] = snomed_values[integer_floats].astype(int).astype(str)
-        concept_ids[~integer_floats] = snomed_values[~integer_floats].astype(str).str.strip()
-        
-        # Get additional columns with defaults
-        has_qualifiers = lookup_df.get('HasQualifier', 'Unknown').astype(str).str.strip()
-        is_parents = lookup_df.get('IsParent', 'Unknown').astype(str).str.strip()
-        descendants = lookup_df.get('Descendants', '0').astype(str).str.strip()
-        code_types = lookup_df.get('CodeType', 'Unknown').astype(str).str.strip()
-        
-        # Create masks for valid entries
-        valid_mask = (code_ids.notna() & 
-                     (code_ids != 'nan') & 
-                     (code_ids != '') &
-                     concept_ids.notna() & 
-                     (concept_ids != 'nan') & 
-                     (concept_ids != ''))
-        
-        # Build dictionaries using vectorized operations
-        for idx in lookup_df.index[valid_mask]:
-            code_id = code_ids[idx]
-            concept_id = concept_ids[idx]
-            
-            entry_data = {
-                'snomed_code': concept_id,
-                'source_type': source_types[idx],
-                'has_qualifier': has_qualifiers[idx],
-                'is_parent': is_parents[idx], 
-                'descendants': descendants[idx],
-                'code_type': code_types[idx]
-            }
-            
-            # For GUID lookup (clinical codes and medications)
-            guid_to_snomed_dict[code_id] = entry_data
-            
-            # For SNOMED lookup (refsets) - map SNOMED code back to itself with source info
-            snomed_to_info_dict[concept_id] = entry_data
-        
-        processing_time = time.time() - start_time
-        
-        # Store performance metrics in session state for monitoring
-        if 'lookup_performance' not in st.session_state:
-            st.session_state.lookup_performance = {}
-        
-        st.session_state.lookup_performance.update({
-            'dictionary_build_time': processing_time,
-            'guid_dictionary_size': len(guid_to_snomed_dict),
-            'snomed_dictionary_size': len(snomed_to_info_dict),
-            'total_rows_processed': len(lookup_df),
-            'valid_entries': valid_mask.sum(),
-            'build_timestamp': time.time()
-        })
+    start_time = time.time()
+    
+    # Vectorized cleaning of every column used by the records
+    code_ids = lookup_df[emis_guid_col].astype(str).str.strip()
+    concept_ids = _clean_snomed_codes(lookup_df[snomed_code_col])
+    
+    valid_mask = (code_ids.notna() & 
+                 (code_ids != 'nan') & 
+                 (code_ids != '') &
+                 concept_ids.notna() & 
+                 (concept_ids != 'nan') & 
+                 (concept_ids != '')).to_numpy(dtype=bool)
+    
+    columns = LookupColumns({
+        'snomed_code': concept_ids[valid_mask],
+        'source_type': _column_or_default(lookup_df, 'Source_Type', 'Unknown')[valid_mask],
+        'has_qualifier': _column_or_default(lookup_df, 'HasQualifier', 'Unknown')[valid_mask],
+        'is_parent': _column_or_default(lookup_df, 'IsParent', 'Unknown')[valid_mask],
+        'descendants': _column_or_default(lookup_df, 'Descendants', '0')[valid_mask],
+        'code_type': _column_or_default(lookup_df, 'CodeType', 'Unknown')[valid_mask]
+    })
+    
+    # GUID lookup (clinical codes and medications)
+    guid_to_snomed_dict = LookupIndex(code_ids[valid_mask], columns)
+    # SNOMED lookup (refsets) - maps the SNOMED code back to its own record
+    snomed_to_info_dict = LookupIndex(concept_ids[valid_mask], columns)
+    
+    processing_time = time.time() - start_time
+    
+    # Store performance metrics in session state for monitoring
+    if 'lookup_performance' not in st.session_state:
+        st.session_state.lookup_performance = {}
+    
+    st.session_state.lookup_performance.update({
+        'dictionary_build_time': processing_time,
+        'guid_dictionary_size': len(guid_to_snomed_dict),
+        'snomed_dictionary_size': len(snomed_to_info_dict),
+        'total_rows_processed': len(lookup_df),
+        'valid_entries': int(valid_mask.sum()),
+        'build_timestamp': time.time()
+    })
     
-    return guid_to_snomed_dict, snomed_to_info_dict
\ No newline at end of file
+    return guid_to_snomed_dict, snomed_to_info_dict
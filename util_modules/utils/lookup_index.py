@@ -0,0 +1,143 @@
+"""
+Array-backed lookup indexes for the EMIS lookup table.
+
+Replaces per-row dictionaries with category-coded column arrays plus a pandas
+key index; record dicts are only materialized when a key is looked up.
+"""
+
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class LookupColumns:
+    """
+    Lookup table columns stored as category codes.
+    
+    Each field is a numpy array of integer codes into its distinct values, so
+    the table costs a few bytes per row per field instead of one dict per row.
+    Records are only materialized when a row is actually looked up, with fields
+    in the order the columns were given.
+    """
+    
+    __slots__ = ('fields', 'codes', 'categories', 'size')
+    
+    def __init__(self, columns: Dict[str, pd.Series]):
+        self.fields = tuple(columns)
+        self.codes = {}
+        self.categories = {}
+        self.size = 0
+        for name, values in columns.items():
+            # Missing values are kept as a category of their own so records return them unchanged
+            codes, uniques = pd.factorize(values, use_na_sentinel=False)
+            self.codes[name] = codes.astype(np.int32 if len(uniques) > 32767 else np.int16)
+            self.categories[name] = np.asarray(uniques, dtype=object)
+            self.size = len(codes)
+    
+    def value(self, name: str, row: int) -> Any:
+        """Value of one field for one row"""
+        return self.categories[name][self.codes[name][row]]
+    
+    def values(self, name: str, rows: np.ndarray) -> List[Any]:
+        """Values of one field for many rows"""
+        return self.categories[name][self.codes[name][rows]].tolist()
+    
+    def record(self, row: int) -> Dict[str, Any]:
+        """Materialize the record dict for one row"""
+        return {name: self.categories[name][self.codes[name][row]] for name in self.fields}
+    
+    def records(self, rows: np.ndarray) -> List[Dict[str, Any]]:
+        """Materialize record dicts for many rows at once, one array take per field"""
+        values = [self.values(name, rows) for name in self.fields]
+        return [dict(zip(self.fields, row_values)) for row_values in zip(*values)]
+    
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the code arrays and category values"""
+        total = 0
+        for name in self.fields:
+            categories = self.categories[name]
+            total += self.codes[name].nbytes + categories.nbytes
+            total += sum(sys.getsizeof(value) for value in categories)
+        return total
+
+
+class LookupIndex(Mapping):
+    """
+    Read-only key -> lookup record mapping backed by a pandas Index.
+    
+    Drop-in replacement for per-row lookup dictionaries: supports get(), `in`,
+    [], len() and iteration. Keys map to row positions in a LookupColumns; when
+    a key appears more than once the last row wins, matching dict assignment
+    order. With value_field set, lookups return that single field instead of
+    the whole record (e.g. SNOMED code -> EMIS GUID).
+    """
+    
+    def __init__(self, keys: pd.Series, columns: LookupColumns, value_field: Optional[str] = None):
+        keys = pd.Index(keys)
+        last_rows = ~keys.duplicated(keep='last')
+        self._keys = keys[last_rows]
+        self._rows = np.flatnonzero(last_rows)
+        self._columns = columns
+        self._value_field = value_field
+    
+    def field_view(self, value_field: Optional[str]) -> 'LookupIndex':
+        """Index over the same keys and columns returning a single field (or whole records for None)"""
+        view = type(self).__new__(type(self))
+        view._keys = self._keys
+        view._rows = self._rows
+        view._columns = self._columns
+        view._value_field = value_field
+        return view
+    
+    def _row(self, key) -> int:
+        """Row position for a key, or -1 when absent"""
+        try:
+            return self._rows[self._keys.get_loc(key)]
+        except (KeyError, TypeError, ValueError):
+            return -1
+    
+    def _materialize(self, row: int):
+        if self._value_field is not None:
+            return self._columns.value(self._value_field, row)
+        return self._columns.record(row)
+    
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self._materialize(row)
+    
+    def get(self, key, default=None):
+        row = self._row(key)
+        return self._materialize(row) if row >= 0 else default
+    
+    def __contains__(self, key) -> bool:
+        return self._row(key) >= 0
+    
+    def __iter__(self):
+        return iter(self._keys)
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Vectorized get() for a list of keys, with None for keys that are not present"""
+        positions = self._keys.get_indexer(pd.Index(keys, dtype=object))
+        found = np.flatnonzero(positions >= 0)
+        rows = self._rows[positions[found]]
+        if self._value_field is not None:
+            values = self._columns.values(self._value_field, rows)
+        else:
+            values = self._columns.records(rows)
+        
+        results = [None] * len(keys)
+        for position, value in zip(found.tolist(), values):
+            results[position] = value
+        return results
+    
+    def memory_usage(self) -> int:
+        """Approximate bytes held by this index (shared columns included)"""
+        return self._keys.memory_usage(deep=True) + self._rows.nbytes + self._columns.memory_usage()
@@ -0,0 +1,284 @@
+"""
+Shared-Memory Buffers for Background Worker Processes
+
+ProcessPoolExecutor pickles every task argument through a pipe, so passing the
+lookup table or a whole XML document per task copies it into the worker each
+time. This module places them in multiprocessing shared memory once and hands
+workers a small picklable reference instead:
+
+- SharedLookupTable packs the GUID and SNOMED LookupIndexes (keys, row numbers
+  and category-coded columns) into one block; workers attach with
+  attach_shared_lookup() and read the arrays in place, with nothing copied or
+  rebuilt per worker beyond decoding the values a lookup returns
+- share_text() places a document in a block for a single task to read
+
+Shared memory stays in RAM and is never written to disk, so the lookup table
+keeps the protection of the encrypted on-disk cache. The process that creates
+a block owns it and unlinks it when done.
+"""
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .lookup_index import LookupColumns, LookupIndex
+
+
+# Array offsets inside a block are aligned for the integer code/row arrays
+_ALIGNMENT = 8
+
+# (array name, dtype string, shape, byte offset) for each array in a block
+ArrayLayout = Tuple[Tuple[str, str, Tuple[int, ...], int], ...]
+
+
+def _open_block(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing block without this process taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: attaching registers with the resource tracker shared by
+        # the pool workers, which is harmless since the owner unregisters on unlink
+        return shared_memory.SharedMemory(name=name)
+
+
+def _release_block(block: shared_memory.SharedMemory):
+    """Close and unlink a block this process owns"""
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _encode_strings(values) -> np.ndarray:
+    """Fixed-width UTF-8 byte strings (numpy 'S' dtype) for string values"""
+    return np.array([str(value).encode('utf-8') for value in values], dtype=bytes)
+
+
+def _pack_arrays(arrays: Dict[str, np.ndarray]) -> Tuple[shared_memory.SharedMemory, ArrayLayout]:
+    """Copy arrays into one new block, returning it with the layout needed to read them back"""
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, shape, start), array in zip(layout, arrays.values()):
+        target = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+        target[...] = array
+        del target
+    return block, tuple(layout)
+
+
+def _unpack_arrays(block: shared_memory.SharedMemory, layout: ArrayLayout) -> Dict[str, np.ndarray]:
+    """Read-only array views over a block"""
+    arrays = {}
+    for name, dtype, shape, start in layout:
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+        array.flags.writeable = False
+        arrays[name] = array
+    return arrays
+
+
+class SharedLookupColumns(LookupColumns):
+    """LookupColumns whose codes and categories are views over shared memory (categories as UTF-8 bytes)"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_arrays(cls, fields: Tuple[str, ...], arrays: Dict[str, np.ndarray]) -> 'SharedLookupColumns':
+        columns = cls.__new__(cls)
+        columns.fields = fields
+        columns.codes = {name: arrays[f'codes:{name}'] for name in fields}
+        columns.categories = {name: arrays[f'categories:{name}'] for name in fields}
+        columns.size = len(columns.codes[fields[0]]) if fields else 0
+        return columns
+
+    def value(self, name: str, row: int):
+        return self.categories[name][self.codes[name][row]].decode('utf-8')
+
+    def values(self, name: str, rows: np.ndarray) -> List:
+        return [value.decode('utf-8') for value in self.categories[name][self.codes[name][rows]].tolist()]
+
+    def record(self, row: int) -> Dict:
+        return {name: self.value(name, row) for name in self.fields}
+
+    def memory_usage(self) -> int:
+        return sum(self.codes[name].nbytes + self.categories[name].nbytes for name in self.fields)
+
+
+class SharedLookupIndex(LookupIndex):
+    """
+    LookupIndex over sorted UTF-8 keys in shared memory.
+
+    Keys are found by binary search on the shared array rather than a
+    per-process pandas Index, so a worker attaching to the table builds nothing.
+    """
+
+    def __init__(self, sorted_keys: np.ndarray, rows: np.ndarray, columns: SharedLookupColumns,
+                 value_field: Optional[str] = None):
+        self._keys = sorted_keys
+        self._rows = rows
+        self._columns = columns
+        self._value_field = value_field
+
+    def _positions(self, keys: List) -> np.ndarray:
+        """Position of each key in the sorted key array, or -1 when absent"""
+        valid = np.array([isinstance(key, str) for key in keys], dtype=bool)
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        if not len(self._keys) or not valid.any():
+            return positions
+        query = _encode_strings([key for key, is_valid in zip(keys, valid) if is_valid])
+        found = np.minimum(np.searchsorted(self._keys, query), len(self._keys) - 1)
+        matched = self._keys[found] == query
+        positions[np.flatnonzero(valid)] = np.where(matched, found, -1)
+        return positions
+
+    def _row(self, key) -> int:
+        position = self._positions([key])[0]
+        return int(self._rows[position]) if position >= 0 else -1
+
+    def __iter__(self):
+        return (key.decode('utf-8') for key in self._keys.tolist())
+
+    def get_many(self, keys: List[str]) -> List[Optional[object]]:
+        positions = self._positions(keys)
+        found = np.flatnonzero(positions >= 0)
+        rows = self._rows[positions[found]]
+        if self._value_field is not None:
+            values = self._columns.values(self._value_field, rows)
+        else:
+            values = self._columns.records(rows)
+
+        results = [None] * len(keys)
+        for position, value in zip(found.tolist(), values):
+            results[position] = value
+        return results
+
+    def memory_usage(self) -> int:
+        return self._keys.nbytes + self._rows.nbytes + self._columns.memory_usage()
+
+
+@dataclass(frozen=True)
+class SharedLookupRef:
+    """Picklable reference to a published lookup table (what tasks carry instead of the table)"""
+    fingerprint: str
+    block_name: str
+    layout: ArrayLayout
+    fields: Tuple[str, ...]
+
+
+class SharedLookupTable:
+    """
+    GUID and SNOMED lookup indexes published to shared memory by the owning process.
+
+    Both indexes must share one LookupColumns, as those from the lookup
+    dictionary build do. close() unlinks the block; workers still attached keep
+    their mapping until they drop it.
+    """
+
+    def __init__(self, fingerprint: str, guid_index: LookupIndex, snomed_index: LookupIndex):
+        columns = guid_index._columns
+        if snomed_index._columns is not columns:
+            raise ValueError("GUID and SNOMED indexes must share the same lookup columns")
+
+        arrays = {}
+        for name in columns.fields:
+            arrays[f'codes:{name}'] = np.ascontiguousarray(columns.codes[name])
+            arrays[f'categories:{name}'] = _encode_strings(columns.categories[name])
+        for prefix, index in (('guid', guid_index), ('snomed', snomed_index)):
+            keys = _encode_strings(index._keys)
+            order = np.argsort(keys, kind='stable')
+            arrays[f'{prefix}:keys'] = keys[order]
+            arrays[f'{prefix}:rows'] = np.asarray(index._rows, dtype=np.int64)[order]
+
+        self._block, layout = _pack_arrays(arrays)
+        self.ref = SharedLookupRef(fingerprint, self._block.name, layout, columns.fields)
+
+    @classmethod
+    def empty(cls, fingerprint: str) -> 'SharedLookupTable':
+        """Published table with no rows (for an empty lookup table)"""
+        index = LookupIndex(pd.Series([], dtype=object), LookupColumns({}))
+        return cls(fingerprint, index, index)
+
+    @property
+    def fingerprint(self) -> str:
+        return self.ref.fingerprint
+
+    @property
+    def nbytes(self) -> int:
+        return self._block.size
+
+    def close(self):
+        if self._block is not None:
+            _release_block(self._block)
+            self._block = None
+
+
+# Tables this process has attached to, by block name (worker side)
+_attached_lookups: Dict[str, Tuple[shared_memory.SharedMemory, SharedLookupIndex, SharedLookupIndex]] = {}
+MAX_ATTACHED_LOOKUPS = 2
+
+
+def attach_shared_lookup(ref: SharedLookupRef) -> Tuple[SharedLookupIndex, SharedLookupIndex]:
+    """
+    GUID and SNOMED indexes for a published lookup table, attaching on first use
+
+    Attachments are kept per process, so a worker maps each table version once
+    however many tasks use it.
+    """
+    attached = _attached_lookups.get(ref.block_name)
+    if attached is None:
+        block = _open_block(ref.block_name)
+        arrays = _unpack_arrays(block, ref.layout)
+        columns = SharedLookupColumns.from_arrays(ref.fields, arrays)
+        attached = (
+            block,
+            SharedLookupIndex(arrays['guid:keys'], arrays['guid:rows'], columns),
+            SharedLookupIndex(arrays['snomed:keys'], arrays['snomed:rows'], columns),
+        )
+        # Older versions are dropped rather than closed: indexes handed out may still view the block
+        while len(_attached_lookups) >= MAX_ATTACHED_LOOKUPS:
+            _attached_lookups.pop(next(iter(_attached_lookups)))
+        _attached_lookups[ref.block_name] = attached
+    return attached[1], attached[2]
+
+
+@dataclass(frozen=True)
+class SharedTextRef:
+    """Picklable reference to text placed in shared memory by share_text()"""
+    block_name: str
+    size: int
+
+
+def share_text(text: str) -> Tuple[shared_memory.SharedMemory, SharedTextRef]:
+    """
+    Place text in a new shared-memory block
+
+    Returns:
+        The block (the caller owns it and releases it with release_shared_text)
+        and the reference to pass to the worker
+    """
+    data = text.encode('utf-8')
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    return block, SharedTextRef(block.name, len(data))
+
+
+def read_shared_text(ref: SharedTextRef) -> str:
+    """Text from a block created by share_text (in any process)"""
+    block = _open_block(ref.block_name)
+    try:
+        return bytes(block.buf[:ref.size]).decode('utf-8')
+    finally:
+        block.close()
+
+
+def release_shared_text(block: shared_memory.SharedMemory):
+    """Free a block created by share_text"""
+    _release_block(block)
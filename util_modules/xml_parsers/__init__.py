@@ -8,8 +8,19 @@ from .restriction_parser import parse_restriction, RestrictionParser
 from .value_set_parser import parse_value_set, ValueSetParser
 from .linked_criteria_parser import parse_linked_criterion, LinkedCriteriaParser
 from .base_parser import XMLParserBase, get_namespaces
+from .parsed_document import (
+    ParsedDocument,
+    get_parsed_document,
+    build_parsed_document,
+    discard_parsed_document,
+    clear_parsed_document_cache,
+    determine_report_type
+)
+from .report_cache import ReportResultCache, get_report_cache, clear_report_cache
 from .xml_utils import (
     parse_xml_for_emis_guids, 
+    extract_emis_guids_from_element,
+    extract_emis_guids_by_source,
     is_pseudo_refset, 
     is_pseudo_refset_from_xml_structure,
     get_medication_type_flag, 
@@ -29,7 +40,18 @@ __all__ = [
     'LinkedCriteriaParser',
     'XMLParserBase',
     'get_namespaces',
+    'ParsedDocument',
+    'get_parsed_document',
+    'build_parsed_document',
+    'discard_parsed_document',
+    'clear_parsed_document_cache',
+    'determine_report_type',
+    'ReportResultCache',
+    'get_report_cache',
+    'clear_report_cache',
     'parse_xml_for_emis_guids',
+    'extract_emis_guids_from_element',
+    'extract_emis_guids_by_source',
     'is_pseudo_refset',
     'is_pseudo_refset_from_xml_structure',
     'get_medication_type_flag',
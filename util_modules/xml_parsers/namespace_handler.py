@@ -4,23 +4,178 @@ Handles all mixed namespace patterns in one centralized location.
 """
 
 import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
 from typing import Dict, List, Optional, Any
 
 
+EMIS_NAMESPACE = 'http://www.e-mis.com/emisopen'
+
+# Namespace resolution strategies
+NAMESPACE_MODE_MIXED = 'mixed'            # Try non-namespaced first, then namespaced (always safe)
+NAMESPACE_MODE_NAMESPACED = 'namespaced'  # Document only uses namespaced EMIS elements
+NAMESPACE_MODE_PLAIN = 'plain'            # Document only uses non-namespaced elements
+
+# Strategy for the document currently being processed on this thread/task.
+# Set via namespace_mode_scope() by code that has detected the document's namespace usage.
+_active_namespace_mode: ContextVar[Optional[str]] = ContextVar('emis_namespace_mode', default=None)
+
+
+def detect_namespace_mode(root: ET.Element, namespace_uri: str = EMIS_NAMESPACE) -> str:
+    """
+    Detect whether a document (or subtree) uses namespaced elements, plain elements or both.
+    
+    Args:
+        root: Document root or subtree root to scan
+        namespace_uri: Namespace URI counted as namespaced
+        
+    Returns:
+        One of NAMESPACE_MODE_NAMESPACED, NAMESPACE_MODE_PLAIN or NAMESPACE_MODE_MIXED
+    """
+    namespaced_prefix = f'{{{namespace_uri}}}'
+    has_namespaced = False
+    has_plain = False
+    for elem in root.iter():
+        tag = elem.tag
+        if not isinstance(tag, str):
+            continue
+        if tag.startswith(namespaced_prefix):
+            has_namespaced = True
+        elif not tag.startswith('{'):
+            has_plain = True
+        if has_namespaced and has_plain:
+            return NAMESPACE_MODE_MIXED
+    return resolve_namespace_mode(has_namespaced, has_plain)
+
+
+def resolve_namespace_mode(has_namespaced: bool, has_plain: bool) -> str:
+    """Pick the resolution strategy from observed element namespace usage"""
+    if has_namespaced and not has_plain:
+        return NAMESPACE_MODE_NAMESPACED
+    if has_plain and not has_namespaced:
+        return NAMESPACE_MODE_PLAIN
+    return NAMESPACE_MODE_MIXED
+
+
+@contextmanager
+def namespace_mode_scope(mode: Optional[str]):
+    """
+    Apply a detected namespace strategy to every NamespaceHandler used within the block.
+    
+    Args:
+        mode: Strategy from detect_namespace_mode(); None leaves the current strategy unchanged
+    """
+    if mode is None:
+        yield
+        return
+    token = _active_namespace_mode.set(mode)
+    try:
+        yield
+    finally:
+        _active_namespace_mode.reset(token)
+
+
+def _add_namespace_prefix(xpath: str) -> str:
+    """Convert a non-namespaced XPath to its emis: prefixed form"""
+    # Handle different XPath patterns
+    if xpath.startswith('.//'):
+        # Descendant search: .//element -> .//emis:element
+        element_part = xpath[3:]
+        return f'.//emis:{element_part}'
+    elif xpath.startswith('./'):
+        # Child search: ./element -> ./emis:element
+        element_part = xpath[2:]
+        return f'./emis:{element_part}'
+    elif '/' in xpath:
+        # Complex path: convert each element
+        parts = xpath.split('/')
+        namespaced_parts = []
+        for part in parts:
+            if part and not part.startswith('emis:') and part != '.' and part != '..':
+                namespaced_parts.append(f'emis:{part}')
+            else:
+                namespaced_parts.append(part)
+        return '/'.join(namespaced_parts)
+    else:
+        # Simple element name
+        return f'emis:{xpath}'
+
+
+@lru_cache(maxsize=2048)
+def _compile_xpath(xpath: str, namespace_uri: str) -> str:
+    """
+    Compile the namespaced variant of an XPath once, in {uri}tag form.
+    Clark notation needs no prefix map, so simple child lookups stay on ElementTree's fast path.
+    """
+    return _add_namespace_prefix(xpath).replace('emis:', f'{{{namespace_uri}}}')
+
+
+@lru_cache(maxsize=2048)
+def _compile_name(element_name: str, namespace_uri: str) -> str:
+    """Compile the namespaced variant of a single element name once, in {uri}tag form"""
+    return f'{{{namespace_uri}}}{element_name}'
+
+
 class NamespaceHandler:
     """
     Centralized namespace handling for EMIS XML files.
     Handles mixed namespace structures where elements can be either namespaced or non-namespaced.
+    
+    Namespaced paths are compiled once and cached. When the document's namespace usage is
+    known (explicit mode, or an active namespace_mode_scope), only the matching variant is
+    searched; otherwise both variants are tried, non-namespaced first.
     """
     
-    def __init__(self, namespaces: Optional[Dict[str, str]] = None):
+    def __init__(self, namespaces: Optional[Dict[str, str]] = None, mode: Optional[str] = None):
         """
         Initialize namespace handler.
         
         Args:
             namespaces: Namespace dictionary (defaults to EMIS namespace)
+            mode: Optional fixed resolution strategy (defaults to the active scope, else mixed)
         """
-        self.namespaces = namespaces or {'emis': 'http://www.e-mis.com/emisopen'}
+        self.namespaces = namespaces or {'emis': EMIS_NAMESPACE}
+        self.namespace_uri = self.namespaces.get('emis', EMIS_NAMESPACE)
+        self.mode = mode
+    
+    @classmethod
+    def for_document(cls, root: ET.Element, namespaces: Optional[Dict[str, str]] = None) -> 'NamespaceHandler':
+        """Create a handler with the namespace strategy detected from a document or subtree"""
+        handler = cls(namespaces)
+        handler.mode = detect_namespace_mode(root, handler.namespace_uri)
+        return handler
+    
+    def _resolution_mode(self) -> str:
+        """Strategy for the current lookup"""
+        return self.mode or _active_namespace_mode.get() or NAMESPACE_MODE_MIXED
+    
+    def _find_first(self, parent: ET.Element, plain: str, namespaced: str) -> Optional[ET.Element]:
+        mode = self._resolution_mode()
+        if mode == NAMESPACE_MODE_NAMESPACED:
+            return parent.find(namespaced)
+        # Try non-namespaced first
+        element = parent.find(plain)
+        if element is None and mode != NAMESPACE_MODE_PLAIN:
+            # Try namespaced
+            element = parent.find(namespaced)
+        return element
+    
+    def _find_all(self, parent: ET.Element, plain: str, namespaced: str) -> List[ET.Element]:
+        mode = self._resolution_mode()
+        if mode == NAMESPACE_MODE_NAMESPACED:
+            return parent.findall(namespaced)
+        # Get non-namespaced elements first
+        elements = parent.findall(plain)
+        if mode == NAMESPACE_MODE_PLAIN:
+            return elements
+        # Add namespaced elements (avoiding duplicates)
+        namespaced_elements = parent.findall(namespaced)
+        if elements:
+            seen = {id(elem) for elem in elements}
+            elements.extend([elem for elem in namespaced_elements if id(elem) not in seen])
+            return elements
+        return namespaced_elements
     
     def find(self, parent: ET.Element, element_name: str) -> Optional[ET.Element]:
         """
@@ -33,12 +188,7 @@ class NamespaceHandler:
         Returns:
             Element if found, None otherwise
         """
-        # Try non-namespaced first
-        element = parent.find(element_name)
-        if element is None:
-            # Try namespaced
-            element = parent.find(f'emis:{element_name}', self.namespaces)
-        return element
+        return self._find_first(parent, element_name, _compile_name(element_name, self.namespace_uri))
     
     def find_with_path(self, parent: ET.Element, xpath: str) -> Optional[ET.Element]:
         """
@@ -51,13 +201,7 @@ class NamespaceHandler:
         Returns:
             Element if found, None otherwise
         """
-        # Try non-namespaced first
-        element = parent.find(xpath)
-        if element is None:
-            # Convert xpath to namespaced version
-            namespaced_xpath = self._add_namespace_to_xpath(xpath)
-            element = parent.find(namespaced_xpath, self.namespaces)
-        return element
+        return self._find_first(parent, xpath, _compile_xpath(xpath, self.namespace_uri))
     
     def findall(self, parent: ET.Element, element_name: str) -> List[ET.Element]:
         """
@@ -70,12 +214,7 @@ class NamespaceHandler:
         Returns:
             List of elements (may be empty)
         """
-        # Get non-namespaced elements first
-        elements = parent.findall(element_name)
-        # Add namespaced elements (avoiding duplicates)
-        namespaced_elements = parent.findall(f'emis:{element_name}', self.namespaces)
-        elements.extend([elem for elem in namespaced_elements if elem not in elements])
-        return elements
+        return self._find_all(parent, element_name, _compile_name(element_name, self.namespace_uri))
     
     def findall_with_path(self, parent: ET.Element, xpath: str) -> List[ET.Element]:
         """
@@ -88,13 +227,7 @@ class NamespaceHandler:
         Returns:
             List of elements (may be empty)
         """
-        # Get non-namespaced elements first
-        elements = parent.findall(xpath)
-        # Add namespaced elements (avoiding duplicates)
-        namespaced_xpath = self._add_namespace_to_xpath(xpath)
-        namespaced_elements = parent.findall(namespaced_xpath, self.namespaces)
-        elements.extend([elem for elem in namespaced_elements if elem not in elements])
-        return elements
+        return self._find_all(parent, xpath, _compile_xpath(xpath, self.namespace_uri))
     
     def get_text(self, element: Optional[ET.Element], default: str = "") -> str:
         """
@@ -136,28 +269,7 @@ class NamespaceHandler:
         Returns:
             XPath expression with emis: namespace prefixes
         """
-        # Handle different XPath patterns
-        if xpath.startswith('.//'):
-            # Descendant search: .//element -> .//emis:element
-            element_part = xpath[3:]
-            return f'.//emis:{element_part}'
-        elif xpath.startswith('./'):
-            # Child search: ./element -> ./emis:element
-            element_part = xpath[2:]
-            return f'./emis:{element_part}'
-        elif '/' in xpath:
-            # Complex path: convert each element
-            parts = xpath.split('/')
-            namespaced_parts = []
-            for part in parts:
-                if part and not part.startswith('emis:') and part != '.' and part != '..':
-                    namespaced_parts.append(f'emis:{part}')
-                else:
-                    namespaced_parts.append(part)
-            return '/'.join(namespaced_parts)
-        else:
-            # Simple element name
-            return f'emis:{xpath}'
+        return _add_namespace_prefix(xpath)
 
 
 # Convenience functions for backward compatibility
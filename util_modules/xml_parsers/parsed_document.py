@@ -0,0 +1,229 @@
+"""
+Parsed Document Model for EMIS XML
+Parses an uploaded XML document once and shares the tree, classified report
+elements and lookup indexes with the GUID extractor and every analyzer.
+"""
+
+import hashlib
+import io
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+from .namespace_handler import NamespaceHandler, NAMESPACE_MODE_MIXED, EMIS_NAMESPACE, resolve_namespace_mode
+from .base_parser import get_namespaces
+from .report_cache import fingerprint_reports
+
+
+# Parsed documents kept per process; each holds a full element tree so keep this small
+_MAX_CACHED_DOCUMENTS = 2
+_document_cache: "OrderedDict[str, ParsedDocument]" = OrderedDict()
+_document_cache_lock = threading.Lock()
+
+
+@dataclass
+class ParsedDocument:
+    """Single parse of an EMIS XML document with pre-built indexes"""
+    content_hash: str
+    root: ET.Element
+    namespaces: Dict[str, str]
+    
+    # Document metadata
+    document_id: str
+    creation_time: str
+    
+    # All report elements in document order, and the subset not nested in another report
+    report_elements: List[ET.Element] = field(default_factory=list)
+    top_level_report_elements: List[ET.Element] = field(default_factory=list)
+    
+    # Report elements classified by type
+    search_elements: List[ET.Element] = field(default_factory=list)
+    audit_elements: List[ET.Element] = field(default_factory=list)
+    list_elements: List[ET.Element] = field(default_factory=list)
+    aggregate_elements: List[ET.Element] = field(default_factory=list)
+    
+    # listReport/auditReport/aggregateReport elements found outside any report
+    orphan_report_content: List[ET.Element] = field(default_factory=list)
+    
+    # Folder index (reportFolder elements in document order, keyed by folder id)
+    folder_elements: List[ET.Element] = field(default_factory=list)
+    folder_index: Dict[str, ET.Element] = field(default_factory=dict)
+    
+    # Report GUID -> report element
+    element_index: Dict[str, ET.Element] = field(default_factory=dict)
+    
+    # Detected namespace usage, for namespace_mode_scope() around analysis of this document
+    namespace_mode: str = NAMESPACE_MODE_MIXED
+    
+    # Report element -> GUID plus content hash, for reusing per-report results across uploads
+    report_fingerprints: Dict[ET.Element, str] = field(default_factory=dict)
+
+
+def _local_name(tag) -> str:
+    """Strip any {namespace} prefix from an element tag"""
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else tag
+
+
+def compute_content_hash(xml_content: Union[str, bytes]) -> str:
+    """Stable hash of the raw XML content used to key parsed documents"""
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    return hashlib.sha256(xml_content).hexdigest()
+
+
+def determine_report_type(report_elem: ET.Element, ns: Optional[NamespaceHandler] = None) -> str:
+    """
+    Determine the type of a report element from its explicit content structure.
+    parentType only describes the parent relationship, so it is not used here.
+    
+    Returns:
+        'audit', 'aggregate', 'list' or 'search'
+    """
+    ns = ns or NamespaceHandler()
+    if ns.find(report_elem, 'auditReport') is not None:
+        return 'audit'
+    elif ns.find(report_elem, 'aggregateReport') is not None:
+        return 'aggregate'
+    elif ns.find(report_elem, 'listReport') is not None:
+        return 'list'
+    # Population criteria, or no specific structure indicators - treat as a search
+    return 'search'
+
+
+def build_parsed_document(xml_content: Union[str, bytes], content_hash: Optional[str] = None) -> ParsedDocument:
+    """
+    Parse XML content and build its indexes in a single pass.
+    
+    Args:
+        xml_content: Raw XML content (str or bytes)
+        content_hash: Optional precomputed content hash
+    
+    Returns:
+        ParsedDocument for the content
+    """
+    content_hash = content_hash or compute_content_hash(xml_content)
+    source = io.StringIO(xml_content) if isinstance(xml_content, str) else io.BytesIO(xml_content)
+    
+    report_elements = []
+    top_level_reports = []
+    orphan_content = []
+    folder_elements = []
+    report_depth = 0
+    namespaced_prefix = f'{{{EMIS_NAMESPACE}}}'
+    has_namespaced = False
+    has_plain = False
+    
+    try:
+        context = ET.iterparse(source, events=('start', 'end'))
+        for event, elem in context:
+            name = _local_name(elem.tag)
+            if event == 'start':
+                # Track namespace usage so lookups can skip the variant this document never uses
+                if elem.tag.startswith(namespaced_prefix):
+                    has_namespaced = True
+                elif not elem.tag.startswith('{'):
+                    has_plain = True
+                if name == 'report':
+                    if report_depth == 0:
+                        top_level_reports.append(elem)
+                    report_elements.append(elem)
+                    report_depth += 1
+                continue
+            
+            if name == 'report':
+                report_depth -= 1
+            elif name == 'reportFolder':
+                folder_elements.append(elem)
+            elif name in ('listReport', 'auditReport', 'aggregateReport') and report_depth == 0:
+                orphan_content.append(elem)
+        root = context.root
+    except ET.ParseError as e:
+        raise Exception(f"XML parsing error: {str(e)}")
+    
+    namespace_mode = resolve_namespace_mode(has_namespaced, has_plain)
+    ns = NamespaceHandler(mode=namespace_mode)
+    doc_id_elem = ns.find(root, 'id')
+    creation_time_elem = ns.find(root, 'creationTime')
+    
+    document = ParsedDocument(
+        content_hash=content_hash,
+        root=root,
+        namespaces=get_namespaces(),
+        document_id=doc_id_elem.text if doc_id_elem is not None else "Unknown",
+        creation_time=creation_time_elem.text if creation_time_elem is not None else "Unknown",
+        report_elements=report_elements,
+        top_level_report_elements=top_level_reports,
+        orphan_report_content=orphan_content,
+        folder_elements=folder_elements,
+        namespace_mode=namespace_mode
+    )
+    
+    # Classify reports and index them by GUID (child lookups only, no further tree walks)
+    classified = {
+        'search': document.search_elements,
+        'audit': document.audit_elements,
+        'list': document.list_elements,
+        'aggregate': document.aggregate_elements
+    }
+    for report_elem in report_elements:
+        classified[determine_report_type(report_elem, ns)].append(report_elem)
+        report_id = ns.find(report_elem, 'id')
+        if report_id is not None and report_id.text:
+            document.element_index.setdefault(report_id.text, report_elem)
+    
+    for folder_elem in folder_elements:
+        folder_id = ns.find(folder_elem, 'id')
+        if folder_id is not None and folder_id.text:
+            document.folder_index.setdefault(folder_id.text, folder_elem)
+    
+    raw_content = xml_content.encode('utf-8') if isinstance(xml_content, str) else xml_content
+    document.report_fingerprints = fingerprint_reports(raw_content, report_elements, ns)
+    
+    return document
+
+
+def get_parsed_document(xml_content: Union[str, bytes, ParsedDocument]) -> ParsedDocument:
+    """
+    Return the shared ParsedDocument for some XML content, parsing it only once.
+    
+    Documents are cached per process by content hash, so the GUID extractor and each
+    analyzer handed the same upload reuse one element tree. Passing an existing
+    ParsedDocument returns it unchanged.
+    """
+    if isinstance(xml_content, ParsedDocument):
+        return xml_content
+    
+    content_hash = compute_content_hash(xml_content)
+    with _document_cache_lock:
+        document = _document_cache.get(content_hash)
+        if document is not None:
+            _document_cache.move_to_end(content_hash)
+            return document
+    
+    document = build_parsed_document(xml_content, content_hash)
+    
+    with _document_cache_lock:
+        _document_cache[content_hash] = document
+        _document_cache.move_to_end(content_hash)
+        while len(_document_cache) > _MAX_CACHED_DOCUMENTS:
+            _document_cache.popitem(last=False)
+    
+    return document
+
+
+def discard_parsed_document(xml_content: Union[str, bytes, ParsedDocument]):
+    """Release the cached ParsedDocument for some content once all consumers are done with it"""
+    if isinstance(xml_content, ParsedDocument):
+        content_hash = xml_content.content_hash
+    else:
+        content_hash = compute_content_hash(xml_content)
+    with _document_cache_lock:
+        _document_cache.pop(content_hash, None)
+
+
+def clear_parsed_document_cache():
+    """Drop all cached parsed documents (e.g. when a new file is uploaded)"""
+    with _document_cache_lock:
+        _document_cache.clear()
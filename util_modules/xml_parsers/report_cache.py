@@ -0,0 +1,139 @@
+"""
+Per-Report Fingerprints and Result Cache for Re-Uploaded Documents
+
+Users often re-upload a slightly edited version of the same search pack, and
+every upload used to extract GUIDs from and parse every report again. Each
+report element is fingerprinted as its GUID plus a hash of its raw XML text,
+and work done on a report (extracted GUIDs, parsed SearchReport/Report
+objects) is kept in a process-wide cache under that fingerprint. On the next
+upload only reports whose text changed, or that are new, are processed again.
+
+Fingerprints come from the raw bytes of each <report> element, located with a
+single scan of the document, so they cost one hash pass over the text rather
+than a walk of the element tree. Documents the scan can't line up with the
+parsed tree (e.g. report tags inside comments) are simply not fingerprinted.
+"""
+
+import hashlib
+import re
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .namespace_handler import NamespaceHandler
+
+
+# Entries kept across all documents; each is one report's extracted or parsed results
+DEFAULT_MAX_ENTRIES = 10000
+
+# Start, end or self-closing tags of report elements (not reportFolder etc.), with any namespace prefix
+_REPORT_TAG = re.compile(rb'<(/?)(?:[\w.-]+:)?report(?=[\s/>])[^>]*?(/?)>')
+
+
+def scan_report_spans(data: bytes) -> Optional[List[Tuple[int, int]]]:
+    """
+    Byte range of each report element, in start-tag (document) order
+
+    Returns:
+        (start, end) offsets, or None when the tags don't nest properly
+    """
+    spans: List[List[int]] = []
+    open_spans: List[int] = []
+    for match in _REPORT_TAG.finditer(data):
+        if match.group(1):
+            if not open_spans:
+                return None
+            spans[open_spans.pop()][1] = match.end()
+        elif match.group(2):
+            spans.append([match.start(), match.end()])
+        else:
+            open_spans.append(len(spans))
+            spans.append([match.start(), -1])
+    if open_spans:
+        return None
+    return [(start, end) for start, end in spans]
+
+
+def fingerprint_reports(data: bytes, report_elements: List[ET.Element],
+                        ns: Optional[NamespaceHandler] = None) -> Dict[ET.Element, str]:
+    """
+    Fingerprint ("<report GUID>:<content hash>") for each report element with a GUID
+
+    Args:
+        data: Raw XML the elements were parsed from
+        report_elements: Every report element in document order (ParsedDocument.report_elements)
+        ns: Namespace handler for the document
+
+    Returns:
+        Element -> fingerprint; empty when the raw text can't be matched to the elements
+    """
+    spans = scan_report_spans(data)
+    if spans is None or len(spans) != len(report_elements):
+        return {}
+
+    ns = ns or NamespaceHandler()
+    fingerprints = {}
+    for report_elem, (start, end) in zip(report_elements, spans):
+        id_elem = ns.find(report_elem, 'id')
+        if id_elem is None or not id_elem.text:
+            continue
+        digest = hashlib.blake2b(data[start:end], digest_size=16).hexdigest()
+        fingerprints[report_elem] = f"{id_elem.text}:{digest}"
+    return fingerprints
+
+
+class ReportResultCache:
+    """
+    Thread-safe LRU of per-report results, keyed by (kind, key).
+
+    Kinds keep different stages apart ('guids', 'search', 'report'); keys are
+    fingerprints, combined with anything else the result depends on. Callers
+    store values they won't mutate and copy what they hand out.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, Hashable], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get((kind, key))
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((kind, key))
+            self.hits += 1
+            return value
+
+    def put(self, kind: str, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[(kind, key)] = value
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_report_cache = ReportResultCache()
+
+
+def get_report_cache() -> ReportResultCache:
+    """The process-wide cache shared by GUID extraction and the analyzers"""
+    return _report_cache
+
+
+def clear_report_cache():
+    """Drop all retained per-report results"""
+    _report_cache.clear()
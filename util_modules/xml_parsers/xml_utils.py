@@ -5,7 +5,9 @@ Handles XML parsing, GUID extraction, and code system classification
 
 import xml.etree.ElementTree as ET
 import re
-from util_modules.xml_parsers.namespace_handler import NamespaceHandler
+from util_modules.xml_parsers.namespace_handler import NamespaceHandler, detect_namespace_mode, namespace_mode_scope
+from util_modules.xml_parsers.parsed_document import get_parsed_document
+from util_modules.xml_parsers.report_cache import get_report_cache
 
 def _clean_refset_description(description):
     """Clean up refset descriptions to extract just the meaningful name"""
@@ -25,6 +27,29 @@ def _clean_refset_description(description):
     # If no pattern matches, return original (handles cases like "ETH2016WB_COD")
     return description
 
+def _local_name(tag):
+    """Strip any {namespace} prefix from an element tag"""
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else tag
+
+
+def _build_parent_map(root):
+    """Build a child -> parent index for every element beneath root (one linear pass)"""
+    return {child: parent for parent in root.iter() for child in parent}
+
+def _outermost_ancestor(element, parent_map, name, stop):
+    """
+    Walk up from element and return the outermost ancestor with the given local name,
+    stopping before `stop`. Outermost matches the document-order search this replaces
+    (the first enclosing criterion/columnValue found from the top of the tree).
+    """
+    found = None
+    parent = parent_map.get(element)
+    while parent is not None and parent is not stop:
+        if _local_name(parent.tag) == name:
+            found = parent
+        parent = parent_map.get(parent)
+    return found
+
 def parse_xml_for_emis_guids(xml_content, source_guid=None):
     """
     Parse XML content and extract EMIS GUIDs from value elements.
@@ -35,209 +60,330 @@ def parse_xml_for_emis_guids(xml_content, source_guid=None):
     """
     try:
         root = ET.fromstring(xml_content)
+        with namespace_mode_scope(detect_namespace_mode(root)):
+            return extract_emis_guids_from_element(root, source_guid)
         
-        # Define namespaces
-        # Initialize namespace handler
-        ns = NamespaceHandler()
-        emis_guids = []
+    except ET.ParseError as e:
+        raise Exception(f"XML parsing error: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Error processing XML: {str(e)}")
+
+def extract_emis_guids_from_element(root, source_guid=None):
+    """
+    Extract EMIS GUIDs from an already parsed element (document root or report subtree).
+    
+    Args:
+        root: Element to search beneath
+        source_guid: Optional GUID of the source search/report (for tracking source in dual-mode)
+    """
+    # Initialize namespace handler
+    ns = NamespaceHandler()
+    emis_guids = []
+    # Child -> parent index, built on first use so ancestor context lookups stay O(depth)
+    parent_map = None
+    
+    # Find all valueSet elements using namespace handler
+    all_valuesets = ns.findall_with_path(root, './/valueSet')
+    
+    for valueset in all_valuesets:
+        valueset_id = ns.find(valueset, 'id')
+        valueset_description = ns.find(valueset, 'description')
+        code_system = ns.find(valueset, 'codeSystem')
         
-        # Find all valueSet elements using namespace handler
-        all_valuesets = ns.findall_with_path(root, './/valueSet')
+        # Get valueSet metadata
+        vs_id = valueset_id.text if valueset_id is not None else "N/A"
+        vs_desc = valueset_description.text if valueset_description is not None else "N/A"
         
-        for valueset in all_valuesets:
-            valueset_id = ns.find(valueset, 'id')
-            valueset_description = ns.find(valueset, 'description')
-            code_system = ns.find(valueset, 'codeSystem')
-            
-            # Get valueSet metadata
-            vs_id = valueset_id.text if valueset_id is not None else "N/A"
-            vs_desc = valueset_description.text if valueset_description is not None else "N/A"
-            
-            # Perform XML structure-based detection for refset types
-            is_pseudo_refset_container = is_pseudo_refset_from_xml_structure(valueset, ns)
-            
-            # Analyze structure to understand this valueSet
-            values_elements = ns.findall_with_path(valueset, './/values')
-            has_refset_flag = False
-            refset_values_element = None
-            
-            # Check if any values element has isRefset = true
-            for values in values_elements:
-                is_refset_elem = ns.find(values, 'isRefset')
-                if is_refset_elem is not None and is_refset_elem.text and is_refset_elem.text.lower() == 'true':
-                    has_refset_flag = True
-                    refset_values_element = values
-                    break
-            
-            
-            
-            # If no description at valueSet level, try to get displayName from first values element
-            if vs_desc == "N/A":
-                values_elem = ns.find_with_path(valueset, './/values')
-                if values_elem is not None:
-                    display_name_elem = ns.find(values_elem, 'displayName')
-                    if display_name_elem is not None:
-                        vs_desc = display_name_elem.text
-            
-            # Clean up the description to extract just the meaningful name
-            if vs_desc and vs_desc != "N/A":
-                original_desc = vs_desc
-                vs_desc = _clean_refset_description(vs_desc)
-            vs_system = code_system.text if code_system is not None else "N/A"
+        # Perform XML structure-based detection for refset types
+        is_pseudo_refset_container = is_pseudo_refset_from_xml_structure(valueset, ns)
+        
+        # Analyze structure to understand this valueSet
+        values_elements = ns.findall_with_path(valueset, './/values')
+        has_refset_flag = False
+        refset_values_element = None
+        
+        # Check if any values element has isRefset = true
+        for values in values_elements:
+            is_refset_elem = ns.find(values, 'isRefset')
+            if is_refset_elem is not None and is_refset_elem.text and is_refset_elem.text.lower() == 'true':
+                has_refset_flag = True
+                refset_values_element = values
+                break
+        
+        
+        
+        # If no description at valueSet level, try to get displayName from first values element
+        if vs_desc == "N/A":
+            values_elem = ns.find_with_path(valueset, './/values')
+            if values_elem is not None:
+                display_name_elem = ns.find(values_elem, 'displayName')
+                if display_name_elem is not None:
+                    vs_desc = display_name_elem.text
+        
+        # Clean up the description to extract just the meaningful name
+        if vs_desc and vs_desc != "N/A":
+            original_desc = vs_desc
+            vs_desc = _clean_refset_description(vs_desc)
+        vs_system = code_system.text if code_system is not None else "N/A"
+        
+        # Look for context information (table and column) - first try within valueSet
+        table_elem = ns.find_with_path(valueset, './/table')
+        column_elem = ns.find_with_path(valueset, './/column')
+        
+        # If not found within valueSet, look in parent elements (for pseudo-refsets)
+        if table_elem is None or column_elem is None:
+            # Find the parent criterion that contains this valueSet
+            if parent_map is None:
+                parent_map = _build_parent_map(root)
+            parent_criterion = _outermost_ancestor(valueset, parent_map, 'criterion', root)
             
-            # Look for context information (table and column) - first try within valueSet
-            table_elem = ns.find_with_path(valueset, './/table')
-            column_elem = ns.find_with_path(valueset, './/column')
+            if parent_criterion is not None:
+                if table_elem is None:
+                    table_elem = ns.find(parent_criterion, 'table')
+                if column_elem is None:
+                    column_elem = ns.find_with_path(parent_criterion, './/column')
+        
+        table_context = table_elem.text if table_elem is not None else None
+        column_context = column_elem.text if column_elem is not None else None
+        
+        # Find all values elements within this valueSet using namespace handler
+        values_elements = ns.findall_with_path(valueset, './/values')
+        
+        for values in values_elements:
+            # Get metadata that applies to all values in this set - prioritize non-namespaced
+            include_children_elem = ns.find(values, 'includeChildren')
+            include_children = include_children_elem.text if include_children_elem is not None else "false"
             
-            # If not found within valueSet, look in parent elements (for pseudo-refsets)
-            if table_elem is None or column_elem is None:
-                # Find the parent criterion that contains this valueSet
-                parent_criterion = None
-                # Find all criteria using namespace handler
-                criteria = ns.findall_with_path(root, './/criterion')
-                for criterion in criteria:
-                    if valueset in criterion.iter():
-                        parent_criterion = criterion
-                        break
-                
-                if parent_criterion is not None:
-                    if table_elem is None:
-                        table_elem = ns.find(parent_criterion, 'table')
-                    if column_elem is None:
-                        column_elem = ns.find_with_path(parent_criterion, './/column')
+            is_refset_elem = ns.find(values, 'isRefset')
+            is_refset = is_refset_elem.text if is_refset_elem is not None else "false"
             
-            table_context = table_elem.text if table_elem is not None else None
-            column_context = column_elem.text if column_elem is not None else None
+            # Check if this is a refset - if so, there's usually only one value
+            is_refset_bool = is_refset.lower() == 'true'
             
-            # Find all values elements within this valueSet using namespace handler
-            values_elements = ns.findall_with_path(valueset, './/values')
+            # Find all value elements using namespace handler
+            value_elements = ns.findall(values, 'value')
             
-            for values in values_elements:
-                # Get metadata that applies to all values in this set - prioritize non-namespaced
-                include_children_elem = ns.find(values, 'includeChildren')
-                include_children = include_children_elem.text if include_children_elem is not None else "false"
-                
-                is_refset_elem = ns.find(values, 'isRefset')
-                is_refset = is_refset_elem.text if is_refset_elem is not None else "false"
-                
-                # Check if this is a refset - if so, there's usually only one value
-                is_refset_bool = is_refset.lower() == 'true'
-                
-                # Find all value elements using namespace handler
-                value_elements = ns.findall(values, 'value')
+            for value in value_elements:
+                emis_guid = value.text if value.text else "N/A"
                 
-                for value in value_elements:
-                    emis_guid = value.text if value.text else "N/A"
-                    
-                    # For refsets, get displayName from values element or use valueSet description
-                    if is_refset_bool:
-                        # First try to get displayName from the values element (Pattern 1)
-                        display_name_elem = ns.find(values, 'displayName')
-                        if display_name_elem is not None:
-                            xml_display_name = display_name_elem.text
-                        else:
-                            # Fall back to valueSet description (Pattern 2) 
-                            xml_display_name = vs_desc
+                # For refsets, get displayName from values element or use valueSet description
+                if is_refset_bool:
+                    # First try to get displayName from the values element (Pattern 1)
+                    display_name_elem = ns.find(values, 'displayName')
+                    if display_name_elem is not None:
+                        xml_display_name = display_name_elem.text
                     else:
-                        # Get displayName - could be child of value or sibling
-                        display_name_elem = ns.find(value, 'displayName')
-                        if display_name_elem is None:
-                            # Try finding displayName as sibling of value
-                            display_name_elem = ns.find(values, 'displayName')
-                        
-                        xml_display_name = display_name_elem.text if display_name_elem is not None else "N/A"
-                    
-                    # Determine flags based on XML structure
-                    is_pseudorefset_flag = False
-                    is_pseudomember_flag = False
-                    
-                    if has_refset_flag:  # This valueSet contains a refset
-                        if is_refset_bool:  # This specific code is the refset identifier
-                            if is_pseudo_refset_container:
-                                is_pseudorefset_flag = True  # Pseudo-refset identifier
-                            # If not pseudo, it's a true refset (is_refset=True is sufficient)
-                        else:  # This is a member code in the same valueSet as a refset
-                            if is_pseudo_refset_container:
-                                is_pseudomember_flag = True  # Member of pseudo-refset
+                        # Fall back to valueSet description (Pattern 2) 
+                        xml_display_name = vs_desc
+                else:
+                    # Get displayName - could be child of value or sibling
+                    display_name_elem = ns.find(value, 'displayName')
+                    if display_name_elem is None:
+                        # Try finding displayName as sibling of value
+                        display_name_elem = ns.find(values, 'displayName')
                     
-                    emis_guids.append({
-                        'valueSet_guid': vs_id,
-                        'valueSet_description': vs_desc,
-                        'code_system': vs_system,
-                        'emis_guid': emis_guid,
-                        'xml_display_name': xml_display_name,
-                        'include_children': include_children.lower() == 'true',
-                        'is_refset': is_refset_bool,
-                        'is_pseudorefset': is_pseudorefset_flag,
-                        'is_pseudomember': is_pseudomember_flag,
-                        'table_context': table_context,
-                        'column_context': column_context,
-                        'source_guid': source_guid  # Track which search/report this came from
-                    })
-        
-        # Find all libraryItem elements (internal EMIS libraries) using namespace handler
-        library_items = ns.findall_with_path(root, './/libraryItem')
-        for library_item in library_items:
-            library_guid = library_item.text if library_item.text else "N/A"
-            
-            # Find context information for the library item
-            table_context = None
-            column_context = None
-            
-            # Find the parent criterion that contains this libraryItem
-            parent_criterion = None
-            # Find all criteria using namespace handler
-            criteria = ns.findall_with_path(root, './/criterion')
-            for criterion in criteria:
-                if library_item in criterion.iter():
-                    parent_criterion = criterion
-                    break
-            
-            if parent_criterion is not None:
-                table_elem = ns.find(parent_criterion, 'table')
-                table_context = table_elem.text if table_elem is not None else None
+                    xml_display_name = display_name_elem.text if display_name_elem is not None else "N/A"
+                
+                # Determine flags based on XML structure
+                is_pseudorefset_flag = False
+                is_pseudomember_flag = False
                 
-                # Find column context from the columnValue that contains this libraryItem
-                column_value = None
-                # Find all columnValue using namespace handler
-                column_values = ns.findall_with_path(parent_criterion, './/columnValue')
-                for cv in column_values:
-                    if library_item in cv.iter():
-                        column_value = cv
-                        break
+                if has_refset_flag:  # This valueSet contains a refset
+                    if is_refset_bool:  # This specific code is the refset identifier
+                        if is_pseudo_refset_container:
+                            is_pseudorefset_flag = True  # Pseudo-refset identifier
+                        # If not pseudo, it's a true refset (is_refset=True is sufficient)
+                    else:  # This is a member code in the same valueSet as a refset
+                        if is_pseudo_refset_container:
+                            is_pseudomember_flag = True  # Member of pseudo-refset
                 
-                if column_value is not None:
-                    column_elem = ns.find(column_value, 'column')
-                    column_context = column_elem.text if column_elem is not None else None
+                emis_guids.append({
+                    'valueSet_guid': vs_id,
+                    'valueSet_description': vs_desc,
+                    'code_system': vs_system,
+                    'emis_guid': emis_guid,
+                    'xml_display_name': xml_display_name,
+                    'include_children': include_children.lower() == 'true',
+                    'is_refset': is_refset_bool,
+                    'is_pseudorefset': is_pseudorefset_flag,
+                    'is_pseudomember': is_pseudomember_flag,
+                    'table_context': table_context,
+                    'column_context': column_context,
+                    'source_guid': source_guid  # Track which search/report this came from
+                })
+    
+    # Find all libraryItem elements (internal EMIS libraries) using namespace handler
+    library_items = ns.findall_with_path(root, './/libraryItem')
+    for library_item in library_items:
+        library_guid = library_item.text if library_item.text else "N/A"
+        
+        # Find context information for the library item
+        table_context = None
+        column_context = None
+        
+        # Find the parent criterion that contains this libraryItem
+        if parent_map is None:
+            parent_map = _build_parent_map(root)
+        parent_criterion = _outermost_ancestor(library_item, parent_map, 'criterion', root)
+        
+        if parent_criterion is not None:
+            table_elem = ns.find(parent_criterion, 'table')
+            table_context = table_elem.text if table_elem is not None else None
             
-            # Classify library items based on context (similar to valueSet logic)
-            code_system = "UNKNOWN"
-            if column_context:
-                if column_context.upper() in ['READCODE', 'SNOMEDCODE']:
-                    code_system = "CLINICAL_CODES"
-                elif column_context.upper() in ['DRUGCODE']:
-                    code_system = "MEDICATION_CODES"
+            # Find column context from the columnValue that contains this libraryItem
+            column_value = _outermost_ancestor(library_item, parent_map, 'columnValue', parent_criterion)
             
-            emis_guids.append({
-                'valueSet_guid': library_guid,  # Use library GUID as the valueSet identifier
-                'valueSet_description': f"EMIS Library Item {library_guid}",
-                'code_system': code_system,
-                'emis_guid': library_guid,
-                'xml_display_name': f"Library Item: {library_guid}",
-                'include_children': False,  # Library items don't have children
-                'is_refset': False,  # Library items are not refsets
-                'is_library_item': True,  # Flag to identify library items
-                'table_context': table_context,
-                'column_context': column_context,
-                'source_guid': source_guid  # Track which search/report this came from
-            })
+            if column_value is not None:
+                column_elem = ns.find(column_value, 'column')
+                column_context = column_elem.text if column_elem is not None else None
         
-        return emis_guids
+        # Classify library items based on context (similar to valueSet logic)
+        code_system = "UNKNOWN"
+        if column_context:
+            if column_context.upper() in ['READCODE', 'SNOMEDCODE']:
+                code_system = "CLINICAL_CODES"
+            elif column_context.upper() in ['DRUGCODE']:
+                code_system = "MEDICATION_CODES"
         
-    except ET.ParseError as e:
-        raise Exception(f"XML parsing error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Error processing XML: {str(e)}")
+        emis_guids.append({
+            'valueSet_guid': library_guid,  # Use library GUID as the valueSet identifier
+            'valueSet_description': f"EMIS Library Item {library_guid}",
+            'code_system': code_system,
+            'emis_guid': library_guid,
+            'xml_display_name': f"Library Item: {library_guid}",
+            'include_children': False,  # Library items don't have children
+            'is_refset': False,  # Library items are not refsets
+            'is_library_item': True,  # Flag to identify library items
+            'table_context': table_context,
+            'column_context': column_context,
+            'source_guid': source_guid  # Track which search/report this came from
+        })
+    
+    return emis_guids
+
+
+# Report sub-elements whose codes are attributed to their parent report
+_REPORT_CONTENT_TYPES = ('listReport', 'auditReport', 'aggregateReport')
+
+
+class _SourceAttributedCollector:
+    """
+    Collects guid_info dicts per report with the app's source attribution rules:
+    searches (reports containing criteria) are attributed to their own GUID, and
+    list/audit/aggregate report content to the GUID of the enclosing report.
+    """
+    
+    _ORPHAN_PREFIXES = {
+        'listReport': 'list_report',
+        'auditReport': 'audit_report',
+        'aggregateReport': 'aggregate_report'
+    }
+    
+    def __init__(self, on_error=None, namespace_mode=None, report_cache=None):
+        self.ns = NamespaceHandler()
+        self.on_error = on_error
+        # Document-wide namespace strategy if known, otherwise detected per report subtree
+        self.namespace_mode = namespace_mode
+        # Per-fingerprint results from earlier uploads (ReportResultCache), if reuse is wanted
+        self.report_cache = report_cache
+        self.error_count = 0
+        self.buckets = {'search': [], 'listReport': [], 'auditReport': [], 'aggregateReport': []}
+    
+    def _report_guid(self, report_elem):
+        id_elem = self.ns.find(report_elem, 'id')
+        return id_elem.text if id_elem is not None else None
+    
+    def _orphan_guid(self, kind, elem):
+        return f"{self._ORPHAN_PREFIXES[kind]}_{hash(ET.tostring(elem))}"
+    
+    def _extract(self, kind, elem, source_guid):
+        try:
+            self.buckets[kind].extend(extract_emis_guids_from_element(elem, source_guid=source_guid))
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.error_count += 1
+            self.on_error(kind, e)
+    
+    def add_report(self, report_elem, fingerprint=None):
+        """
+        Extract codes from a top-level report (and any reports nested inside it)
+        
+        With a fingerprint and a report cache, an unchanged report reuses the codes
+        extracted last time, and a newly extracted one is kept for next time.
+        """
+        use_cache = fingerprint is not None and self.report_cache is not None
+        if use_cache:
+            cached = self.report_cache.get('guids', (self.namespace_mode, fingerprint))
+            if cached is not None:
+                for kind, guid_infos in cached.items():
+                    self.buckets[kind].extend(dict(guid_info) for guid_info in guid_infos)
+                return
+        
+        sizes = {kind: len(bucket) for kind, bucket in self.buckets.items()}
+        error_count = self.error_count
+        with namespace_mode_scope(self.namespace_mode or detect_namespace_mode(report_elem)):
+            self._add_report(report_elem)
+        
+        # Reports that hit an error are extracted again next time, so the warning isn't lost
+        if use_cache and self.error_count == error_count:
+            self.report_cache.put('guids', (self.namespace_mode, fingerprint), {
+                kind: [dict(guid_info) for guid_info in bucket[sizes[kind]:]]
+                for kind, bucket in self.buckets.items() if len(bucket) > sizes[kind]
+            })
+    
+    def _add_report(self, report_elem):
+        # Nested reports are still treated as independent searches
+        for search_elem in report_elem.iter():
+            if _local_name(search_elem.tag) != 'report':
+                continue
+            if self.ns.find_with_path(search_elem, './/criteria') is None:
+                continue
+            search_id = self._report_guid(search_elem) or f"search_{hash(ET.tostring(search_elem))}"
+            self._extract('search', search_elem, search_id)
+        
+        # Report content is attributed to the outermost enclosing report
+        parent_id = self._report_guid(report_elem)
+        for content_elem in report_elem.iter():
+            kind = _local_name(content_elem.tag)
+            if kind in _REPORT_CONTENT_TYPES:
+                self._extract(kind, content_elem, parent_id or self._orphan_guid(kind, content_elem))
+    
+    def add_orphan_content(self, content_elem):
+        """Extract codes from report content found outside any report element"""
+        kind = _local_name(content_elem.tag)
+        with namespace_mode_scope(self.namespace_mode or detect_namespace_mode(content_elem)):
+            self._extract(kind, content_elem, self._orphan_guid(kind, content_elem))
+    
+    def results(self):
+        """Combined results ordered as searches, then list, audit and aggregate reports"""
+        return (self.buckets['search'] + self.buckets['listReport'] +
+                self.buckets['auditReport'] + self.buckets['aggregateReport'])
+
+
+def extract_emis_guids_by_source(document, on_error=None):
+    """
+    Extract EMIS GUIDs with per-report source attribution from a shared ParsedDocument.
+    
+    Reports unchanged since an earlier upload (same fingerprint) reuse the codes
+    extracted then, so only edited or new reports are walked.
+    
+    Args:
+        document: ParsedDocument (or raw XML content, parsed via the shared document cache)
+        on_error: Optional callback ``on_error(kind, exception)`` for per-report failures.
+                  When omitted, per-report failures are raised.
+    
+    Returns:
+        List of guid_info dicts ordered as searches, then list, audit and aggregate reports
+    """
+    document = get_parsed_document(document)
+    collector = _SourceAttributedCollector(on_error, document.namespace_mode, get_report_cache())
+    for report_elem in document.top_level_report_elements:
+        collector.add_report(report_elem, document.report_fingerprints.get(report_elem))
+    for content_elem in document.orphan_report_content:
+        collector.add_orphan_content(content_elem)
+    return collector.results()
+
 
 def is_pseudo_refset_from_xml_structure(valueset_element, ns):
     """